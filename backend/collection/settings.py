@@ -60,6 +60,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'collection.wsgi.application'
+# ASGI-режим (поток Copilot по SSE): uvicorn collection.asgi:application
+ASGI_APPLICATION = 'collection.asgi.application'
+# Потоков для одновременных запросов async-эндпоинтов /api/async/ (0 — последовательно)
+ASYNC_QUERY_WORKERS = int(os.getenv('ASYNC_QUERY_WORKERS', '8'))
 
 DATABASES = {
     'default': {
@@ -81,6 +85,42 @@ if os.getenv('POSTGRES_HOST'):
         },
     }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Общий для всех воркеров кэш (при REDIS_URL — Redis): счётчики rate limit,
+# версии NBA и профили Client 360, которые сбрасываются по событиям. Без него —
+# LocMem: счётчик и сброс в каждом процессе свои, TTL записей NBA / Client 360 короткий
+RATE_LIMIT_CACHE = 'default'
+SHARED_CACHE = 'default'
+if os.getenv('REDIS_URL'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    }
+    RATE_LIMIT_CACHE = SHARED_CACHE = 'shared'
+
+# Аудит API (AuditMiddleware): доля журналируемых GET без ПДн и ёмкость очереди записи
+AUDIT_GET_SAMPLE_RATE = float(os.getenv('AUDIT_GET_SAMPLE_RATE', '0.1'))
+AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', '10000'))
+
+# Профилирование запросов (ProfilingMiddleware): SQL, время, N+1 по маршрутам.
+# Выключено по умолчанию; сводка — /api/profiling/routes/ и py manage.py profile_endpoints
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+PROFILING_SAMPLES = int(os.getenv('PROFILING_SAMPLES', '500'))
+# Пороги, при превышении которых запрос пишется в лог (None — не проверять)
+PROFILING_BUDGETS = {
+    'queries': int(os.getenv('PROFILING_MAX_QUERIES', '50')),
+    'sql_ms': float(os.getenv('PROFILING_MAX_SQL_MS', '200')),
+    'total_ms': float(os.getenv('PROFILING_MAX_TOTAL_MS', '1000')),
+    'duplicates': int(os.getenv('PROFILING_MAX_DUPLICATES', '10')),
+}
+if PROFILING_ENABLED:
+    MIDDLEWARE.insert(0, 'collection_app.middleware.profiling.ProfilingMiddleware')
+
 AUTH_PASSWORD_VALIDATORS = []
 
 LANGUAGE_CODE = 'ru-ru'
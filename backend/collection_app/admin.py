@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Operator, Client, Credit, CreditState, Payment, Intervention, ScoringResult, Assignment, CreditApplication
+from .models import (
+    Operator, Client, Credit, CreditState, Payment, Intervention, ScoringResult, Assignment, CreditApplication,
+    PeriodicJob, JobRun,
+)
 
 admin.site.register(Operator)
 admin.site.register(Client)
@@ -10,3 +13,5 @@ admin.site.register(Intervention)
 admin.site.register(ScoringResult)
 admin.site.register(Assignment)
 admin.site.register(CreditApplication)
+admin.site.register(PeriodicJob)
+admin.site.register(JobRun)
@@ -0,0 +1,76 @@
+"""
+Микробенчмарк подсказок Copilot: задержка на одно обновление транскрипции.
+
+Разговор моделируется репликами, приходящими частями (как промежуточные
+результаты распознавания речи). Сравниваются вызов get_realtime_suggestions
+на каждое обновление и CopilotSession, просматривающая только дописанный текст.
+
+Примеры:
+  py manage.py benchmark_copilot
+  py manage.py benchmark_copilot --calls 500 --chunk 10
+"""
+
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from collection_app.ml.smart_scripts import CopilotSession, SmartScriptService
+
+UTTERANCES = [
+    'Добрый день, Иван! Это Оператор из Банк.', 'Здравствуйте, слушаю.',
+    'Звоню по поводу задолженности по вашему кредиту, просрочка уже тридцать дней.',
+    'Да, я знаю, сейчас сложно с работой.', 'Понимаю. Когда сможете внести платёж?',
+    'Нет денег до зарплаты, может через неделю.', 'Какую сумму и когда готовы внести?',
+    'Перезвоните позже, я сейчас не могу говорить.', 'Хорошо, договорились на пятницу.',
+    'Я уже оплатил часть в прошлом месяце.', 'Сумма задолженности составляет 15 000 рублей.',
+]
+CLIENT_DATA = {
+    'client_name': 'Иван', 'operator_name': 'Оператор', 'bank_name': 'Банк', 'amount': '15 000',
+    'overdue_days': '30', 'date': 'пятницы', 'time': '10:00', 'complaint_phone': '8-800-123-45-67',
+}
+TARGET_US = 1000
+
+
+class Command(BaseCommand):
+    help = 'Микробенчмарк задержки подсказок Copilot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200, help='Разговоров (default: 200)')
+        parser.add_argument('--utterances', type=int, default=30, help='Реплик в разговоре (default: 30)')
+        parser.add_argument('--chunk', type=int, default=16,
+                            help='Символов в одном обновлении транскрипции (default: 16)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        calls = []
+        for _ in range(options['calls']):
+            text = ' '.join(rng.choice(UTTERANCES) for _ in range(options['utterances']))
+            calls.append([text[:end] for end in range(options['chunk'], len(text) + options['chunk'],
+                                                      options['chunk'])])
+        updates = sum(len(call) for call in calls)
+
+        service = SmartScriptService()
+        stateless = []
+        for call in calls:
+            for transcript in call:
+                started = time.perf_counter()
+                service.get_realtime_suggestions(transcript, CLIENT_DATA, 'unable', 'restructure_offer')
+                stateless.append(time.perf_counter() - started)
+
+        incremental = []
+        for call in calls:
+            session = CopilotSession(CLIENT_DATA, 'unable', 'restructure_offer')
+            for transcript in call:
+                started = time.perf_counter()
+                session.update(transcript)
+                incremental.append(time.perf_counter() - started)
+
+        self.stdout.write(f'Обновлений: {updates}, длина разговора: {len(calls[0][-1])} символов')
+        for label, timings in (('get_realtime_suggestions', stateless), ('CopilotSession.update', incremental)):
+            timings.sort()
+            mean_us = sum(timings) / len(timings) * 1e6
+            p99_us = timings[int(len(timings) * 0.99) - 1] * 1e6
+            style = self.style.SUCCESS if p99_us < TARGET_US else self.style.WARNING
+            self.stdout.write(style(f'  {label:<26} mean {mean_us:7.1f} мкс   p99 {p99_us:7.1f} мкс'))
@@ -0,0 +1,99 @@
+"""
+Нагрузочное сравнение отчётов: WSGI (sync views) и ASGI (async views /api/async/).
+
+Запросы идут в процессе через тестовые клиенты Django (без сети):
+WSGI — пул потоков с django.test.Client, как у многопоточного WSGI-сервера;
+ASGI — AsyncClient и asyncio.gather в одном цикле событий, как у uvicorn.
+Для профиля клиента запросы перебирают разных клиентов, общий кэш (SHARED_CACHE)
+очищается перед каждым режимом. Выводит p50 / p99 задержки по каждому эндпоинту.
+
+Примеры:
+  py manage.py benchmark_dashboards
+  py manage.py benchmark_dashboards --requests 400 --concurrency 32 --endpoint dashboard
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client as TestClient
+
+from collection_app.models import Client, Operator
+from collection_app.services.shared_cache import shared_cache
+
+ENDPOINTS = ('dashboard', 'stats', 'operator', 'profile')
+
+
+def _percentile(timings, q):
+    timings = sorted(timings)
+    return timings[max(0, int(len(timings) * q) - 1)] * 1000
+
+
+class Command(BaseCommand):
+    help = 'Сравнение p50/p99 отчётов дашборда: WSGI vs ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на эндпоинт (default: 200)')
+        parser.add_argument('--concurrency', type=int, default=16, help='Одновременных запросов (default: 16)')
+        parser.add_argument('--endpoint', choices=ENDPOINTS, action='append',
+                            help='Эндпоинт (можно несколько; по умолчанию — все)')
+        parser.add_argument('--period', default='month', choices=['day', 'week', 'month'])
+
+    def handle(self, *args, **options):
+        operator_id = Operator.objects.order_by('id').values_list('id', flat=True).first()
+        client_ids = list(Client.objects.order_by('id').values_list('id', flat=True)[:options['requests']])
+        if operator_id is None or not client_ids:
+            raise CommandError('Нет данных: сначала py manage.py populate_db')
+
+        period = options['period']
+        urls = {
+            'dashboard': lambda i: (f'/api/dashboard/?period={period}', f'/api/async/dashboard/?period={period}'),
+            'stats': lambda i: ('/api/dashboard/stats/', '/api/async/dashboard/stats/'),
+            'operator': lambda i: (f'/api/dashboard/operator/{operator_id}/',
+                                   f'/api/async/dashboard/operator/{operator_id}/'),
+            'profile': lambda i: (f'/api/clients/{client_ids[i % len(client_ids)]}/profile_360/',
+                                  f'/api/async/clients/{client_ids[i % len(client_ids)]}/profile_360/'),
+        }
+        n, concurrency = options['requests'], options['concurrency']
+        self.stdout.write(f'Запросов на эндпоинт: {n}, одновременно: {concurrency}')
+
+        for name in options['endpoint'] or ENDPOINTS:
+            pairs = [urls[name](i) for i in range(n)]
+            shared_cache().clear()
+            wsgi = self._run_wsgi([sync_url for sync_url, _ in pairs], concurrency)
+            shared_cache().clear()
+            asgi = asyncio.run(self._run_asgi([async_url for _, async_url in pairs], concurrency))
+            for label, timings in (('WSGI', wsgi), ('ASGI', asgi)):
+                self.stdout.write(f'  {name:<10} {label}  p50 {_percentile(timings, 0.5):8.1f} мс'
+                                  f'   p99 {_percentile(timings, 0.99):8.1f} мс')
+            speedup = _percentile(wsgi, 0.99) / max(_percentile(asgi, 0.99), 1e-6)
+            style = self.style.SUCCESS if speedup >= 1 else self.style.WARNING
+            self.stdout.write(style(f'  {name:<10} p99 WSGI / ASGI: x{speedup:.2f}'))
+
+    def _run_wsgi(self, urls, concurrency):
+        def request(url):
+            started = time.perf_counter()
+            response = TestClient().get(url)
+            elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise CommandError(f'{url}: HTTP {response.status_code}')
+            return elapsed
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(request, urls))
+
+    async def _run_asgi(self, urls, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        client = AsyncClient()
+
+        async def request(url):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url)
+                elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise CommandError(f'{url}: HTTP {response.status_code}')
+            return elapsed
+
+        return await asyncio.gather(*(request(url) for url in urls))
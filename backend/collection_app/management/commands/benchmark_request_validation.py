@@ -0,0 +1,97 @@
+"""
+Бенчмарк RequestValidationMiddleware: накладные расходы на запрос по размеру тела.
+
+Сравнивается прежняя проверка (каждый паттерн отдельно по строке запроса
+и по всему телу) и текущая (один общий regex за проход, JSON разбирается
+только при совпадении в сыром теле или \\u-экранировании, у multipart
+проверяются только текстовые поля, тело больше MAX_SCAN_BYTES — потоково
+до лимита). В обоих случаях замеряется только проверка, без вызова view
+и сборки ответа. Колонка «блок» показывает, был ли запрос отклонён:
+прежняя проверка отклоняет любой multipart из-за «--» в границах частей.
+
+Примеры:
+  py manage.py benchmark_request_validation
+  py manage.py benchmark_request_validation --sizes 1 16 256 4096 --repeat 20
+"""
+
+import json
+import time
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from collection_app.middleware.security import RequestValidationMiddleware
+
+
+def legacy_contains_forbidden_patterns(request, patterns):
+    """Прежняя проверка: по паттерну за проход, тело целиком"""
+    query_string = request.META.get('QUERY_STRING', '').upper()
+    for pattern in patterns:
+        if pattern.upper() in query_string:
+            return True
+    if request.method in ['POST', 'PUT', 'PATCH']:
+        try:
+            body = request.body.decode('utf-8', errors='ignore').upper()
+            for pattern in patterns:
+                if pattern.upper() in body:
+                    return True
+        except Exception:
+            pass
+    return False
+
+
+def json_body(size: int) -> bytes:
+    row = {'credit_id': 0, 'amount': 1500.5, 'notes': 'Клиент обещал оплатить до пятницы'}
+    rows = [dict(row, credit_id=i) for i in range(max(1, size // len(json.dumps(row).encode())))]
+    return json.dumps(rows, ensure_ascii=False).encode()
+
+
+def csv_body(size: int) -> bytes:
+    line = b'40817810000000000001;15000.00;2026-10-01;payment\n'
+    return b'credit_account;amount;date;purpose\n' + line * max(1, size // len(line))
+
+
+class Command(BaseCommand):
+    help = 'Накладные расходы RequestValidationMiddleware по размеру тела'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 64, 1024, 8192],
+                            help='Размеры тела, КБ (default: 1 64 1024 8192)')
+        parser.add_argument('--repeat', type=int, default=30, help='Запросов на точку (default: 30)')
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        middleware = RequestValidationMiddleware(lambda request: HttpResponse())
+        patterns = middleware.FORBIDDEN_PATTERNS
+
+        def make_request(kind, payload):
+            if kind == 'json':
+                return factory.post('/api/payments/', payload, content_type='application/json')
+            return factory.post('/api/payments/import/', {'file': SimpleUploadedFile('payments.csv', payload)})
+
+        self.stdout.write(f"{'тело':>8} {'тип':<10} {'прежняя, мкс':>14} {'блок':>5} {'текущая, мкс':>14} {'блок':>5}")
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=None):
+            for size_kb in options['sizes']:
+                for kind, build in (('json', json_body), ('multipart', csv_body)):
+                    payload = build(size_kb * 1024)
+                    legacy = self._measure(options['repeat'], lambda: make_request(kind, payload),
+                                           lambda r: legacy_contains_forbidden_patterns(r, patterns))
+                    current = self._measure(options['repeat'], lambda: make_request(kind, payload),
+                                            middleware._contains_forbidden_patterns)
+                    self.stdout.write(
+                        f'{size_kb:>6}КБ {kind:<10} {legacy[0]:>14.1f} {legacy[1]:>5} '
+                        f'{current[0]:>14.1f} {current[1]:>5}'
+                    )
+
+    @staticmethod
+    def _measure(repeat, make_request, check):
+        timings, blocked = [], False
+        for _ in range(repeat):
+            request = make_request()
+            started = time.perf_counter()
+            blocked = check(request)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return timings[len(timings) // 2] * 1e6, 'да' if blocked else 'нет'
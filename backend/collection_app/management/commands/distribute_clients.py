@@ -71,7 +71,7 @@ class Command(BaseCommand):
         """Get credits that are overdue or at risk"""
         return Credit.objects.filter(
             status__in=['overdue', 'default', 'active']
-        ).select_related('client').prefetch_related('states', 'scorings')
+        ).select_related('client', 'current_state').prefetch_related('states', 'scorings')
 
     def _calculate_operator_scores(self, operators):
         """
@@ -146,7 +146,7 @@ class Command(BaseCommand):
             client = credit.client
             
             # Get latest credit state for overdue info
-            latest_state = credit.states.order_by('-state_date').first()
+            latest_state = credit.current_state
             overdue_amount = float(latest_state.overdue_principal) if latest_state else 0
             
             # Calculate days past due
@@ -135,7 +135,7 @@ class Command(BaseCommand):
 
     def _generate_training_data(self):
         """Генерация обучающей выборки из реальных таблиц БД."""
-        credits = Credit.objects.select_related('client').prefetch_related(
+        credits = Credit.objects.select_related('client', 'current_state').prefetch_related(
             'payments', 'interventions'
         ).all()
 
@@ -235,8 +235,8 @@ class Command(BaseCommand):
             records.append({
                 'client_id': client.id,
                 'credit_id': credit.id,
-                'overdue_amount': float(credit.states.order_by('-state_date').first().overdue_principal)
-                    if credit.states.exists() else 0,
+                'overdue_amount': float(credit.current_state.overdue_principal)
+                    if credit.current_state else 0,
                 'age': age, 'gender': gender, 'marital_status': marital,
                 'employment': employment, 'dependents': dependents,
                 'monthly_income': monthly_income,
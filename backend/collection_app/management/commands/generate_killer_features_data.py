@@ -144,7 +144,7 @@ class Command(BaseCommand):
 
     def generate_return_forecasts(self):
         """Генерация прогнозов возврата"""
-        credits = Credit.objects.filter(status='overdue').select_related('client')
+        credits = Credit.objects.filter(status='overdue').select_related('client', 'current_state')
         
         # Должны соответствовать RECOMMENDATION_CHOICES модели
         recommendations = ['continue_soft', 'continue_hard', 'restructure', 'legal', 'sell', 'write_off']
@@ -169,7 +169,7 @@ class Command(BaseCommand):
                 base_prob = random.uniform(0.3, 0.7)
             
             # Получаем сумму долга
-            state = credit.states.order_by('-state_date').first()
+            state = credit.current_state
             debt = float(state.principal_debt) if state else 100000
             
             forecast = ReturnForecast.objects.create(
@@ -0,0 +1,62 @@
+"""
+Загрузка банковских файлов платежей (CSV / XML-выписка).
+
+Платежи сопоставляются с кредитами по номеру договора (Credit.id), вставляются
+пакетно; затем пересчитываются состояния кредитов, обещания и кейсы.
+Повторная загрузка того же файла (по SHA-256) пропускается.
+
+Примеры:
+  py manage.py import_payments payments_2025-01-15.csv
+  py manage.py import_payments statement.xml --format xml
+  py manage.py import_payments day1.csv day2.csv --chunk-size 50000
+"""
+
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from collection_app.services.payment_import import PaymentImportService
+
+
+class Command(BaseCommand):
+    help = 'Загрузка банковских файлов платежей с пересчётом состояний кредитов и обещаний'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='Пути к файлам')
+        parser.add_argument(
+            '--format', choices=['csv', 'xml'], default=None,
+            help='Формат файла (по умолчанию — по расширению)'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=PaymentImportService.CHUNK_SIZE,
+            help=f'Строк в порции (default: {PaymentImportService.CHUNK_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        for file_name in options['files']:
+            path = Path(file_name)
+            if not path.exists():
+                raise CommandError(f'Файл не найден: {path}')
+
+            with path.open('rb') as f:
+                job = PaymentImportService.import_file(
+                    f, file_name=path.name, file_format=options['format'], chunk_size=options['chunk_size'],
+                )
+
+            if job.duplicate:
+                self.stdout.write(self.style.WARNING(
+                    f'{path.name}: уже загружен {job.started_at:%Y-%m-%d %H:%M} — пропуск'
+                ))
+                continue
+            if job.status == 'failed':
+                self.stderr.write(self.style.ERROR(f'{path.name}: ошибка — {job.errors[-1] if job.errors else "?"}'))
+                continue
+
+            self.stdout.write(self.style.SUCCESS(
+                f'{path.name}: строк {job.rows_total}, загружено {job.rows_imported}, '
+                f'без договора {job.rows_unmatched}, с ошибками {job.rows_invalid}\n'
+                f'  Обновлено состояний: {job.credits_updated}, закрыто обещаний: {job.promises_settled}\n'
+                f'  Время: {job.duration_seconds:.2f} сек ({job.rows_per_second:.0f} строк/сек)'
+            ))
+            for error in job.errors[:10]:
+                self.stdout.write(f'  ! {error}')
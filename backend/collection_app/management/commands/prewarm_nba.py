@@ -0,0 +1,36 @@
+"""
+Прогрев рекомендаций NBA по очередям операторов.
+
+Входы собираются фиксированным числом запросов на порцию, баллы считаются
+векторно по всей порции (ml/next_best_action.py), NextBestAction пишется bulk_create.
+
+Примеры:
+  py manage.py prewarm_nba                    # все назначения с просрочкой
+  py manage.py prewarm_nba --operator 5 --operator 7
+  py manage.py prewarm_nba --chunk-size 5000
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from collection_app.ml.next_best_action import operator_queue_pairs, save_nba_batch
+
+
+class Command(BaseCommand):
+    help = 'Пакетная генерация NBA по очередям операторов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operator', type=int, action='append', dest='operators',
+                            help='ID оператора (можно несколько раз)')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Пар клиент/кредит в порции (default: 2000)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        created = save_nba_batch(
+            operator_queue_pairs(options['operators']), chunk_size=options['chunk_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Рекомендаций создано: {len(created)} за {time.perf_counter() - started:.1f} сек'
+        ))
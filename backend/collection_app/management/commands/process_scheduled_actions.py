@@ -0,0 +1,52 @@
+"""
+Воркер запланированных действий (ScheduledAction).
+
+Действия захватываются пачками (SKIP LOCKED на PostgreSQL, claim-токен на SQLite),
+поэтому можно запускать несколько экземпляров параллельно.
+
+Примеры:
+  py manage.py process_scheduled_actions
+  py manage.py process_scheduled_actions --workers 8 --batch-size 500
+  py manage.py process_scheduled_actions --loop --interval 30
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from collection_app.services.workflow_service import WorkflowEngine
+
+
+class Command(BaseCommand):
+    help = 'Выполнение наступивших запланированных действий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Потоков выполнения (default: 4)')
+        parser.add_argument('--batch-size', type=int, default=WorkflowEngine.ACTION_BATCH_SIZE,
+                            help=f'Действий в захватываемой пачке (default: {WorkflowEngine.ACTION_BATCH_SIZE})')
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать постоянно, опрашивая очередь')
+        parser.add_argument('--interval', type=int, default=15,
+                            help='Пауза между опросами в режиме --loop, сек')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = WorkflowEngine.process_scheduled_actions(
+                batch_size=options['batch_size'], workers=options['workers'],
+            )
+            if stats['executed'] or stats['failed'] or not options['loop']:
+                self._report(stats)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def _report(self, stats):
+        self.stdout.write(self.style.SUCCESS(
+            f"Выполнено: {stats['executed']}, ошибок: {stats['failed']}"
+        ))
+        for action_type, latency in sorted(stats['latency'].items()):
+            self.stdout.write(
+                f"  {action_type:<15} n={latency['count']:<6} "
+                f"avg={latency['avg_ms']} ms  max={latency['max_ms']} ms"
+            )
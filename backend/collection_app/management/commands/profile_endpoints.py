@@ -0,0 +1,74 @@
+"""
+Отчёт о медленных эндпоинтах: запросы идут в процессе через тестовый клиент
+Django с ProfilingMiddleware, затем выводятся маршруты по p95 и по числу
+SQL-запросов с самыми частыми повторяющимися запросами (признак N+1).
+
+По умолчанию — подозрительные эндпоинты: полный дашборд, статистика оператора,
+назначения, профиль клиента 360 (разные клиенты). Статистику работающего
+сервера (PROFILING_ENABLED=1) отдаёт GET /api/profiling/routes/.
+
+Примеры:
+  py manage.py profile_endpoints
+  py manage.py profile_endpoints --requests 50 --url /api/clients/ --url /api/credits/
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client as TestClient, modify_settings
+
+from collection_app.middleware.profiling import request_profiler
+from collection_app.models import Client, Operator
+
+
+class Command(BaseCommand):
+    help = 'Профиль эндпоинтов: топ маршрутов по p95 и по числу SQL-запросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help='Запросов на эндпоинт (default: 20)')
+        parser.add_argument('--url', action='append', help='URL для проверки (можно несколько)')
+        parser.add_argument('--limit', type=int, default=10, help='Маршрутов в отчёте (default: 10)')
+
+    def handle(self, *args, **options):
+        n = options['requests']
+        if options['url']:
+            urls = [lambda i, url=url: url for url in options['url']]
+        else:
+            operator_id = Operator.objects.order_by('id').values_list('id', flat=True).first()
+            client_ids = list(Client.objects.order_by('id').values_list('id', flat=True)[:n])
+            if operator_id is None or not client_ids:
+                raise CommandError('Нет данных: сначала py manage.py populate_db')
+            urls = [
+                lambda i: '/api/dashboard/',
+                lambda i: f'/api/dashboard/operator/{operator_id}/',
+                lambda i: '/api/assignments/',
+                lambda i: f'/api/clients/{client_ids[i % len(client_ids)]}/profile_360/',
+            ]
+
+        request_profiler.reset()
+        client = TestClient()
+        with modify_settings(MIDDLEWARE={'prepend': 'collection_app.middleware.profiling.ProfilingMiddleware'}):
+            for build in urls:
+                for i in range(n):
+                    url = build(i)
+                    response = client.get(url)
+                    if response.status_code >= 500:
+                        raise CommandError(f'{url}: HTTP {response.status_code}')
+
+        self.stdout.write(f'Запросов на эндпоинт: {n}, бюджеты: {request_profiler.budgets()}')
+        for order, title in (('p95', 'по p95'), ('queries', 'по числу SQL-запросов')):
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\nТоп маршрутов {title}'))
+            self.stdout.write(f"{'маршрут':<55} {'p95, мс':>9} {'SQL p95':>9} {'запросов':>9} "
+                              f"{'макс':>6} {'сверх':>6}")
+            for row in request_profiler.report(order=order, limit=options['limit']):
+                self.stdout.write(
+                    f"{row['route'][:55]:<55} {row['p95_ms']:>9.1f} {row['p95_sql_ms']:>9.1f} "
+                    f"{row['avg_queries']:>9.1f} {row['max_queries']:>6} {row['over_budget']:>6}"
+                )
+
+        duplicated = [row for row in request_profiler.report(order='queries', limit=options['limit'])
+                      if row['duplicate_queries']]
+        if duplicated:
+            self.stdout.write(self.style.MIGRATE_HEADING('\nПовторяющиеся запросы (N+1)'))
+        for row in duplicated:
+            self.stdout.write(self.style.WARNING(row['route']))
+            for item in row['duplicate_queries'][:3]:
+                self.stdout.write(f"  в {item['requests']} запр.: {item['sql'][:150]}")
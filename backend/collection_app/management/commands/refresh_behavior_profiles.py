@@ -0,0 +1,54 @@
+"""
+Пересчёт поведенческих профилей клиентов из очереди DirtyClient.
+
+Клиентов отмечают сигналы Payment / Intervention / Promise и bulk-загрузки;
+команда пересчитывает только их, пачками. Вместо ночного полного пересчёта
+достаточно запускать её раз в несколько минут (или задачей планировщика).
+
+Примеры:
+  py manage.py refresh_behavior_profiles
+  py manage.py refresh_behavior_profiles --batch-size 1000
+  py manage.py refresh_behavior_profiles --loop --interval 60
+  py manage.py refresh_behavior_profiles --all        # отметить всех и пересчитать
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from collection_app.models import Client
+from collection_app.services.behavior_refresh import BehaviorProfileRefresher
+
+
+class Command(BaseCommand):
+    help = 'Инкрементальный пересчёт поведенческих профилей изменённых клиентов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BehaviorProfileRefresher.BATCH_SIZE,
+                            help=f'Клиентов в пачке (default: {BehaviorProfileRefresher.BATCH_SIZE})')
+        parser.add_argument('--loop', action='store_true',
+                            help='Работать постоянно, опрашивая очередь')
+        parser.add_argument('--interval', type=int, default=60,
+                            help='Пауза между опросами в режиме --loop, сек')
+        parser.add_argument('--all', action='store_true',
+                            help='Предварительно отметить всех клиентов')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            marked = BehaviorProfileRefresher.mark_dirty(
+                Client.objects.values_list('id', flat=True), reason='manual',
+            )
+            self.stdout.write(f'Отмечено клиентов: {marked}')
+
+        while True:
+            started = time.monotonic()
+            stats = BehaviorProfileRefresher.refresh_dirty(batch_size=options['batch_size'])
+            if stats['clients'] or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Профилей пересчитано: {stats['clients']} ({stats['batches']} пачек) "
+                    f"за {time.monotonic() - started:.1f} сек, в очереди: "
+                    f"{BehaviorProfileRefresher.pending_count()}"
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
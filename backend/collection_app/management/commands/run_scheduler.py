@@ -0,0 +1,91 @@
+"""
+Встроенный планировщик периодических задач (скоринг, обещания, алерты, действия).
+
+Заменяет ручной запуск и .bat-файлы Task Scheduler: расписания хранятся в PeriodicJob,
+история запусков — в JobRun. Одновременно может работать несколько экземпляров —
+задачи выполняет только лидер.
+
+Примеры:
+  py manage.py run_scheduler --install-defaults
+  py manage.py run_scheduler                    # постоянная работа
+  py manage.py run_scheduler --once             # один проход (для cron)
+  py manage.py run_scheduler --run-now "Ночной скоринг"
+  py manage.py run_scheduler --report --days 7  # кто съедает ночное окно
+"""
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Avg, Count, Max, Sum
+from django.utils import timezone
+
+from collection_app.models import PeriodicJob, JobRun
+from collection_app.services.scheduler import PeriodicScheduler
+
+
+class Command(BaseCommand):
+    help = 'DB-планировщик периодических задач с историей запусков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Один проход и выход')
+        parser.add_argument('--interval', type=int, default=30, help='Пауза между проходами, сек')
+        parser.add_argument('--install-defaults', action='store_true',
+                            help='Создать задачи по умолчанию')
+        parser.add_argument('--run-now', type=str, default=None, help='Выполнить задачу по имени сейчас')
+        parser.add_argument('--report', action='store_true', help='Сводка длительностей запусков')
+        parser.add_argument('--days', type=int, default=7, help='Период сводки, дней')
+
+    def handle(self, *args, **options):
+        if options['install_defaults']:
+            created = PeriodicScheduler.ensure_default_jobs()
+            self.stdout.write(self.style.SUCCESS(f'Создано задач: {created}'))
+            return
+
+        if options['report']:
+            self._report(options['days'])
+            return
+
+        if options['run_now']:
+            job = PeriodicJob.objects.filter(name=options['run_now']).first()
+            if job is None:
+                raise CommandError(f"Задача не найдена: {options['run_now']}")
+            self._print_run(PeriodicScheduler.run_job(job, owner=PeriodicScheduler.default_owner()))
+            return
+
+        owner = PeriodicScheduler.default_owner()
+        self.stdout.write(f'Планировщик {owner} запущен')
+        try:
+            while True:
+                for run in PeriodicScheduler.tick(owner=owner):
+                    self._print_run(run)
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            PeriodicScheduler.release_lease(owner)
+
+    def _print_run(self, run):
+        style = {'success': self.style.SUCCESS, 'failed': self.style.ERROR}.get(run.status, self.style.WARNING)
+        self.stdout.write(style(
+            f'[{run.started_at:%Y-%m-%d %H:%M:%S}] {run.job.name}: {run.get_status_display()}, '
+            f'{run.duration_seconds:.1f} сек, строк: {run.rows_affected if run.rows_affected is not None else "—"}'
+            + (f' — {run.error}' if run.error else '')
+        ))
+
+    def _report(self, days):
+        since = timezone.now() - timedelta(days=days)
+        rows = (
+            JobRun.objects.filter(started_at__gte=since).exclude(status='skipped')
+            .values('job__name')
+            .annotate(runs=Count('id'), total=Sum('duration_seconds'), avg=Avg('duration_seconds'),
+                      longest=Max('duration_seconds'), rows=Sum('rows_affected'))
+            .order_by('-total')
+        )
+        self.stdout.write(f'Запуски за {days} дн.:')
+        self.stdout.write(f"  {'Задача':<40} {'запусков':>8} {'всего, с':>10} {'сред., с':>9} {'макс., с':>9} {'строк':>10}")
+        for row in rows:
+            self.stdout.write(
+                f"  {row['job__name']:<40} {row['runs']:>8} {row['total']:>10.1f} "
+                f"{row['avg']:>9.1f} {row['longest']:>9.1f} {row['rows'] or 0:>10}"
+            )
@@ -0,0 +1,44 @@
+"""
+Массовый прогон правил workflow по активным кейсам.
+
+Условия правил переводятся в SQL-фильтры, подходящие кейсы выбираются одним
+запросом на правило, действия выполняются пачками.
+
+Примеры:
+  py manage.py run_workflow_rules
+  py manage.py run_workflow_rules --dry-run
+  py manage.py run_workflow_rules --stage soft_early --batch-size 1000
+"""
+
+from django.core.management.base import BaseCommand
+
+from collection_app.models import CollectionCase, WorkflowRule
+from collection_app.services.workflow_service import WorkflowEngine
+
+
+class Command(BaseCommand):
+    help = 'Прогон правил workflow по всем активным кейсам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать подходящие кейсы')
+        parser.add_argument('--stage', type=str, default=None,
+                            help='Только кейсы указанной стадии')
+        parser.add_argument('--batch-size', type=int, default=WorkflowEngine.BATCH_SIZE,
+                            help=f'Кейсов в пачке (default: {WorkflowEngine.BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        qs = CollectionCase.objects.filter(status='active')
+        if options['stage']:
+            qs = qs.filter(stage=options['stage'])
+
+        stats = WorkflowEngine.run_rules(
+            queryset=qs, dry_run=options['dry_run'], batch_size=options['batch_size'],
+        )
+        names = dict(WorkflowRule.objects.values_list('id', 'name'))
+        for key, count in stats.items():
+            if key != 'cases':
+                self.stdout.write(f'  {names.get(int(key), key)}: {count}')
+
+        prefix = '[DRY RUN] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(f'{prefix}Кейсов обработано: {stats["cases"]}'))
@@ -0,0 +1,35 @@
+"""
+Пакетное психотипирование всех клиентов.
+
+Признаки считаются сгруппированными запросами, баллы психотипов — матричным
+произведением (ml/psychotyping.py), ClientBehaviorProfile пишется upsert'ом порциями.
+
+Примеры:
+  py manage.py update_psychotypes
+  py manage.py update_psychotypes --chunk-size 20000
+  py manage.py update_psychotypes --client 42 --client 43
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from collection_app.ml.psychotyping import update_client_profiles
+
+
+class Command(BaseCommand):
+    help = 'Пакетное обновление психотипов клиентов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Клиентов в порции (default: 5000)')
+        parser.add_argument('--client', type=int, action='append', dest='clients',
+                            help='ID клиента (можно несколько раз)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        updated = update_client_profiles(client_ids=options['clients'], chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Профилей обновлено: {updated} за {elapsed:.1f} сек'
+        ))
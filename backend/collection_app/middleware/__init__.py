@@ -3,9 +3,12 @@ Security Middleware Package
 
 Provides:
 - RateLimitMiddleware: Request rate limiting
+- SlidingWindowLimiter: Atomic sliding-window limiter (shared cache + local leases)
 - AuditMiddleware: Action logging for compliance
+- AuditQueue: Bounded audit queue with background batched writes
 - SecurityHeadersMiddleware: Security headers
 - RequestValidationMiddleware: Input validation
+- ProfilingMiddleware: Per-request SQL / timing profile aggregated per route (opt-in)
 """
 
 from .security import (
@@ -16,6 +19,9 @@ from .security import (
     rate_limit,
     audit_action,
 )
+from .rate_limiter import SlidingWindowLimiter, RateLimitDecision
+from .audit_queue import AuditQueue, AuditRecord, audit_queue
+from .profiling import ProfilingMiddleware, RequestProfiler, request_profiler
 
 __all__ = [
     'RateLimitMiddleware',
@@ -24,4 +30,12 @@ __all__ = [
     'RequestValidationMiddleware',
     'rate_limit',
     'audit_action',
+    'SlidingWindowLimiter',
+    'RateLimitDecision',
+    'AuditQueue',
+    'AuditRecord',
+    'audit_queue',
+    'ProfilingMiddleware',
+    'RequestProfiler',
+    'request_profiler',
 ]
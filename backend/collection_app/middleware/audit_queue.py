@@ -0,0 +1,225 @@
+"""
+Очередь записей аудита: запрос только ставит запись в ограниченную очередь,
+фоновый поток пишет их пачками через bulk_create.
+
+Обязательные записи (изменения данных, доступ к ПДн) не теряются: если очередь
+заполнена, запись выполняется сразу в потоке запроса. Необязательные (выборка
+GET без ПДн) при переполнении отбрасываются и учитываются в метриках.
+Тело запроса сохраняется только как сырой фрагмент; имена чувствительных полей
+(без значений) извлекаются при записи, в фоновом потоке.
+
+Настройки:
+    AUDIT_QUEUE_SIZE       — ёмкость очереди (default 10000)
+    AUDIT_BATCH_SIZE       — записей в одном bulk_create (default 200)
+    AUDIT_FLUSH_INTERVAL   — сек ожидания неполной пачки (default 1.0)
+    AUDIT_BACKGROUND       — False: без фонового потока, запись по flush() (тесты)
+
+Использование:
+    from collection_app.middleware.audit_queue import audit_queue
+    audit_queue.enqueue(AuditRecord(...))
+    audit_queue.metrics()
+"""
+
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Имена полей с персональными данными (152-ФЗ); значения в журнал не пишутся
+SENSITIVE_FIELDS = (
+    'passport', 'inn', 'snils', 'phone', 'email', 'address',
+    'birth_date', 'income', 'employer',
+)
+
+
+@dataclass
+class AuditRecord:
+    action: str
+    path: str
+    method: str
+    user_id: Optional[int] = None
+    client_id: Optional[int] = None
+    ip_address: Optional[str] = None
+    details: Dict = field(default_factory=dict)
+    personal_data: bool = False
+    required: bool = True  # False — выборочный GET, можно отбросить при переполнении
+    body: bytes = b''
+    content_type: str = ''
+    created: float = field(default_factory=time.time)
+
+
+def sensitive_fields_in_body(body: bytes, content_type: str) -> List[str]:
+    """Чувствительные поля, переданные в теле (JSON-объект или форма)"""
+    if not body:
+        return []
+    keys: Iterable[str] = ()
+    try:
+        if content_type.startswith('application/json'):
+            data = json.loads(body)
+            if isinstance(data, list):
+                keys = {key for item in data if isinstance(item, dict) for key in item}
+            elif isinstance(data, dict):
+                keys = data.keys()
+        elif content_type.startswith('application/x-www-form-urlencoded'):
+            keys = parse_qs(body.decode('utf-8', errors='ignore')).keys()
+    except ValueError:
+        return []
+    return sorted(name for name in keys if any(s in name.lower() for s in SENSITIVE_FIELDS))
+
+
+class AuditQueue:
+    """Ограниченная очередь аудита с фоновой пакетной записью"""
+
+    def __init__(self, maxsize: Optional[int] = None):
+        self._maxsize = maxsize
+        self._queue: Optional[queue.Queue] = None
+        self._worker: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stats = dict(enqueued=0, written=0, dropped=0, sync_writes=0, batches=0,
+                           failed=0, max_depth=0)
+        self._last_flush: Optional[float] = None
+
+    @property
+    def queue(self) -> queue.Queue:
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue(maxsize=self._maxsize or getattr(settings, 'AUDIT_QUEUE_SIZE', 10000))
+            return self._queue
+
+    def enqueue(self, record: AuditRecord) -> bool:
+        """Поставить запись в очередь; False — необязательная запись отброшена"""
+        self._ensure_worker()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if not record.required:
+                self._count('dropped')
+                return False
+            # Обратное давление: обязательная запись — сразу, в потоке запроса
+            self._count('sync_writes')
+            self._write([record])
+            return True
+        self._count('enqueued')
+        depth = self.queue.qsize()
+        with self._lock:
+            self._stats['max_depth'] = max(self._stats['max_depth'], depth)
+        return True
+
+    def flush(self) -> int:
+        """Записать всё, что накопилось в очереди; возвращает число записей"""
+        written = 0
+        batch_size = getattr(settings, 'AUDIT_BATCH_SIZE', 200)
+        with self._flush_lock:
+            while True:
+                batch = self._take(batch_size)
+                if not batch:
+                    return written
+                written += self._write(batch)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(
+            depth=self.queue.qsize(),
+            capacity=self.queue.maxsize,
+            worker_alive=bool(self._worker and self._worker.is_alive()),
+            last_flush=self._last_flush,
+        )
+        return stats
+
+    def reset_metrics(self) -> None:
+        with self._lock:
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def _count(self, key: str, value: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += value
+
+    def _take(self, limit: int, timeout: Optional[float] = None) -> List[AuditRecord]:
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=timeout) if timeout else self.queue.get_nowait())
+            while len(batch) < limit:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _ensure_worker(self) -> None:
+        if not getattr(settings, 'AUDIT_BACKGROUND', True):
+            return
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                if self._worker is None:
+                    # Дописать остаток очереди при остановке процесса
+                    atexit.register(self.flush)
+                self._worker = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        interval = getattr(settings, 'AUDIT_FLUSH_INTERVAL', 1.0)
+        batch_size = getattr(settings, 'AUDIT_BATCH_SIZE', 200)
+        while True:
+            batch = self._take(batch_size, timeout=interval)
+            if not batch:
+                continue
+            # Неполная пачка — подождать ещё немного, чтобы писать крупнее
+            if len(batch) < batch_size:
+                time.sleep(min(0.05, interval))
+                batch += self._take(batch_size - len(batch))
+            with self._flush_lock:
+                close_old_connections()
+                self._write(batch)
+
+    def _write(self, records: List[AuditRecord]) -> int:
+        from ..models import AuditLog, Client, Operator
+
+        try:
+            user_ids = {r.user_id for r in records if r.user_id}
+            operators = dict(Operator.objects.filter(user_id__in=user_ids).values_list('user_id', 'id')) \
+                if user_ids else {}
+            client_ids = {r.client_id for r in records if r.client_id}
+            existing_clients = set(Client.objects.filter(id__in=client_ids).values_list('id', flat=True)) \
+                if client_ids else set()
+            entries = []
+            for record in records:
+                details = dict(record.details, method=record.method, path=record.path,
+                               user_id=record.user_id, personal_data_accessed=record.personal_data,
+                               requested_at=record.created)
+                fields = sensitive_fields_in_body(record.body, record.content_type)
+                if fields:
+                    details['sensitive_fields'] = fields
+                    details['personal_data_accessed'] = True
+                entries.append(AuditLog(
+                    action=record.action,
+                    operator_id=operators.get(record.user_id),
+                    client_id=record.client_id if record.client_id in existing_clients else None,
+                    ip_address=record.ip_address or None,
+                    details=details,
+                ))
+            AuditLog.objects.bulk_create(entries, batch_size=getattr(settings, 'AUDIT_BATCH_SIZE', 200))
+        except Exception as e:
+            logger.error(f"Failed to write {len(records)} audit records: {e}")
+            self._count('failed', len(records))
+            return 0
+        self._count('written', len(entries))
+        self._count('batches')
+        self._last_flush = time.time()
+        return len(entries)
+
+
+audit_queue = AuditQueue()
@@ -0,0 +1,260 @@
+"""
+Профилирование запросов: число SQL-запросов, время SQL, повторяющиеся запросы
+(N+1), время Python и размер ответа — по каждому запросу, с агрегацией в памяти
+процесса по маршруту (шаблон URL, а не конкретный путь).
+
+Включается явно: PROFILING_ENABLED=1 добавляет ProfilingMiddleware в MIDDLEWARE
+(см. settings). Запросы, превысившие бюджет, пишутся в лог предупреждением.
+
+Учитываются запросы из потока обработки запроса; запросы из пула потоков
+(секции ASYNC_QUERY_WORKERS в async-отчётах) в счётчик не попадают.
+
+Настройки:
+    PROFILING_ENABLED   — включить middleware (default False)
+    PROFILING_SAMPLES   — последних запросов на маршрут для перцентилей (default 500)
+    PROFILING_BUDGETS   — пороги для лога: queries, sql_ms, total_ms, duplicates
+
+Использование:
+    from collection_app.middleware.profiling import request_profiler
+    request_profiler.report(order='p95', limit=10)
+    request_profiler.reset()
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGETS = {'queries': 50, 'sql_ms': 200, 'total_ms': 1000, 'duplicates': 10}
+
+_IN_LIST = re.compile(r'\((?:\s*%s\s*,)*\s*%s\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_SPACES = re.compile(r'\s+')
+
+
+def fingerprint(sql: str) -> str:
+    """Шаблон запроса: без чисел и длины списков IN (%s, %s, ...)"""
+    sql = _IN_LIST.sub('(...)', sql)
+    sql = _NUMBER.sub('N', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+@dataclass
+class RequestProfile:
+    route: str
+    method: str
+    status: int
+    total_ms: float
+    sql_ms: float
+    queries: int
+    response_bytes: int
+    duplicates: Dict[str, int] = field(default_factory=dict)  # шаблон -> число выполнений
+
+    @property
+    def python_ms(self) -> float:
+        return max(0.0, self.total_ms - self.sql_ms)
+
+    @property
+    def duplicate_queries(self) -> int:
+        """Лишние выполнения: всё сверх первого по каждому шаблону"""
+        return sum(count - 1 for count in self.duplicates.values())
+
+
+class QueryRecorder:
+    """execute_wrapper: считает запросы, время и шаблоны"""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.fingerprints: Counter = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self) -> Dict[str, int]:
+        return {sql: count for sql, count in self.fingerprints.items() if count > 1}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class RouteStats:
+    """Агрегат маршрута: счётчики за всё время + последние samples для перцентилей"""
+
+    def __init__(self, samples: int):
+        self.requests = 0
+        self.over_budget = 0
+        self.total_queries = 0
+        self.total_sql_ms = 0.0
+        self.max_queries = 0
+        self.durations: deque = deque(maxlen=samples)
+        self.query_counts: deque = deque(maxlen=samples)
+        self.sql_times: deque = deque(maxlen=samples)
+        self.python_times: deque = deque(maxlen=samples)
+        self.sizes: deque = deque(maxlen=samples)
+        self.duplicates: Counter = Counter()  # шаблон -> запросов, где он повторялся
+
+    def add(self, profile: RequestProfile, over_budget: bool) -> None:
+        self.requests += 1
+        self.over_budget += over_budget
+        self.total_queries += profile.queries
+        self.total_sql_ms += profile.sql_ms
+        self.max_queries = max(self.max_queries, profile.queries)
+        self.durations.append(profile.total_ms)
+        self.query_counts.append(profile.queries)
+        self.sql_times.append(profile.sql_ms)
+        self.python_times.append(profile.python_ms)
+        self.sizes.append(profile.response_bytes)
+        self.duplicates.update(profile.duplicates.keys())
+        if len(self.duplicates) > 200:
+            self.duplicates = Counter(dict(self.duplicates.most_common(100)))
+
+    def summary(self, route: str) -> Dict:
+        durations = list(self.durations)
+        return {
+            'route': route,
+            'requests': self.requests,
+            'over_budget': self.over_budget,
+            'p50_ms': round(_percentile(durations, 0.5), 2),
+            'p95_ms': round(_percentile(durations, 0.95), 2),
+            'avg_queries': round(self.total_queries / self.requests, 1),
+            'p95_queries': _percentile(list(self.query_counts), 0.95),
+            'max_queries': self.max_queries,
+            'p95_sql_ms': round(_percentile(list(self.sql_times), 0.95), 2),
+            'p95_python_ms': round(_percentile(list(self.python_times), 0.95), 2),
+            'avg_response_bytes': round(sum(self.sizes) / len(self.sizes)) if self.sizes else 0,
+            'duplicate_queries': [
+                {'sql': sql, 'requests': count} for sql, count in self.duplicates.most_common(5)
+            ],
+        }
+
+
+class RequestProfiler:
+    """Агрегатор профилей по маршрутам (в памяти процесса)"""
+
+    ORDERS = {'p95': 'p95_ms', 'queries': 'avg_queries', 'sql': 'p95_sql_ms', 'requests': 'requests'}
+
+    def __init__(self):
+        self._routes: Dict[str, RouteStats] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def budgets() -> Dict:
+        return {**DEFAULT_BUDGETS, **getattr(settings, 'PROFILING_BUDGETS', {})}
+
+    def over_budget(self, profile: RequestProfile) -> List[str]:
+        """Какие бюджеты превышены (пусто — в пределах)"""
+        budgets = self.budgets()
+        values = {
+            'queries': profile.queries,
+            'sql_ms': profile.sql_ms,
+            'total_ms': profile.total_ms,
+            'duplicates': profile.duplicate_queries,
+        }
+        return [name for name, value in values.items()
+                if budgets.get(name) is not None and value > budgets[name]]
+
+    def record(self, profile: RequestProfile) -> List[str]:
+        exceeded = self.over_budget(profile)
+        key = f'{profile.method} {profile.route}'
+        with self._lock:
+            stats = self._routes.get(key)
+            if stats is None:
+                stats = self._routes[key] = RouteStats(getattr(settings, 'PROFILING_SAMPLES', 500))
+            stats.add(profile, bool(exceeded))
+        if exceeded:
+            top = max(profile.duplicates.items(), key=lambda item: item[1], default=None)
+            logger.warning(
+                f"Over budget ({', '.join(exceeded)}): {key} status={profile.status} "
+                f"total={profile.total_ms:.1f}ms sql={profile.sql_ms:.1f}ms queries={profile.queries} "
+                f"duplicates={profile.duplicate_queries}"
+                + (f" top_duplicate={top[1]}x {top[0][:200]}" if top else '')
+            )
+        return exceeded
+
+    def report(self, order: str = 'p95', limit: int = 20) -> List[Dict]:
+        """Сводка по маршрутам, по убыванию order (p95 / queries / sql / requests)"""
+        if order not in self.ORDERS:
+            raise ValueError(f'order: {", ".join(self.ORDERS)}')
+        with self._lock:
+            rows = [stats.summary(route) for route, stats in self._routes.items()]
+        rows.sort(key=lambda row: row[self.ORDERS[order]], reverse=True)
+        return rows[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+
+request_profiler = RequestProfiler()
+
+
+def _route(request: HttpRequest) -> str:
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not match.route:
+        return '<unresolved>'
+    # Маршруты DRF-роутера — регулярные выражения: ^clients/(?P<pk>[^/.]+)/$
+    return re.sub(r'\(\?P<(\w+)>[^)]*\)', r'<\1>', match.route).replace('^', '').replace('$', '')
+
+
+class ProfilingMiddleware:
+    """
+    Profiling Middleware.
+
+    Считает SQL-запросы всех баз (connection.execute_wrapper) и время запроса,
+    передаёт профиль в request_profiler. Заголовки X-Profile-Queries
+    и X-Profile-SQL-Ms — для отладки с клиента.
+    """
+
+    def __init__(self, get_response: Callable, profiler: Optional[RequestProfiler] = None):
+        self.get_response = get_response
+        self.profiler = profiler or request_profiler
+
+    def __call__(self, request: HttpRequest):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - started) * 1000
+
+        if getattr(response, 'streaming', False):
+            # Тело потока ещё не сформировано (и его запросы не учтены)
+            size = int(response.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        profile = RequestProfile(
+            route=_route(request),
+            method=request.method,
+            status=response.status_code,
+            total_ms=total_ms,
+            sql_ms=recorder.sql_time * 1000,
+            queries=recorder.queries,
+            response_bytes=size,
+            duplicates=recorder.duplicates(),
+        )
+        self.profiler.record(profile)
+        response['X-Profile-Queries'] = str(profile.queries)
+        response['X-Profile-SQL-Ms'] = f'{profile.sql_ms:.1f}'
+        return response
@@ -0,0 +1,136 @@
+"""
+Rate limiter: скользящее окно поверх атомарного счётчика в кэше.
+
+Окно приближается двумя фиксированными: запросы текущего окна плюс запросы
+предыдущего с весом оставшейся доли,
+    estimate = prev * (1 - elapsed / window) + current.
+Счётчик текущего окна увеличивается только через cache.incr (атомарно
+в LocMem / Redis / Memcached), поэтому параллельные запросы не теряют
+приращения и лимит не превышается.
+
+Локальный быстрый путь: процесс берёт у общего счётчика «аренду» из нескольких
+слотов одним incr и расходует её без обращений к кэшу. Неиспользованные слоты
+возвращаются, если лимит почти исчерпан; при смене окна остаток аренды пропадает
+(недобор не больше lease на процесс, перебора нет).
+
+Общий счётчик для всех воркеров — кэш settings.RATE_LIMIT_CACHE (Redis
+при REDIS_URL, см. settings.CACHES).
+
+Использование:
+    limiter = SlidingWindowLimiter(limit=100, window=60)
+    decision = limiter.hit('ip:10.0.0.1')
+    if not decision.allowed: ...  # decision.retry_after
+"""
+
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+@dataclass
+class RateLimitDecision:
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: int  # сек до освобождения слота (0 — запрос разрешён)
+
+
+class _Lease:
+    __slots__ = ('window_index', 'slots', 'previous', 'last_count')
+
+    def __init__(self, window_index: int, previous: int):
+        self.window_index = window_index
+        self.slots = 0
+        self.previous = previous  # счётчик предыдущего окна (уже не меняется)
+        self.last_count = 0
+
+
+class SlidingWindowLimiter:
+    """Лимит limit запросов за скользящее окно window секунд на ключ"""
+
+    def __init__(self, limit: int, window: int, prefix: str = 'rl', lease: int = 8,
+                 cache_alias: Optional[str] = None, clock: Callable[[], float] = time.time):
+        self.limit = limit
+        self.window = window
+        self.prefix = prefix
+        self.lease = max(1, lease)
+        self.cache_alias = cache_alias or getattr(settings, 'RATE_LIMIT_CACHE', 'default')
+        self.clock = clock
+        self._leases: Dict[str, _Lease] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, key: str, window_index: int) -> str:
+        return f'{self.prefix}:{key}:{window_index}'
+
+    def hit(self, key: str) -> RateLimitDecision:
+        """Учесть запрос; allowed=False — лимит исчерпан"""
+        now = self.clock()
+        window_index = int(now // self.window)
+        elapsed = (now % self.window) / self.window
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease.window_index == window_index and lease.slots > 0:
+                lease.slots -= 1
+                return RateLimitDecision(True, self.limit, self._remaining(lease, elapsed), 0)
+            # Аренда кончилась или окно сменилось — к общему счётчику
+            if lease is None or lease.window_index != window_index:
+                previous = self.cache.get(self._key(key, window_index - 1), 0)
+                lease = self._leases[key] = _Lease(window_index, previous)
+                if len(self._leases) > 10000:
+                    self._drop_stale(window_index)
+
+        # Сколько запросов текущего окна допускает вес предыдущего
+        allowance = self.limit - math.floor(lease.previous * (1 - elapsed))
+        if allowance <= 0:
+            return self._reject(lease, elapsed)
+        # Крупная аренда, пока до лимита далеко; у края — по одному слоту
+        want = self.lease if lease.last_count + 2 * self.lease <= allowance else 1
+        count = self._incr(self._key(key, window_index), want)
+        granted = min(want, allowance - (count - want))
+        if granted < want:
+            # Вернуть слоты сверх лимита, чтобы их могли взять другие процессы
+            self.cache.decr(self._key(key, window_index), want - max(granted, 0))
+            count -= want - max(granted, 0)
+        with self._lock:
+            lease.last_count = max(lease.last_count, count)
+            if granted <= 0:
+                return self._reject(lease, elapsed)
+            lease.slots += granted - 1
+        return RateLimitDecision(True, self.limit, self._remaining(lease, elapsed), 0)
+
+    def _incr(self, cache_key: str, delta: int) -> int:
+        cache = self.cache
+        # add не перезапишет счётчик, созданный другим процессом
+        cache.add(cache_key, 0, self.window * 2)
+        try:
+            return cache.incr(cache_key, delta)
+        except ValueError:  # ключ вытеснен между add и incr
+            cache.add(cache_key, 0, self.window * 2)
+            return cache.incr(cache_key, delta)
+
+    def _remaining(self, lease: _Lease, elapsed: float) -> int:
+        used = math.floor(lease.previous * (1 - elapsed)) + lease.last_count
+        return max(0, self.limit - used)
+
+    def _reject(self, lease: _Lease, elapsed: float) -> RateLimitDecision:
+        # Слот освобождается не позже начала следующего окна
+        retry_after = max(1, math.ceil((1 - elapsed) * self.window))
+        return RateLimitDecision(False, self.limit, 0, retry_after)
+
+    def _drop_stale(self, window_index: int) -> None:
+        for key in [k for k, lease in self._leases.items() if lease.window_index != window_index]:
+            del self._leases[key]
+
+    def reset(self) -> None:
+        """Сбросить локальные аренды (тесты)"""
+        with self._lock:
+            self._leases.clear()
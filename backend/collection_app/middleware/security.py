@@ -8,29 +8,58 @@ Security Middleware - Защита API
 - Security Headers
 """
 
-import time
+import hashlib
+import io
+import json
 import logging
-from collections import defaultdict
-from datetime import datetime, timedelta
+import random
+import re
+import time
 from typing import Callable, Dict, Optional
 from functools import wraps
+from urllib.parse import unquote_plus
 
 from django.http import JsonResponse, HttpRequest
-from django.core.cache import cache
 from django.conf import settings
 from rest_framework import status
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
 
-from ..models import AuditLog
+from .audit_queue import SENSITIVE_FIELDS, AuditQueue, AuditRecord, audit_queue
+from .rate_limiter import RateLimitDecision, SlidingWindowLimiter
 
 logger = logging.getLogger(__name__)
 
 
+def _client_ip(request: HttpRequest) -> str:
+    """IP клиента с учётом прокси (первый адрес X-Forwarded-For)"""
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _rate_limit_identity(request: HttpRequest) -> str:
+    """
+    Ключ лимита: пользователь сессии, иначе токен DRF (Authorization: Token ...),
+    иначе IP. Токен не проверяется (это сделает view) — ключ по его хэшу,
+    без запроса к БД на каждый запрос.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    auth = get_authorization_header(request).split()
+    if len(auth) == 2 and auth[0].lower() == TokenAuthentication.keyword.lower().encode():
+        return f'token:{hashlib.sha1(auth[1]).hexdigest()}'
+    return f"ip:{_client_ip(request) or 'unknown'}"
+
+
 class RateLimitMiddleware:
     """
     Rate Limiting Middleware.
     
-    Ограничивает количество запросов с одного IP.
-    Использует sliding window algorithm.
+    Ограничивает количество запросов с одного пользователя (сессия после
+    AuthenticationMiddleware или токен DRF) или, для анонимных, с одного IP.
+    Скользящее окно с атомарными счётчиками (см. rate_limiter.py).
     """
     
     # Лимиты по умолчанию (requests per window)
@@ -50,26 +79,36 @@ class RateLimitMiddleware:
     
     def __init__(self, get_response: Callable):
         self.get_response = get_response
+        self.limiters = {
+            endpoint_type: SlidingWindowLimiter(limit, window, prefix=f'rate_limit:{endpoint_type}')
+            for endpoint_type, (limit, window) in self.DEFAULT_RATE_LIMITS.items()
+        }
     
     def __call__(self, request: HttpRequest):
-        client_ip = self._get_client_ip(request)
         endpoint_type = self._get_endpoint_type(request.path)
+        identity = self._get_identity(request)
         
-        if not self._check_rate_limit(client_ip, endpoint_type):
-            return JsonResponse(
+        decision = self._check_rate_limit(identity, endpoint_type)
+        if not decision.allowed:
+            response = JsonResponse(
                 {'error': 'Rate limit exceeded. Please try again later.'},
                 status=status.HTTP_429_TOO_MANY_REQUESTS
             )
+            response['Retry-After'] = str(decision.retry_after)
+            return response
         
         response = self.get_response(request)
+        response['X-RateLimit-Limit'] = str(decision.limit)
+        response['X-RateLimit-Remaining'] = str(decision.remaining)
         return response
     
     def _get_client_ip(self, request: HttpRequest) -> str:
         """Получение IP клиента с учётом прокси"""
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            return x_forwarded_for.split(',')[0].strip()
-        return request.META.get('REMOTE_ADDR', 'unknown')
+        return _client_ip(request) or 'unknown'
+    
+    def _get_identity(self, request: HttpRequest) -> str:
+        """Ключ лимита: пользователь (сессия или токен), иначе IP"""
+        return _rate_limit_identity(request)
     
     def _get_endpoint_type(self, path: str) -> str:
         """Определение типа эндпоинта для лимитов"""
@@ -83,43 +122,22 @@ class RateLimitMiddleware:
         
         return 'default'
     
-    def _check_rate_limit(self, client_ip: str, endpoint_type: str) -> bool:
-        """
-        Проверка rate limit с использованием sliding window.
-        
-        Returns:
-            bool: True если запрос разрешён
-        """
-        max_requests, window_seconds = self.DEFAULT_RATE_LIMITS.get(
-            endpoint_type, self.DEFAULT_RATE_LIMITS['default']
-        )
-        
-        cache_key = f"rate_limit:{client_ip}:{endpoint_type}"
-        
-        # Получаем текущий счётчик
-        current = cache.get(cache_key, {'count': 0, 'reset_at': time.time() + window_seconds})
-        
-        # Проверяем, не истёк ли window
-        if time.time() > current['reset_at']:
-            current = {'count': 0, 'reset_at': time.time() + window_seconds}
-        
-        # Проверяем лимит
-        if current['count'] >= max_requests:
-            logger.warning(f"Rate limit exceeded for IP {client_ip} on {endpoint_type}")
-            return False
-        
-        # Увеличиваем счётчик
-        current['count'] += 1
-        cache.set(cache_key, current, window_seconds)
-        
-        return True
+    def _check_rate_limit(self, identity: str, endpoint_type: str) -> RateLimitDecision:
+        """Учесть запрос в скользящем окне; decision.allowed — запрос разрешён"""
+        limiter = self.limiters.get(endpoint_type, self.limiters['default'])
+        decision = limiter.hit(identity)
+        if not decision.allowed:
+            logger.warning(f"Rate limit exceeded for {identity} on {endpoint_type}")
+        return decision
 
 
 class AuditMiddleware:
     """
     Audit Logging Middleware.
     
-    Логирует все действия пользователей для compliance.
+    Логирует действия пользователей для compliance. Запись ставится в очередь
+    (audit_queue.py) и пишется фоновым потоком пачками; изменения и доступ
+    к ПДн логируются всегда, прочие GET — с долей AUDIT_GET_SAMPLE_RATE.
     """
     
     # Эндпоинты, требующие аудита
@@ -137,104 +155,120 @@ class AuditMiddleware:
     AUDIT_METHODS = ['POST', 'PUT', 'PATCH', 'DELETE']
     
     # Чувствительные поля (персональные данные)
-    SENSITIVE_FIELDS = [
-        'passport', 'inn', 'snils', 'phone', 'email', 'address',
-        'birth_date', 'income', 'employer'
-    ]
+    SENSITIVE_FIELDS = list(SENSITIVE_FIELDS)
+    
+    ACTION_MAP = {
+        'POST': 'api_create',
+        'PUT': 'api_update',
+        'PATCH': 'api_update',
+        'DELETE': 'api_delete',
+        'GET': 'api_read',
+    }
     
-    def __init__(self, get_response: Callable):
+    # Тело сохраняется для разбора в фоне только у небольших JSON / form запросов
+    BODY_CONTENT_TYPES = ('application/json', 'application/x-www-form-urlencoded')
+    MAX_BODY_CAPTURE = 64 * 1024
+    
+    def __init__(self, get_response: Callable, queue: Optional[AuditQueue] = None):
         self.get_response = get_response
+        self.queue = queue or audit_queue
     
     def __call__(self, request: HttpRequest):
         # Сохраняем начальное время
         start_time = time.time()
         
-        # Определяем, нужен ли аудит
-        should_audit = self._should_audit(request)
+        # Определяем, нужен ли аудит: 'required', 'sampled' или None
+        mode = self._audit_mode(request)
         
         # Сохраняем информацию для аудита до выполнения запроса
-        if should_audit:
-            audit_data = self._prepare_audit_data(request)
+        if mode:
+            audit_data = self._prepare_audit_data(request, mode)
         
         # Выполняем запрос
         response = self.get_response(request)
         
-        # Логируем после выполнения
-        if should_audit:
+        # Ставим запись в очередь после выполнения
+        if mode:
             self._log_audit(request, response, audit_data, time.time() - start_time)
         
         return response
     
-    def _should_audit(self, request: HttpRequest) -> bool:
-        """Проверка необходимости аудита"""
+    def _audit_mode(self, request: HttpRequest) -> Optional[str]:
+        """Обязательный аудит, выборочный (GET без ПДн) или без аудита"""
+        audited_path = any(request.path.startswith(path) for path in self.AUDIT_PATHS)
+        
         # Всегда логируем изменяющие методы на чувствительных эндпоинтах
         if request.method in self.AUDIT_METHODS:
-            for path in self.AUDIT_PATHS:
-                if request.path.startswith(path):
-                    return True
+            return 'required' if audited_path else None
         
-        # Логируем просмотр персональных данных
-        if request.method == 'GET' and '/clients/' in request.path:
-            return True
+        if request.method != 'GET':
+            return None
         
-        return False
+        # Всегда логируем просмотр персональных данных
+        if self._check_personal_data_access(request):
+            return 'required'
+        
+        if audited_path and random.random() < self._sample_rate():
+            return 'sampled'
+        return None
+    
+    @staticmethod
+    def _sample_rate() -> float:
+        return getattr(settings, 'AUDIT_GET_SAMPLE_RATE', 0.1)
     
-    def _prepare_audit_data(self, request: HttpRequest) -> Dict:
+    def _prepare_audit_data(self, request: HttpRequest, mode: str) -> Dict:
         """Подготовка данных для аудита"""
+        body, content_type = b'', request.content_type or ''
+        if request.method in self.AUDIT_METHODS and content_type.startswith(self.BODY_CONTENT_TYPES):
+            try:
+                if int(request.META.get('CONTENT_LENGTH') or 0) <= self.MAX_BODY_CAPTURE:
+                    body = request.body
+            except ValueError:
+                pass
         return {
-            'path': request.path,
-            'method': request.method,
             'ip_address': self._get_client_ip(request),
             'user_agent': request.META.get('HTTP_USER_AGENT', '')[:500],
-            'timestamp': datetime.now().isoformat(),
+            'mode': mode,
+            'body': body,
+            'content_type': content_type,
         }
     
     def _log_audit(self, request: HttpRequest, response, audit_data: Dict, 
                    duration: float) -> None:
-        """Запись в журнал аудита"""
+        """Постановка записи аудита в очередь"""
         try:
-            # Определяем действие
-            action_map = {
-                'POST': 'create',
-                'PUT': 'update',
-                'PATCH': 'update',
-                'DELETE': 'delete',
-                'GET': 'read',
-            }
-            action = action_map.get(request.method, 'read')
-            
-            # Определяем модель
             model_name = self._extract_model_name(request.path)
-            
-            # Извлекаем ID объекта из URL
             object_id = self._extract_object_id(request.path)
+            user = getattr(request, 'user', None)
+            details = {
+                'model': model_name,
+                'object_id': object_id,
+                'status_code': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'user_agent': audit_data['user_agent'],
+            }
+            sampled = audit_data['mode'] == 'sampled'
+            if sampled:
+                details['sample_rate'] = self._sample_rate()
             
-            # Проверяем доступ к персональным данным
-            personal_data_accessed = self._check_personal_data_access(request)
-            
-            # Создаём запись аудита
-            AuditLog.objects.create(
-                user=request.user if request.user.is_authenticated else None,
-                action=action,
-                model_name=model_name,
-                object_id=object_id,
+            self.queue.enqueue(AuditRecord(
+                action=self.ACTION_MAP.get(request.method, 'api_read'),
+                path=request.path,
+                method=request.method,
+                user_id=user.pk if user is not None and user.is_authenticated else None,
+                client_id=object_id if model_name == 'clients' else None,
                 ip_address=audit_data['ip_address'],
-                user_agent=audit_data['user_agent'],
-                personal_data_accessed=personal_data_accessed,
-                changes={
-                    'status_code': response.status_code,
-                    'duration_ms': round(duration * 1000, 2),
-                }
-            )
-            
+                details=details,
+                personal_data=not sampled and (request.method == 'GET' or model_name == 'clients'),
+                required=not sampled,
+                body=audit_data['body'],
+                content_type=audit_data['content_type'],
+            ))
         except Exception as e:
-            logger.error(f"Failed to create audit log: {e}")
+            logger.error(f"Failed to enqueue audit log: {e}")
     
     def _get_client_ip(self, request: HttpRequest) -> str:
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            return x_forwarded_for.split(',')[0].strip()
-        return request.META.get('REMOTE_ADDR', '')
+        return _client_ip(request)
     
     def _extract_model_name(self, path: str) -> str:
         """Извлечение имени модели из пути"""
@@ -258,11 +292,7 @@ class AuditMiddleware:
             return True
         
         # Проверяем query parameters
-        for field in self.SENSITIVE_FIELDS:
-            if field in request.GET or field in getattr(request, 'data', {}):
-                return True
-        
-        return False
+        return any(field in request.GET for field in self.SENSITIVE_FIELDS)
 
 
 class SecurityHeadersMiddleware:
@@ -308,16 +338,59 @@ class SecurityHeadersMiddleware:
         return response
 
 
+class _PrefixedStream:
+    """Поток тела запроса: уже прочитанное начало + остаток исходного потока"""
+    
+    def __init__(self, prefix: bytes, stream):
+        self._prefix = io.BytesIO(prefix)
+        self._stream = stream
+    
+    def read(self, size=-1, /):
+        if size is None or size < 0:
+            return self._prefix.read() + self._stream.read()
+        data = self._prefix.read(size)
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+    
+    def readline(self, size=-1, /):
+        line = self._prefix.readline(size)
+        if line.endswith(b'\n') or (size is not None and 0 <= size <= len(line)):
+            return line
+        rest_size = -1 if size is None or size < 0 else size - len(line)
+        return line + self._stream.readline(rest_size)
+    
+    def close(self):
+        self._prefix.close()
+        self._stream.close()
+
+
 class RequestValidationMiddleware:
     """
     Request Validation Middleware.
     
-    Валидация и санитизация входящих запросов.
+    Валидация и санитизация входящих запросов. Запрещённые паттерны собраны
+    в одно регулярное выражение и проверяются за один проход: строка запроса
+    (после URL-декодирования), строки JSON, значения формы, текстовые поля
+    multipart (файлы и границы частей не проверяются). Тело до SMALL_BODY_BYTES
+    без совпадений и экранирования (%, +, \\u) проверяется одним проходом
+    без разбора по типу. Тело больше MAX_SCAN_BYTES проверяется потоково
+    и только в пределах этого лимита.
     """
     
     # Максимальный размер запроса (10 MB)
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024
     
+    # Сколько байт тела проверять (остальное не читается заранее)
+    MAX_SCAN_BYTES = 1024 * 1024
+    SCAN_CHUNK = 64 * 1024
+    
+    # До этого размера тело сначала проверяется одним проходом как есть
+    SMALL_BODY_BYTES = 4 * 1024
+    
+    # Экранирование, за которым может скрываться паттерн (URL-кодирование, JSON \\u)
+    ESCAPES = (b'%', b'+', b'\\u')
+    
     # Запрещённые паттерны (SQL injection, XSS)
     FORBIDDEN_PATTERNS = [
         '<script',
@@ -331,6 +404,12 @@ class RequestValidationMiddleware:
     
     def __init__(self, get_response: Callable):
         self.get_response = get_response
+        # Без IGNORECASE: данные приводятся к нижнему регистру один раз (в разы быстрее)
+        alternation = '|'.join(re.escape(pattern.lower()) for pattern in self.FORBIDDEN_PATTERNS)
+        self._pattern = re.compile(alternation)
+        self._bytes_pattern = re.compile(alternation.encode())
+        # Перекрытие кусков при потоковой проверке: паттерн мог начаться в предыдущем
+        self._overlap = max(len(pattern.encode()) for pattern in self.FORBIDDEN_PATTERNS) - 1
     
     def __call__(self, request: HttpRequest):
         # Проверка размера запроса
@@ -353,62 +432,144 @@ class RequestValidationMiddleware:
     
     def _contains_forbidden_patterns(self, request: HttpRequest) -> bool:
         """Проверка на вредоносные паттерны"""
-        # Проверяем query string
-        query_string = request.META.get('QUERY_STRING', '').upper()
-        for pattern in self.FORBIDDEN_PATTERNS:
-            if pattern.upper() in query_string:
-                return True
+        # Проверяем query string (в т.ч. закодированные %3Cscript и т.п.)
+        query_string = request.META.get('QUERY_STRING', '')
+        if query_string and self._search(unquote_plus(query_string)):
+            return True
         
-        # Проверяем тело запроса (для POST/PUT)
+        # Проверяем тело запроса (для POST/PUT/PATCH)
         if request.method in ['POST', 'PUT', 'PATCH']:
             try:
-                body = request.body.decode('utf-8', errors='ignore').upper()
-                for pattern in self.FORBIDDEN_PATTERNS:
-                    if pattern.upper() in body:
-                        return True
-            except:
-                pass
+                return self._scan_body(request)
+            except Exception:
+                # Тело, которое нельзя прочитать, отклонит сам Django / DRF
+                return False
         
         return False
+    
+    def _scan_body(self, request: HttpRequest) -> bool:
+        content_type = request.content_type or ''
+        multipart = content_type == 'multipart/form-data'
+        if int(request.META.get('CONTENT_LENGTH') or 0) > self.MAX_SCAN_BYTES:
+            head, found = self._read_head(request, scan=not multipart)
+            return self._scan_multipart(head, request) if multipart else found
+        
+        body = request.body
+        if not body:
+            return False
+        if (len(body) <= self.SMALL_BODY_BYTES and not self._search_bytes(body)
+                and not any(escape in body for escape in self.ESCAPES)):
+            # Чисто в сыром виде — разбор по типу ничего не найдёт
+            return False
+        if content_type == 'application/json':
+            return self._scan_json(body)
+        if content_type == 'application/x-www-form-urlencoded':
+            return self._search(unquote_plus(body.decode('utf-8', errors='ignore')))
+        if multipart:
+            return self._scan_multipart(body, request)
+        return self._search_bytes(body)
+    
+    def _search(self, text: str) -> bool:
+        return self._pattern.search(text.lower()) is not None
+    
+    def _search_bytes(self, data: bytes) -> bool:
+        return self._bytes_pattern.search(data.lower()) is not None
+    
+    def _read_head(self, request: HttpRequest, scan: bool):
+        """
+        Прочитать до MAX_SCAN_BYTES тела кусками, проверяя каждый (scan=True);
+        прочитанное возвращается в поток запроса для view.
+        """
+        stream = request._stream
+        chunks, size, found, tail = [], 0, False, b''
+        while size < self.MAX_SCAN_BYTES:
+            chunk = stream.read(min(self.SCAN_CHUNK, self.MAX_SCAN_BYTES - size))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+            if scan:
+                if self._search_bytes(tail + chunk):
+                    found = True
+                    break
+                tail = chunk[-self._overlap:] if self._overlap else b''
+        head = b''.join(chunks)
+        request._stream = _PrefixedStream(head, stream)
+        return head, found
+    
+    def _scan_json(self, body: bytes) -> bool:
+        """
+        Проверка только строк JSON (ключей и значений). Сначала — один проход
+        по сырому телу: без совпадений и \\u-экранирования чисто и без разбора.
+        """
+        raw_match = self._search_bytes(body)
+        if not raw_match and b'\\u' not in body:
+            return False
+        try:
+            stack = [json.loads(body)]
+        except ValueError:
+            return raw_match
+        search = self._search
+        while stack:
+            value = stack.pop()
+            if isinstance(value, str):
+                if search(value):
+                    return True
+            elif isinstance(value, dict):
+                for key, item in value.items():
+                    if search(key):
+                        return True
+                    stack.append(item)
+            elif isinstance(value, list):
+                stack.extend(value)
+        return False
+    
+    def _scan_multipart(self, body: bytes, request: HttpRequest) -> bool:
+        """Текстовые поля multipart; файлы и строки-границы (--boundary) пропускаются"""
+        boundary = request.content_params.get('boundary', '').encode()
+        if not boundary:
+            return False
+        for part in body.split(b'--' + boundary):
+            headers, _, value = part.partition(b'\r\n\r\n')
+            if not value or b'filename=' in headers.lower():
+                continue
+            if self._search_bytes(value[:-2] if value.endswith(b'\r\n') else value):
+                return True
+        return False
 
 
 # Декоратор для функциональных view
 def rate_limit(limit: int, window: int):
     """
-    Декоратор rate limiting для view.
+    Декоратор rate limiting для view (скользящее окно, ключ — пользователь или IP).
     
     Args:
         limit: Максимум запросов
         window: Окно времени в секундах
     """
     def decorator(view_func):
+        limiter = SlidingWindowLimiter(limit, window, prefix=f'rl:{view_func.__name__}')
+        
         @wraps(view_func)
         def wrapper(request, *args, **kwargs):
-            x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-            if x_forwarded_for:
-                client_ip = x_forwarded_for.split(',')[0].strip()
-            else:
-                client_ip = request.META.get('REMOTE_ADDR', 'unknown')
-            
-            cache_key = f"rl:{view_func.__name__}:{client_ip}"
-            
-            current = cache.get(cache_key, 0)
-            if current >= limit:
-                return JsonResponse(
+            decision = limiter.hit(_rate_limit_identity(request))
+            if not decision.allowed:
+                response = JsonResponse(
                     {'error': 'Rate limit exceeded'},
                     status=429
                 )
-            
-            cache.set(cache_key, current + 1, window)
+                response['Retry-After'] = str(decision.retry_after)
+                return response
             
             return view_func(request, *args, **kwargs)
+        wrapper.limiter = limiter
         return wrapper
     return decorator
 
 
 def audit_action(action: str, model: str):
     """
-    Декоратор для аудита конкретного действия.
+    Декоратор для аудита конкретного действия (запись через очередь аудита).
     
     Args:
         action: Тип действия
@@ -421,13 +582,16 @@ def audit_action(action: str, model: str):
             
             # Логируем действие
             try:
-                AuditLog.objects.create(
-                    user=request.user if request.user.is_authenticated else None,
+                user = getattr(request, 'user', None)
+                audit_queue.enqueue(AuditRecord(
                     action=action,
-                    model_name=model,
-                    object_id=kwargs.get('pk'),
-                    ip_address=request.META.get('REMOTE_ADDR', ''),
-                )
+                    path=request.path,
+                    method=request.method,
+                    user_id=user.pk if user is not None and user.is_authenticated else None,
+                    ip_address=_client_ip(request),
+                    details={'model': model, 'object_id': kwargs.get('pk'),
+                             'status_code': getattr(response, 'status_code', None)},
+                ))
             except Exception as e:
                 logger.error(f"Audit log failed: {e}")
             
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def _bucket_for_dpd(dpd):
+    if dpd <= 0:
+        return 'current'
+    elif dpd <= 30:
+        return '0-30'
+    elif dpd <= 60:
+        return '30-60'
+    elif dpd <= 90:
+        return '60-90'
+    return '90+'
+
+
+def backfill_current_state(apps, schema_editor):
+    """Заполнить Credit.current_state по последнему CreditState"""
+    Credit = apps.get_model('collection_app', 'Credit')
+    CreditState = apps.get_model('collection_app', 'CreditState')
+    latest = {}
+    states = CreditState.objects.order_by('credit_id', '-state_date', '-id').values_list('id', 'credit_id', 'overdue_days')
+    for state_id, credit_id, dpd in states.iterator():
+        latest.setdefault(credit_id, (state_id, dpd or 0))
+    batch = []
+    for credit in Credit.objects.filter(pk__in=list(latest)).only('id').iterator():
+        state_id, dpd = latest[credit.pk]
+        credit.current_state_id = state_id
+        credit.current_overdue_days = dpd
+        credit.current_bucket = _bucket_for_dpd(dpd)
+        batch.append(credit)
+    Credit.objects.bulk_update(batch, ['current_state', 'current_overdue_days', 'current_bucket'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection_app', '0008_violationlog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='credit',
+            name='current_bucket',
+            field=models.CharField(choices=[('current', 'Без просрочки'), ('0-30', '1-30 дней'), ('30-60', '31-60 дней'), ('60-90', '61-90 дней'), ('90+', 'Более 90 дней')], default='current', max_length=10, verbose_name='Текущая стадия просрочки'),
+        ),
+        migrations.AddField(
+            model_name='credit',
+            name='current_overdue_days',
+            field=models.IntegerField(default=0, verbose_name='Текущая просрочка (дней)'),
+        ),
+        migrations.AddField(
+            model_name='credit',
+            name='current_state',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='collection_app.creditstate', verbose_name='Текущее состояние'),
+        ),
+        migrations.AddIndex(
+            model_name='credit',
+            index=models.Index(fields=['current_bucket'], name='idx_credit_bucket'),
+        ),
+        migrations.AddIndex(
+            model_name='credit',
+            index=models.Index(fields=['current_overdue_days'], name='idx_credit_cur_dpd'),
+        ),
+        migrations.AddIndex(
+            model_name='creditstate',
+            index=models.Index(fields=['credit', '-state_date'], name='idx_cstate_credit_date'),
+        ),
+        migrations.RunPython(backfill_current_state, migrations.RunPython.noop),
+    ]
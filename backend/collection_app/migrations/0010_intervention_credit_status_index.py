@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection_app', '0009_credit_current_state'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='intervention',
+            index=models.Index(fields=['credit', 'status', '-datetime'], name='idx_interv_credit_st_dt'),
+        ),
+    ]
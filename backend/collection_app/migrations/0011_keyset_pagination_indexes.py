@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-19 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection_app', '0010_intervention_credit_status_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='creditstate',
+            index=models.Index(fields=['-state_date', '-id'], name='idx_cstate_date'),
+        ),
+        migrations.AddIndex(
+            model_name='intervention',
+            index=models.Index(fields=['-datetime', '-id'], name='idx_interv_datetime'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['-payment_date', '-id'], name='idx_payment_date'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['credit', '-payment_date'], name='idx_payment_credit_date'),
+        ),
+    ]
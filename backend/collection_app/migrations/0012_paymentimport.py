@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection_app', '0011_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_hash', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 файла')),
+                ('file_name', models.CharField(blank=True, max_length=255, verbose_name='Имя файла')),
+                ('file_format', models.CharField(choices=[('csv', 'CSV'), ('xml', 'Банковская выписка XML')], max_length=10, verbose_name='Формат')),
+                ('status', models.CharField(choices=[('processing', 'Обрабатывается'), ('completed', 'Завершён'), ('failed', 'Ошибка')], default='processing', max_length=20, verbose_name='Статус')),
+                ('rows_total', models.IntegerField(default=0, verbose_name='Строк в файле')),
+                ('rows_imported', models.IntegerField(default=0, verbose_name='Загружено платежей')),
+                ('rows_unmatched', models.IntegerField(default=0, verbose_name='Не найден договор')),
+                ('rows_invalid', models.IntegerField(default=0, verbose_name='Ошибки разбора')),
+                ('credits_updated', models.IntegerField(default=0, verbose_name='Обновлено кредитов')),
+                ('promises_settled', models.IntegerField(default=0, verbose_name='Закрыто обещаний')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Ошибки (первые)')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Начало')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание')),
+                ('duration_seconds', models.FloatField(default=0, verbose_name='Длительность (сек)')),
+            ],
+            options={
+                'verbose_name': 'Импорт платежей',
+                'verbose_name_plural': 'Импорты платежей',
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection_app', '0012_paymentimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledaction',
+            name='claim_token',
+            field=models.CharField(blank=True, db_index=True, max_length=32, verbose_name='Токен захвата'),
+        ),
+        migrations.AddField(
+            model_name='scheduledaction',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Захвачено'),
+        ),
+        migrations.AlterField(
+            model_name='scheduledaction',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает'), ('processing', 'Выполняется'), ('executed', 'Выполнено'), ('failed', 'Ошибка'), ('cancelled', 'Отменено')], default='pending', max_length=20, verbose_name='Статус'),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledaction',
+            index=models.Index(fields=['status', 'scheduled_at'], name='idx_sched_status_at'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection_app', '0013_scheduledaction_claim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodicJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Название')),
+                ('task', models.CharField(max_length=50, verbose_name='Задача')),
+                ('schedule', models.CharField(help_text='минута час день месяц день_недели, напр. "0 2 * * *"', max_length=100, verbose_name='Расписание (cron)')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Параметры')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активна')),
+                ('next_run_at', models.DateTimeField(blank=True, null=True, verbose_name='Следующий запуск')),
+                ('last_run_at', models.DateTimeField(blank=True, null=True, verbose_name='Последний запуск')),
+                ('running_since', models.DateTimeField(blank=True, null=True, verbose_name='Выполняется с')),
+                ('max_runtime_minutes', models.IntegerField(default=240, verbose_name='Макс. длительность (мин)')),
+            ],
+            options={
+                'verbose_name': 'Периодическая задача',
+                'verbose_name_plural': 'Периодические задачи',
+                'ordering': ['next_run_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SchedulerLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Ключ')),
+                ('owner', models.CharField(max_length=100, verbose_name='Владелец')),
+                ('expires_at', models.DateTimeField(verbose_name='Действует до')),
+            ],
+            options={
+                'verbose_name': 'Аренда планировщика',
+                'verbose_name_plural': 'Аренды планировщика',
+            },
+        ),
+        migrations.CreateModel(
+            name='JobRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('success', 'Успешно'), ('failed', 'Ошибка'), ('skipped', 'Пропущено (наложение)')], default='running', max_length=20, verbose_name='Статус')),
+                ('worker', models.CharField(blank=True, max_length=100, verbose_name='Экземпляр планировщика')),
+                ('started_at', models.DateTimeField(verbose_name='Начало')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание')),
+                ('duration_seconds', models.FloatField(default=0, verbose_name='Длительность (сек)')),
+                ('rows_affected', models.IntegerField(blank=True, null=True, verbose_name='Обработано строк')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='collection_app.periodicjob', verbose_name='Задача')),
+            ],
+            options={
+                'verbose_name': 'Запуск задачи',
+                'verbose_name_plural': 'Запуски задач',
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['job', '-started_at'], name='idx_jobrun_job_started')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection_app', '0014_periodic_scheduler'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='precollectionalert',
+            index=models.Index(fields=['credit', '-created_at'], name='idx_precoll_credit_created'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection_app', '0015_precollection_alert_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyClient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('marked_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Отмечен')),
+                ('reason', models.CharField(blank=True, default='', max_length=20, verbose_name='Источник')),
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dirty_mark', to='collection_app.client', verbose_name='Клиент')),
+            ],
+            options={
+                'verbose_name': 'Клиент к пересчёту профиля',
+                'verbose_name_plural': 'Клиенты к пересчёту профиля',
+            },
+        ),
+    ]
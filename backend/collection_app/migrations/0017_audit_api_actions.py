@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection_app', '0016_dirty_client_queue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='auditlog',
+            name='action',
+            field=models.CharField(choices=[('intervention_create', 'Создание воздействия'), ('intervention_update', 'Обновление воздействия'), ('assignment_create', 'Назначение клиента'), ('assignment_delete', 'Удаление назначения'), ('scoring_run', 'Запуск скоринга'), ('model_train', 'Обучение модели'), ('distribution_run', 'Распределение клиентов'), ('compliance_violation', 'Нарушение комплаенса'), ('bankruptcy_check', 'Проверка банкротства'), ('contact_blocked', 'Контакт заблокирован'), ('login', 'Вход в систему'), ('logout', 'Выход из системы'), ('api_read', 'Просмотр через API'), ('api_create', 'Создание через API'), ('api_update', 'Изменение через API'), ('api_delete', 'Удаление через API')], db_index=True, max_length=50, verbose_name='Действие'),
+        ),
+    ]
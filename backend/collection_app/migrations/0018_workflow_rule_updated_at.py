@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('collection_app', '0017_audit_api_actions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowrule',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Изменено'),
+        ),
+    ]
@@ -7,10 +7,11 @@ Next Best Action (NBA) — ML-сервис рекомендаций по взы
 - С каким сценарием разговора
 - Какое предложение дать (реструктуризация, каникулы, скидка)
 """
-import random
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
 
 # Веса для расчёта оптимального канала связи
 CHANNEL_WEIGHTS = {
@@ -48,7 +49,8 @@ class NextBestActionService:
     def calculate_best_contact_time(
         self,
         client_profile: Dict,
-        overdue_days: int
+        overdue_days: int,
+        now: Optional[datetime] = None
     ) -> Tuple[datetime, int]:
         """
         Определяет лучшее время для контакта и срочность.
@@ -60,7 +62,7 @@ class NextBestActionService:
         best_hour = client_profile.get('best_contact_hour', 14)
         best_day = client_profile.get('best_contact_day', 2)  # 0=Пн
         
-        now = datetime.now()
+        now = now or datetime.now()
         current_weekday = now.weekday()
         
         # Определяем срочность на основе просрочки
@@ -165,7 +167,7 @@ class NextBestActionService:
         reasoning = []
         
         # Базовые сценарии по психотипу
-        possible_scenarios = SCENARIO_BY_PSYCHOTYPE.get(psychotype, ['soft_reminder'])
+        possible_scenarios = list(SCENARIO_BY_PSYCHOTYPE.get(psychotype, ['soft_reminder']))
         
         # Корректируем на основе истории
         prev_scenarios = [c.get('scenario') for c in contact_history[-5:]]
@@ -210,7 +212,7 @@ class NextBestActionService:
             (offer, max_discount_percent, reasoning)
         """
         reasoning = []
-        possible_offers = OFFERS_BY_RISK.get(risk_segment, ['none'])
+        possible_offers = list(OFFERS_BY_RISK.get(risk_segment, ['none']))
         
         # Рассчитываем максимальную скидку
         if risk_segment == 'critical':
@@ -252,7 +254,8 @@ class NextBestActionService:
         credit_id: int,
         client_profile: Dict,
         credit_data: Dict,
-        contact_history: List[Dict] = None
+        contact_history: List[Dict] = None,
+        now: Optional[datetime] = None
     ) -> Dict:
         """
         Генерирует полную рекомендацию Next Best Action.
@@ -262,7 +265,8 @@ class NextBestActionService:
             credit_id: ID кредита
             client_profile: Данные профиля поведения клиента
             credit_data: Данные по кредиту (overdue_amount, overdue_days, risk_segment и т.д.)
-            contact_history: История контактов
+            contact_history: История контактов (по возрастанию времени)
+            now: Момент расчёта (по умолчанию — текущее время)
         
         Returns:
             Словарь с рекомендацией NBA
@@ -285,7 +289,7 @@ class NextBestActionService:
         
         # Генерируем рекомендации
         recommended_time, urgency = self.calculate_best_contact_time(
-            client_profile, overdue_days
+            client_profile, overdue_days, now
         )
         
         channel, channel_confidence = self.calculate_best_channel(
@@ -329,70 +333,328 @@ def get_nba_for_client(client, credit) -> Dict:
         from collection_app.ml.next_best_action import get_nba_for_client
         nba = get_nba_for_client(client, credit)
     """
-    service = NextBestActionService()
-    
-    # Собираем профиль клиента
-    profile = {}
-    if hasattr(client, 'behavior_profile'):
-        bp = client.behavior_profile
-        profile = {
-            'psychotype': bp.psychotype,
-            'best_contact_hour': bp.best_contact_hour,
-            'best_contact_day': bp.best_contact_day,
-            'preferred_channel': bp.preferred_channel,
-            'promises_kept_ratio': bp.promises_kept_ratio,
-            'income': float(client.income) if client.income else 0,
-        }
-    else:
-        profile = {
-            'psychotype': 'forgetful',
-            'best_contact_hour': 14,
-            'best_contact_day': 2,
-            'preferred_channel': 'phone',
-            'promises_kept_ratio': 0.5,
-            'income': float(client.income) if client.income else 0,
-        }
-    
-    # Собираем данные по кредиту
-    latest_state = credit.states.order_by('-state_date').first()
-    overdue_amount = float(latest_state.overdue_principal) if latest_state else 0
-    total_debt = float(latest_state.principal_debt) if latest_state else 0
-    
-    # Определяем дни просрочки
-    from django.utils import timezone
-    from datetime import date
-    overdue_days = 0
-    if credit.status == 'overdue':
-        last_payment = credit.payments.order_by('-payment_date').first()
-        if last_payment and last_payment.planned_date:
-            overdue_days = (date.today() - last_payment.planned_date).days
-    
-    # Риск-сегмент из скоринга
-    scoring = credit.scorings.order_by('-calculation_date').first()
-    risk_segment = scoring.risk_segment if scoring else 'medium'
+    nba = generate_nba_batch([(client.id, credit.id)])[0]
+    nba['recommended_datetime'] = nba['recommended_datetime'].isoformat()
+    return nba
+
+
+# =====================================================================
+# Пакетная генерация NBA (очередь оператора, кампания)
+# =====================================================================
+
+CHANNELS = list(CHANNEL_WEIGHTS)
+RISK_SEGMENTS = list(OFFERS_BY_RISK)
+SCENARIO_PSYCHOTYPES = list(SCENARIO_BY_PSYCHOTYPE)
+HISTORY_LIMIT = 10
+
+DEFAULT_PROFILE = {
+    'psychotype': 'forgetful',
+    'best_contact_hour': 14,
+    'best_contact_day': 2,
+    'preferred_channel': 'phone',
+    'promises_kept_ratio': 0.5,
+}
+
+# Постоянные части весов каналов: base + бонусы по психотипу и сумме просрочки
+_BASE = np.array([CHANNEL_WEIGHTS[c]['base'] for c in CHANNELS])
+_IS_PHONE = np.array([c == 'phone' for c in CHANNELS])
+_IS_REMINDER = np.array([c in ('sms', 'push') for c in CHANNELS])
+
+_MAX_DISCOUNT = np.array([5.0, 15.0, 30.0, 50.0, 5.0])  # RISK_SEGMENTS + неизвестный
+
+
+def _pick_offer(offers: List[str], dti_class: int, psych_class: int) -> str:
+    """Выбор предложения как в calculate_best_offer (dti: 0 — нет/норма, 1 — >3, 2 — >6)"""
+    offers = list(offers)
+    if dti_class == 2:
+        offers = ['restructure_12m', 'holiday_3m', 'partial_write_off']
+    elif dti_class == 1 and 'restructure_6m' not in offers:
+        offers.insert(0, 'restructure_6m')
+    if psych_class == 1:
+        offers = [o for o in offers if 'restructure' in o or 'holiday' in o]
+    elif psych_class == 2:
+        offers = [o for o in offers if 'discount' in o]
+    return offers[0] if offers else 'none'
+
+
+# Таблица решений: [риск-сегмент, класс долговой нагрузки, класс психотипа] -> предложение
+_OFFER_TABLE = np.array([
+    [[_pick_offer(offers, d, q) for q in range(3)] for d in range(3)]
+    for offers in [OFFERS_BY_RISK[r] for r in RISK_SEGMENTS] + [['none']]
+], dtype=object)
+_SCENARIO_FIRST = np.array(
+    [SCENARIO_BY_PSYCHOTYPE[p][0] for p in SCENARIO_PSYCHOTYPES] + ['soft_reminder'], dtype=object,
+)
+_SCENARIO_HAS_RESTRUCTURE = np.array(
+    ['restructure_offer' in SCENARIO_BY_PSYCHOTYPE[p] for p in SCENARIO_PSYCHOTYPES] + [False],
+)
+
+
+def collect_nba_inputs(pairs: List[Tuple[int, int]], today: Optional[date] = None) -> List[Tuple[Dict, Dict, List[Dict]]]:
+    """
+    Входы generate_nba для пар (client_id, credit_id) за фиксированное число запросов:
+    клиенты с профилями, кредиты с последним платежом и скорингом, последние контакты.
     
-    credit_data = {
-        'overdue_days': max(overdue_days, 0),
-        'overdue_amount': overdue_amount,
-        'total_debt': total_debt,
-        'risk_segment': risk_segment,
-    }
+    Returns:
+        [(client_profile, credit_data, contact_history)] в порядке pairs
     
-    # История контактов
-    interventions = client.interventions.filter(credit=credit).order_by('-datetime')[:10]
-    contact_history = [
-        {
-            'channel': i.intervention_type,
-            'result': i.status,
-            'scenario': 'soft_reminder',  # Упрощённо
+    Raises:
+        ValueError: клиента или кредита из пары нет в БД
+    """
+    from django.db.models import F, OuterRef, Subquery, Window
+    from django.db.models.functions import RowNumber
+    from collection_app.models import Client, Credit, Intervention, Payment, ScoringResult
+
+    today = today or date.today()
+    client_ids = {client_id for client_id, _ in pairs}
+    credit_ids = {credit_id for _, credit_id in pairs}
+
+    profiles = {}
+    for (client_id, income, psychotype, hour, day, channel, ratio) in Client.objects.filter(
+        pk__in=client_ids,
+    ).values_list(
+        'id', 'income', 'behavior_profile__psychotype', 'behavior_profile__best_contact_hour',
+        'behavior_profile__best_contact_day', 'behavior_profile__preferred_channel',
+        'behavior_profile__promises_kept_ratio',
+    ):
+        profile = dict(DEFAULT_PROFILE) if psychotype is None else {
+            'psychotype': psychotype,
+            'best_contact_hour': hour,
+            'best_contact_day': day,
+            'preferred_channel': channel,
+            'promises_kept_ratio': ratio,
+        }
+        profile['income'] = float(income) if income else 0
+        profiles[client_id] = profile
+
+    last_planned = Payment.objects.filter(credit=OuterRef('pk')).order_by('-payment_date', '-id').values('planned_date')[:1]
+    latest_scoring = ScoringResult.objects.filter(credit=OuterRef('pk')).order_by('-calculation_date', '-id').values('risk_segment')[:1]
+    credits = {}
+    for (credit_id, status, overdue_principal, principal_debt, planned, risk_segment) in Credit.objects.filter(
+        pk__in=credit_ids,
+    ).annotate(
+        last_planned=Subquery(last_planned), risk_segment=Subquery(latest_scoring),
+    ).values_list(
+        'id', 'status', 'current_state__overdue_principal', 'current_state__principal_debt',
+        'last_planned', 'risk_segment',
+    ):
+        overdue_days = (today - planned).days if status == 'overdue' and planned else 0
+        credits[credit_id] = {
+            'overdue_days': max(overdue_days, 0),
+            'overdue_amount': float(overdue_principal) if overdue_principal is not None else 0,
+            'total_debt': float(principal_debt) if principal_debt is not None else 0,
+            'risk_segment': risk_segment or 'medium',
         }
-        for i in interventions
+
+    unknown = [pair for pair in pairs if pair[0] not in profiles or pair[1] not in credits]
+    if unknown:
+        raise ValueError(f'NBA: нет клиента или кредита для пар {unknown[:10]}')
+
+    # Последние HISTORY_LIMIT контактов по каждой паре — одним запросом с оконной функцией
+    history = {}
+    recent = Intervention.objects.filter(
+        client_id__in=client_ids, credit_id__in=credit_ids,
+    ).annotate(
+        rank=Window(RowNumber(), partition_by=[F('client_id'), F('credit_id')], order_by=F('datetime').desc()),
+    ).filter(rank__lte=HISTORY_LIMIT).values_list('client_id', 'credit_id', 'datetime', 'intervention_type', 'status')
+    for client_id, credit_id, moment, channel, status in recent:
+        history.setdefault((client_id, credit_id), []).append(
+            (moment, {'channel': channel, 'result': status, 'scenario': 'soft_reminder'})  # Упрощённо
+        )
+
+    return [
+        (
+            profiles[client_id],
+            credits[credit_id],
+            [item for _, item in sorted(history.get((client_id, credit_id), []), key=lambda x: x[0])],
+        )
+        for client_id, credit_id in pairs
     ]
-    
-    return service.generate_nba(
-        client_id=client.id,
-        credit_id=credit.id,
-        client_profile=profile,
-        credit_data=credit_data,
-        contact_history=contact_history
+
+
+def score_nba_batch(pairs: List[Tuple[int, int]], inputs: List[Tuple[Dict, Dict, List[Dict]]],
+                    now: Optional[datetime] = None) -> List[Dict]:
+    """
+    Векторный расчёт рекомендаций по всей пачке — те же правила, что generate_nba:
+    срочность и время, баллы каналов (матрица пары × каналы), сценарий и предложение
+    по таблицам решений.
+    """
+    now = now or datetime.now()
+    n = len(pairs)
+    if not n:
+        return []
+
+    profiles = [profile for profile, _, _ in inputs]
+    psychotypes = [p.get('psychotype', 'forgetful') for p in profiles]
+    overdue_days = np.array([c.get('overdue_days', 0) for _, c, _ in inputs], dtype=np.int64)
+    overdue_amount = np.array([float(c.get('overdue_amount', 0)) for _, c, _ in inputs])
+    total_debt = np.array([float(c.get('total_debt', c.get('overdue_amount', 0))) for _, c, _ in inputs])
+    income = np.array([float(p.get('income') or 0) for p in profiles])
+    ratio = np.array([p.get('promises_kept_ratio', 0.5) for p in profiles], dtype=float)
+    best_hour = np.array([p.get('best_contact_hour', 14) for p in profiles], dtype=np.int64)
+    best_day = np.array([p.get('best_contact_day', 2) for p in profiles], dtype=np.int64)
+    psych = np.array(psychotypes, dtype=object)
+    risk_idx = np.array([
+        RISK_SEGMENTS.index(c.get('risk_segment', 'medium')) if c.get('risk_segment', 'medium') in RISK_SEGMENTS
+        else len(RISK_SEGMENTS) for _, c, _ in inputs
+    ])
+
+    # Срочность и время контакта
+    urgency = 1 + (overdue_days > 14) + (overdue_days > 30) + (overdue_days > 60) + (overdue_days > 90)
+    if 9 <= now.hour < 20:
+        urgent_time = now + timedelta(minutes=15)
+    else:
+        urgent_time = now.replace(hour=9, minute=0, second=0, microsecond=0)
+        if now.hour >= 20:
+            urgent_time += timedelta(days=1)
+    weekday = now.weekday()
+    days = (best_day - weekday) % 7
+    days = np.where((days == 0) & (now.hour >= best_hour), 7, days)
+    target_weekday = (weekday + days) % 7
+    days = days + np.where((urgency < 3) & (target_weekday >= 5), 7 - target_weekday, 0)
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # Каналы: баллы в том же порядке сложения, что calculate_best_channel
+    preferred = np.array([p.get('preferred_channel', 'phone') for p in profiles], dtype=object)
+    scores = np.tile(_BASE, (n, 1))
+    scores += np.where(preferred[:, None] == np.array(CHANNELS, dtype=object)[None, :], 0.25, 0)
+    scores += np.where((psych == 'toxic')[:, None] & _IS_PHONE, -0.2, 0)
+    scores += np.where((psych == 'forgetful')[:, None] & _IS_REMINDER, 0.15, 0)
+    scores += np.where((psych == 'unwilling')[:, None] & _IS_PHONE, 0.1, 0)
+    scores += np.where((overdue_amount > 100000)[:, None] & _IS_PHONE, 0.2, 0)
+    scores += np.where((overdue_amount < 10000)[:, None] & _IS_REMINDER, 0.15, 0)
+    scores = np.minimum(scores, 1.0)
+    failed = np.zeros((n, len(CHANNELS)), dtype=bool)
+    for i, (_, _, history) in enumerate(inputs):
+        for contact in history[-3:]:
+            if contact.get('result') in ('no_answer', 'refuse') and contact.get('channel') in CHANNEL_WEIGHTS:
+                failed[i, CHANNELS.index(contact['channel'])] = True
+    scores[failed] = -np.inf
+    best_channel = scores.argmax(axis=1)
+    channel_confidence = scores[np.arange(n), best_channel]
+    no_channel = failed.all(axis=1)
+
+    # Сценарий
+    soft_count = np.array([
+        [c.get('scenario') for c in history[-5:]].count('soft_reminder') for _, _, history in inputs
+    ])
+    psych_idx = np.array([
+        SCENARIO_PSYCHOTYPES.index(p) if p in SCENARIO_BY_PSYCHOTYPE else len(SCENARIO_PSYCHOTYPES)
+        for p in psychotypes
+    ])
+    low_ratio = ratio < 0.3
+    restructure_hint = (overdue_days > 60) & (psych != 'toxic')
+    scenario = np.select(
+        [restructure_hint & (low_ratio | ~_SCENARIO_HAS_RESTRUCTURE[psych_idx]), low_ratio],
+        ['restructure_offer', 'firm_demand'],
+        _SCENARIO_FIRST[psych_idx],
     )
+
+    # Предложение
+    has_income = income > 0
+    dti = np.divide(total_debt, income, out=np.zeros(n), where=has_income)
+    dti_class = np.where(has_income & (dti > 6), 2, np.where(has_income & (dti > 3), 1, 0))
+    psych_class = np.select([psych == 'unable', psych == 'unwilling'], [1, 2], 0)
+    offer = _OFFER_TABLE[risk_idx, dti_class, psych_class]
+    max_discount = _MAX_DISCOUNT[risk_idx]
+    max_discount = np.where(dti_class == 2, np.minimum(max_discount + 20, 50), max_discount)
+
+    results = []
+    for i, (client_id, credit_id) in enumerate(pairs):
+        reasoning = []
+        if soft_count[i] >= 2:
+            reasoning.append('Мягкий подход не дал результата')
+        if low_ratio[i]:
+            reasoning.append(f'Низкий % выполнения обещаний ({ratio[i]:.0%})')
+        if restructure_hint[i]:
+            reasoning.append('Большой срок просрочки — предложите реструктуризацию')
+        if not reasoning:
+            reasoning.append(f'Рекомендовано для психотипа "{psychotypes[i]}"')
+        if dti_class[i] == 2:
+            reasoning.append(f'Высокое отношение долга к доходу ({dti[i]:.1f}x)')
+        elif dti_class[i] == 1:
+            reasoning.append('Умеренная долговая нагрузка')
+        if psych_class[i] == 1:
+            reasoning.append('Клиент хочет платить, но не может — предложите рассрочку')
+        elif psych_class[i] == 2:
+            reasoning.append('Клиент может платить — предложите скидку за быструю оплату')
+
+        if no_channel[i]:
+            channel, confidence = 'phone', 0.3
+        else:
+            channel, confidence = CHANNELS[best_channel[i]], float(channel_confidence[i])
+        results.append({
+            'client_id': client_id,
+            'credit_id': credit_id,
+            'recommended_datetime': urgent_time if urgency[i] >= 4 else
+            midnight + timedelta(days=int(days[i]), hours=int(best_hour[i])),
+            'urgency': int(urgency[i]),
+            'recommended_channel': channel,
+            'recommended_scenario': scenario[i],
+            'recommended_offer': offer[i],
+            'max_discount_percent': float(max_discount[i]),
+            'reasoning': '. '.join(reasoning),
+            'confidence_score': round((confidence + 0.5) / 2, 2),
+        })
+    return results
+
+
+def generate_nba_batch(pairs: Iterable[Tuple[int, int]], now: Optional[datetime] = None) -> List[Dict]:
+    """
+    Рекомендации для набора пар (client_id, credit_id) без записи в БД.
+    recommended_datetime — datetime (в generate_nba — строка ISO).
+    """
+    pairs = list(pairs)
+    now = now or _local_now()
+    return score_nba_batch(pairs, collect_nba_inputs(pairs, today=now.date()), now=now)
+
+
+def save_nba_batch(pairs: Iterable[Tuple[int, int]], now: Optional[datetime] = None,
+                   chunk_size: int = 2000) -> List:
+    """
+    Сгенерировать и записать NextBestAction для пар (client_id, credit_id) порциями.
+    Прежние ожидающие рекомендации по этим кредитам помечаются как истёкшие.
+    
+    Использовать для прогрева утренней очереди:
+        from collection_app.ml.next_best_action import save_nba_batch
+        save_nba_batch(Assignment.objects.filter(operator=op).values_list('credit__client_id', 'credit_id'))
+    """
+    from django.db import transaction
+    from collection_app.models import NextBestAction
+    from collection_app.services.client_profile import Client360Loader
+
+    pairs = list(dict.fromkeys(pairs))
+    now = now or _local_now()
+    created = []
+    for offset in range(0, len(pairs), chunk_size):
+        chunk = pairs[offset:offset + chunk_size]
+        rows = [
+            NextBestAction(**{k: v for k, v in nba.items() if k not in ('client_id', 'credit_id')},
+                           client_id=nba['client_id'], credit_id=nba['credit_id'])
+            for nba in generate_nba_batch(chunk, now=now)
+        ]
+        with transaction.atomic():
+            NextBestAction.objects.filter(
+                credit_id__in={credit_id for _, credit_id in chunk}, status='pending',
+            ).update(status='expired')
+            created.extend(NextBestAction.objects.bulk_create(rows))
+        # bulk-операции не шлют сигналы — кэш Client 360 сбрасываем сами
+        for client_id in {client_id for client_id, _ in chunk}:
+            Client360Loader.invalidate(client_id)
+    return created
+
+
+def operator_queue_pairs(operator_ids: Optional[Iterable[int]] = None):
+    """Пары (client_id, credit_id) очередей операторов: просрочка > 0, без банкротов и отказов (230-ФЗ)"""
+    from collection_app.models import Assignment
+    qs = Assignment.objects.filter(overdue_days__gt=0).exclude(
+        credit__client__is_bankrupt=True,
+    ).exclude(credit__client__contact_refused=True)
+    if operator_ids:
+        qs = qs.filter(operator_id__in=list(operator_ids))
+    return qs.values_list('credit__client_id', 'credit_id')
+
+
+def _local_now() -> datetime:
+    from django.utils import timezone
+    return timezone.localtime()
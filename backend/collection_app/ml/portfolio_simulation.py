@@ -0,0 +1,198 @@
+"""
+Монте-Карло симуляция транша для переговоров о продаже / списании.
+
+Вероятности полного и частичного возврата по каждому кредиту берутся из пакетного
+прогноза (forecast_arrays — те же правила, что ReturnForecastService). Исходы
+кредитов коррелированы через однофакторную гауссову копулу: общий для сценария
+фактор Z и собственный шум кредита,
+    X = sqrt(rho) * Z + sqrt(1 - rho) * eps,
+полный возврат — X < Ф⁻¹(p_full), частичный (50% долга) — X < Ф⁻¹(p_partial).
+Деньги поступают в ожидаемый срок прогноза и дисконтируются, затраты на взыскание —
+доля долга, как в calculate_npv.
+
+Сценарии считаются блоками матричным произведением и делятся на задачи фиксированного
+размера с собственными seed — результат не зависит от числа процессов.
+Итог (перцентили NPV по стратегиям) кэшируется в общем кэше (SHARED_CACHE) по (транш,
+отпечаток входов прогноза, версия модели, ставка): изменение долга, платежей, скоринга
+или профиля клиентов транша даёт новый ключ — пересчёт без явного сброса.
+
+Пул процессов (workers > 1) — только для py manage.py simulate_portfolio: из потока
+веб-воркера эндпоинт считает в одном процессе.
+
+Использование:
+    from collection_app.ml.portfolio_simulation import simulate_portfolio
+    result = simulate_portfolio(segment='high', n_scenarios=50000, workers=4)
+    result['strategies']['continue']['p5']
+"""
+
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from scipy.special import ndtri
+
+from .return_forecast import (
+    COLLECTION_COST_PCT, MODEL_VERSION, WRITE_OFF_TAX_BENEFIT, collect_forecast_inputs, forecast_arrays,
+)
+
+SIMULATOR_VERSION = 'mc_copula_v1'
+STRATEGIES = ('continue', 'sell', 'write_off')
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+DEFAULT_CORRELATION = 0.15
+# Сценариев в одной задаче пула и элементов матрицы (сценарии x кредиты) в одном блоке
+TASK_SCENARIOS = 2000
+BLOCK_ELEMENTS = 2_000_000
+CACHE_PREFIX = 'portfolio_sim'
+CACHE_TTL = 60 * 60 * 24
+
+
+def tranche_credit_ids(segment: Optional[str] = None) -> List[int]:
+    """Просроченные кредиты транша: по сегменту последнего скоринга (без скоринга — medium)"""
+    from django.db.models import OuterRef, Subquery, Value
+    from django.db.models.functions import Coalesce
+    from collection_app.models import Credit, ScoringResult
+
+    qs = Credit.objects.filter(status='overdue')
+    if segment:
+        latest = ScoringResult.objects.filter(credit=OuterRef('pk')).order_by('-calculation_date', '-id')
+        qs = qs.annotate(
+            risk_segment=Coalesce(Subquery(latest.values('risk_segment')[:1]), Value('medium')),
+        ).filter(risk_segment=segment)
+    return list(qs.order_by('id').values_list('id', flat=True))
+
+
+def tranche_key(credit_ids: Iterable[int]) -> str:
+    """Идентификатор транша — отпечаток состава кредитов"""
+    payload = ','.join(str(cid) for cid in sorted(credit_ids))
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def inputs_fingerprint(inputs: Dict[str, np.ndarray]) -> str:
+    """Отпечаток входов прогноза (collect_forecast_inputs) — версия данных транша"""
+    digest = hashlib.sha1()
+    for name in sorted(inputs):
+        values = inputs[name]
+        digest.update(name.encode())
+        digest.update(repr(values.tolist()).encode() if values.dtype == object else values.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def simulation_cache_key(tranche: str, inputs_version: str, discount_rate: float, n_scenarios: int,
+                         correlation: float, seed: int) -> str:
+    return (f'{CACHE_PREFIX}:{tranche}:{inputs_version}:{MODEL_VERSION}:{SIMULATOR_VERSION}:'
+            f'{discount_rate:g}:{n_scenarios}:{correlation:g}:{seed}')
+
+
+def simulation_inputs(inputs: Dict[str, np.ndarray], discount_rate: float) -> Dict[str, np.ndarray]:
+    """Пороги копулы и дисконтированные суммы по кредитам из пакетного прогноза"""
+    if not discount_rate > -1:  # в т.ч. NaN: иначе дисконт inf / nan
+        raise ValueError(f'discount_rate должна быть больше -1: {discount_rate}')
+    arrays = forecast_arrays(inputs, discount_rate)
+    debt = inputs['total_debt']
+    discount_factor = 1 / ((1 + discount_rate) ** (arrays['expected_return_days'] / 365))
+    return {
+        'full_threshold': ndtri(arrays['return_probability']),
+        'partial_threshold': ndtri(arrays['partial_return_probability']),
+        # Полный возврат = две «половины»: частичный порог и полный (p_full <= p_partial)
+        'half_value': 0.5 * debt * discount_factor,
+        'collection_cost': float(debt.sum() * COLLECTION_COST_PCT),
+        'npv_sell': float(arrays['npv_sell'].sum()),
+        'npv_write_off': float(debt.sum() * WRITE_OFF_TAX_BENEFIT * -1),
+        'expected_npv_continue': float(arrays['npv_continue'].sum()),
+    }
+
+
+def _simulate_block(args) -> np.ndarray:
+    """Задача пула: NPV продолжения взыскания по n сценариям"""
+    full_threshold, partial_threshold, half_value, collection_cost, correlation, n, seed = args
+    rng = np.random.default_rng(seed)
+    n_credits = len(half_value)
+    block = max(1, BLOCK_ELEMENTS // max(n_credits, 1))
+    loading, noise = np.float32(np.sqrt(correlation)), np.float32(np.sqrt(1 - correlation))
+    full_threshold, partial_threshold = full_threshold.astype(np.float32), partial_threshold.astype(np.float32)
+    result = np.empty(n)
+    for start in range(0, n, block):
+        size = min(block, n - start)
+        # float32 для шума: точности порогов хватает, генерация и сравнения вдвое дешевле
+        latent = rng.standard_normal((size, n_credits), dtype=np.float32)
+        latent *= noise
+        latent += loading * rng.standard_normal((size, 1), dtype=np.float32)
+        halves = (latent < full_threshold).astype(np.float64) + (latent < partial_threshold)
+        result[start:start + size] = halves @ half_value - collection_cost
+    return result
+
+
+def simulate_npv(sim_inputs: Dict[str, np.ndarray], n_scenarios: int, correlation: float = DEFAULT_CORRELATION,
+                 workers: int = 1, seed: int = 42) -> np.ndarray:
+    """NPV продолжения взыскания по сценариям (workers > 1 — пул процессов)"""
+    children = np.random.SeedSequence(seed).spawn((n_scenarios + TASK_SCENARIOS - 1) // TASK_SCENARIOS)
+    tasks = [
+        (sim_inputs['full_threshold'], sim_inputs['partial_threshold'], sim_inputs['half_value'],
+         sim_inputs['collection_cost'], correlation, min(TASK_SCENARIOS, n_scenarios - i * TASK_SCENARIOS), child)
+        for i, child in enumerate(children)
+    ]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            parts = list(pool.map(_simulate_block, tasks))
+    else:
+        parts = [_simulate_block(task) for task in tasks]
+    return np.concatenate(parts) if parts else np.zeros(0)
+
+
+def _distribution(values: np.ndarray) -> Dict[str, float]:
+    stats = {'mean': round(float(values.mean()), 2), 'std': round(float(values.std()), 2)}
+    for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        stats[f'p{q}'] = round(float(value), 2)
+    return stats
+
+
+def simulate_portfolio(segment: Optional[str] = None, credit_ids: Optional[Iterable[int]] = None,
+                       n_scenarios: int = 20000, discount_rate: float = 0.15,
+                       correlation: float = DEFAULT_CORRELATION, workers: Optional[int] = None,
+                       seed: int = 42, refresh: bool = False, today: Optional[date] = None) -> Dict:
+    """
+    Распределение NPV транша по стратегиям continue / sell / write_off.
+    Транш — явный список credit_ids или просроченные кредиты сегмента (все — без сегмента).
+    """
+    from collection_app.services.shared_cache import shared_cache
+
+    cache = shared_cache()
+    credit_ids = sorted(set(credit_ids)) if credit_ids is not None else tranche_credit_ids(segment)
+    tranche = tranche_key(credit_ids)
+    started = time.perf_counter()
+    inputs = collect_forecast_inputs(credit_ids, today=today)
+    key = simulation_cache_key(tranche, inputs_fingerprint(inputs), discount_rate, n_scenarios, correlation, seed)
+    if not refresh:
+        cached = cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True)
+
+    workers = workers or min(os.cpu_count() or 1, 8)
+    sim_inputs = simulation_inputs(inputs, discount_rate)
+    npv_continue = simulate_npv(sim_inputs, n_scenarios, correlation, workers=workers, seed=seed) \
+        if credit_ids else np.zeros(n_scenarios)
+    samples = {
+        'continue': npv_continue,
+        'sell': np.full(n_scenarios, sim_inputs['npv_sell']),
+        'write_off': np.full(n_scenarios, sim_inputs['npv_write_off']),
+    }
+    result = {
+        'tranche': tranche,
+        'segment': segment,
+        'credits': len(credit_ids),
+        'total_debt': round(float(inputs['total_debt'].sum()), 2),
+        'scenarios': n_scenarios,
+        'correlation': correlation,
+        'discount_rate': discount_rate,
+        'model_version': MODEL_VERSION,
+        'strategies': {name: _distribution(samples[name]) for name in STRATEGIES},
+        'expected_npv_continue': round(sim_inputs['expected_npv_continue'], 2),
+        'prob_continue_beats_sell': round(float((npv_continue > sim_inputs['npv_sell']).mean()), 4),
+        'elapsed_sec': round(time.perf_counter() - started, 3),
+    }
+    cache.set(key, result, CACHE_TTL)
+    return dict(result, cached=False)
@@ -11,7 +11,9 @@
 from dataclasses import dataclass
 from datetime import date, timedelta
 from decimal import Decimal
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
 
 
 @dataclass
@@ -90,6 +92,29 @@ PSYCHOTYPE_INDICATORS = {
     },
 }
 
+# Матричное представление весов для пакетного расчёта:
+# scores = indicators (клиенты × признаки) @ PSYCHOTYPE_WEIGHTS (признаки × психотипы)
+PSYCHOTYPES = list(PSYCHOTYPE_INDICATORS)
+INDICATOR_NAMES = sorted({name for cfg in PSYCHOTYPE_INDICATORS.values() for name in cfg['indicators']})
+PSYCHOTYPE_WEIGHTS = np.array([
+    [PSYCHOTYPE_INDICATORS[pt]['indicators'].get(name, 0.0) for pt in PSYCHOTYPES]
+    for name in INDICATOR_NAMES
+])
+PSYCHOTYPE_WEIGHTS /= PSYCHOTYPE_WEIGHTS.sum(axis=0)  # нормировка, как в calculate_psychotype_scores
+
+FACTOR_NAMES = {
+    'answers_calls': 'Отвечает на звонки',
+    'ignores_contacts': 'Игнорирует контакты',
+    'keeps_promises': 'Выполняет обещания',
+    'partial_payments': 'Делает частичные платежи',
+    'high_debt_to_income': 'Высокая долговая нагрузка',
+    'low_income': 'Низкий доход',
+    'aggression': 'Агрессивное поведение',
+    'regular_payments': 'Регулярные платежи',
+    'makes_promises': 'Даёт обещания',
+    'small_overdue_days': 'Небольшая просрочка',
+}
+
 
 class PsychotypingService:
     """Сервис автоматического определения психотипа клиента."""
@@ -299,20 +324,7 @@ class PsychotypingService:
         factors = [ind for ind, val in relevant_indicators[:3] if val > 0.3]
         
         # Человекочитаемые факторы
-        factor_names = {
-            'answers_calls': 'Отвечает на звонки',
-            'ignores_contacts': 'Игнорирует контакты',
-            'keeps_promises': 'Выполняет обещания',
-            'partial_payments': 'Делает частичные платежи',
-            'high_debt_to_income': 'Высокая долговая нагрузка',
-            'low_income': 'Низкий доход',
-            'aggression': 'Агрессивное поведение',
-            'regular_payments': 'Регулярные платежи',
-            'makes_promises': 'Даёт обещания',
-            'small_overdue_days': 'Небольшая просрочка',
-        }
-        
-        readable_factors = [factor_names.get(f, f) for f in factors]
+        readable_factors = [FACTOR_NAMES.get(f, f) for f in factors]
         
         return PsychotypeResult(
             psychotype=best_psychotype,
@@ -331,63 +343,183 @@ def classify_client(client) -> PsychotypeResult:
         result = classify_client(client)
         print(result.psychotype, result.confidence)
     """
-    service = PsychotypingService()
-    
-    # Собираем данные
-    total_debt = sum(
-        float(c.states.order_by('-state_date').first().principal_debt or 0)
-        for c in client.credits.all()
-        if c.states.exists()
+    return classify_clients([client.pk])[client.pk]
+
+
+def build_indicator_matrix(client_ids: List[int], today: Optional[date] = None) -> np.ndarray:
+    """
+    Матрица признаков (клиенты × INDICATOR_NAMES) по сгруппированным запросам —
+    те же правила, что analyze_payment_behavior / analyze_contact_behavior /
+    analyze_promise_keeping, без обхода кредитов и платежей в Python.
+    """
+    from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+    from collection_app.models import Client, Credit, Intervention, Payment
+
+    today = today or date.today()
+    n = len(client_ids)
+    row = {client_id: i for i, client_id in enumerate(client_ids)}
+    col = {name: j for j, name in enumerate(INDICATOR_NAMES)}
+    X = np.zeros((n, len(INDICATOR_NAMES)))
+
+    income = np.zeros(n)
+    for client_id, value in Client.objects.filter(pk__in=client_ids).values_list('id', 'income'):
+        income[row[client_id]] = float(value or 0)
+
+    total_debt = np.zeros(n)
+    for client_id, debt in (
+        Credit.objects.filter(client_id__in=client_ids).values('client_id')
+        .annotate(debt=Sum('current_state__principal_debt')).values_list('client_id', 'debt')
+    ):
+        total_debt[row[client_id]] = float(debt or 0)
+
+    # Просрочка: по просроченным кредитам — дни от плановой даты последнего платежа
+    overdue_days = np.zeros(n)
+    last_planned = Payment.objects.filter(credit=OuterRef('pk')).order_by('-payment_date', '-id').values('planned_date')[:1]
+    for client_id, planned in (
+        Credit.objects.filter(client_id__in=client_ids, status='overdue')
+        .annotate(last_planned=Subquery(last_planned)).values_list('client_id', 'last_planned')
+    ):
+        if planned:
+            i = row[client_id]
+            overdue_days[i] = max(overdue_days[i], (today - planned).days)
+
+    # Платёжное поведение
+    pay_total, pay_on_time, pay_partial = np.zeros(n), np.zeros(n), np.zeros(n)
+    for client_id, total, on_time, partial in (
+        Payment.objects.filter(credit__client_id__in=client_ids).values('credit__client_id')
+        .annotate(
+            total=Count('id'),
+            on_time=Count('id', filter=Q(overdue_days__lte=3)),
+            partial=Count('id', filter=Q(amount__lt=F('min_payment'))),
+        ).values_list('credit__client_id', 'total', 'on_time', 'partial')
+    ):
+        i = row[client_id]
+        pay_total[i], pay_on_time[i], pay_partial[i] = total, on_time, partial
+
+    has_pay = pay_total > 0
+    safe_pay = np.where(has_pay, pay_total, 1)
+    on_time_ratio = pay_on_time / safe_pay
+    with_income = has_pay & (income > 0)
+    debt_ratio = total_debt / np.where(income > 0, income, 1)
+    X[:, col['regular_payments']] = np.where(has_pay, on_time_ratio, 0)
+    X[:, col['random_payment_pattern']] = np.where(has_pay & (on_time_ratio < 0.7), 1 - on_time_ratio, 0)
+    X[:, col['partial_payments']] = np.where(has_pay, pay_partial / safe_pay, 0)
+    X[:, col['high_debt_to_income']] = np.where(
+        with_income, np.minimum(debt_ratio / 6, 1.0), np.where(has_pay, 0.8, 0)
     )
-    
-    overdue_days = 0
-    for credit in client.credits.filter(status='overdue'):
-        last_payment = credit.payments.order_by('-payment_date').first()
-        if last_payment and last_payment.planned_date:
-            days = (date.today() - last_payment.planned_date).days
-            overdue_days = max(overdue_days, days)
-    
-    client_data = {
-        'income': float(client.income) if client.income else 0,
-        'total_debt': total_debt,
-        'overdue_days': overdue_days,
-    }
-    
-    # Платежи
-    all_payments = []
-    for credit in client.credits.all():
-        for p in credit.payments.all():
-            all_payments.append({
-                'amount': float(p.amount),
-                'min_payment': float(p.min_payment) if p.min_payment else 0,
-                'overdue_days': p.overdue_days,
-            })
-    
-    # Контакты
-    interventions = [
-        {
-            'status': i.status,
-            'aggression_detected': False,  # Можно расширить через ConversationAnalysis
-        }
-        for i in client.interventions.all()
-    ]
-    
-    # Обещания
-    promises = [
-        {
-            'kept': i.status == 'completed' and i.promise_amount > 0,
-            'partial': False,
-        }
-        for i in client.interventions.filter(status='promise')
-    ]
-    
-    return service.determine_psychotype(
-        client_data=client_data,
-        payments=all_payments,
-        interventions=interventions,
-        promises=promises
+    X[:, col['low_debt_to_income']] = np.where(with_income, np.maximum(0, 1 - debt_ratio / 3), 0)
+    X[:, col['has_income']] = np.where(with_income, 1.0, 0)
+    X[:, col['low_income']] = np.where(
+        with_income, np.select([income < 30000, income < 50000], [1.0, 0.5], 0), np.where(has_pay, 0.8, 0)
     )
 
+    # Контактное поведение (агрессия пока не размечается — как в classify_client)
+    contact_total, answered, promised, refused = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+    for client_id, total, ans, prom, ref in (
+        Intervention.objects.filter(client_id__in=client_ids).values('client_id')
+        .annotate(
+            total=Count('id'),
+            answered=Count('id', filter=~Q(status='no_answer')),
+            promised=Count('id', filter=Q(status='promise')),
+            refused=Count('id', filter=Q(status='refuse')),
+        ).values_list('client_id', 'total', 'answered', 'promised', 'refused')
+    ):
+        i = row[client_id]
+        contact_total[i], answered[i], promised[i], refused[i] = total, ans, prom, ref
+
+    has_contacts = contact_total > 0
+    safe_contacts = np.where(has_contacts, contact_total, 1)
+    X[:, col['answers_calls']] = np.where(has_contacts, answered / safe_contacts, 0)
+    X[:, col['ignores_contacts']] = np.where(has_contacts, 1 - answered / safe_contacts, 0)
+    X[:, col['makes_promises']] = np.where(has_contacts, promised / safe_contacts, 0)
+    X[:, col['no_promises']] = np.where(has_contacts, 1 - promised / safe_contacts, 0)
+    X[:, col['refuses_contact']] = np.where(has_contacts, refused / safe_contacts, 0)
+    X[:, col['no_conflict']] = np.where(has_contacts, np.maximum(0, 1 - refused / safe_contacts / 2), 0)
+    # Обещания из воздействий со статусом promise: выполненными не бывают (как в classify_client)
+    X[:, col['keeps_promises']] = 0
+    X[:, col['partial_promise_kept']] = 0
+
+    X[:, col['small_overdue_days']] = np.select([overdue_days <= 14, overdue_days <= 30], [1.0, 0.5], 0)
+    return X
+
+
+def classify_clients(client_ids: Optional[Iterable[int]] = None,
+                     today: Optional[date] = None) -> Dict[int, PsychotypeResult]:
+    """
+    Пакетная классификация: признаки — сгруппированными запросами,
+    баллы всех психотипов — одним матричным произведением.
+    """
+    from collection_app.models import Client
+
+    if client_ids is None:
+        client_ids = Client.objects.order_by('id').values_list('id', flat=True)
+    client_ids = list(client_ids)
+    if not client_ids:
+        return {}
+
+    X = build_indicator_matrix(client_ids, today=today)
+    scores = X @ PSYCHOTYPE_WEIGHTS
+    best = scores.argmax(axis=1)
+
+    results = {}
+    for i, client_id in enumerate(client_ids):
+        psychotype = PSYCHOTYPES[best[i]]
+        config = PSYCHOTYPE_INDICATORS[psychotype]
+        relevant = sorted(
+            ((name, X[i, INDICATOR_NAMES.index(name)]) for name in config['indicators']),
+            key=lambda x: x[1], reverse=True,
+        )
+        factors = [FACTOR_NAMES.get(name, name) for name, value in relevant[:3] if value > 0.3]
+        results[client_id] = PsychotypeResult(
+            psychotype=psychotype,
+            confidence=round(float(scores[i, best[i]]), 2),
+            factors=factors,
+            recommended_approach=config['approach'],
+        )
+    return results
+
+
+def update_client_profiles(client_ids: Optional[Iterable[int]] = None, chunk_size: int = 5000,
+                           today: Optional[date] = None) -> int:
+    """
+    Пакетное обновление психотипов ClientBehaviorProfile (upsert порциями).
+    
+    Использовать в cron-задаче:
+        from collection_app.ml.psychotyping import update_client_profiles
+        update_client_profiles()
+    """
+    from django.utils import timezone
+    from collection_app.models import Client, ClientBehaviorProfile
+    from collection_app.services.client_profile import Client360Loader
+    from collection_app.services.nba_cache import NBACache
+
+    if client_ids is None:
+        client_ids = Client.objects.order_by('id').values_list('id', flat=True)
+    client_ids = list(client_ids)
+
+    updated = 0
+    for offset in range(0, len(client_ids), chunk_size):
+        results = classify_clients(client_ids[offset:offset + chunk_size], today=today)
+        now = timezone.now()
+        ClientBehaviorProfile.objects.bulk_create(
+            [
+                ClientBehaviorProfile(
+                    client_id=client_id, psychotype=result.psychotype,
+                    psychotype_confidence=result.confidence, last_updated=now,
+                )
+                for client_id, result in results.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['client'],
+            update_fields=['psychotype', 'psychotype_confidence', 'last_updated'],
+        )
+        # bulk_create не шлёт сигналы — кэш Client 360 сбрасываем сами
+        for client_id in results:
+            Client360Loader.invalidate(client_id)
+        NBACache.invalidate_clients(results)
+        updated += len(results)
+    return updated
+
 
 def update_client_profile(client) -> None:
     """
@@ -8,10 +8,12 @@
 - Рекомендацию: продолжать взыскание / продавать / списывать
 - NPV при разных стратегиях
 """
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from datetime import date, timedelta
 from decimal import Decimal
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
 
 
 @dataclass
@@ -386,61 +388,266 @@ def forecast_credit_return(credit) -> ReturnForecastResult:
         from collection_app.ml.return_forecast import forecast_credit_return
         result = forecast_credit_return(credit)
     """
-    from datetime import date
-    
-    service = ReturnForecastService()
-    client = credit.client
-    
-    # Данные клиента
-    client_data = {
-        'income': float(client.income) if client.income else 0,
-        'employment': client.employment,
-    }
-    
-    # Поведенческий профиль
-    behavior_profile = {}
-    if hasattr(client, 'behavior_profile'):
-        bp = client.behavior_profile
-        behavior_profile = {
-            'psychotype': bp.psychotype,
-            'contact_rate': bp.successful_contacts / bp.total_contacts if bp.total_contacts > 0 else 0.5,
-            'promises_kept_ratio': bp.promises_kept_ratio,
-            'job_changed_recently': bp.job_changed_recently,
-            'income_dropped': bp.income_dropped,
-            'multiple_credits': bp.multiple_credits,
-        }
-    else:
-        behavior_profile = {
-            'psychotype': 'unknown',
-            'contact_rate': 0.5,
-            'promises_kept_ratio': 0.5,
-        }
-    
-    # Данные по кредиту
-    latest_state = credit.states.order_by('-state_date').first()
-    total_debt = float(latest_state.principal_debt) if latest_state else float(credit.principal_amount)
-    
-    overdue_days = 0
-    if credit.status == 'overdue':
-        last_payment = credit.payments.order_by('-payment_date').first()
-        if last_payment and last_payment.planned_date:
-            overdue_days = (date.today() - last_payment.planned_date).days
-    
-    scoring = credit.scorings.order_by('-calculation_date').first()
-    risk_segment = scoring.risk_segment if scoring else 'medium'
-    
-    credit_data = {
-        'total_debt': total_debt,
-        'overdue_days': max(overdue_days, 0),
-        'risk_segment': risk_segment,
+    return forecast_credits([credit.id])[0]
+
+
+# =====================================================================
+# Пакетный прогноз по портфелю (float-массивы NumPy)
+# =====================================================================
+
+# Версия правил прогноза — входит в ключи кэшей производных расчётов (симуляция портфеля)
+MODEL_VERSION = 'return_forecast_v1'
+RISK_SEGMENTS = list(BASE_RETURN_PROBABILITY)
+RECENT_PAYMENTS = 5
+COLLECTION_COST_PCT = 0.15
+WRITE_OFF_TAX_BENEFIT = 0.20
+
+_BASE_PROB = np.array([BASE_RETURN_PROBABILITY[r] for r in RISK_SEGMENTS] + [0.5])
+_SALE_PRICE = np.array([PORTFOLIO_SALE_PRICES[r] for r in RISK_SEGMENTS] + [0.20])
+# Порядок кандидатов как в determine_recommendation: при равной уверенности побеждает первый
+_EXTRA_RECOMMENDATIONS = [('write_off', 0.85), ('restructure', 0.70), ('legal', 0.65)]
+
+INPUT_FIELDS = (
+    'credit_id', 'income', 'employment', 'psychotype', 'contact_rate', 'promises_kept_ratio',
+    'overdue_days', 'total_debt', 'risk_segment', 'job_changed_recently', 'income_dropped',
+    'multiple_credits', 'partial_payments',
+)
+_INPUT_DTYPES = {
+    'credit_id': np.int64, 'overdue_days': np.int64,
+    'employment': object, 'psychotype': object, 'risk_segment': object,
+    'job_changed_recently': bool, 'income_dropped': bool, 'multiple_credits': bool, 'partial_payments': bool,
+}
+
+
+def collect_forecast_inputs(credit_ids: List[int], today: Optional[date] = None) -> Dict[str, np.ndarray]:
+    """
+    Входы прогноза по кредитам двумя запросами: кредит с клиентом, профилем,
+    последним платежом и скорингом; флаг частичных платежей среди последних RECENT_PAYMENTS.
+    Колонки — массивы в порядке credit_ids (см. INPUT_FIELDS).
+    """
+    from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Value, When, Window
+    from django.db.models.functions import RowNumber
+    from collection_app.models import Credit, Payment, ScoringResult
+
+    today = today or date.today()
+    last_planned = Payment.objects.filter(credit=OuterRef('pk')).order_by('-payment_date', '-id').values('planned_date')[:1]
+    latest_scoring = ScoringResult.objects.filter(credit=OuterRef('pk')).order_by('-calculation_date', '-id').values('risk_segment')[:1]
+    rows = {row[0]: row for row in Credit.objects.filter(pk__in=credit_ids).annotate(
+        last_planned=Subquery(last_planned), risk_segment=Subquery(latest_scoring),
+    ).values_list(
+        'id', 'status', 'principal_amount', 'current_state__principal_debt', 'last_planned', 'risk_segment',
+        'client__income', 'client__employment', 'client__behavior_profile__psychotype',
+        'client__behavior_profile__successful_contacts', 'client__behavior_profile__total_contacts',
+        'client__behavior_profile__promises_kept_ratio', 'client__behavior_profile__job_changed_recently',
+        'client__behavior_profile__income_dropped', 'client__behavior_profile__multiple_credits',
+    )}
+
+    partial = set()
+    recent = Payment.objects.filter(credit_id__in=credit_ids).annotate(
+        rank=Window(RowNumber(), partition_by=[F('credit_id')], order_by=[F('payment_date').desc(), F('id').desc()]),
+        is_partial=Case(When(min_payment__gt=0, amount__lt=F('min_payment'), then=Value(1)),
+                        default=Value(0), output_field=IntegerField()),
+    ).filter(rank__lte=RECENT_PAYMENTS).values_list('credit_id', 'is_partial')
+    for credit_id, is_partial in recent:
+        if is_partial:
+            partial.add(credit_id)
+
+    columns = {name: [] for name in INPUT_FIELDS}
+    for credit_id in credit_ids:
+        (_, status, principal, debt, planned, segment, income, employment, psychotype,
+         successful, total, kept, job_changed, income_dropped, multiple) = rows[credit_id]
+        has_profile = psychotype is not None
+        columns['credit_id'].append(credit_id)
+        columns['income'].append(float(income) if income else 0.0)
+        columns['employment'].append(employment or 'unknown')
+        columns['psychotype'].append(psychotype if has_profile else 'unknown')
+        columns['contact_rate'].append(successful / total if has_profile and total > 0 else 0.5)
+        columns['promises_kept_ratio'].append(kept if has_profile else 0.5)
+        overdue_days = (today - planned).days if status == 'overdue' and planned else 0
+        columns['overdue_days'].append(max(overdue_days, 0))
+        columns['total_debt'].append(float(debt) if debt is not None else float(principal))
+        columns['risk_segment'].append(segment or 'medium')
+        columns['job_changed_recently'].append(bool(job_changed))
+        columns['income_dropped'].append(bool(income_dropped))
+        columns['multiple_credits'].append(bool(multiple))
+        columns['partial_payments'].append(credit_id in partial)
+
+    return {name: np.array(values, dtype=_INPUT_DTYPES.get(name, float)) for name, values in columns.items()}
+
+
+def forecast_arrays(inputs: Dict[str, np.ndarray], discount_rate: float = 0.15) -> Dict[str, np.ndarray]:
+    """
+    Векторный прогноз по правилам ReturnForecastService: корректировка по факторам,
+    вероятности, ожидаемые сумма и срок, три NPV и рекомендация — float-массивы.
+    Маски факторов возвращаются в 'factors' как [(текст, маска, позитивный)].
+    """
+    n = len(inputs['credit_id'])
+    income = inputs['income']
+    employment, psychotype = inputs['employment'], inputs['psychotype']
+    contact_rate, kept = inputs['contact_rate'], inputs['promises_kept_ratio']
+    overdue_days, debt = inputs['overdue_days'], inputs['total_debt']
+    risk_idx = np.array([
+        RISK_SEGMENTS.index(r) if r in BASE_RETURN_PROBABILITY else len(RISK_SEGMENTS)
+        for r in inputs['risk_segment']
+    ], dtype=np.int64) if n else np.zeros(0, dtype=np.int64)
+
+    debt_ratio = np.divide(debt, income, out=np.zeros(n), where=income > 0)
+    # (текст, маска, вклад, позитивный) — порядок сложения как в analyze_factors
+    factors = [
+        ('Стабильный доход', income > 50000, FACTOR_WEIGHTS['has_income'], True),
+        ('Есть доход', (income > 0) & (income <= 50000), FACTOR_WEIGHTS['has_income'] * 0.5, True),
+        ('Нет подтверждённого дохода', income <= 0, FACTOR_WEIGHTS['no_income'], False),
+        ('Трудоустроен', employment == 'employed', FACTOR_WEIGHTS['employed'], True),
+        ('Безработный', employment == 'unemployed', FACTOR_WEIGHTS['unemployed'], False),
+        ('Готов к диалогу', psychotype == 'cooperative', FACTOR_WEIGHTS['cooperative'], True),
+        ('Конфликтный клиент', psychotype == 'toxic', FACTOR_WEIGHTS['toxic'], False),
+        ('Финансовые трудности', psychotype == 'unable', -0.05, False),
+        ('Высокая контактность', contact_rate > 0.7, FACTOR_WEIGHTS['answers_calls'], True),
+        ('Игнорирует контакты', contact_rate < 0.3, FACTOR_WEIGHTS['ignores_contacts'], False),
+        ('Выполняет обещания', kept > 0.7, FACTOR_WEIGHTS['keeps_promises'], True),
+        ('Не выполняет обещания', kept < 0.3, FACTOR_WEIGHTS['breaks_promises'], False),
+        (None, overdue_days > 180, FACTOR_WEIGHTS['long_overdue'], False),  # текст с числом дней
+        ('Просрочка более 90 дней', (overdue_days > 90) & (overdue_days <= 180),
+         FACTOR_WEIGHTS['long_overdue'] * 0.5, False),
+        ('Небольшая просрочка', overdue_days < 30, 0.05, True),
+        ('Посильный размер долга', (income > 0) & (debt_ratio < 2), FACTOR_WEIGHTS['small_debt'], True),
+        ('Долг превышает 6 месячных доходов', (income > 0) & (debt_ratio > 6), -0.10, False),
+        ('Недавняя смена работы', inputs['job_changed_recently'], FACTOR_WEIGHTS['job_changed'], False),
+        ('Падение дохода', inputs['income_dropped'], -0.08, False),
+        ('Множественные кредиты', inputs['multiple_credits'], FACTOR_WEIGHTS['multiple_debts'], False),
+        ('Делает частичные платежи', inputs['partial_payments'], FACTOR_WEIGHTS['partial_payments'], True),
+    ]
+    adjustment = np.zeros(n)
+    for _, mask, weight, _ in factors:
+        adjustment = adjustment + np.where(mask, weight, 0.0)
+
+    full_prob = np.clip(_BASE_PROB[risk_idx] + adjustment, 0.01, 0.99)
+    partial_prob = np.clip(full_prob * 1.3 + 0.1, 0.01, 0.99)
+    expected_pct = full_prob * 1.0 + np.maximum(0, partial_prob - full_prob) * 0.5
+    expected_amount = debt * expected_pct
+    expected_days = np.select([full_prob > 0.7, full_prob > 0.5, full_prob > 0.3], [30, 60, 120], 365)
+
+    discount_factor = 1 / ((1 + discount_rate) ** (expected_days / 365))
+    npv_continue = expected_amount * discount_factor - debt * COLLECTION_COST_PCT
+    npv_sell = debt * _SALE_PRICE[risk_idx]
+    npv_write_off = debt * WRITE_OFF_TAX_BENEFIT * -1
+
+    continue_best = (npv_continue >= npv_sell) & (npv_continue >= npv_write_off)
+    base_label = np.select(
+        [continue_best & (full_prob > 0.5), continue_best, npv_sell >= npv_write_off],
+        ['continue_soft', 'continue_hard', 'sell'], 'write_off',
+    ).astype(object)
+    base_conf = np.select(
+        [continue_best & (full_prob > 0.5), continue_best, npv_sell >= npv_write_off], [0.8, 0.7, 0.75], 0.6,
+    )
+    extra_masks = [
+        (overdue_days > 365) & (full_prob < 0.15),
+        (psychotype == 'unable') & (full_prob > 0.3),
+        (overdue_days > 180) & (full_prob < 0.25),
+    ]
+    confidence_matrix = np.column_stack(
+        [base_conf] + [np.where(mask, conf, -1.0) for mask, (_, conf) in zip(extra_masks, _EXTRA_RECOMMENDATIONS)]
+    ) if n else np.zeros((0, 4))
+    best = confidence_matrix.argmax(axis=1)
+    labels = np.column_stack([base_label] + [np.full(n, label, dtype=object) for label, _ in _EXTRA_RECOMMENDATIONS]) \
+        if n else np.zeros((0, 4), dtype=object)
+
+    return {
+        'return_probability': full_prob,
+        'partial_return_probability': partial_prob,
+        'expected_return_amount': expected_amount,
+        'expected_return_days': expected_days,
+        'npv_continue': npv_continue,
+        'npv_sell': npv_sell,
+        'npv_write_off': npv_write_off,
+        'recommendation': labels[np.arange(n), best],
+        'recommendation_confidence': confidence_matrix[np.arange(n), best],
+        'factors': [(text, mask, positive) for text, mask, _, positive in factors],
     }
+
+
+def _money(values: np.ndarray) -> List[Decimal]:
+    """float-массив -> Decimal с копейками (через целые копейки)"""
+    return [Decimal(cents).scaleb(-2) for cents in np.rint(values * 100).astype(np.int64).tolist()]
+
+
+def _results(inputs: Dict[str, np.ndarray], arrays: Dict[str, np.ndarray]) -> List[ReturnForecastResult]:
+    """Массивы -> ReturnForecastResult; округление до копеек только здесь"""
+    n = len(inputs['credit_id'])
+    positive, negative = [[] for _ in range(n)], [[] for _ in range(n)]
+    overdue_days = inputs['overdue_days'].tolist()
+    for text, mask, is_positive in arrays['factors']:
+        target = positive if is_positive else negative
+        for i in np.flatnonzero(mask).tolist():
+            target[i].append(text or f'Длительная просрочка ({overdue_days[i]} дней)')
+
+    columns = zip(
+        arrays['return_probability'].tolist(), arrays['partial_return_probability'].tolist(),
+        _money(arrays['expected_return_amount']), arrays['expected_return_days'].tolist(),
+        arrays['recommendation'].tolist(), arrays['recommendation_confidence'].tolist(),
+        _money(arrays['npv_continue']), _money(arrays['npv_sell']), _money(arrays['npv_write_off']),
+    )
+    return [
+        ReturnForecastResult(
+            return_probability=round(full, 3),
+            partial_return_probability=round(partial, 3),
+            expected_return_amount=amount,
+            expected_return_days=days,
+            recommendation=recommendation,
+            recommendation_confidence=round(confidence, 2),
+            positive_factors=positive[i],
+            negative_factors=negative[i],
+            npv_continue=npv_continue,
+            npv_sell=npv_sell,
+            npv_write_off=npv_write_off,
+        )
+        for i, (full, partial, amount, days, recommendation, confidence, npv_continue, npv_sell, npv_write_off)
+        in enumerate(columns)
+    ]
+
+
+def forecast_credits(credit_ids: List[int], today: Optional[date] = None,
+                     discount_rate: float = 0.15) -> List[ReturnForecastResult]:
+    """Прогнозы для списка кредитов (в порядке credit_ids)"""
+    inputs = collect_forecast_inputs(list(credit_ids), today=today)
+    return _results(inputs, forecast_arrays(inputs, discount_rate))
+
+
+def forecast_portfolio(credit_ids: Optional[Iterable[int]] = None, chunk_size: int = 5000,
+                       today: Optional[date] = None, discount_rate: float = 0.15) -> int:
+    """
+    Прогноз по всей просроченной книге (или по credit_ids) с записью ReturnForecast
+    через bulk_create порциями. Возвращает число прогнозов.
     
-    # История
-    contact_history = []
-    for payment in credit.payments.all():
-        contact_history.append({
-            'type': 'payment',
-            'partial': float(payment.amount) < float(payment.min_payment) if payment.min_payment else False,
-        })
-    
-    return service.forecast(client_data, behavior_profile, credit_data, contact_history)
+    Использовать перед решением о продаже портфеля:
+        from collection_app.ml.return_forecast import forecast_portfolio
+        forecast_portfolio()
+    """
+    from django.db import transaction
+    from collection_app.models import Credit, ReturnForecast
+    from collection_app.services.client_profile import Client360Loader
+
+    today = today or date.today()
+    if credit_ids is None:
+        credit_ids = Credit.objects.filter(status='overdue').order_by('id').values_list('id', flat=True)
+    credit_ids = list(credit_ids)
+
+    created = 0
+    for offset in range(0, len(credit_ids), chunk_size):
+        chunk = credit_ids[offset:offset + chunk_size]
+        inputs = collect_forecast_inputs(chunk, today=today)
+        results = _results(inputs, forecast_arrays(inputs, discount_rate))
+        with transaction.atomic():
+            ReturnForecast.objects.bulk_create([
+                ReturnForecast(
+                    credit_id=credit_id,
+                    expected_return_date=today + timedelta(days=result.expected_return_days),
+                    **asdict(result),
+                )
+                for credit_id, result in zip(chunk, results)
+            ], batch_size=2000)
+        # bulk_create не шлёт сигналы — кэш Client 360 сбрасываем сами
+        for client_id in set(Credit.objects.filter(pk__in=chunk).values_list('client_id', flat=True)):
+            Client360Loader.invalidate(client_id)
+        created += len(results)
+    return created
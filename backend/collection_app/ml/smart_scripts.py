@@ -6,8 +6,14 @@
 - Извлечение эффективных формулировок
 - Подсказки оператору в реальном времени
 - Обработка возражений
+
+Шаблоны разбираются один раз (CompiledTemplate), скрипты кэшируются по
+(сценарий, психотип), ключевые слова возражений и этапов собраны в один индекс, а CopilotSession
+при обновлении транскрипции просматривает только дописанную часть.
 """
+import re
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict, List, Optional, Tuple
 
 
@@ -182,6 +188,97 @@ STAGE_PHRASES = {
     ],
 }
 
+# Ключевые слова этапов (см. _detect_conversation_stage)
+STAGE_KEYWORDS = (
+    'до свидания', 'всего доброго', 'когда', 'оплат', 'внес', 'задолженност', 'долг',
+    'здравствуйте', 'добрый день',
+)
+# Возражение ищется в последней реплике — последних символах транскрипции
+RECENT_CHARS = 200
+
+DEFAULT_OBJECTION_RESPONSES = [
+    'Понимаю вашу позицию. Давайте обсудим, как можем помочь.',
+    'Хорошо, что вы это сказали. Какой вариант решения вы видите?',
+]
+
+_PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+
+class CompiledTemplate:
+    """Шаблон фразы, разобранный один раз: литералы и имена переменных"""
+
+    __slots__ = ('text', 'parts', 'tail')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.parts: List[Tuple[str, str]] = []  # (литерал перед переменной, переменная)
+        pos = 0
+        for match in _PLACEHOLDER.finditer(text):
+            self.parts.append((text[pos:match.start()], match.group(1)))
+            pos = match.end()
+        self.tail = text[pos:]
+
+    def render(self, data: Dict) -> str:
+        """Подставить переменные; отсутствующие в data остаются как {name}"""
+        if not self.parts:
+            return self.text
+        out = []
+        for literal, name in self.parts:
+            out.append(literal)
+            out.append(str(data[name]) if name in data else '{' + name + '}')
+        out.append(self.tail)
+        return ''.join(out)
+
+
+@lru_cache(maxsize=1024)
+def compile_template(text: str) -> CompiledTemplate:
+    return CompiledTemplate(text)
+
+
+def _compile_all(phrases: List[str]) -> Tuple[CompiledTemplate, ...]:
+    return tuple(compile_template(phrase) for phrase in phrases)
+
+
+@lru_cache(maxsize=256)
+def compiled_script(scenario: str, psychotype: str) -> Dict[str, Tuple[CompiledTemplate, ...]]:
+    """Скомпилированный скрипт (сценарий, психотип) с откатом на soft_reminder / forgetful"""
+    scenario_templates = SCRIPT_TEMPLATES.get(scenario, SCRIPT_TEMPLATES['soft_reminder'])
+    template = scenario_templates.get(psychotype, scenario_templates.get('forgetful', {}))
+    return {category: _compile_all(phrases) for category, phrases in template.items()}
+
+
+# Контекст подсказок по этапу: (контекст, success_rate, категория)
+_STAGE_SUGGESTIONS = {
+    'ptp_request': ('Переходите к запросу обещания платежа', 0.68, 'ptp_request'),
+    'farewell': ('Завершение разговора', 0.85, 'closing'),
+}
+_OBJECTION_TEMPLATES = {key: _compile_all(responses) for key, responses in OBJECTION_HANDLERS.items()}
+_STAGE_TEMPLATES = {stage: _compile_all(phrases) for stage, phrases in STAGE_PHRASES.items()}
+
+
+class KeywordIndex:
+    """
+    Общий словарь ключевых слов возражений и этапов. Поиск — str.rfind по каждому
+    слову (C-код; для полутора десятков слов быстрее общего регулярного выражения)
+    только по ещё не просмотренной части текста; результат — позиции последних вхождений.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = tuple(dict.fromkeys(keywords))
+        self.max_len = max(len(k) for k in self.keywords)
+
+    def scan(self, text: str, start: int = 0, found: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """{слово: позиция последнего вхождения}; start/found — дозаполнить после прошлого скана"""
+        found = {} if found is None else found
+        for keyword in self.keywords:
+            pos = text.rfind(keyword, start)
+            if pos >= 0:
+                found[keyword] = pos
+        return found
+
+
+KEYWORDS = KeywordIndex(list(OBJECTION_HANDLERS) + list(STAGE_KEYWORDS))
+
 
 class SmartScriptService:
     """Сервис умных скриптов для операторов."""
@@ -203,19 +300,10 @@ class SmartScriptService:
         Returns:
             {opening: [...], key_phrases: [...], closing: [...]}
         """
-        # Получаем шаблон
-        scenario_templates = SCRIPT_TEMPLATES.get(scenario, SCRIPT_TEMPLATES['soft_reminder'])
-        template = scenario_templates.get(psychotype, scenario_templates.get('forgetful', {}))
-        
-        # Подставляем переменные
-        result = {}
-        for category, phrases in template.items():
-            result[category] = [
-                self._substitute_variables(phrase, client_data)
-                for phrase in phrases
-            ]
-        
-        return result
+        return {
+            category: [template.render(client_data) for template in templates]
+            for category, templates in compiled_script(scenario, psychotype).items()
+        }
 
     def get_objection_response(
         self,
@@ -232,21 +320,10 @@ class SmartScriptService:
         Returns:
             Список вариантов ответа
         """
-        objection_lower = objection_text.lower()
-        
-        # Ищем подходящий обработчик
-        for key, responses in OBJECTION_HANDLERS.items():
-            if key in objection_lower:
-                return [
-                    self._substitute_variables(r, client_data)
-                    for r in responses
-                ]
-        
-        # Универсальные ответы
-        return [
-            'Понимаю вашу позицию. Давайте обсудим, как можем помочь.',
-            'Хорошо, что вы это сказали. Какой вариант решения вы видите?',
-        ]
+        key = self._first_objection(KEYWORDS.scan(objection_text.lower()))
+        if key is None:
+            return list(DEFAULT_OBJECTION_RESPONSES)
+        return [template.render(client_data) for template in _OBJECTION_TEMPLATES[key]]
 
     def get_stage_phrases(
         self,
@@ -263,8 +340,7 @@ class SmartScriptService:
         Returns:
             Список фраз
         """
-        phrases = STAGE_PHRASES.get(stage, [])
-        return [self._substitute_variables(p, client_data) for p in phrases]
+        return [template.render(client_data) for template in _STAGE_TEMPLATES.get(stage, ())]
 
     def get_realtime_suggestions(
         self,
@@ -285,79 +361,30 @@ class SmartScriptService:
         Returns:
             Список подсказок
         """
-        suggestions = []
-        transcript_lower = current_transcript.lower()
-        
-        # Определяем этап разговора
-        stage = self._detect_conversation_stage(transcript_lower)
-        
-        # Проверяем, есть ли возражение
-        detected_objection = self._detect_objection(transcript_lower)
-        if detected_objection:
-            responses = self.get_objection_response(detected_objection, client_data)
-            for resp in responses[:2]:
-                suggestions.append(ScriptSuggestion(
-                    phrase=resp,
-                    context=f'Ответ на возражение: "{detected_objection}"',
-                    success_rate=0.72,
-                    category='objection',
-                ))
-        
-        # Подсказки по этапу
-        if stage == 'need_ptp':
-            ptp_phrases = self.get_stage_phrases('ptp_request', client_data)
-            for phrase in ptp_phrases[:2]:
-                suggestions.append(ScriptSuggestion(
-                    phrase=phrase,
-                    context='Переходите к запросу обещания платежа',
-                    success_rate=0.68,
-                    category='ptp_request',
-                ))
-        
-        elif stage == 'need_closing':
-            closing_phrases = self.get_stage_phrases('farewell', client_data)
-            for phrase in closing_phrases[:2]:
-                suggestions.append(ScriptSuggestion(
-                    phrase=phrase,
-                    context='Завершение разговора',
-                    success_rate=0.85,
-                    category='closing',
-                ))
-        
-        # Ключевые фразы сценария
-        script = self.get_script_for_client(psychotype, scenario, client_data)
-        for phrase in script.get('key_phrases', [])[:2]:
-            if phrase.lower() not in transcript_lower:
-                suggestions.append(ScriptSuggestion(
-                    phrase=phrase,
-                    context='Эффективная фраза для этого типа клиента',
-                    success_rate=0.65,
-                    category='key_phrase',
-                ))
-        
-        return suggestions[:5]  # Максимум 5 подсказок
+        return CopilotSession(client_data, psychotype, scenario).update(current_transcript)
 
     def _substitute_variables(self, text: str, data: Dict) -> str:
         """Подставляет переменные в текст."""
-        result = text
-        for key, value in data.items():
-            result = result.replace('{' + key + '}', str(value))
-        return result
+        return compile_template(text).render(data)
 
     def _detect_conversation_stage(self, transcript: str) -> str:
         """Определяет текущий этап разговора."""
+        return self._stage_from_keywords(KEYWORDS.scan(transcript), len(transcript))
+
+    @staticmethod
+    def _stage_from_keywords(found: Dict[str, int], length: int) -> str:
         # Упрощённая логика
-        if 'до свидания' in transcript or 'всего доброго' in transcript:
+        if 'до свидания' in found or 'всего доброго' in found:
             return 'ended'
         
-        if 'когда' in transcript and ('оплат' in transcript or 'внес' in transcript):
+        if 'когда' in found and ('оплат' in found or 'внес' in found):
             return 'ptp_discussed'
         
-        if 'задолженност' in transcript or 'долг' in transcript:
+        if 'задолженност' in found or 'долг' in found:
             return 'need_ptp'
         
-        if 'здравствуйте' in transcript or 'добрый день' in transcript:
-            if len(transcript) < 200:
+        if 'здравствуйте' in found or 'добрый день' in found:
+            if length < 200:
                 return 'greeting'
             return 'need_ptp'
         
@@ -365,13 +392,15 @@ class SmartScriptService:
 
     def _detect_objection(self, transcript: str) -> Optional[str]:
         """Определяет возражение в транскрипции."""
-        # Последние 200 символов — вероятно, последняя реплика
-        recent = transcript[-200:] if len(transcript) > 200 else transcript
-        
-        for objection_key in OBJECTION_HANDLERS.keys():
-            if objection_key in recent:
-                return objection_key
-        
+        # Последние RECENT_CHARS символов — вероятно, последняя реплика
+        return self._first_objection(KEYWORDS.scan(transcript), len(transcript) - RECENT_CHARS)
+
+    @staticmethod
+    def _first_objection(found: Dict[str, int], since: int = 0) -> Optional[str]:
+        """Первое (в порядке OBJECTION_HANDLERS) возражение, встретившееся не раньше since"""
+        for key in OBJECTION_HANDLERS:
+            if key in found and found[key] >= since:
+                return key
         return None
 
     def analyze_successful_calls(
@@ -396,6 +425,78 @@ class SmartScriptService:
         }
 
 
+class CopilotSession:
+    """
+    Подсказки по ходу одного разговора. Транскрипция растёт — ключевые слова
+    ищутся только в дописанной части, фразы с подстановкой данных клиента
+    рендерятся один раз за разговор.
+    
+        session = CopilotSession(client_data, psychotype, scenario)
+        suggestions = session.update(transcript)  # на каждое обновление
+    """
+
+    MAX_SUGGESTIONS = 5
+
+    def __init__(self, client_data: Dict, psychotype: str, scenario: str):
+        self.client_data = client_data
+        self.psychotype = psychotype
+        self.scenario = scenario
+        self.stage: Optional[str] = None
+        self.objection: Optional[str] = None
+        self._raw = ''
+        self._text = ''
+        self._found: Dict[str, int] = {}
+        self._said: set = set()
+        self._rendered: Dict[Tuple[str, str], List[Tuple[str, str, float, str]]] = {}
+
+    def update(self, transcript: str) -> List[ScriptSuggestion]:
+        if transcript.startswith(self._raw):
+            scanned = len(self._text)
+            text = self._text + transcript[len(self._raw):].lower()
+        else:
+            scanned, self._found, self._said = 0, {}, set()
+            text = transcript.lower()
+        # Слово могло начаться в уже просмотренном хвосте
+        KEYWORDS.scan(text, max(0, scanned - KEYWORDS.max_len + 1), self._found)
+        self._raw, self._text = transcript, text
+
+        rows = []
+        objection = self.objection = SmartScriptService._first_objection(self._found, len(text) - RECENT_CHARS)
+        if objection:
+            rows += self._phrases('objection', objection)
+        stage = self.stage = SmartScriptService._stage_from_keywords(self._found, len(text))
+        if stage == 'need_ptp':
+            rows += self._phrases('stage', 'ptp_request')
+        elif stage == 'need_closing':
+            rows += self._phrases('stage', 'farewell')
+        # Ключевая фраза, уже произнесённая оператором, больше не подсказывается
+        for row in self._phrases('script', 'key_phrases'):
+            lowered = row[0].lower()
+            if lowered not in self._said and text.find(lowered, max(0, scanned - len(lowered) + 1)) >= 0:
+                self._said.add(lowered)
+            if lowered not in self._said:
+                rows.append(row)
+        return [
+            ScriptSuggestion(phrase=phrase, context=context, success_rate=rate, category=category)
+            for phrase, context, rate, category in rows[:self.MAX_SUGGESTIONS]
+        ]
+
+    def _phrases(self, kind: str, key: str) -> List[Tuple[str, str, float, str]]:
+        """Первые две фразы группы: (фраза, контекст, success_rate, категория)"""
+        rendered = self._rendered.get((kind, key))
+        if rendered is None:
+            if kind == 'objection':
+                templates, meta = _OBJECTION_TEMPLATES[key], (f'Ответ на возражение: "{key}"', 0.72, 'objection')
+            elif kind == 'stage':
+                templates, meta = _STAGE_TEMPLATES[key], _STAGE_SUGGESTIONS[key]
+            else:
+                templates = compiled_script(self.scenario, self.psychotype).get(key, ())
+                meta = ('Эффективная фраза для этого типа клиента', 0.65, 'key_phrase')
+            rendered = [(t.render(self.client_data),) + meta for t in templates[:2]]
+            self._rendered[(kind, key)] = rendered
+        return rendered
+
+
 def get_script_suggestions(client, credit, nba_recommendation: Dict) -> List[ScriptSuggestion]:
     """
     Утилита для получения подсказок скрипта.
@@ -406,18 +507,6 @@ def get_script_suggestions(client, credit, nba_recommendation: Dict) -> List[Scr
     """
     service = SmartScriptService()
     
-    # Данные для подстановки
-    client_data = {
-        'client_name': client.full_name.split()[0] if client.full_name else 'клиент',
-        'operator_name': 'Оператор',
-        'bank_name': 'Банк',
-        'amount': f"{credit.principal_amount:,.0f}".replace(',', ' '),
-        'overdue_days': '30',  # Можно вычислить
-        'date': 'пятницы',
-        'time': '10:00',
-        'complaint_phone': '8-800-123-45-67',
-    }
-    
     # Получаем психотип
     psychotype = 'forgetful'
     if hasattr(client, 'behavior_profile'):
@@ -427,7 +516,23 @@ def get_script_suggestions(client, credit, nba_recommendation: Dict) -> List[Scr
     
     return service.get_realtime_suggestions(
         current_transcript='',
-        client_data=client_data,
+        client_data=script_client_data(client, credit),
         psychotype=psychotype,
         scenario=scenario,
     )
+
+
+def script_client_data(client, credit=None) -> Dict[str, str]:
+    """Данные для подстановки в шаблоны скриптов"""
+    data = {
+        'client_name': client.full_name.split()[0] if client.full_name else 'клиент',
+        'operator_name': 'Оператор',
+        'bank_name': 'Банк',
+        'overdue_days': '30',  # Можно вычислить
+        'date': 'пятницы',
+        'time': '10:00',
+        'complaint_phone': '8-800-123-45-67',
+    }
+    if credit is not None:
+        data['amount'] = f"{credit.principal_amount:,.0f}".replace(',', ' ')
+    return data
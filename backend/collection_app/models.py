@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 
@@ -256,11 +256,26 @@ class Credit(models.Model):
     status = models.CharField('Статус кредита', max_length=20, choices=STATUS_CHOICES, default='active')
     actuality_date = models.DateField('Дата актуальности', null=True, blank=True)
 
-    @property
-    def delinquency_bucket(self):
-        """Стадия просрочки (DPD): 0-30, 30-60, 60-90, 90+"""
-        state = self.states.order_by('-state_date').first() if hasattr(self, 'states') else None
-        dpd = state.overdue_days if state and state.overdue_days else 0
+    # Текущее (последнее по state_date) состояние — поддерживается CreditState.save()/delete()
+    current_state = models.ForeignKey(
+        'CreditState', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+', verbose_name='Текущее состояние',
+    )
+    current_overdue_days = models.IntegerField('Текущая просрочка (дней)', default=0)
+
+    BUCKET_CHOICES = [
+        ('current', 'Без просрочки'),
+        ('0-30', '1-30 дней'),
+        ('30-60', '31-60 дней'),
+        ('60-90', '61-90 дней'),
+        ('90+', 'Более 90 дней'),
+    ]
+    current_bucket = models.CharField('Текущая стадия просрочки', max_length=10, choices=BUCKET_CHOICES, default='current')
+
+    @staticmethod
+    def bucket_for_dpd(dpd):
+        """Стадия просрочки по количеству дней"""
+        dpd = dpd or 0
         if dpd <= 0:
             return 'current'
         elif dpd <= 30:
@@ -272,11 +287,71 @@ class Credit(models.Model):
         else:
             return '90+'
 
+    @property
+    def delinquency_bucket(self):
+        """Стадия просрочки (DPD): 0-30, 30-60, 60-90, 90+"""
+        return self.current_bucket
+
     @property
     def days_past_due(self):
         """Количество дней просрочки из последнего CreditState"""
-        state = self.states.order_by('-state_date').first() if hasattr(self, 'states') else None
-        return state.overdue_days if state and state.overdue_days else 0
+        return self.current_overdue_days
+
+    def refresh_current_state(self):
+        """
+        Пересчитать указатель на последнее состояние и денормализованные DPD/bucket.
+        Обновляет и объект в памяти, и строку в БД (без вызова save()).
+        """
+        state = self.states.order_by('-state_date', '-id').first() if self.pk else None
+        self.current_state = state
+        self.current_overdue_days = state.overdue_days if state and state.overdue_days else 0
+        self.current_bucket = self.bucket_for_dpd(self.current_overdue_days)
+        if self.pk:
+            Credit.objects.filter(pk=self.pk).update(
+                current_state=state,
+                current_overdue_days=self.current_overdue_days,
+                current_bucket=self.current_bucket,
+            )
+        return state
+
+    @classmethod
+    def refresh_current_states(cls, credit_ids=None):
+        """
+        Массовый пересчёт текущих состояний — для путей через bulk_create/update,
+        которые обходят CreditState.save(). Возвращает количество обновлённых кредитов.
+        Кэш Client 360 (DPD, bucket) изменившихся кредитов сбрасывается после коммита.
+        """
+        latest = CreditState.objects.order_by('credit_id', '-state_date', '-id')
+        if credit_ids is not None:
+            credit_ids = list(credit_ids)
+            latest = latest.filter(credit_id__in=credit_ids)
+        latest_by_credit = {}
+        for state in latest.only('id', 'credit_id', 'overdue_days').iterator():
+            latest_by_credit.setdefault(state.credit_id, state)
+
+        credits = cls.objects.only('id', 'client_id', 'current_state', 'current_overdue_days', 'current_bucket')
+        if credit_ids is not None:
+            credits = credits.filter(pk__in=credit_ids)
+        changed = []
+        for credit in credits.iterator():
+            state = latest_by_credit.get(credit.pk)
+            dpd = state.overdue_days if state and state.overdue_days else 0
+            state_id = state.pk if state else None
+            bucket = cls.bucket_for_dpd(dpd)
+            if (credit.current_state_id, credit.current_overdue_days, credit.current_bucket) != (state_id, dpd, bucket):
+                credit.current_state_id = state_id
+                credit.current_overdue_days = dpd
+                credit.current_bucket = bucket
+                changed.append(credit)
+        cls.objects.bulk_update(
+            changed, ['current_state', 'current_overdue_days', 'current_bucket'], batch_size=1000,
+        )
+        if changed:
+            # bulk_update не шлёт сигналы — профиль 360 сбрасываем сами, по разу на клиента
+            from .services.client_profile import Client360Loader
+            client_ids = {credit.client_id for credit in changed}
+            transaction.on_commit(lambda: Client360Loader.invalidate_clients(client_ids))
+        return len(changed)
 
     def __str__(self):
         return f"Кредит #{self.id} - {self.client.full_name}"
@@ -284,6 +359,10 @@ class Credit(models.Model):
     class Meta:
         verbose_name = 'Кредит'
         verbose_name_plural = 'Кредиты'
+        indexes = [
+            models.Index(fields=['current_bucket'], name='idx_credit_bucket'),
+            models.Index(fields=['current_overdue_days'], name='idx_credit_cur_dpd'),
+        ]
 
 
 # =====================================================
@@ -440,6 +519,9 @@ class PreCollectionAlert(models.Model):
         verbose_name = 'Алерт Pre-Collection'
         verbose_name_plural = 'Алерты Pre-Collection'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['credit', '-created_at'], name='idx_precoll_credit_created'),
+        ]
 
 
 # =====================================================
@@ -798,6 +880,8 @@ class WorkflowRule(models.Model):
     is_active = models.BooleanField('Активно', default=True)
     
     created_at = models.DateTimeField('Создано', auto_now_add=True)
+    # Версия скомпилированных правил в процессах (WorkflowEngine.get_compiled_rules)
+    updated_at = models.DateTimeField('Изменено', auto_now=True)
     
     class Meta:
         verbose_name = 'Правило workflow'
@@ -826,6 +910,7 @@ class ScheduledAction(models.Model):
     
     STATUS_CHOICES = [
         ('pending', 'Ожидает'),
+        ('processing', 'Выполняется'),
         ('executed', 'Выполнено'),
         ('failed', 'Ошибка'),
         ('cancelled', 'Отменено'),
@@ -835,10 +920,86 @@ class ScheduledAction(models.Model):
     executed_at = models.DateTimeField('Выполнено', null=True, blank=True)
     result = models.TextField('Результат', blank=True)
     
+    # Захват пачки воркером (см. WorkflowEngine.claim_scheduled_actions)
+    claim_token = models.CharField('Токен захвата', max_length=32, blank=True, db_index=True)
+    claimed_at = models.DateTimeField('Захвачено', null=True, blank=True)
+    
     class Meta:
         verbose_name = 'Запланированное действие'
         verbose_name_plural = 'Запланированные действия'
         ordering = ['scheduled_at']
+        indexes = [
+            models.Index(fields=['status', 'scheduled_at'], name='idx_sched_status_at'),
+        ]
+
+
+class PeriodicJob(models.Model):
+    """Периодическая задача встроенного планировщика (см. services/scheduler.py)"""
+    name = models.CharField('Название', max_length=100, unique=True)
+    task = models.CharField('Задача', max_length=50)
+    schedule = models.CharField('Расписание (cron)', max_length=100,
+                                help_text='минута час день месяц день_недели, напр. "0 2 * * *"')
+    params = models.JSONField('Параметры', default=dict, blank=True)
+    is_active = models.BooleanField('Активна', default=True)
+
+    next_run_at = models.DateTimeField('Следующий запуск', null=True, blank=True)
+    last_run_at = models.DateTimeField('Последний запуск', null=True, blank=True)
+    # Защита от наложения: заполнено, пока задача выполняется
+    running_since = models.DateTimeField('Выполняется с', null=True, blank=True)
+    max_runtime_minutes = models.IntegerField('Макс. длительность (мин)', default=240)
+
+    def __str__(self):
+        return f"{self.name} [{self.schedule}]"
+
+    class Meta:
+        verbose_name = 'Периодическая задача'
+        verbose_name_plural = 'Периодические задачи'
+        ordering = ['next_run_at']
+
+
+class JobRun(models.Model):
+    """История запусков периодических задач"""
+    job = models.ForeignKey(PeriodicJob, on_delete=models.CASCADE, related_name='runs', verbose_name='Задача')
+
+    STATUS_CHOICES = [
+        ('running', 'Выполняется'),
+        ('success', 'Успешно'),
+        ('failed', 'Ошибка'),
+        ('skipped', 'Пропущено (наложение)'),
+    ]
+    status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default='running')
+    worker = models.CharField('Экземпляр планировщика', max_length=100, blank=True)
+
+    started_at = models.DateTimeField('Начало')
+    finished_at = models.DateTimeField('Окончание', null=True, blank=True)
+    duration_seconds = models.FloatField('Длительность (сек)', default=0)
+    rows_affected = models.IntegerField('Обработано строк', null=True, blank=True)
+    error = models.TextField('Ошибка', blank=True)
+
+    def __str__(self):
+        return f"{self.job.name} {self.started_at:%Y-%m-%d %H:%M} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = 'Запуск задачи'
+        verbose_name_plural = 'Запуски задач'
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['job', '-started_at'], name='idx_jobrun_job_started'),
+        ]
+
+
+class SchedulerLease(models.Model):
+    """Аренда лидерства планировщика: задачи запускает только владелец непросроченной аренды"""
+    name = models.CharField('Ключ', max_length=50, unique=True)
+    owner = models.CharField('Владелец', max_length=100)
+    expires_at = models.DateTimeField('Действует до')
+
+    def __str__(self):
+        return f"{self.name}: {self.owner} до {self.expires_at:%H:%M:%S}"
+
+    class Meta:
+        verbose_name = 'Аренда планировщика'
+        verbose_name_plural = 'Аренды планировщика'
 
 
 class CreditState(models.Model):
@@ -856,12 +1017,27 @@ class CreditState(models.Model):
     overdue_days = models.IntegerField('Длительность просрочки (дней)', default=0)
     overdue_close_date = models.DateField('Дата закрытия просрочки', null=True, blank=True)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Держим Credit.current_state в актуальном состоянии
+        self.credit.refresh_current_state()
+
+    def delete(self, *args, **kwargs):
+        credit = self.credit
+        result = super().delete(*args, **kwargs)
+        credit.refresh_current_state()
+        return result
+
     def __str__(self):
         return f"Состояние кредита #{self.credit_id} на {self.state_date}"
 
     class Meta:
         verbose_name = 'Состояние кредита'
         verbose_name_plural = 'Состояния кредитов'
+        indexes = [
+            models.Index(fields=['credit', '-state_date'], name='idx_cstate_credit_date'),
+            models.Index(fields=['-state_date', '-id'], name='idx_cstate_date'),
+        ]
 
 
 class Payment(models.Model):
@@ -889,6 +1065,53 @@ class Payment(models.Model):
     class Meta:
         verbose_name = 'Платёж'
         verbose_name_plural = 'Платежи'
+        indexes = [
+            models.Index(fields=['-payment_date', '-id'], name='idx_payment_date'),
+            models.Index(fields=['credit', '-payment_date'], name='idx_payment_credit_date'),
+        ]
+
+
+class PaymentImport(models.Model):
+    """Загрузка файла платежей из банка (идемпотентность по хэшу файла)"""
+    file_hash = models.CharField('SHA-256 файла', max_length=64, unique=True)
+    file_name = models.CharField('Имя файла', max_length=255, blank=True)
+
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('xml', 'Банковская выписка XML'),
+    ]
+    file_format = models.CharField('Формат', max_length=10, choices=FORMAT_CHOICES)
+
+    STATUS_CHOICES = [
+        ('processing', 'Обрабатывается'),
+        ('completed', 'Завершён'),
+        ('failed', 'Ошибка'),
+    ]
+    status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default='processing')
+
+    rows_total = models.IntegerField('Строк в файле', default=0)
+    rows_imported = models.IntegerField('Загружено платежей', default=0)
+    rows_unmatched = models.IntegerField('Не найден договор', default=0)
+    rows_invalid = models.IntegerField('Ошибки разбора', default=0)
+    credits_updated = models.IntegerField('Обновлено кредитов', default=0)
+    promises_settled = models.IntegerField('Закрыто обещаний', default=0)
+    errors = models.JSONField('Ошибки (первые)', default=list, blank=True)
+
+    started_at = models.DateTimeField('Начало', auto_now_add=True)
+    finished_at = models.DateTimeField('Окончание', null=True, blank=True)
+    duration_seconds = models.FloatField('Длительность (сек)', default=0)
+
+    @property
+    def rows_per_second(self):
+        return round(self.rows_total / self.duration_seconds, 1) if self.duration_seconds else 0
+
+    def __str__(self):
+        return f"Импорт {self.file_name or self.file_hash[:12]} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = 'Импорт платежей'
+        verbose_name_plural = 'Импорты платежей'
+        ordering = ['-started_at']
 
 
 class Intervention(models.Model):
@@ -938,6 +1161,8 @@ class Intervention(models.Model):
             models.Index(fields=['operator', '-datetime'], name='idx_interv_op_dt'),
             models.Index(fields=['status'], name='idx_interv_status'),
             models.Index(fields=['credit'], name='idx_interv_credit'),
+            models.Index(fields=['credit', 'status', '-datetime'], name='idx_interv_credit_st_dt'),
+            models.Index(fields=['-datetime', '-id'], name='idx_interv_datetime'),
         ]
 
 
@@ -1414,6 +1639,24 @@ class ClientBehaviorProfile(models.Model):
         verbose_name_plural = 'Поведенческие профили'
 
 
+class DirtyClient(models.Model):
+    """
+    Очередь клиентов с устаревшим поведенческим профилем.
+    Отметку ставят сигналы Payment / Intervention / Promise и bulk-загрузки,
+    снимает refresh_behavior_profiles (см. services/behavior_refresh.py).
+    """
+    client = models.OneToOneField(Client, on_delete=models.CASCADE, related_name='dirty_mark', verbose_name='Клиент')
+    marked_at = models.DateTimeField('Отмечен', default=timezone.now, db_index=True)
+    reason = models.CharField('Источник', max_length=20, blank=True, default='')
+
+    def __str__(self):
+        return f"{self.client_id}: {self.reason} ({self.marked_at:%Y-%m-%d %H:%M})"
+
+    class Meta:
+        verbose_name = 'Клиент к пересчёту профиля'
+        verbose_name_plural = 'Клиенты к пересчёту профиля'
+
+
 class NextBestAction(models.Model):
     """Рекомендация следующего лучшего действия (NBA)"""
     client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='nba_recommendations')
@@ -1821,6 +2064,10 @@ class AuditLog(models.Model):
         ('contact_blocked', 'Контакт заблокирован'),
         ('login', 'Вход в систему'),
         ('logout', 'Выход из системы'),
+        ('api_read', 'Просмотр через API'),
+        ('api_create', 'Создание через API'),
+        ('api_update', 'Изменение через API'),
+        ('api_delete', 'Удаление через API'),
     ]
     action = models.CharField('Действие', max_length=50, choices=ACTION_CHOICES, db_index=True)
     
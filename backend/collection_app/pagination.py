@@ -0,0 +1,35 @@
+"""
+Пагинация списков API.
+
+KeysetPagination — курсорная (keyset) пагинация по индексированной сортировке:
+стоимость страницы не зависит от её номера, в отличие от OFFSET.
+Списки отдаются страницами по умолчанию (page_size 100, не больше max_page_size).
+?paginate=false возвращает прежний ответ — весь список массивом; его передают
+только вызовы фронтенда, которые считают итоги по всему списку.
+
+    GET /api/payments/?page_size=50
+    GET /api/payments/?cursor=cD0yMDI1LTAxLTE1
+    GET /api/credits/?status=overdue&paginate=false
+"""
+
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """Курсорная пагинация; сортировку задаёт view через cursor_ordering / get_cursor_ordering()"""
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('-id',)
+    # Прежний ответ без пагинации — только для вызовов фронтенда, которым нужен весь список
+    unpaginated_query_param = 'paginate'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.unpaginated_query_param) == 'false':
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        if hasattr(view, 'get_cursor_ordering'):
+            return tuple(view.get_cursor_ordering())
+        return tuple(getattr(view, 'cursor_ordering', self.ordering))
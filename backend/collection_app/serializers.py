@@ -3,10 +3,43 @@ from .models import (
     Client, Credit, Payment, Intervention, Operator, ScoringResult, 
     Assignment, CreditApplication, CreditState, ClientBehaviorProfile,
     NextBestAction, SmartScript, ConversationAnalysis, ComplianceAlert, ReturnForecast,
-    BankruptcyCheck, MLModelVersion, AuditLog, ViolationLog,
+    BankruptcyCheck, MLModelVersion, AuditLog, ViolationLog, PaymentImport,
 )
 from django.contrib.auth.models import User
 
+
+class SparseFieldsMixin:
+    """
+    Выборочные поля: ?fields=id,status,client_name оставляет в ответе только их.
+    Применяется только к сериализатору верхнего уровня (с request в context).
+    Meta.sparse_dependencies — колонки модели, нужные вычисляемым полям
+    (используется SparseFieldsViewMixin для only()).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        requested = parse_requested_fields(request)
+        if not requested:
+            return
+        keep = set(requested) & set(self.fields)
+        if not keep:
+            return
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+
+def parse_requested_fields(request):
+    """Список полей из ?fields=a,b,c (None, если параметр не задан)"""
+    raw = request.query_params.get('fields') if hasattr(request, 'query_params') else None
+    if not raw:
+        return None
+    return [f.strip() for f in raw.split(',') if f.strip()]
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -17,17 +50,17 @@ class OperatorSerializer(serializers.ModelSerializer):
         model = Operator
         fields = '__all__'
 
-class ClientSerializer(serializers.ModelSerializer):
+class ClientSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Client
         fields = '__all__'
 
-class CreditStateSerializer(serializers.ModelSerializer):
+class CreditStateSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = CreditState
         fields = '__all__'
 
-class CreditSerializer(serializers.ModelSerializer):
+class CreditSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     client_name = serializers.CharField(source='client.full_name', read_only=True)
     client_phone = serializers.CharField(source='client.phone_mobile', read_only=True)
     latest_state = serializers.SerializerMethodField()
@@ -38,9 +71,16 @@ class CreditSerializer(serializers.ModelSerializer):
     class Meta:
         model = Credit
         fields = '__all__'
+        read_only_fields = ['current_state', 'current_overdue_days', 'current_bucket']
+        sparse_dependencies = {
+            'latest_state': ['current_state'],
+            'term_months': ['open_date', 'planned_close_date'],
+            'delinquency_bucket': ['current_bucket'],
+            'days_past_due': ['current_overdue_days'],
+        }
     
     def get_latest_state(self, obj):
-        state = obj.states.order_by('-state_date').first()
+        state = obj.current_state
         if state:
             return CreditStateSerializer(state).data
         return None
@@ -52,12 +92,19 @@ class CreditSerializer(serializers.ModelSerializer):
             return months if months > 0 else None
         return None
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = '__all__'
 
-class InterventionSerializer(serializers.ModelSerializer):
+class PaymentImportSerializer(serializers.ModelSerializer):
+    rows_per_second = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = PaymentImport
+        fields = '__all__'
+
+class InterventionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     operator_name = serializers.CharField(source='operator.full_name', read_only=True)
     client_name = serializers.CharField(source='client.full_name', read_only=True)
     
@@ -65,7 +112,7 @@ class InterventionSerializer(serializers.ModelSerializer):
         model = Intervention
         fields = '__all__'
 
-class ScoringResultSerializer(serializers.ModelSerializer):
+class ScoringResultSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ScoringResult
         fields = '__all__'
@@ -83,25 +130,38 @@ class AssignmentSerializer(serializers.ModelSerializer):
         model = Assignment
         fields = '__all__'
     
-    def get_last_promise_amount(self, obj):
+    # Значения берутся из аннотаций AssignmentViewSet.annotate_queue();
+    # запрос на строку выполняется только для неаннотированных объектов.
+    
+    def _last_promise(self, obj):
         from collection_app.models import Intervention
-        last = Intervention.objects.filter(
+        return Intervention.objects.filter(
             credit=obj.credit, status='promise'
         ).order_by('-datetime').first()
-        if last and last.promise_amount:
-            return float(last.promise_amount)
+    
+    def get_last_promise_amount(self, obj):
+        if hasattr(obj, 'queue_last_promise_amount'):
+            amount = obj.queue_last_promise_amount
+        else:
+            last = self._last_promise(obj)
+            amount = last.promise_amount if last else None
+        if amount:
+            return float(amount)
         return None
     
     def get_last_promise_date(self, obj):
-        from collection_app.models import Intervention
-        last = Intervention.objects.filter(
-            credit=obj.credit, status='promise'
-        ).order_by('-datetime').first()
-        if last and last.promise_date:
-            return str(last.promise_date)
+        if hasattr(obj, 'queue_last_promise_date'):
+            promise_date = obj.queue_last_promise_date
+        else:
+            last = self._last_promise(obj)
+            promise_date = last.promise_date if last else None
+        if promise_date:
+            return str(promise_date)
         return None
     
     def get_total_attempts(self, obj):
+        if hasattr(obj, 'queue_total_attempts'):
+            return obj.queue_total_attempts
         from collection_app.models import Intervention
         return Intervention.objects.filter(credit=obj.credit).count()
 
@@ -190,42 +250,62 @@ class Client360Serializer(serializers.ModelSerializer):
         model = Client
         fields = '__all__'
     
+    # Связи берутся из prefetch Client360Loader (или собранные Client360Loader.assemble);
+    # без них — прежние запросы.
+    
+    def _credits(self, obj):
+        if hasattr(obj, 'loaded_credits'):
+            return obj.loaded_credits
+        if 'credits' in getattr(obj, '_prefetched_objects_cache', {}):
+            return list(obj.credits.all())
+        return list(obj.credits.select_related('client', 'current_state').order_by('id'))
+    
     def get_credits(self, obj):
-        credits = obj.credits.all()
-        return CreditSerializer(credits, many=True).data
+        return CreditSerializer(self._credits(obj), many=True).data
     
     def get_interventions(self, obj):
-        interventions = obj.interventions.order_by('-datetime')[:20]
+        if hasattr(obj, 'recent_interventions'):
+            interventions = obj.recent_interventions
+        else:
+            interventions = obj.interventions.order_by('-datetime')[:20]
         return InterventionSerializer(interventions, many=True).data
     
     def get_total_debt(self, obj):
         total = 0
-        for credit in obj.credits.all():
-            state = credit.states.order_by('-state_date').first()
+        for credit in self._credits(obj):
+            state = credit.current_state
             if state:
                 total += float(state.principal_debt)
         return total
     
     def get_total_overdue(self, obj):
         total = 0
-        for credit in obj.credits.all():
-            state = credit.states.order_by('-state_date').first()
+        for credit in self._credits(obj):
+            state = credit.current_state
             if state:
                 total += float(state.overdue_principal)
         return total
     
     def get_nba_recommendations(self, obj):
-        nbas = NextBestAction.objects.filter(client=obj, status='pending').order_by('-created_at')[:5]
+        if hasattr(obj, 'pending_nba'):
+            nbas = obj.pending_nba
+        else:
+            nbas = NextBestAction.objects.filter(client=obj, status='pending').order_by('-created_at')[:5]
         return NextBestActionSerializer(nbas, many=True).data
     
     def get_latest_forecast(self, obj):
-        for credit in obj.credits.filter(status='overdue'):
-            forecast = credit.forecasts.order_by('-calculated_at').first()
+        for credit in self._credits(obj):
+            if credit.status != 'overdue':
+                continue
+            if hasattr(credit, 'ordered_forecasts'):
+                forecast = credit.ordered_forecasts[0] if credit.ordered_forecasts else None
+            else:
+                forecast = credit.forecasts.order_by('-calculated_at').first()
             if forecast:
                 return ReturnForecastSerializer(forecast).data
         return None
 
-class OperatorQueueSerializer(serializers.ModelSerializer):
+class OperatorQueueSerializer(AssignmentSerializer):
     """Очередь оператора с расширенными данными"""
     client = serializers.SerializerMethodField()
     nba = serializers.SerializerMethodField()
@@ -247,9 +327,30 @@ class OperatorQueueSerializer(serializers.ModelSerializer):
         }
     
     def get_nba(self, obj):
-        nba = NextBestAction.objects.filter(
-            credit=obj.credit, status='pending'
-        ).order_by('-created_at').first()
+        # my_queue передаёт рекомендации из NBACache одной пачкой
+        nba_cache = self.context.get('nba_cache')
+        if nba_cache is not None:
+            cached = nba_cache.get((obj.credit.client_id, obj.credit_id))
+            if cached is None:
+                return None
+            nba = cached['nba']
+            return {
+                'channel': dict(NextBestAction.CHANNEL_CHOICES).get(nba['recommended_channel']),
+                'scenario': dict(NextBestAction.SCENARIO_CHOICES).get(nba['recommended_scenario']),
+                'offer': dict(NextBestAction.OFFER_CHOICES).get(nba['recommended_offer']),
+                'urgency': nba['urgency'],
+                'confidence': nba['confidence_score'],
+                'reasoning': nba['reasoning'],
+                'recommended_datetime': nba['recommended_datetime'],
+                'fingerprint': cached['fingerprint'],
+            }
+        # pending_nba заполняется через Prefetch
+        if hasattr(obj.credit, 'pending_nba'):
+            nba = obj.credit.pending_nba[0] if obj.credit.pending_nba else None
+        else:
+            nba = NextBestAction.objects.filter(
+                credit=obj.credit, status='pending'
+            ).order_by('-created_at').first()
         if nba:
             return {
                 'channel': nba.get_recommended_channel_display(),
@@ -5,15 +5,48 @@ Services Layer - Бизнес-логика приложения
 - distribution.py: Распределение работы по операторам
 - collection_service.py: Управление процессом взыскания
 - workflow_service.py: Автоматизация бизнес-процессов (Rules Engine)
+- client_profile.py: Загрузка и кэширование Client 360
+- export.py: Потоковая выгрузка таблиц (CSV / JSONL / Parquet)
+- payment_import.py: Загрузка банковских файлов платежей
+- amortization.py: Векторный расчёт графиков и заполнение истории CreditState
+- scheduler.py: Встроенный планировщик периодических задач
+- promise_matcher.py: Пакетная проверка обещаний по платежам
+- behavior_refresh.py: Инкрементальный пересчёт поведенческих профилей (очередь DirtyClient)
+- nba_cache.py: Кэш рекомендаций NBA с инвалидацией по событиям клиента
+- shared_cache.py: Общий для воркеров кэш (SHARED_CACHE) для записей со сбросом по событиям
+- copilot_stream.py: Поток подсказок Copilot по звонку (SSE, состояние в памяти)
+- dashboards.py: Отчёты дашбордов из независимых запросов (одновременно в async views)
 """
 
 from .distribution import DistributionService
 from .collection_service import CollectionService
 from .workflow_service import WorkflowEngine, RulesBuilder
+from .client_profile import Client360Loader
+from .export import ExportService
+from .payment_import import PaymentImportService
+from .amortization import AmortizationEngine
+from .scheduler import PeriodicScheduler
+from .promise_matcher import PromiseMatcher
+from .behavior_refresh import BehaviorProfileRefresher
+from .nba_cache import NBACache
+from .copilot_stream import CopilotStreamHub
+from .dashboards import ManagerDashboard, SummaryDashboard, OperatorDashboard
 
 __all__ = [
     'DistributionService',
     'CollectionService', 
     'WorkflowEngine',
     'RulesBuilder',
+    'Client360Loader',
+    'ExportService',
+    'PaymentImportService',
+    'AmortizationEngine',
+    'PeriodicScheduler',
+    'PromiseMatcher',
+    'BehaviorProfileRefresher',
+    'NBACache',
+    'CopilotStreamHub',
+    'ManagerDashboard',
+    'SummaryDashboard',
+    'OperatorDashboard',
 ]
\ No newline at end of file
@@ -0,0 +1,365 @@
+"""
+Векторизованный движок графиков погашения (аннуитет) и помесячных CreditState.
+
+Графики всех кредитов строятся одним набором NumPy-массивов (строка = кредит × период),
+сравниваются с существующими состояниями по ключу (credit_id, state_date) и недостающие
+строки пишутся через bulk_create порциями.
+
+Использование:
+    from collection_app.services.amortization import AmortizationEngine
+
+    # Заполнить пропуски по всему портфелю
+    stats = AmortizationEngine.fill_gaps(today=date.today())
+
+    # Пересчитать график одного кредита после реструктуризации
+    AmortizationEngine.recalculate_credit(credit, from_date=date(2025, 3, 1))
+"""
+
+import logging
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from django.db import transaction
+
+from ..models import Credit, CreditState, Payment
+
+logger = logging.getLogger(__name__)
+
+_KEY_SHIFT = 20  # credit_id << 20 | дни от эпохи
+
+
+def _money(value: float) -> Decimal:
+    return Decimal(f'{value:.2f}')
+
+
+def _period_dates(months: np.ndarray, day_of_month: np.ndarray) -> np.ndarray:
+    """Дата платежа в месяце: день открытия, для коротких месяцев — 28-е"""
+    first = months.astype('datetime64[D]')
+    days_in_month = ((months + 1).astype('datetime64[D]') - first).astype(np.int64)
+    day = np.where(day_of_month <= days_in_month, day_of_month, 28)
+    return first + (day - 1)
+
+
+def _keys(credit_ids: np.ndarray, dates: np.ndarray) -> np.ndarray:
+    return (credit_ids.astype(np.int64) << _KEY_SHIFT) | dates.astype('datetime64[D]').astype(np.int64)
+
+
+@dataclass
+class Schedule:
+    """Плоский график: одна строка на (кредит, период)"""
+    credit_id: np.ndarray
+    period: np.ndarray
+    state_date: np.ndarray            # datetime64[D]
+    planned_payment_date: np.ndarray  # datetime64[D]
+    principal_debt: np.ndarray
+    interest: np.ndarray
+    rate_monthly: np.ndarray
+    monthly_payment: np.ndarray
+
+    def __len__(self):
+        return len(self.credit_id)
+
+    def take(self, mask: np.ndarray) -> 'Schedule':
+        return Schedule(**{name: getattr(self, name)[mask] for name in self.__dataclass_fields__})
+
+
+@dataclass
+class FillStats:
+    credits_total: int = 0
+    credits_fixed: int = 0
+    states_created: int = 0
+    payments_created: int = 0
+    samples: List[str] = field(default_factory=list)
+
+
+class AmortizationEngine:
+    """Графики погашения и заполнение истории CreditState"""
+
+    CHUNK_SIZE = 2000        # кредитов за проход
+    BATCH_SIZE = 5000        # строк в bulk_create
+    # Синтетика для демо-данных (как в прежнем fill_credit_states)
+    OVERDUE_MONTH_SHARE = 0.6
+    PAYMENT_SHARE = 0.85
+    LATE_PAYMENT_SHARE = 0.25
+
+    # ------------------------------------------------------------------
+    # Расчёт графика
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def build_schedule(credit_ids, open_dates, end_dates, principal, annual_rate, monthly_payment,
+                       start_period=None, start_balance=None) -> Schedule:
+        """
+        Аннуитетный график для массива кредитов.
+
+        Период k — дата open_date + k месяцев (k = 0 — дата выдачи), последний период ≤ end_date.
+        Остаток: B_k = P(1+r)^k − M((1+r)^k − 1)/r. Если платёж не покрывает проценты,
+        используется линейное погашение 70% платежа.
+        start_period/start_balance — пересчёт с периода (после реструктуризации).
+        """
+        credit_ids = np.asarray(credit_ids, dtype=np.int64)
+        open_dates = np.asarray(open_dates, dtype='datetime64[D]')
+        end_dates = np.asarray(end_dates, dtype='datetime64[D]')
+        principal = np.asarray(principal, dtype=np.float64)
+        rate = np.asarray(annual_rate, dtype=np.float64) / 100 / 12
+        monthly = np.asarray(monthly_payment, dtype=np.float64)
+        start_period = np.zeros(len(credit_ids), dtype=np.int64) if start_period is None \
+            else np.asarray(start_period, dtype=np.int64)
+        start_balance = principal if start_balance is None else np.asarray(start_balance, dtype=np.float64)
+
+        open_months = open_dates.astype('datetime64[M]')
+        day_of_month = (open_dates - open_months.astype('datetime64[D]')).astype(np.int64) + 1
+
+        months_diff = (end_dates.astype('datetime64[M]') - open_months).astype(np.int64)
+        last_fits = _period_dates(open_months + months_diff, day_of_month) <= end_dates
+        n_periods = np.clip(months_diff + last_fits.astype(np.int64) - start_period, 0, None)
+
+        total = int(n_periods.sum())
+        idx = np.repeat(np.arange(len(credit_ids)), n_periods)
+        offsets = np.repeat(np.cumsum(n_periods) - n_periods, n_periods)
+        k_local = np.arange(total, dtype=np.int64) - offsets
+        k = k_local + start_period[idx]
+
+        months = open_months[idx] + k
+        state_dates = _period_dates(months, day_of_month[idx])
+        planned = _period_dates(months + 1, day_of_month[idx])
+
+        p, r, m = start_balance[idx], rate[idx], monthly[idx]
+        growth = np.power(1 + r, k_local)
+        safe_r = np.where(r > 0, r, 1.0)
+        annuity = np.where(r > 0, p * growth - m * (growth - 1) / safe_r, p - m * k_local)
+        share = np.where(m - p * r > 0, m - p * r, m * 0.7)
+        linear = p - share * k_local
+        balance = np.clip(np.where(m > p * r, annuity, linear), 0, None).round(2)
+
+        return Schedule(
+            credit_id=credit_ids[idx], period=k, state_date=state_dates, planned_payment_date=planned,
+            principal_debt=balance, interest=(balance * r).round(2),
+            rate_monthly=r, monthly_payment=m,
+        )
+
+    # ------------------------------------------------------------------
+    # Заполнение пропусков
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def fill_gaps(cls, credit_ids: Optional[Iterable[int]] = None, today: Optional[date] = None,
+                  dry_run: bool = False, seed: Optional[int] = None,
+                  simulate: bool = True, chunk_size: Optional[int] = None) -> FillStats:
+        """
+        Дозаполнить помесячную историю CreditState (и платежи) для кредитов.
+        simulate=True — как прежде генерировать синтетическую просрочку/платежи для демо-данных.
+        """
+        today = today or date.today()
+        rng = np.random.default_rng(seed)
+        stats = FillStats()
+
+        qs = Credit.objects.order_by('id')
+        if credit_ids is not None:
+            qs = qs.filter(pk__in=list(credit_ids))
+        all_ids = list(qs.values_list('id', flat=True))
+        stats.credits_total = len(all_ids)
+
+        chunk_size = chunk_size or cls.CHUNK_SIZE
+        for offset in range(0, len(all_ids), chunk_size):
+            chunk_ids = all_ids[offset:offset + chunk_size]
+            cls._fill_chunk(chunk_ids, today, rng, dry_run, simulate, stats)
+        return stats
+
+    @classmethod
+    def _fill_chunk(cls, chunk_ids: List[int], today: date, rng, dry_run: bool,
+                    simulate: bool, stats: FillStats) -> None:
+        credits = list(
+            Credit.objects.filter(pk__in=chunk_ids).order_by('id').values_list(
+                'id', 'client_id', 'open_date', 'planned_close_date', 'principal_amount',
+                'interest_rate', 'monthly_payment', 'status',
+            )
+        )
+        if not credits:
+            return
+        ids, client_ids, open_dates, close_dates, principal, rates, monthly, statuses = map(list, zip(*credits))
+
+        existing = np.array(
+            list(CreditState.objects.filter(credit_id__in=ids).values_list('credit_id', 'state_date')),
+            dtype=object,
+        ).reshape(-1, 2)
+        existing_ids = existing[:, 0].astype(np.int64)
+        existing_dates = existing[:, 1].astype('datetime64[D]')
+        existing_keys = _keys(existing_ids, existing_dates)
+        existing_count = dict(zip(*np.unique(existing_ids, return_counts=True)))
+
+        last_known: Dict[int, np.datetime64] = {}
+        if len(existing_ids):
+            order = np.lexsort((existing_dates, existing_ids))
+            last_pos = np.r_[existing_ids[order][1:] != existing_ids[order][:-1], True]
+            last_known = dict(zip(existing_ids[order][last_pos].tolist(), existing_dates[order][last_pos]))
+
+        # Конечная дата: закрытые — до последнего состояния/плановой даты, остальные — до сегодня
+        today64 = np.datetime64(today, 'D')
+        end_dates = []
+        for credit_id, close_date, status in zip(ids, close_dates, statuses):
+            if status != 'closed':
+                end_dates.append(today64)
+            elif credit_id in last_known:
+                end_dates.append(last_known[credit_id])
+            else:
+                end_dates.append(np.datetime64(close_date, 'D') if close_date else today64)
+
+        schedule = cls.build_schedule(
+            ids, open_dates, np.array(end_dates, dtype='datetime64[D]'),
+            [float(x) for x in principal], [float(x) for x in rates], [float(x) for x in monthly],
+        )
+        missing = schedule.take(~np.isin(_keys(schedule.credit_id, schedule.state_date), existing_keys))
+        if not len(missing):
+            return
+
+        fixed_ids = np.unique(missing.credit_id)
+        stats.credits_fixed += len(fixed_ids)
+        if dry_run:
+            per_credit = dict(zip(*np.unique(missing.credit_id, return_counts=True)))
+            for credit_id in fixed_ids[:max(0, 10 - len(stats.samples))]:
+                stats.samples.append(
+                    f'Credit #{credit_id}: {existing_count.get(credit_id, 0)} states, '
+                    f'need +{per_credit[credit_id]}'
+                )
+            return
+
+        position = {credit_id: i for i, credit_id in enumerate(ids)}
+        row_credit = np.array([position[c] for c in missing.credit_id.tolist()], dtype=np.int64)
+        status_arr = np.array(statuses, dtype=object)[row_credit]
+        balance = missing.principal_debt
+
+        # Закрытые кредиты: после последнего известного состояния долг 0
+        last_arr = np.array(
+            [last_known.get(c, np.datetime64('NaT')) for c in missing.credit_id.tolist()], dtype='datetime64[D]'
+        )
+        closed_after = (status_arr == 'closed') & ~np.isnat(last_arr) & (missing.state_date >= last_arr)
+        balance = np.where(closed_after, 0.0, balance)
+        interest = np.where(closed_after, 0.0, missing.interest)
+
+        n = len(missing)
+        overdue_principal = np.zeros(n)
+        overdue_interest = np.zeros(n)
+        penalties = np.zeros(n)
+        overdue_days = np.zeros(n, dtype=np.int64)
+        if simulate:
+            is_overdue = np.isin(status_arr, ['overdue', 'default']) & (balance > 0)
+            hit = is_overdue & (rng.random(n) < cls.OVERDUE_MONTH_SHARE)
+            overdue_principal = np.where(hit, balance * rng.uniform(0.05, 0.25, n), 0).round(2)
+            overdue_interest = np.where(hit, balance * missing.rate_monthly * rng.uniform(0.5, 1.5, n), 0).round(2)
+            overdue_days = np.where(hit, rng.integers(5, 91, n), 0)
+            penalties = np.where(
+                hit & (rng.random(n) < 0.3), overdue_principal * rng.uniform(0.01, 0.05, n), 0,
+            ).round(2)
+
+        states = [
+            CreditState(
+                credit_id=credit_id, client_id=client_ids[pos], state_date=state_date,
+                planned_payment_date=planned, principal_debt=_money(debt),
+                overdue_principal=_money(op), interest=_money(intr), overdue_interest=_money(oi),
+                penalties=_money(pen), overdue_days=dpd,
+            )
+            for credit_id, pos, state_date, planned, debt, op, intr, oi, pen, dpd in zip(
+                missing.credit_id.tolist(), row_credit.tolist(),
+                missing.state_date.astype(object), missing.planned_payment_date.astype(object),
+                balance.tolist(), overdue_principal.tolist(), interest.tolist(),
+                overdue_interest.tolist(), penalties.tolist(), overdue_days.tolist(),
+            )
+        ]
+
+        payments = []
+        if simulate:
+            paid_keys = _keys(*cls._existing_payment_pairs(ids))
+            no_payment = ~np.isin(_keys(missing.credit_id, missing.state_date), paid_keys)
+            pays = (balance > 0) & no_payment & ((status_arr == 'closed') | (rng.random(n) < cls.PAYMENT_SHARE))
+            late = np.where(rng.random(n) < cls.LATE_PAYMENT_SHARE, rng.integers(1, 31, n), 0)
+            pay_dates = missing.state_date + late
+            amounts = (missing.monthly_payment * rng.uniform(0.95, 1.05, n)).round(2)
+            for i in np.flatnonzero(pays).tolist():
+                payments.append(Payment(
+                    credit_id=int(missing.credit_id[i]), payment_date=pay_dates[i].astype(object),
+                    amount=_money(amounts[i]), payment_type='regular',
+                    planned_date=missing.state_date[i].astype(object),
+                    min_payment=_money(missing.monthly_payment[i] * 0.1), overdue_days=int(late[i]),
+                ))
+
+        with transaction.atomic():
+            CreditState.objects.bulk_create(states, batch_size=cls.BATCH_SIZE)
+            Payment.objects.bulk_create(payments, batch_size=cls.BATCH_SIZE)
+            Credit.refresh_current_states(fixed_ids.tolist())
+        stats.states_created += len(states)
+        stats.payments_created += len(payments)
+
+    @staticmethod
+    def _existing_payment_pairs(credit_ids: List[int]):
+        pairs = list(Payment.objects.filter(credit_id__in=credit_ids).values_list('credit_id', 'payment_date'))
+        if not pairs:
+            return np.array([], dtype=np.int64), np.array([], dtype='datetime64[D]')
+        ids, dates = zip(*pairs)
+        return np.array(ids, dtype=np.int64), np.array(dates, dtype='datetime64[D]')
+
+    # ------------------------------------------------------------------
+    # Один кредит
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def credit_schedule(cls, credit: Credit, end_date: Optional[date] = None) -> Schedule:
+        """Плановый график одного кредита до end_date (по умолчанию — плановая дата закрытия)"""
+        end = end_date or credit.planned_close_date or date.today()
+        return cls.build_schedule(
+            [credit.pk], [credit.open_date], [end], [float(credit.principal_amount)],
+            [float(credit.interest_rate)], [float(credit.monthly_payment)],
+        )
+
+    @classmethod
+    def recalculate_credit(cls, credit: Credit, from_date: date, end_date: Optional[date] = None) -> int:
+        """
+        Пересчитать плановый долг/проценты кредита начиная с from_date по текущим условиям
+        (monthly_payment, interest_rate, planned_close_date) — после реструктуризации.
+        Базой служит основной долг последнего состояния до from_date. Поля просрочки не меняются.
+        Возвращает число записанных состояний.
+        """
+        end = end_date or max(credit.planned_close_date or date.today(), date.today())
+        base = credit.states.filter(state_date__lt=from_date).order_by('-state_date').first()
+        start_balance = float(base.principal_debt) if base else float(credit.principal_amount)
+
+        open_month = np.datetime64(credit.open_date, 'M')
+        start_period = int((np.datetime64(from_date, 'M') - open_month).astype(np.int64))
+        day = credit.open_date.day
+        if _period_dates(np.array([np.datetime64(from_date, 'M')]), np.array([day]))[0] < np.datetime64(from_date, 'D'):
+            start_period += 1
+
+        schedule = cls.build_schedule(
+            [credit.pk], [credit.open_date], [end], [float(credit.principal_amount)],
+            [float(credit.interest_rate)], [float(credit.monthly_payment)],
+            start_period=[start_period], start_balance=[start_balance],
+        )
+        if not len(schedule):
+            return 0
+
+        existing = {s.state_date: s for s in credit.states.filter(state_date__gte=from_date)}
+        to_create, to_update = [], []
+        for state_date, planned, debt, intr in zip(
+            schedule.state_date.astype(object), schedule.planned_payment_date.astype(object),
+            schedule.principal_debt.tolist(), schedule.interest.tolist(),
+        ):
+            state = existing.get(state_date)
+            if state is None:
+                state = CreditState(credit_id=credit.pk, client_id=credit.client_id, state_date=state_date)
+                to_create.append(state)
+            else:
+                to_update.append(state)
+            state.planned_payment_date = planned
+            state.principal_debt = _money(debt)
+            state.interest = _money(intr)
+
+        with transaction.atomic():
+            CreditState.objects.bulk_create(to_create, batch_size=cls.BATCH_SIZE)
+            CreditState.objects.bulk_update(
+                to_update, ['planned_payment_date', 'principal_debt', 'interest'], batch_size=cls.BATCH_SIZE,
+            )
+            credit.refresh_current_state()
+        return len(to_create) + len(to_update)
@@ -0,0 +1,174 @@
+"""
+Инкрементальный пересчёт поведенческих профилей по очереди DirtyClient.
+
+Новые и изменённые Payment / Intervention / Promise отмечают клиента (сигналы,
+bulk-загрузки — вызовом mark_dirty). Обработчик берёт отмеченных клиентов пачками
+и пересчитывает ClientBehaviorProfile только для них: психотип (classify_clients),
+лучший час / день контакта и предпочтительный канал (по состоявшимся контактам),
+счётчики контактов и признаки обещаний. Отметка снимается, только если клиент не был
+отмечен повторно во время пересчёта.
+
+Использование:
+    from collection_app.services.behavior_refresh import BehaviorProfileRefresher
+    BehaviorProfileRefresher.mark_dirty([client_id], reason='payment')
+    stats = BehaviorProfileRefresher.refresh_dirty()
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+from django.utils import timezone
+
+from ..models import ClientBehaviorProfile, DirtyClient, Intervention
+from .client_profile import Client360Loader
+from .nba_cache import NBACache
+from .promise_matcher import PromiseMatcher
+
+logger = logging.getLogger(__name__)
+
+
+class BehaviorProfileRefresher:
+    """Пересчёт профилей клиентов из очереди DirtyClient"""
+
+    BATCH_SIZE = 500
+    # Типы воздействий, которые являются каналами профиля (письмо и визит — нет)
+    CHANNELS = {code for code, _ in ClientBehaviorProfile.PREFERRED_CHANNEL_CHOICES}
+    PROFILE_FIELDS = [
+        'psychotype', 'psychotype_confidence', 'best_contact_hour', 'best_contact_day',
+        'preferred_channel', 'total_contacts', 'successful_contacts',
+        'promises_kept_ratio', 'avg_promise_delay', 'last_updated',
+    ]
+
+    @classmethod
+    def mark_dirty(cls, client_ids: Iterable[int], reason: str = '') -> int:
+        """Отметить клиентов (upsert — повторная отметка только сдвигает marked_at)"""
+        client_ids = {cid for cid in client_ids if cid}
+        if not client_ids:
+            return 0
+        now = timezone.now()
+        DirtyClient.objects.bulk_create(
+            [DirtyClient(client_id=cid, marked_at=now, reason=reason) for cid in client_ids],
+            update_conflicts=True,
+            unique_fields=['client'],
+            update_fields=['marked_at', 'reason'],
+        )
+        return len(client_ids)
+
+    @classmethod
+    def pending_count(cls) -> int:
+        return DirtyClient.objects.count()
+
+    @classmethod
+    def refresh_dirty(cls, batch_size: Optional[int] = None, max_batches: Optional[int] = None,
+                      today: Optional[date] = None) -> Dict[str, int]:
+        """
+        Обработать очередь пачками (старые отметки первыми).
+        Клиенты, отмеченные после старта прохода, остаются на следующий.
+        """
+        batch_size = batch_size or cls.BATCH_SIZE
+        started = timezone.now()
+        stats = {'clients': 0, 'batches': 0}
+        while max_batches is None or stats['batches'] < max_batches:
+            claimed_at = timezone.now()
+            client_ids = list(
+                DirtyClient.objects.filter(marked_at__lte=started)
+                .order_by('marked_at', 'client_id').values_list('client_id', flat=True)[:batch_size]
+            )
+            if not client_ids:
+                break
+            with transaction.atomic():
+                cls.refresh_clients(client_ids, today=today)
+                # Отмеченные во время пересчёта — останутся в очереди
+                DirtyClient.objects.filter(client_id__in=client_ids, marked_at__lte=claimed_at).delete()
+            stats['clients'] += len(client_ids)
+            stats['batches'] += 1
+        logger.info('Behavior profiles refreshed: %s clients in %s batches', stats['clients'], stats['batches'])
+        return stats
+
+    @classmethod
+    def refresh_clients(cls, client_ids: List[int], today: Optional[date] = None) -> int:
+        """Пересчитать профили указанных клиентов (создаёт недостающие)"""
+        from ..ml.psychotyping import classify_clients
+
+        if not client_ids:
+            return 0
+        psychotypes = classify_clients(client_ids, today=today)
+        contacts = cls.contact_stats(client_ids)
+        promises = PromiseMatcher.promise_stats(client_ids)
+        now = timezone.now()
+
+        existing = {p.client_id: p for p in ClientBehaviorProfile.objects.filter(client_id__in=client_ids)}
+        new_profiles = []
+        for client_id in client_ids:
+            profile = existing.get(client_id)
+            if profile is None:
+                profile = ClientBehaviorProfile(client_id=client_id)
+                new_profiles.append(profile)
+            result = psychotypes[client_id]
+            profile.psychotype = result.psychotype
+            profile.psychotype_confidence = result.confidence
+            # Нет состоявшихся контактов — прежние значения (или значения по умолчанию)
+            for field, value in contacts.get(client_id, {}).items():
+                setattr(profile, field, value)
+            if client_id in promises:
+                profile.promises_kept_ratio, profile.avg_promise_delay = promises[client_id]
+            profile.last_updated = now
+
+        ClientBehaviorProfile.objects.bulk_update(
+            list(existing.values()), cls.PROFILE_FIELDS, batch_size=cls.BATCH_SIZE,
+        )
+        ClientBehaviorProfile.objects.bulk_create(
+            new_profiles,
+            batch_size=cls.BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['client'],
+            update_fields=cls.PROFILE_FIELDS,
+        )
+        # bulk-операции не шлют сигналы — кэш Client 360 сбрасываем сами
+        for client_id in client_ids:
+            Client360Loader.invalidate(client_id)
+        NBACache.invalidate_clients(client_ids)
+        return len(client_ids)
+
+    @classmethod
+    def contact_stats(cls, client_ids: List[int]) -> Dict[int, Dict]:
+        """
+        Контактные поля профиля по сгруппированным запросам.
+        Лучший час / день / канал — мода по состоявшимся контактам (все, кроме no_answer).
+        """
+        result: Dict[int, Dict] = defaultdict(dict)
+        interventions = Intervention.objects.filter(client_id__in=client_ids)
+        for client_id, total, successful in (
+            interventions.values('client_id')
+            .annotate(total=Count('id'), successful=Count('id', filter=~Q(status='no_answer')))
+            .values_list('client_id', 'total', 'successful')
+        ):
+            result[client_id].update(total_contacts=total, successful_contacts=successful)
+
+        reached = interventions.exclude(status='no_answer')
+        modes = [
+            ('best_contact_hour', reached.annotate(key=ExtractHour('datetime'))),
+            ('best_contact_day', reached.annotate(key=ExtractIsoWeekDay('datetime') - 1)),  # 0=Пн
+            ('preferred_channel', reached.filter(intervention_type__in=cls.CHANNELS)
+             .annotate(key=F('intervention_type'))),
+        ]
+        for field, qs in modes:
+            for client_id, key in cls._mode(qs).items():
+                result[client_id][field] = key
+        return result
+
+    @staticmethod
+    def _mode(queryset) -> Dict[int, object]:
+        """Самое частое значение key по клиенту (при равенстве — меньшее)"""
+        best: Dict[int, tuple] = {}
+        rows = queryset.values('client_id', 'key').annotate(n=Count('id')).values_list('client_id', 'key', 'n')
+        for client_id, key, n in rows:
+            current = best.get(client_id)
+            if current is None or (-n, key) < (-current[1], current[0]):
+                best[client_id] = (key, n)
+        return {client_id: key for client_id, (key, _) in best.items()}
@@ -0,0 +1,159 @@
+"""
+Загрузчик 360° профиля клиента.
+
+Профиль собирается фиксированным числом запросов (клиент + prefetch кредитов,
+прогнозов, NBA и последних воздействий) и кэшируется по клиенту.
+Кэш сбрасывается сигналами при записи в связанные таблицы (см. signals.py);
+профили лежат в общем кэше (settings.SHARED_CACHE), поэтому сброс виден всем
+воркерам. Без общего кэша — только своему процессу, и TTL короткий.
+Async-вариант (aget_profile) выполняет те же запросы одновременно, каждый
+в своём потоке (services/dashboards.gather_sections), и собирает граф вручную.
+
+Использование:
+    from collection_app.services.client_profile import Client360Loader
+    data = Client360Loader.get_profile(client_id)
+    data = await Client360Loader.aget_profile(client_id)
+"""
+
+import logging
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from django.db.models import Prefetch
+
+from ..models import Client, Credit, Intervention, NextBestAction, ReturnForecast
+from .shared_cache import shared_cache, ttl
+
+logger = logging.getLogger(__name__)
+
+
+class Client360Loader:
+    """Сборка и кэширование Client 360"""
+
+    CACHE_PREFIX = 'client360'
+    CACHE_TTL = 300  # секунд; основной механизм — инвалидация по записи
+    LOCAL_CACHE_TTL = 60  # кэш процесса (без REDIS_URL): сброс в другом воркере сюда не доходит
+    RECENT_INTERVENTIONS = 20
+    PENDING_NBA = 5
+
+    @classmethod
+    def cache_key(cls, client_id: int) -> str:
+        return f'{cls.CACHE_PREFIX}:{client_id}'
+
+    @classmethod
+    def queryset(cls):
+        """Клиент со всем графом 360 — 6 запросов независимо от числа кредитов"""
+        return Client.objects.select_related('behavior_profile').prefetch_related(
+            Prefetch(
+                'credits',
+                queryset=Credit.objects.select_related('current_state').order_by('id'),
+            ),
+            Prefetch(
+                'credits__forecasts',
+                queryset=ReturnForecast.objects.order_by('-calculated_at'),
+                to_attr='ordered_forecasts',
+            ),
+            Prefetch(
+                'interventions',
+                queryset=Intervention.objects.select_related('operator').order_by('-datetime')[:cls.RECENT_INTERVENTIONS],
+                to_attr='recent_interventions',
+            ),
+            Prefetch(
+                'nba_recommendations',
+                queryset=NextBestAction.objects.filter(status='pending').order_by('-created_at')[:cls.PENDING_NBA],
+                to_attr='pending_nba',
+            ),
+        )
+
+    @classmethod
+    def load(cls, client_id: int) -> Optional[Client]:
+        """Загрузить клиента с предвыбранными связями (без кэша)"""
+        return cls.queryset().filter(pk=client_id).first()
+
+    @classmethod
+    def get_profile(cls, client_id: int) -> Optional[dict]:
+        """Сериализованный профиль из кэша либо из БД. None — клиент не найден."""
+        from ..serializers import Client360Serializer
+
+        key = cls.cache_key(client_id)
+        data = shared_cache().get(key)
+        if data is not None:
+            return data
+
+        client = cls.load(client_id)
+        if client is None:
+            return None
+        data = dict(Client360Serializer(client).data)
+        shared_cache().set(key, data, ttl(cls.CACHE_TTL, cls.LOCAL_CACHE_TTL))
+        return data
+
+    @classmethod
+    def sections(cls, client_id: int) -> Dict[str, Callable[[], Any]]:
+        """Те же запросы, что в queryset(), но независимые друг от друга"""
+        return {
+            'client': lambda: Client.objects.select_related('behavior_profile').filter(pk=client_id).first(),
+            'credits': lambda: list(
+                Credit.objects.filter(client_id=client_id).select_related('current_state').order_by('id')
+            ),
+            'forecasts': lambda: list(
+                ReturnForecast.objects.filter(credit__client_id=client_id).order_by('-calculated_at')
+            ),
+            'interventions': lambda: list(
+                Intervention.objects.filter(client_id=client_id).select_related('operator')
+                .order_by('-datetime')[:cls.RECENT_INTERVENTIONS]
+            ),
+            'pending_nba': lambda: list(
+                NextBestAction.objects.filter(client_id=client_id, status='pending')
+                .order_by('-created_at')[:cls.PENDING_NBA]
+            ),
+        }
+
+    @classmethod
+    def assemble(cls, parts: Dict[str, Any]) -> Optional[Client]:
+        """Разложить результаты sections() по атрибутам, которые читает Client360Serializer"""
+        client = parts['client']
+        if client is None:
+            return None
+        forecasts = defaultdict(list)
+        for forecast in parts['forecasts']:
+            forecasts[forecast.credit_id].append(forecast)
+        for credit in parts['credits']:
+            credit.client = client
+            credit.ordered_forecasts = forecasts[credit.id]
+        for intervention in parts['interventions']:
+            intervention.client = client
+        client.loaded_credits = parts['credits']
+        client.recent_interventions = parts['interventions']
+        client.pending_nba = parts['pending_nba']
+        return client
+
+    @classmethod
+    async def aget_profile(cls, client_id: int) -> Optional[dict]:
+        """Async get_profile: запросы профиля выполняются одновременно"""
+        from ..serializers import Client360Serializer
+        from .dashboards import gather_sections
+
+        key = cls.cache_key(client_id)
+        data = await shared_cache().aget(key)
+        if data is not None:
+            return data
+
+        client = cls.assemble(await gather_sections(cls.sections(client_id)))
+        if client is None:
+            return None
+        data = dict(Client360Serializer(client).data)
+        await shared_cache().aset(key, data, ttl(cls.CACHE_TTL, cls.LOCAL_CACHE_TTL))
+        return data
+
+    @classmethod
+    def invalidate(cls, client_id: Optional[int]) -> None:
+        """Сбросить кэш профиля клиента"""
+        if client_id:
+            shared_cache().delete(cls.cache_key(client_id))
+
+    @classmethod
+    def invalidate_clients(cls, client_ids: Iterable[int]) -> None:
+        """Сбросить кэш профилей пачки клиентов (bulk-пути без сигналов)"""
+        keys = [cls.cache_key(client_id) for client_id in set(client_ids) if client_id]
+        if keys:
+            shared_cache().delete_many(keys)
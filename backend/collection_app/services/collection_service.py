@@ -80,11 +80,11 @@ class CollectionService:
             
             for credit in credits:
                 # Получаем последнее состояние кредита
-                latest_state = credit.states.order_by('-state_date').first()
+                latest_state = credit.current_state
                 if latest_state:
                     total_debt += latest_state.principal_debt
                     overdue_amount += latest_state.overdue_principal + latest_state.overdue_interest
-                    max_dpd = max(max_dpd, latest_state.overdue_days)
+                    max_dpd = max(max_dpd, credit.current_overdue_days)
             
             # Определение начальной стадии
             stage = cls._determine_stage(max_dpd)
@@ -207,44 +207,15 @@ class CollectionService:
         """
         Проверка выполнения обещания
         
+        Платежи ищутся по всем кредитам кейса в окне [создание; дата обещания + 3 дня],
+        см. PromiseMatcher (там же пакетная проверка).
+        
         Args:
             promise: Обещание
         """
-        from django.db.models import Sum
-        
-        case = promise.case
-        credit = case.credits.first()
-        
-        if not credit:
-            return
-        
-        # Ищем платежи за период
-        payments = credit.payments.filter(
-            payment_date__gte=promise.created_at.date(),
-            payment_date__lte=promise.promised_date + timedelta(days=3)  # +3 дня grace period
-        )
+        from .promise_matcher import PromiseMatcher
         
-        total_paid = payments.aggregate(Sum('amount'))['amount__sum'] or Decimal('0')
-        
-        with transaction.atomic():
-            promise.actual_amount = total_paid
-            promise.verified_at = timezone.now()
-            
-            if total_paid >= promise.promised_amount:
-                promise.status = 'kept'
-            elif total_paid > 0:
-                promise.status = 'partial'
-                promise.actual_date = payments.order_by('-payment_date').first().payment_date
-            else:
-                promise.status = 'broken'
-                case.broken_promises += 1
-                case.save(update_fields=['broken_promises'])
-            
-            promise.save()
-            
-            # Проверяем правила эскалации при нарушенном обещании
-            if promise.status == 'broken':
-                cls._check_escalation_rules(case)
+        PromiseMatcher.match_promises([promise])
     
     @classmethod
     def get_operator_workload(cls, operator: Operator) -> Dict:
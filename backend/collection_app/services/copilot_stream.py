@@ -0,0 +1,236 @@
+"""
+Поток подсказок Copilot по звонку (server push вместо опроса).
+
+Оператор открывает звонок один раз: клиент, психотип, сценарий NBA и проверка
+230-ФЗ загружаются при открытии. Дальше приходят только куски транскрипции;
+состояние звонка (CopilotSession, этап, возражение, просмотренная часть текста
+для комплаенса) живёт в памяти процесса, поэтому каждый кусок стоит только
+инкрементальной работы. События (suggestions / objection / stage / compliance /
+closed) раздаются подписчикам SSE-потока и возвращаются в ответ на отправку куска.
+
+Состояние — в памяти одного процесса: ASGI-сервер с одним воркером или
+«липкая» маршрутизация по call_id.
+
+Использование:
+    from collection_app.services.copilot_stream import CopilotStreamHub
+    call = CopilotStreamHub.open_call(client_id, credit_id)
+    events = CopilotStreamHub.push_chunk(call.call_id, 'Нет денег, перезвоните позже')
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from dataclasses import asdict
+from typing import Dict, List, Optional
+
+from django.utils import timezone
+
+from ..ml.compliance import ComplianceService
+from ..ml.smart_scripts import CopilotSession, script_client_data
+from ..models import Client, Credit
+
+logger = logging.getLogger(__name__)
+
+
+class CallStream:
+    """Состояние одного звонка и журнал его событий"""
+
+    def __init__(self, client_id: int, credit_id: Optional[int], operator_id: Optional[int],
+                 session: CopilotSession):
+        self.call_id = uuid.uuid4().hex
+        self.client_id = client_id
+        self.credit_id = credit_id
+        self.operator_id = operator_id
+        self.session = session
+        self.transcript = ''
+        self.compliance_scanned = 0
+        self.reported = set()  # (шаблон, позиция) уже отправленных нарушений
+        self.stage: Optional[str] = None
+        self.objection: Optional[str] = None
+        self.suggestions: List[str] = []
+        self.events: List[Dict] = []
+        self.closed = False
+        self.last_activity = time.monotonic()
+        self.lock = threading.Lock()
+        self.waiters: List[tuple] = []  # (loop, asyncio.Event) подписчиков SSE
+
+    def emit(self, event: str, data: Dict) -> Dict:
+        entry = {'id': len(self.events) + 1, 'event': event, 'data': data}
+        self.events.append(entry)
+        return entry
+
+    def notify(self) -> None:
+        for loop, waiter in list(self.waiters):
+            loop.call_soon_threadsafe(waiter.set)
+
+
+class CopilotStreamHub:
+    """Реестр открытых звонков в памяти процесса"""
+
+    CALL_TTL = 60 * 60  # закрыть звонок без активности, сек
+    # Перекрытие при проверке дописанного текста: запрещённая фраза могла начаться раньше
+    COMPLIANCE_OVERLAP = 80
+    CONTEXT_CHARS = 30
+    KEEPALIVE = 15  # сек между комментариями-пингами SSE
+    PURGE_INTERVAL = 60  # сек между проверками звонков без активности
+
+    _calls: Dict[str, CallStream] = {}
+    _lock = threading.Lock()
+    _purged_at = 0.0
+    _compliance = ComplianceService()
+
+    @classmethod
+    def open_call(cls, client_id: int, credit_id: Optional[int] = None,
+                  operator_id: Optional[int] = None) -> CallStream:
+        """Открыть звонок: один раз загрузить клиента, сценарий и проверку 230-ФЗ"""
+        from .compliance_230fz import can_contact
+        from .nba_cache import NBACache
+
+        client = Client.objects.select_related('behavior_profile').get(pk=client_id)
+        credit = Credit.objects.filter(pk=credit_id, client_id=client_id).first() if credit_id else None
+        profile = getattr(client, 'behavior_profile', None)
+        psychotype = profile.psychotype if profile else 'forgetful'
+        scenario = NBACache.get(client_id, credit.id)['nba']['recommended_scenario'] if credit else 'soft_reminder'
+
+        call = CallStream(client_id, credit.id if credit else None, operator_id,
+                          CopilotSession(script_client_data(client, credit), psychotype, scenario))
+        check = can_contact(client_id, 'phone')
+        with call.lock:
+            call.emit('opened', {'call_id': call.call_id, 'client_id': client_id, 'credit_id': call.credit_id,
+                                 'psychotype': psychotype, 'scenario': scenario})
+            if not check['allowed']:
+                call.emit('compliance', {'violations': [{'type': 'contact_rules', 'severity': 'violation',
+                                                         'description': v} for v in check['violations']],
+                                         'warnings': [], 'reason': check['reason']})
+            cls._add_suggestions(call)
+
+        cls._purge_idle()
+        with cls._lock:
+            cls._calls[call.call_id] = call
+        return call
+
+    @classmethod
+    def get(cls, call_id: str) -> Optional[CallStream]:
+        return cls._calls.get(call_id)
+
+    @classmethod
+    def push_chunk(cls, call_id: str, text: str) -> List[Dict]:
+        """Дописать кусок транскрипции; возвращает новые события"""
+        cls._purge_idle()
+        call = cls._calls.get(call_id)
+        if call is None or call.closed:
+            raise KeyError(call_id)
+        with call.lock:
+            before = len(call.events)
+            call.transcript += text
+            call.last_activity = time.monotonic()
+            cls._add_suggestions(call)
+            cls._add_compliance(call)
+            new_events = call.events[before:]
+        if new_events:
+            call.notify()
+        return new_events
+
+    @classmethod
+    def close_call(cls, call_id: str) -> Optional[CallStream]:
+        with cls._lock:
+            call = cls._calls.pop(call_id, None)
+        if call is not None:
+            with call.lock:
+                call.closed = True
+                call.emit('closed', {'call_id': call_id, 'transcript_length': len(call.transcript)})
+            call.notify()
+        return call
+
+    @classmethod
+    def _add_suggestions(cls, call: CallStream) -> None:
+        session = call.session
+        suggestions = session.update(call.transcript)
+        if session.stage != call.stage:
+            call.stage = session.stage
+            call.emit('stage', {'stage': session.stage})
+        if session.objection and session.objection != call.objection:
+            call.emit('objection', {'objection': session.objection})
+        call.objection = session.objection
+        phrases = [s.phrase for s in suggestions]
+        if phrases != call.suggestions:
+            call.suggestions = phrases
+            call.emit('suggestions', {'suggestions': [asdict(s) for s in suggestions]})
+
+    @classmethod
+    def _add_compliance(cls, call: CallStream) -> None:
+        """Проверка только дописанного текста (с перекрытием), без повторов"""
+        transcript = call.transcript
+        start = max(0, call.compliance_scanned - cls.COMPLIANCE_OVERLAP)
+        violations, warnings = cls._compliance.check_text_compliance(transcript[start:])
+        call.compliance_scanned = len(transcript)
+        fresh = {'violations': [], 'warnings': []}
+        for bucket, items in (('violations', violations), ('warnings', warnings)):
+            for item in items:
+                position = start + item['position']
+                if (item['pattern'], position) in call.reported:
+                    continue
+                call.reported.add((item['pattern'], position))
+                end = position + len(item['match'])
+                fresh[bucket].append(dict(
+                    item, position=position,
+                    context=transcript[max(0, position - cls.CONTEXT_CHARS):end + cls.CONTEXT_CHARS],
+                ))
+        if fresh['violations'] or fresh['warnings']:
+            call.emit('compliance', fresh)
+
+    @classmethod
+    def _purge_idle(cls) -> None:
+        """
+        Закрыть звонки без активности дольше CALL_TTL (не чаще PURGE_INTERVAL):
+        вызывается при открытии звонка, на каждом куске и на пинге SSE.
+        """
+        now = time.monotonic()
+        with cls._lock:
+            if now - cls._purged_at < cls.PURGE_INTERVAL:
+                return
+            cls._purged_at = now
+            deadline = now - cls.CALL_TTL
+            idle = [cls._calls.pop(cid) for cid, call in list(cls._calls.items()) if call.last_activity < deadline]
+        for call in idle:
+            logger.info('Copilot call %s closed by timeout', call.call_id)
+            call.closed = True
+            call.notify()
+
+    @classmethod
+    async def stream(cls, call: CallStream, last_event_id: int = 0):
+        """
+        Асинхронный генератор событий звонка в формате SSE (с id для Last-Event-ID).
+        Завершается после события closed.
+        """
+        loop = asyncio.get_running_loop()
+        waiter = asyncio.Event()
+        call.waiters.append((loop, waiter))
+        sent = last_event_id
+        try:
+            while True:
+                waiter.clear()
+                with call.lock:
+                    pending = call.events[sent:]
+                    closed = call.closed
+                for entry in pending:
+                    sent = entry['id']
+                    yield cls.format_event(entry)
+                if closed and sent >= len(call.events):
+                    return
+                try:
+                    await asyncio.wait_for(waiter.wait(), timeout=cls.KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Брошенные звонки закрываются и без новых open_call / push_chunk
+                    cls._purge_idle()
+                    yield f': ping {timezone.now().isoformat()}\n\n'
+        finally:
+            call.waiters.remove((loop, waiter))
+
+    @staticmethod
+    def format_event(entry: Dict) -> str:
+        payload = json.dumps(entry['data'], ensure_ascii=False, default=str)
+        return f"id: {entry['id']}\nevent: {entry['event']}\ndata: {payload}\n\n"
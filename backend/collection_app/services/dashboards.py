@@ -0,0 +1,394 @@
+"""
+Отчёты дашбордов из независимых секций.
+
+Секция — функция без аргументов с одним запросом (агрегаты сгруппированы,
+без цикла по операторам); отчёт собирается из результатов секций.
+Синхронные views выполняют секции по очереди, асинхронные (/api/async/...,
+ASGI-режим) — одновременно через gather_sections: каждая секция в потоке пула
+со своим соединением с БД, и задержка определяется самой долгой секцией,
+а не суммой всех round-trip.
+
+Использование:
+    from collection_app.services.dashboards import ManagerDashboard
+    data = ManagerDashboard('week').build()          # sync
+    data = await ManagerDashboard('week').abuild()   # async
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import ExtractHour, TruncDate
+from django.utils import timezone
+
+from ..models import (
+    Assignment, Client, ComplianceAlert, Credit, Intervention, NextBestAction, Operator, Payment,
+)
+
+Sections = Dict[str, Callable[[], Any]]
+
+CONTACT_STATUSES = ['completed', 'promise', 'refuse', 'callback']
+PHONE = Q(intervention_type='phone')
+CONTACT = PHONE & Q(status__in=CONTACT_STATUSES)
+PROMISE = Q(status='promise')
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def day_start(day) -> datetime:
+    """
+    Начало дня в текущей зоне. Фильтр datetime >= day_start(d) вместо datetime__date >= d
+    использует индекс и не вызывает преобразование даты для каждой строки.
+    """
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def query_workers() -> int:
+    """Потоков для параллельных секций; 0 — по очереди в основном потоке (тесты)"""
+    return getattr(settings, 'ASYNC_QUERY_WORKERS', 8)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=query_workers(), thread_name_prefix='dashboard-sql')
+        return _executor
+
+
+def shutdown_executor() -> None:
+    """Остановить пул (его соединения с БД закрываются вместе с потоками)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+def _run_section(section: Callable[[], Any]) -> Any:
+    # Потоки пула живут долго и держат своё соединение между запросами: как Django
+    # в начале запроса, закрываем устаревшее (CONN_MAX_AGE, разрыв со стороны БД),
+    # после ошибки — тоже
+    close_old_connections()
+    try:
+        return section()
+    except Exception:
+        close_old_connections()
+        raise
+
+
+async def gather_sections(sections: Sections) -> Dict[str, Any]:
+    """Выполнить независимые секции одновременно"""
+    if query_workers() <= 0:
+        return await sync_to_async(lambda: {name: section() for name, section in sections.items()})()
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(executor, _run_section, section) for section in sections.values()
+    ))
+    return dict(zip(sections, results))
+
+
+class Dashboard:
+    """Отчёт: секции (запросы) + сборка ответа"""
+
+    def sections(self) -> Sections:
+        raise NotImplementedError
+
+    def assemble(self, results: Dict[str, Any]) -> Dict:
+        raise NotImplementedError
+
+    def build(self) -> Dict:
+        return self.assemble({name: section() for name, section in self.sections().items()})
+
+    async def abuild(self) -> Dict:
+        return self.assemble(await gather_sections(self.sections()))
+
+
+def _rate(part: int, whole: int) -> float:
+    return round(part / whole * 100, 1) if whole > 0 else 0
+
+
+class ManagerDashboard(Dashboard):
+    """Дашборд руководителя (DashboardFullView)"""
+
+    PERIOD_DAYS = {'day': 0, 'week': 7}
+    STATUS_MAPPING = {
+        'no_answer': ('Не дозвон', '#94a3b8'),
+        'promise': ('Обещание', '#22c55e'),
+        'refuse': ('Отказ', '#ef4444'),
+        'callback': ('Перезвонить', '#f59e0b'),
+        'completed': ('Контакт', '#3b82f6'),
+    }
+    TIME_DISTRIBUTION = [
+        {'name': 'На звонке', 'value': 65, 'color': '#22c55e'},
+        {'name': 'Постобработка', 'value': 15, 'color': '#3b82f6'},
+        {'name': 'Ожидание', 'value': 12, 'color': '#f59e0b'},
+        {'name': 'Перерыв', 'value': 8, 'color': '#94a3b8'},
+    ]
+
+    def __init__(self, period: str = 'day'):
+        self.period = period
+        self.today = timezone.now().date()
+        self.start_date = self.today - timedelta(days=self.PERIOD_DAYS.get(period, 30))
+
+    def sections(self) -> Sections:
+        interventions = Intervention.objects.filter(datetime__gte=day_start(self.start_date))
+        calls = interventions.filter(PHONE)
+        return {
+            'operators': lambda: list(Operator.objects.order_by('id').values_list('id', 'full_name')),
+            'per_operator': lambda: {
+                row['operator_id']: row for row in interventions.values('operator_id').annotate(
+                    calls=Count('id', filter=PHONE),
+                    contacts=Count('id', filter=CONTACT),
+                    ptp_count=Count('id', filter=PROMISE),
+                    ptp_amount=Sum('promise_amount', filter=PROMISE),
+                    total_duration=Sum('duration', filter=PHONE),
+                ).order_by()
+            },
+            'daily': lambda: list(calls.annotate(date=TruncDate('datetime')).values('date').annotate(
+                calls=Count('id'),
+                contacts=Count('id', filter=Q(status__in=CONTACT_STATUSES)),
+                ptp=Count('id', filter=PROMISE),
+            ).order_by('date')),
+            'hourly': lambda: list(calls.annotate(hour=ExtractHour('datetime')).values('hour').annotate(
+                calls=Count('id'),
+                total_duration=Sum('duration'),
+                contacts=Count('id', filter=Q(status__in=CONTACT_STATUSES)),
+            ).order_by('hour')),
+            'results': lambda: list(calls.values('status').annotate(count=Count('id')).order_by()),
+        }
+
+    def assemble(self, results: Dict[str, Any]) -> Dict:
+        operator_stats = []
+        for operator_id, name in results['operators']:
+            row = results['per_operator'].get(operator_id, {})
+            total_calls = row.get('calls', 0)
+            contacts = row.get('contacts', 0)
+            total_duration = row.get('total_duration') or 0
+            total_time_min = total_duration // 60
+            operator_stats.append({
+                'id': operator_id,
+                'name': name,
+                'calls': total_calls,
+                'contacts': contacts,
+                'contactRate': _rate(contacts, total_calls),
+                'avgDuration': total_duration // total_calls if total_calls > 0 else 0,
+                'totalTime': total_time_min,
+                'breakTime': int(total_time_min * 0.12),  # ~12% на перерывы
+                'ptpCount': row.get('ptp_count', 0),
+                'ptpAmount': float(row.get('ptp_amount') or 0),
+            })
+
+        daily_data = [{
+            'date': day['date'].strftime('%d.%m') if day['date'] else '',
+            'calls': day['calls'],
+            'contacts': day['contacts'],
+            'ptp': day['ptp'],
+        } for day in results['daily']]
+
+        hourly_data = [{
+            'hour': f"{h['hour']:02d}:00",
+            'calls': h['calls'],
+            'avgDuration': h['total_duration'] // h['calls'] if h['calls'] > 0 else 0,
+            'contactRate': _rate(h['contacts'], h['calls']),
+        } for h in results['hourly']]
+
+        total_results = sum(r['count'] for r in results['results'])
+        call_results = []
+        for r in results['results']:
+            if r['status'] in self.STATUS_MAPPING:
+                name, color = self.STATUS_MAPPING[r['status']]
+                value = round(r['count'] / total_results * 100) if total_results > 0 else 0
+                call_results.append({'name': name, 'value': value, 'color': color})
+
+        totals = {
+            key: sum(op[key] for op in operator_stats)
+            for key in ('calls', 'contacts', 'totalTime', 'breakTime', 'ptpCount', 'ptpAmount')
+        }
+        totals['contactRate'] = _rate(totals['contacts'], totals['calls'])
+        totals['avgDuration'] = (sum(op['avgDuration'] for op in operator_stats) // len(operator_stats)
+                                 if operator_stats else 0)
+
+        return {
+            'period': self.period,
+            'startDate': self.start_date.isoformat(),
+            'endDate': self.today.isoformat(),
+            'totals': totals,
+            'operatorStats': operator_stats,
+            'dailyCalls': daily_data,
+            'hourlyCalls': hourly_data,
+            'callResults': call_results,
+            'timeDistribution': self.TIME_DISTRIBUTION,
+        }
+
+
+class SummaryDashboard(Dashboard):
+    """Сводка для дашборда (DashboardStatsView)"""
+
+    OPEN_ALERT_STATUSES = ['new', 'escalated']
+
+    def __init__(self):
+        self.today = timezone.now().date()
+        self.month_start = self.today.replace(day=1)
+
+    def sections(self) -> Sections:
+        month_interventions = Intervention.objects.filter(datetime__gte=day_start(self.month_start))
+        return {
+            'total_clients': Client.objects.count,
+            'total_credits': Credit.objects.count,
+            'overdue_credits': Credit.objects.filter(status='overdue').count,
+            'payments_this_month': lambda: Payment.objects.filter(
+                payment_date__gte=self.month_start).aggregate(total=Sum('amount'))['total'] or 0,
+            'interventions_today': Intervention.objects.filter(
+                datetime__gte=day_start(self.today), datetime__lt=day_start(self.today + timedelta(days=1))).count,
+            'channel_stats': lambda: list(month_interventions.values(channel=F('intervention_type'))
+                                          .annotate(count=Count('id')).order_by('-count')),
+            'result_stats': lambda: list(month_interventions.values(result=F('status'))
+                                         .annotate(count=Count('id')).order_by('-count')),
+            'active_alerts': ComplianceAlert.objects.filter(status__in=self.OPEN_ALERT_STATUSES).count,
+            'nba_stats': lambda: list(NextBestAction.objects.filter(created_at__gte=day_start(self.month_start))
+                                      .values('status').annotate(count=Count('id')).order_by()),
+        }
+
+    def assemble(self, results: Dict[str, Any]) -> Dict:
+        return {
+            'summary': {
+                'total_clients': results['total_clients'],
+                'total_credits': results['total_credits'],
+                'overdue_credits': results['overdue_credits'],
+                'payments_this_month': float(results['payments_this_month']),
+                'interventions_today': results['interventions_today'],
+                'active_compliance_alerts': results['active_alerts'],
+            },
+            'channel_stats': results['channel_stats'],
+            'result_stats': results['result_stats'],
+            'nba_stats': results['nba_stats'],
+        }
+
+
+class OperatorDashboard(Dashboard):
+    """Личная статистика оператора (OperatorStatsView)"""
+
+    PERIODS = {'today': 0, 'week': 7, 'month': 30}
+    TOP_PROMISES = 10
+
+    def __init__(self, operator: Operator):
+        self.operator = operator
+        self.today = timezone.now().date()
+
+    def sections(self) -> Sections:
+        interventions = Intervention.objects.filter(operator=self.operator)
+        month_ints = interventions.filter(datetime__gte=day_start(self.today - timedelta(days=30)))
+        tomorrow = day_start(self.today + timedelta(days=1))
+        sections = {
+            # today — только текущий день, week / month — всё начиная с даты (как datetime__date__gte)
+            f'stats_{name}': self._period_stats(interventions.filter(
+                datetime__gte=day_start(self.today - timedelta(days=days)),
+                **({'datetime__lt': tomorrow} if days == 0 else {}),
+            ))
+            for name, days in self.PERIODS.items()
+        }
+        sections.update({
+            'total_interventions': interventions.count,
+            'daily': lambda: list(month_ints.filter(PHONE).annotate(date=TruncDate('datetime')).values('date').annotate(
+                calls=Count('id'),
+                contacts=Count('id', filter=Q(status__in=CONTACT_STATUSES)),
+                promises=Count('id', filter=PROMISE),
+                promise_amount=Sum('promise_amount', filter=PROMISE),
+                total_duration=Sum('duration'),
+            ).order_by('date')),
+            'status_dist': lambda: list(month_ints.values('status').annotate(count=Count('id')).order_by('-count')),
+            'hourly': lambda: list(month_ints.filter(PHONE).annotate(hour=ExtractHour('datetime'))
+                                   .values('hour').annotate(calls=Count('id')).order_by('hour')),
+            'active_assignments': Assignment.objects.filter(operator=self.operator, overdue_days__gt=0).count,
+            'top_promises': lambda: list(
+                month_ints.filter(status='promise', promise_amount__gt=0)
+                .order_by('-promise_amount')[:self.TOP_PROMISES]
+                .values('id', 'client__full_name', 'promise_amount', 'promise_date', 'datetime')
+            ),
+        })
+        return sections
+
+    @staticmethod
+    def _period_stats(qs) -> Callable[[], Dict]:
+        """Все счётчики периода одним запросом"""
+        return lambda: qs.aggregate(
+            total=Count('id'),
+            calls=Count('id', filter=PHONE),
+            contacts=Count('id', filter=CONTACT),
+            no_answer=Count('id', filter=Q(status='no_answer')),
+            promises=Count('id', filter=PROMISE),
+            promise_amount=Sum('promise_amount', filter=PROMISE),
+            refusals=Count('id', filter=Q(status='refuse')),
+            completed=Count('id', filter=Q(status='completed')),
+            callbacks=Count('id', filter=Q(status='callback')),
+            total_duration=Sum('duration', filter=PHONE),
+        )
+
+    @staticmethod
+    def _format_stats(row: Dict) -> Dict:
+        calls, contacts, promises = row['calls'], row['contacts'], row['promises']
+        total_duration = row['total_duration'] or 0
+        return {
+            'total': row['total'],
+            'calls': calls,
+            'contacts': contacts,
+            'noAnswer': row['no_answer'],
+            'promises': promises,
+            'promiseAmount': float(row['promise_amount'] or 0),
+            'refusals': row['refusals'],
+            'completed': row['completed'],
+            'callbacks': row['callbacks'],
+            'totalDuration': total_duration,
+            'avgDuration': total_duration // calls if calls > 0 else 0,
+            'contactRate': _rate(contacts, calls),
+            'promiseRate': _rate(promises, contacts),
+        }
+
+    def assemble(self, results: Dict[str, Any]) -> Dict:
+        operator = self.operator
+        daily_data = [{
+            'date': day['date'].strftime('%d.%m') if day['date'] else '',
+            'dateFull': day['date'].isoformat() if day['date'] else '',
+            'calls': day['calls'],
+            'contacts': day['contacts'],
+            'promises': day['promises'],
+            'promiseAmount': float(day['promise_amount'] or 0),
+            'avgDuration': (day['total_duration'] or 0) // day['calls'] if day['calls'] > 0 else 0,
+        } for day in results['daily']]
+
+        top_promises = results['top_promises']
+        for p in top_promises:
+            p['promise_amount'] = float(p['promise_amount'])
+            p['datetime'] = p['datetime'].isoformat() if p['datetime'] else None
+            p['promise_date'] = p['promise_date'].isoformat() if p['promise_date'] else None
+
+        return {
+            'operator': {
+                'id': operator.id,
+                'name': operator.full_name,
+                'role': operator.role,
+                'specialization': operator.specialization,
+                'hireDate': operator.hire_date.isoformat() if operator.hire_date else None,
+                'status': operator.status,
+            },
+            **{name: self._format_stats(results[f'stats_{name}']) for name in self.PERIODS},
+            'allTime': {
+                'totalInterventions': results['total_interventions'],
+                'totalCollected': float(operator.total_collected),
+                'successRate': operator.success_rate,
+            },
+            'daily': daily_data,
+            'statusDistribution': results['status_dist'],
+            'hourly': [{'hour': f"{h['hour']:02d}:00", 'calls': h['calls']} for h in results['hourly']],
+            'activeAssignments': results['active_assignments'],
+            'topPromises': top_promises,
+        }
@@ -152,7 +152,7 @@ class DistributionService:
         - Risk segment from scoring (0-10 pts)
         """
         # Get overdue info from latest state
-        latest_state = credit.states.order_by('-state_date').first()
+        latest_state = credit.current_state
         overdue_amount = float(latest_state.overdue_principal) if latest_state else 0
         
         # Estimate days overdue
@@ -0,0 +1,186 @@
+"""
+Кэш рекомендаций Next Best Action по паре (клиент, кредит).
+
+Запись кэша — последняя рассчитанная рекомендация, отпечаток её входов
+(профиль, данные кредита, история контактов) и версия клиента на момент расчёта.
+Запись Intervention / Payment / ScoringResult / ClientBehaviorProfile увеличивает
+версию клиента (сигналы, bulk-пути — invalidate_clients), поэтому сброс — O(1)
+независимо от числа кредитов. Промахи пачки пересчитываются одним вызовом
+collect_nba_inputs + score_nba_batch; все ключи пачки читаются одним get_many.
+
+Версии и записи лежат в общем кэше (settings.SHARED_CACHE, Redis при REDIS_URL),
+поэтому сброс в одном воркере виден всем. Без общего кэша сброс действует только
+в своём процессе, и записи живут LOCAL_CACHE_TTL.
+
+Счётчики (попадания, промахи, время пересчёта, пересчёты с неизменными входами)
+хранятся в том же кэше — см. stats().
+
+Использование:
+    from collection_app.services.nba_cache import NBACache
+    nba = NBACache.get(client_id, credit_id)
+    queue = NBACache.get_many([(client_id, credit_id), ...])
+"""
+
+import hashlib
+import json
+import logging
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.utils import timezone
+
+from .shared_cache import shared_cache, ttl
+
+logger = logging.getLogger(__name__)
+
+Pair = Tuple[int, int]
+
+
+class NBACache:
+    """Кэш NBA с инвалидацией по событиям клиента"""
+
+    CACHE_PREFIX = 'nba'
+    # Рекомендованное время контакта стареет — TTL как страховка
+    CACHE_TTL = 900
+    # Кэш процесса (без REDIS_URL): сброс в другом воркере сюда не доходит
+    LOCAL_CACHE_TTL = 60
+    METRICS = ('hits', 'misses', 'batches', 'recompute_ms', 'unchanged')
+
+    @classmethod
+    def entry_key(cls, client_id: int, credit_id: int) -> str:
+        return f'{cls.CACHE_PREFIX}:{client_id}:{credit_id}'
+
+    @classmethod
+    def version_key(cls, client_id: int) -> str:
+        return f'{cls.CACHE_PREFIX}:v:{client_id}'
+
+    @classmethod
+    def metric_key(cls, name: str) -> str:
+        return f'{cls.CACHE_PREFIX}:metrics:{name}'
+
+    @staticmethod
+    def fingerprint(inputs) -> str:
+        """Отпечаток входов рекомендации (профиль, кредит, история)"""
+        payload = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    @classmethod
+    def get(cls, client_id: int, credit_id: int) -> Dict:
+        return cls.get_many([(client_id, credit_id)])[(client_id, credit_id)]
+
+    @classmethod
+    def get_many(cls, pairs: Iterable[Pair]) -> Dict[Pair, Dict]:
+        """
+        Рекомендации для пар (client_id, credit_id).
+        Значение: {'nba': ..., 'fingerprint': ..., 'computed_at': ..., 'cached': bool}
+        """
+        pairs = list(dict.fromkeys(pairs))
+        if not pairs:
+            return {}
+        client_ids = {client_id for client_id, _ in pairs}
+        stored = shared_cache().get_many(
+            [cls.entry_key(*pair) for pair in pairs] + [cls.version_key(cid) for cid in client_ids]
+        )
+        # Версии нет (первое обращение или вытеснена) — новая, все записи клиента устарели
+        missing = [cls.version_key(cid) for cid in client_ids if cls.version_key(cid) not in stored]
+        if missing:
+            for key in missing:
+                shared_cache().add(key, time.time_ns(), None)
+            stored.update(shared_cache().get_many(missing))
+
+        result, stale = {}, {}
+        for pair in pairs:
+            entry = stored.get(cls.entry_key(*pair))
+            version = stored.get(cls.version_key(pair[0]))
+            if entry and version is not None and entry['version'] == version:
+                result[pair] = dict(entry, cached=True)
+            else:
+                stale[pair] = (entry, version)
+
+        cls._bump('hits', len(result))
+        if stale:
+            cls._bump('misses', len(stale))
+            result.update(cls._recompute(stale))
+        return result
+
+    @classmethod
+    def _recompute(cls, stale: Dict[Pair, Tuple[Optional[Dict], int]]) -> Dict[Pair, Dict]:
+        from ..ml.next_best_action import collect_nba_inputs, score_nba_batch
+
+        started = time.perf_counter()
+        pairs = list(stale)
+        now = timezone.localtime()
+        inputs = collect_nba_inputs(pairs, today=now.date())
+        scored = score_nba_batch(pairs, inputs, now=now)
+
+        result, to_store, unchanged = {}, {}, 0
+        for pair, pair_inputs, nba in zip(pairs, inputs, scored):
+            previous, version = stale[pair]
+            fingerprint = cls.fingerprint(pair_inputs)
+            # Сброс был, а входы те же — признак лишней инвалидации
+            unchanged += bool(previous and previous['fingerprint'] == fingerprint)
+            entry = {
+                'nba': dict(nba, recommended_datetime=nba['recommended_datetime'].isoformat()),
+                'fingerprint': fingerprint,
+                'computed_at': now.isoformat(),
+                'version': version,
+            }
+            to_store[cls.entry_key(*pair)] = entry
+            result[pair] = dict(entry, cached=False)
+        shared_cache().set_many(to_store, ttl(cls.CACHE_TTL, cls.LOCAL_CACHE_TTL))
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        cls._bump('batches', 1)
+        cls._bump('recompute_ms', int(round(elapsed_ms)))
+        cls._bump('unchanged', unchanged)
+        logger.debug('NBA cache: recomputed %s pairs in %.1f ms', len(pairs), elapsed_ms)
+        return result
+
+    @classmethod
+    def invalidate(cls, client_id: Optional[int]) -> None:
+        """Сбросить рекомендации по всем кредитам клиента (новая версия)"""
+        if not client_id:
+            return
+        try:
+            shared_cache().incr(cls.version_key(client_id))
+        except ValueError:
+            pass  # версии нет — следующее чтение заведёт новую
+
+    @classmethod
+    def invalidate_clients(cls, client_ids: Iterable[int]) -> None:
+        for client_id in set(client_ids):
+            cls.invalidate(client_id)
+
+    @classmethod
+    def _bump(cls, name: str, delta: int) -> None:
+        if not delta:
+            return
+        key = cls.metric_key(name)
+        try:
+            shared_cache().incr(key, delta)
+        except ValueError:
+            if not shared_cache().add(key, delta, None):
+                shared_cache().incr(key, delta)
+
+    @classmethod
+    def stats(cls) -> Dict:
+        """Счётчики для мониторинга: доля попаданий и время пересчёта"""
+        values = shared_cache().get_many([cls.metric_key(name) for name in cls.METRICS])
+        hits, misses, batches, recompute_ms, unchanged = (
+            values.get(cls.metric_key(name), 0) for name in cls.METRICS
+        )
+        requests = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / requests, 3) if requests else None,
+            'recompute_batches': batches,
+            'recompute_ms_total': recompute_ms,
+            'avg_recompute_ms_per_batch': round(recompute_ms / batches, 1) if batches else None,
+            'avg_recompute_ms_per_pair': round(recompute_ms / misses, 2) if misses else None,
+            'unchanged_recomputes': unchanged,
+        }
+
+    @classmethod
+    def reset_stats(cls) -> None:
+        shared_cache().delete_many([cls.metric_key(name) for name in cls.METRICS])
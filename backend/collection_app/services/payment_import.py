@@ -0,0 +1,406 @@
+"""
+Загрузка банковских файлов платежей (CSV / XML-выписка).
+
+Конвейер:
+1. SHA-256 файла — повторная загрузка того же файла ничего не меняет.
+2. Потоковый разбор порциями по CHUNK_SIZE, сопоставление с кредитами по номеру договора
+   (номер договора = Credit.id), bulk_create платежей.
+3. Set-based пересчёт: новое CreditState по каждому затронутому кредиту,
+   обещания (Promise) и агрегаты кейсов (CollectionCase).
+
+Всё, кроме записи PaymentImport, выполняется в одной транзакции: при ошибке
+файл можно загрузить повторно без дублей. Загрузка, оставшаяся в статусе
+processing дольше PROCESSING_TIMEOUT (процесс убит), считается брошенной
+и тоже перезапускается.
+
+Использование:
+    from collection_app.services.payment_import import PaymentImportService
+    with open('payments_2025-01-15.csv', 'rb') as f:
+        result = PaymentImportService.import_file(f, file_name='payments_2025-01-15.csv')
+    print(result.rows_imported, result.rows_per_second)
+"""
+
+import csv
+import hashlib
+import io
+import logging
+import time
+import xml.etree.ElementTree as ET
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+
+from ..models import (
+    CollectionCase, Credit, CreditState, Payment, PaymentImport, Promise,
+)
+from .promise_matcher import PromiseMatcher
+
+logger = logging.getLogger(__name__)
+
+
+# Синонимы колонок / XML-тегов (в нижнем регистре)
+FIELD_ALIASES = {
+    'contract_id': ('contract_id', 'contract', 'contract_number', 'contractid', 'credit_id', 'credit', 'договор'),
+    'payment_date': ('payment_date', 'date', 'value_date', 'valuedate', 'paymentdate', 'дата'),
+    'amount': ('amount', 'sum', 'amt', 'сумма'),
+    'payment_type': ('payment_type', 'type', 'paymenttype'),
+}
+XML_RECORD_TAGS = {'payment', 'transaction', 'entry'}
+
+
+class PaymentRowError(ValueError):
+    """Строка файла не разобрана"""
+
+
+class PaymentImportService:
+    """Загрузка файлов платежей"""
+
+    CHUNK_SIZE = 10000
+    BATCH_SIZE = 2000
+    MAX_ERRORS = 50
+    # Секунд; после — загрузка в processing без блокировки строки считается брошенной
+    PROCESSING_TIMEOUT = 2 * 3600
+
+    # ------------------------------------------------------------------
+    # Разбор файлов
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def file_hash(fileobj) -> str:
+        """SHA-256 файла (поток читается блоками и перематывается в начало)"""
+        digest = hashlib.sha256()
+        for block in iter(lambda: fileobj.read(1024 * 1024), b''):
+            digest.update(block if isinstance(block, bytes) else block.encode('utf-8'))
+        fileobj.seek(0)
+        return digest.hexdigest()
+
+    @staticmethod
+    def detect_format(file_name: str) -> str:
+        return 'xml' if file_name.lower().endswith('.xml') else 'csv'
+
+    @staticmethod
+    def _canonical(raw: Dict[str, str]) -> Dict[str, str]:
+        lowered = {(k or '').strip().lower(): v for k, v in raw.items()}
+        record = {}
+        for name, aliases in FIELD_ALIASES.items():
+            for alias in aliases:
+                if lowered.get(alias) not in (None, ''):
+                    record[name] = lowered[alias]
+                    break
+        return record
+
+    @staticmethod
+    def _parse_date(value: str) -> date:
+        value = value.strip()[:10]
+        for fmt in ('%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y'):
+            try:
+                return datetime.strptime(value, fmt).date()
+            except ValueError:
+                continue
+        raise PaymentRowError(f'Некорректная дата: {value}')
+
+    @classmethod
+    def parse_record(cls, raw: Dict[str, str]) -> Tuple[int, date, Decimal, str]:
+        """Словарь строки -> (credit_id, payment_date, amount, payment_type)"""
+        record = cls._canonical(raw)
+        missing = {'contract_id', 'payment_date', 'amount'} - set(record)
+        if missing:
+            raise PaymentRowError(f'Нет полей: {", ".join(sorted(missing))}')
+        try:
+            credit_id = int(str(record['contract_id']).strip())
+        except ValueError:
+            raise PaymentRowError(f'Некорректный номер договора: {record["contract_id"]}')
+        try:
+            amount = Decimal(
+                str(record['amount']).replace('\xa0', '').replace(' ', '').replace(',', '.')
+            ).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise PaymentRowError(f'Некорректная сумма: {record["amount"]}')
+        if amount <= 0:
+            raise PaymentRowError(f'Сумма должна быть положительной: {amount}')
+        payment_type = record.get('payment_type', 'regular')
+        if payment_type not in dict(Payment.TYPE_CHOICES):
+            payment_type = 'regular'
+        return credit_id, cls._parse_date(record['payment_date']), amount, payment_type
+
+    @staticmethod
+    def iter_csv(fileobj) -> Iterator[Dict[str, str]]:
+        """Строки CSV; разделитель ';' или ',' определяется по заголовку"""
+        wrapped = not isinstance(fileobj, io.TextIOBase)
+        text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='') if wrapped else fileobj
+        try:
+            header = text.readline()
+            delimiter = ';' if header.count(';') > header.count(',') else ','
+            fieldnames = next(csv.reader([header], delimiter=delimiter))
+            yield from csv.DictReader(text, fieldnames=fieldnames, delimiter=delimiter)
+        finally:
+            if wrapped:
+                text.detach()  # не закрывать исходный файл
+
+    @staticmethod
+    def iter_xml(fileobj) -> Iterator[Dict[str, str]]:
+        """
+        Записи XML-выписки: элементы <Payment>/<Transaction>/<Entry> (без учёта namespace),
+        поля — атрибуты или дочерние теги. Разбор потоковый (iterparse).
+        """
+        for _, elem in ET.iterparse(fileobj, events=('end',)):
+            tag = elem.tag.rsplit('}', 1)[-1].lower()
+            if tag not in XML_RECORD_TAGS:
+                continue
+            record = dict(elem.attrib)
+            for child in elem:
+                record[child.tag.rsplit('}', 1)[-1]] = (child.text or '').strip()
+            elem.clear()
+            yield record
+
+    # ------------------------------------------------------------------
+    # Загрузка
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def import_file(cls, fileobj, file_name: str = '', file_format: Optional[str] = None,
+                    today: Optional[date] = None, chunk_size: Optional[int] = None) -> PaymentImport:
+        """
+        Загрузить файл. Возвращает PaymentImport; для уже загруженного файла —
+        существующую запись с атрибутом duplicate=True.
+        """
+        today = today or timezone.now().date()
+        file_format = file_format or cls.detect_format(file_name)
+        file_hash = cls.file_hash(fileobj)
+
+        existing = PaymentImport.objects.filter(file_hash=file_hash).first()
+        if existing and not cls._claim_retry(existing):
+            existing.duplicate = True
+            return existing
+        try:
+            if existing:  # предыдущая попытка упала или брошена — перезапуск
+                job = existing
+                job.refresh_from_db()
+            else:
+                job = PaymentImport.objects.create(
+                    file_hash=file_hash, file_name=file_name[:255], file_format=file_format,
+                )
+        except IntegrityError:
+            job = PaymentImport.objects.get(file_hash=file_hash)
+            job.duplicate = True
+            return job
+        job.duplicate = False
+
+        started = time.monotonic()
+        records = cls.iter_xml(fileobj) if file_format == 'xml' else cls.iter_csv(fileobj)
+        try:
+            with transaction.atomic():
+                # Строка загрузки заблокирована до коммита: пока загрузка идёт (сколько
+                # бы ни длилась), _claim_retry её не заберёт
+                PaymentImport.objects.select_for_update().only('pk').get(pk=job.pk)
+                affected = cls._load_payments(job, records, chunk_size or cls.CHUNK_SIZE)
+                job.credits_updated = cls.apply_payments_to_states(affected, today)
+                job.promises_settled = cls.settle_promises(affected.keys(), today)
+                cls.refresh_cases(affected.keys())
+            job.status = 'completed'
+            # bulk-операции не шлют сигналы — сбрасываем кэш Client 360 вручную
+            from .behavior_refresh import BehaviorProfileRefresher
+            from .client_profile import Client360Loader
+            from .nba_cache import NBACache
+            client_ids = set(Credit.objects.filter(pk__in=list(affected)).values_list('client_id', flat=True))
+            for client_id in client_ids:
+                Client360Loader.invalidate(client_id)
+            NBACache.invalidate_clients(client_ids)
+            BehaviorProfileRefresher.mark_dirty(client_ids, reason='payment')
+        except Exception as exc:
+            logger.exception('Payment import %s failed', file_name or file_hash)
+            job.status = 'failed'
+            job.rows_imported = 0
+            job.errors = (job.errors + [str(exc)])[-cls.MAX_ERRORS:]
+
+        job.finished_at = timezone.now()
+        job.duration_seconds = round(time.monotonic() - started, 3)
+        job.save()
+        logger.info(
+            'Payment import %s: %s rows, %s imported, %.0f rows/sec',
+            file_name or file_hash, job.rows_total, job.rows_imported, job.rows_per_second,
+        )
+        return job
+
+    @classmethod
+    def _claim_retry(cls, job: PaymentImport) -> bool:
+        """
+        Забрать упавшую или брошенную загрузку на перезапуск (условный UPDATE:
+        из параллельных повторных загрузок файла перезапускает только одна).
+        PostgreSQL: строку, заблокированную идущей загрузкой, SKIP LOCKED пропускает
+        независимо от PROCESSING_TIMEOUT; блокировка снимается с коммитом или
+        с обрывом соединения упавшего процесса.
+        """
+        now = timezone.now()
+        stale = now - timedelta(seconds=cls.PROCESSING_TIMEOUT)
+        claimable = PaymentImport.objects.filter(pk=job.pk).filter(
+            Q(status='failed') | Q(status='processing', started_at__lt=stale)
+        )
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                if not list(claimable.select_for_update(skip_locked=True).values_list('pk', flat=True)):
+                    return False
+            return bool(claimable.update(
+                status='processing', started_at=now, finished_at=None, errors=[],
+                rows_total=0, rows_imported=0, rows_unmatched=0, rows_invalid=0,
+                credits_updated=0, promises_settled=0,
+            ))
+
+    @classmethod
+    def _load_payments(cls, job: PaymentImport, records: Iterable[Dict[str, str]],
+                       chunk_size: int) -> Dict[int, Tuple[Decimal, date]]:
+        """Порционная вставка платежей. Возвращает {credit_id: (сумма, последняя дата)}"""
+        affected: Dict[int, Tuple[Decimal, date]] = {}
+        records = iter(records)
+        row_no = 0
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            parsed = []
+            for raw in chunk:
+                row_no += 1
+                try:
+                    parsed.append(cls.parse_record(raw))
+                except PaymentRowError as exc:
+                    job.rows_invalid += 1
+                    if len(job.errors) < cls.MAX_ERRORS:
+                        job.errors.append(f'Строка {row_no}: {exc}')
+            job.rows_total += len(chunk)
+
+            known = set(
+                Credit.objects.filter(pk__in={p[0] for p in parsed}).values_list('id', flat=True)
+            )
+            payments = []
+            for credit_id, payment_date, amount, payment_type in parsed:
+                if credit_id not in known:
+                    job.rows_unmatched += 1
+                    continue
+                payments.append(Payment(
+                    credit_id=credit_id, payment_date=payment_date, amount=amount,
+                    payment_type=payment_type, actuality_date=payment_date,
+                ))
+                total, last = affected.get(credit_id, (Decimal('0'), payment_date))
+                affected[credit_id] = (total + amount, max(last, payment_date))
+            Payment.objects.bulk_create(payments, batch_size=cls.BATCH_SIZE)
+            job.rows_imported += len(payments)
+        return affected
+
+    # ------------------------------------------------------------------
+    # Пересчёт состояний, обещаний, кейсов
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def apply_payments_to_states(cls, affected: Dict[int, Tuple[Decimal, date]], today: date) -> int:
+        """
+        Новое состояние по каждому кредиту: оплата гасит штрафы, просроченные проценты,
+        просроченный основной долг, остаток — основной долг. Возвращает число кредитов.
+        """
+        if not affected:
+            return 0
+        new_states, changed_states, changed_credits = [], [], []
+        ids = list(affected)
+        for offset in range(0, len(ids), cls.BATCH_SIZE):
+            credits = Credit.objects.filter(
+                pk__in=ids[offset:offset + cls.BATCH_SIZE], current_state__isnull=False,
+            ).select_related('current_state')
+            for credit in credits:
+                paid, last_date = affected[credit.pk]
+                state = credit.current_state
+                state_date = max(last_date, state.state_date)
+                target = state if state_date == state.state_date else CreditState(
+                    credit_id=credit.pk, client_id=state.client_id or credit.client_id,
+                    state_date=state_date, planned_payment_date=state.planned_payment_date,
+                    principal_debt=state.principal_debt, overdue_principal=state.overdue_principal,
+                    interest=state.interest, overdue_interest=state.overdue_interest,
+                    penalties=state.penalties, overdue_start_date=state.overdue_start_date,
+                    overdue_days=state.overdue_days, overdue_close_date=state.overdue_close_date,
+                )
+                remaining = paid
+                for attr in ('penalties', 'overdue_interest', 'overdue_principal'):
+                    part = min(remaining, getattr(target, attr))
+                    setattr(target, attr, getattr(target, attr) - part)
+                    remaining -= part
+                    if attr == 'overdue_principal':
+                        target.principal_debt -= part
+                target.principal_debt = max(Decimal('0'), target.principal_debt - remaining)
+
+                if target.overdue_principal + target.overdue_interest <= 0:
+                    if target.overdue_days:
+                        target.overdue_close_date = last_date
+                    target.overdue_days = 0
+                elif target.overdue_start_date:
+                    target.overdue_days = (state_date - target.overdue_start_date).days
+                else:
+                    target.overdue_days = state.overdue_days + (state_date - state.state_date).days
+
+                (changed_states if target.pk else new_states).append(target)
+
+                status = credit.status
+                if target.principal_debt <= 0:
+                    status = 'closed'
+                elif target.overdue_days == 0 and credit.status in ('overdue', 'default'):
+                    status = 'active'
+                if status != credit.status:
+                    credit.status = status
+                    changed_credits.append(credit)
+
+        CreditState.objects.bulk_create(new_states, batch_size=cls.BATCH_SIZE)
+        CreditState.objects.bulk_update(
+            changed_states,
+            ['principal_debt', 'overdue_principal', 'overdue_interest', 'penalties',
+             'overdue_days', 'overdue_close_date'],
+            batch_size=cls.BATCH_SIZE,
+        )
+        Credit.objects.bulk_update(changed_credits, ['status'], batch_size=cls.BATCH_SIZE)
+        Credit.refresh_current_states(ids)
+        return len(new_states) + len(changed_states)
+
+    @classmethod
+    def settle_promises(cls, credit_ids: Iterable[int], today: date) -> int:
+        """
+        Проверка ожидающих обещаний по кейсам затронутых кредитов (PromiseMatcher).
+        До истечения срока обещание закрывается только как выполненное.
+        Возвращает число закрытых.
+        """
+        promises = list(
+            Promise.objects.filter(status='pending', case__credits__in=list(credit_ids)).distinct()
+        )
+        stats = PromiseMatcher.match_promises(promises, today=today, final=False, escalate=False)
+        return sum(count for status, count in stats.items() if status != 'pending')
+
+    @classmethod
+    def refresh_cases(cls, credit_ids: Iterable[int]) -> int:
+        """Пересчёт долга/просрочки активных кейсов по текущим состояниям кредитов"""
+        credit_ids = list(credit_ids)
+        case_ids = set(
+            CollectionCase.credits.through.objects.filter(credit_id__in=credit_ids)
+            .values_list('collectioncase_id', flat=True)
+        )
+        cases = {c.pk: c for c in CollectionCase.objects.filter(pk__in=case_ids, status='active')}
+        if not cases:
+            return 0
+        totals = (
+            Credit.objects.filter(collection_cases__in=list(cases))
+            .values('collection_cases')
+            .annotate(
+                debt=Sum('current_state__principal_debt'),
+                overdue_principal=Sum('current_state__overdue_principal'),
+                overdue_interest=Sum('current_state__overdue_interest'),
+                dpd=Max('current_overdue_days'),
+            )
+        )
+        for row in totals:
+            case = cases[row['collection_cases']]
+            case.total_debt = row['debt'] or Decimal('0')
+            case.overdue_amount = (row['overdue_principal'] or Decimal('0')) + (row['overdue_interest'] or Decimal('0'))
+            case.overdue_days = row['dpd'] or 0
+        CollectionCase.objects.bulk_update(
+            cases.values(), ['total_debt', 'overdue_amount', 'overdue_days'], batch_size=cls.BATCH_SIZE,
+        )
+        return len(cases)
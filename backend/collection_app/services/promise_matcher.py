@@ -0,0 +1,196 @@
+"""
+Пакетная проверка обещаний (Promise) по платежам.
+
+Обещания обрабатываются порциями: на порцию — один запрос обещаний, один — кредитов
+кейсов и один — платежей в окнах обещаний. Платежи кейса сортируются по дате,
+по ним строятся префиксные суммы; окно обещания [created_at, promised_date + GRACE_DAYS]
+находится двоичным поиском, поэтому частичные и множественные платежи учитываются
+без вложенных циклов. Статусы, счётчики нарушенных обещаний кейсов и поведенческие
+признаки клиентов (promises_kept_ratio, avg_promise_delay) пишутся через bulk_update.
+
+Использование:
+    from collection_app.services.promise_matcher import PromiseMatcher
+    stats = PromiseMatcher.check_due_promises()          # ежедневная проверка
+    PromiseMatcher.match_promises([promise])             # одно обещание
+"""
+
+import logging
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ..models import ClientBehaviorProfile, CollectionCase, Payment, Promise
+from .client_profile import Client360Loader
+from .nba_cache import NBACache
+
+logger = logging.getLogger(__name__)
+
+
+class PromiseMatcher:
+    """Сопоставление обещаний с платежами"""
+
+    GRACE_DAYS = 3
+    CHUNK_SIZE = 5000
+    BATCH_SIZE = 2000
+
+    @classmethod
+    def check_due_promises(cls, today: Optional[date] = None,
+                           chunk_size: Optional[int] = None) -> Dict[str, int]:
+        """Проверка всех ожидающих обещаний с истёкшим сроком (WorkflowEngine.check_promises)"""
+        today = today or date.today()
+        chunk_size = chunk_size or cls.CHUNK_SIZE
+        stats = {'kept': 0, 'broken': 0, 'partial': 0}
+        due = Promise.objects.filter(status='pending', promised_date__lt=today).order_by('id')
+
+        last_id = 0
+        while True:
+            chunk = list(due.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            for status, count in cls.match_promises(chunk, today=today).items():
+                stats[status] = stats.get(status, 0) + count
+        return stats
+
+    @classmethod
+    def match_promises(cls, promises: List[Promise], today: Optional[date] = None,
+                       final: bool = True, escalate: bool = True) -> Dict[str, int]:
+        """
+        Сопоставить обещания с платежами и записать результат.
+
+        Args:
+            promises: Обещания (одной порции)
+            today: Дата проверки
+            final: True — вынести решение (kept/partial/broken) сразу;
+                   False — до конца окна закрывать только выполненные (загрузка платежей)
+            escalate: Проверить правила эскалации кейсов с нарушенными обещаниями
+
+        Returns:
+            Dict: {статус: число обещаний}
+        """
+        today = today or date.today()
+        if not promises:
+            return {}
+
+        case_credits = defaultdict(set)
+        for case_id, credit_id in CollectionCase.credits.through.objects.filter(
+            collectioncase_id__in={p.case_id for p in promises}
+        ).values_list('collectioncase_id', 'credit_id'):
+            case_credits[case_id].add(credit_id)
+
+        windows = {p.pk: (p.created_at.date(), p.promised_date + timedelta(days=cls.GRACE_DAYS)) for p in promises}
+        payments_by_credit = defaultdict(list)
+        credit_ids = {c for ids in case_credits.values() for c in ids}
+        if credit_ids:
+            rows = Payment.objects.filter(
+                credit_id__in=credit_ids,
+                payment_date__range=(min(w[0] for w in windows.values()), max(w[1] for w in windows.values())),
+            ).values_list('credit_id', 'payment_date', 'amount')
+            for credit_id, payment_date, amount in rows:
+                payments_by_credit[credit_id].append((payment_date, amount))
+
+        # Платежи кейса: отсортированные даты + префиксные суммы
+        timelines = {}
+        for case_id, ids in case_credits.items():
+            payments = sorted(p for credit_id in ids for p in payments_by_credit.get(credit_id, ()))
+            dates = [d for d, _ in payments]
+            sums = [Decimal('0')] + list(accumulate(a for _, a in payments))
+            timelines[case_id] = (dates, sums)
+
+        now = timezone.now()
+        stats: Dict[str, int] = defaultdict(int)
+        broken_by_case: Dict[int, int] = defaultdict(int)
+        for promise in promises:
+            start, deadline = windows[promise.pk]
+            dates, sums = timelines.get(promise.case_id, ([], [Decimal('0')]))
+            lo, hi = bisect_left(dates, start), bisect_right(dates, deadline)
+            total_paid = sums[hi] - sums[lo]
+
+            promise.actual_amount = total_paid
+            if hi > lo:
+                promise.actual_date = dates[hi - 1]
+            if total_paid >= promise.promised_amount:
+                promise.status = 'kept'
+            elif final or deadline < today:
+                promise.status = 'partial' if total_paid > 0 else 'broken'
+            if promise.status != 'pending':
+                promise.verified_at = now
+            if promise.status == 'broken':
+                broken_by_case[promise.case_id] += 1
+            stats[promise.status] += 1
+
+        with transaction.atomic():
+            Promise.objects.bulk_update(
+                promises, ['status', 'actual_amount', 'actual_date', 'verified_at'], batch_size=cls.BATCH_SIZE,
+            )
+            # Атомарное приращение (F), по запросу на каждую величину: параллельный
+            # запуск (планировщик и загрузка платежей) не теряет приращения
+            cases_by_delta: Dict[int, List[int]] = defaultdict(list)
+            for case_id, delta in broken_by_case.items():
+                cases_by_delta[delta].append(case_id)
+            for delta, case_ids in cases_by_delta.items():
+                CollectionCase.objects.filter(pk__in=case_ids).update(broken_promises=F('broken_promises') + delta)
+            client_ids = set(CollectionCase.objects.filter(
+                pk__in={p.case_id for p in promises if p.status != 'pending'}
+            ).values_list('client_id', flat=True))
+            cls.refresh_behavior_inputs(client_ids)
+            # bulk_update не шлёт сигналы — отметку к пересчёту профиля ставим сами
+            from .behavior_refresh import BehaviorProfileRefresher
+            BehaviorProfileRefresher.mark_dirty(client_ids, reason='promise')
+
+        if escalate and broken_by_case:
+            from .collection_service import CollectionService
+            for case in CollectionCase.objects.filter(pk__in=broken_by_case):
+                CollectionService._check_escalation_rules(case)
+
+        return dict(stats)
+
+    @classmethod
+    def promise_stats(cls, client_ids: Iterable[int]) -> Dict[int, Tuple[float, float]]:
+        """
+        Признаки психотипирования по истории обещаний клиентов:
+        {client_id: (promises_kept_ratio, avg_promise_delay)} — доля выполненных
+        среди проверенных и средняя задержка фактической оплаты, дней.
+        """
+        client_ids = set(client_ids)
+        if not client_ids:
+            return {}
+        kept, decided, delays = defaultdict(int), defaultdict(int), defaultdict(list)
+        rows = Promise.objects.filter(
+            case__client_id__in=client_ids, status__in=['kept', 'partial', 'broken'],
+        ).values_list('case__client_id', 'status', 'promised_date', 'actual_date')
+        for client_id, status, promised_date, actual_date in rows:
+            decided[client_id] += 1
+            kept[client_id] += status == 'kept'
+            if actual_date:
+                delays[client_id].append(max((actual_date - promised_date).days, 0))
+        return {
+            cid: (
+                round(kept[cid] / decided[cid], 3),
+                round(sum(delays[cid]) / len(delays[cid]), 1) if delays[cid] else 0,
+            )
+            for cid in decided
+        }
+
+    @classmethod
+    def refresh_behavior_inputs(cls, client_ids: Iterable[int]) -> int:
+        """Записать promise_stats в существующие профили клиентов"""
+        stats = cls.promise_stats(client_ids)
+        profiles = list(ClientBehaviorProfile.objects.filter(client_id__in=stats))
+        for profile in profiles:
+            profile.promises_kept_ratio, profile.avg_promise_delay = stats[profile.client_id]
+        ClientBehaviorProfile.objects.bulk_update(
+            profiles, ['promises_kept_ratio', 'avg_promise_delay'], batch_size=cls.BATCH_SIZE,
+        )
+        # bulk_update не шлёт сигналы — кэш Client 360 сбрасываем сами
+        for profile in profiles:
+            Client360Loader.invalidate(profile.client_id)
+        NBACache.invalidate_clients(profile.client_id for profile in profiles)
+        return len(profiles)
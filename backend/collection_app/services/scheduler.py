@@ -0,0 +1,299 @@
+"""
+Встроенный планировщик периодических задач (без Celery/Redis).
+
+- Расписания в формате cron (минута час день месяц день_недели), время — TIME_ZONE.
+- Лидерство: задачи запускает только владелец аренды SchedulerLease,
+  поэтому можно держать несколько экземпляров run_scheduler (горячий резерв).
+  На время задачи аренда продлевается до её max_runtime_minutes.
+- Наложение: задача не стартует, пока running_since не сброшен предыдущим запуском.
+- История: каждый запуск пишется в JobRun (длительность, число строк, ошибка).
+
+Использование:
+    from collection_app.services.scheduler import PeriodicScheduler
+    PeriodicScheduler.ensure_default_jobs()
+    PeriodicScheduler.tick(owner='host-1')
+"""
+
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from io import StringIO
+from typing import Callable, Dict, List, Optional
+
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import PeriodicJob, JobRun, SchedulerLease
+
+logger = logging.getLogger(__name__)
+
+
+class CronSchedule:
+    """Разбор cron-выражения и расчёт следующего срабатывания"""
+
+    FIELDS = [  # (min, max)
+        (0, 59),   # минута
+        (0, 23),   # час
+        (1, 31),   # день месяца
+        (1, 12),   # месяц
+        (0, 6),    # день недели (0 — воскресенье, 7 тоже воскресенье)
+    ]
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f'Ожидается 5 полей cron: {expression!r}')
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse_field(part, low, high) for part, (low, high) in zip(parts, self.FIELDS)
+        )
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+        # Как в cron: если ограничены и день месяца, и день недели — достаточно любого
+        self.dom_restricted = parts[2] != '*'
+        self.dow_restricted = parts[4] != '*'
+
+    @staticmethod
+    def _parse_field(part: str, low: int, high: int) -> set:
+        values = set()
+        for item in part.split(','):
+            step = 1
+            if '/' in item:
+                item, step_text = item.split('/', 1)
+                step = int(step_text)
+                if step <= 0:
+                    raise ValueError(f'Неверный шаг: {part!r}')
+            if item == '*':
+                start, end = low, high
+            elif '-' in item:
+                start, end = (int(x) for x in item.split('-', 1))
+            else:
+                start = int(item)
+                end = high if step > 1 else start
+            upper = 7 if high == 6 else high
+            if start < low or end > upper or start > end:
+                raise ValueError(f'Значение вне диапазона: {part!r}')
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        dom = moment.day in self.days
+        dow = (moment.isoweekday() % 7) in self.weekdays
+        if self.dom_restricted and self.dow_restricted:
+            return dom or dow
+        return dom and dow
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Ближайшее срабатывание строго после moment (aware datetime)"""
+        local = timezone.localtime(moment).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = local + timedelta(days=366 * 5)
+        while local < limit:
+            if local.month not in self.months:
+                year, month = (local.year + 1, 1) if local.month == 12 else (local.year, local.month + 1)
+                local = local.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(local):
+                local = (local + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if local.hour not in self.hours:
+                local = (local + timedelta(hours=1)).replace(minute=0)
+                continue
+            if local.minute not in self.minutes:
+                local += timedelta(minutes=1)
+                continue
+            return timezone.localtime(local)
+        raise ValueError(f'Расписание никогда не срабатывает: {self.expression!r}')
+
+
+# ---------------------------------------------------------------------
+# Задачи: функция(params) -> число обработанных строк (или None)
+# ---------------------------------------------------------------------
+
+JOB_TASKS: Dict[str, Callable[[Dict], Optional[int]]] = {}
+
+
+def register_task(name: str):
+    """Декоратор регистрации задачи планировщика"""
+    def decorator(func):
+        JOB_TASKS[name] = func
+        return func
+    return decorator
+
+
+@register_task('score_all_credits')
+def _score_all_credits(params: Dict) -> Optional[int]:
+    from ..models import ScoringResult
+    before = ScoringResult.objects.count()
+    call_command('score_all_credits', stdout=StringIO(), **params)
+    return ScoringResult.objects.count() - before
+
+
+@register_task('check_promises')
+def _check_promises(params: Dict) -> Optional[int]:
+    from .workflow_service import WorkflowEngine
+    return sum(WorkflowEngine.check_promises().values())
+
+
+@register_task('pre_collection_alerts')
+def _pre_collection_alerts(params: Dict) -> Optional[int]:
+    from .workflow_service import WorkflowEngine
+    return WorkflowEngine.create_pre_collection_alerts()
+
+
+@register_task('scheduled_actions')
+def _scheduled_actions(params: Dict) -> Optional[int]:
+    from .workflow_service import WorkflowEngine
+    stats = WorkflowEngine.process_scheduled_actions(**params)
+    return stats['executed'] + stats['failed']
+
+
+@register_task('workflow_rules')
+def _workflow_rules(params: Dict) -> Optional[int]:
+    from .workflow_service import WorkflowEngine
+    return WorkflowEngine.run_rules(**params)['cases']
+
+
+@register_task('psychotyping')
+def _psychotyping(params: Dict) -> Optional[int]:
+    from ..ml.psychotyping import update_client_profiles
+    return update_client_profiles(**params)
+
+
+@register_task('behavior_refresh')
+def _behavior_refresh(params: Dict) -> Optional[int]:
+    from .behavior_refresh import BehaviorProfileRefresher
+    return BehaviorProfileRefresher.refresh_dirty(**params)['clients']
+
+
+@register_task('nba_prewarm')
+def _nba_prewarm(params: Dict) -> Optional[int]:
+    from ..ml.next_best_action import operator_queue_pairs, save_nba_batch
+    params = dict(params)
+    return len(save_nba_batch(operator_queue_pairs(params.pop('operators', None)), **params))
+
+
+@register_task('credit_state_rollup')
+def _credit_state_rollup(params: Dict) -> Optional[int]:
+    from ..models import Credit
+    return Credit.refresh_current_states()
+
+
+class PeriodicScheduler:
+    """Запуск периодических задач из таблицы PeriodicJob"""
+
+    LEASE_NAME = 'scheduler'
+    # Секунд; лидер продлевает аренду на каждом тике. На время задачи аренда берётся
+    # на max_runtime_minutes задачи: задача выполняется синхронно и тик не продлевает её
+    LEASE_TTL = 120
+
+    # Набор по умолчанию: тяжёлые задачи разнесены по ночному окну
+    DEFAULT_JOBS = [
+        ('Ночной скоринг', 'score_all_credits', '0 1 * * *', {}),
+        ('Пересчёт текущих состояний кредитов', 'credit_state_rollup', '30 0 * * *', {}),
+        ('Проверка обещаний', 'check_promises', '0 3 * * *', {}),
+        ('Правила workflow', 'workflow_rules', '30 3 * * *', {}),
+        ('Pre-collection алерты', 'pre_collection_alerts', '0 4 * * *', {}),
+        ('Психотипирование клиентов', 'psychotyping', '0 2 * * 0', {}),
+        ('Запланированные действия', 'scheduled_actions', '*/5 * * * *', {'workers': 4}),
+        ('Пересчёт изменённых профилей', 'behavior_refresh', '*/10 * * * *', {}),
+        ('Прогрев NBA по очередям', 'nba_prewarm', '30 7 * * 1-5', {}),
+    ]
+
+    @classmethod
+    def default_owner(cls) -> str:
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    @classmethod
+    def ensure_default_jobs(cls) -> int:
+        """Создать задачи по умолчанию, которых ещё нет. Возвращает число созданных."""
+        created = 0
+        for name, task, schedule, params in cls.DEFAULT_JOBS:
+            _, is_new = PeriodicJob.objects.get_or_create(
+                name=name,
+                defaults={
+                    'task': task, 'schedule': schedule, 'params': params,
+                    'next_run_at': CronSchedule(schedule).next_after(timezone.now()),
+                },
+            )
+            created += is_new
+        return created
+
+    @classmethod
+    def acquire_lease(cls, owner: str, ttl: Optional[int] = None) -> bool:
+        """Взять или продлить аренду лидерства (условный UPDATE — атомарно на любой БД)"""
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=ttl or cls.LEASE_TTL)
+        updated = SchedulerLease.objects.filter(
+            Q(owner=owner) | Q(expires_at__lt=now), name=cls.LEASE_NAME,
+        ).update(owner=owner, expires_at=expires_at)
+        if updated:
+            return True
+        try:
+            with transaction.atomic():
+                SchedulerLease.objects.create(name=cls.LEASE_NAME, owner=owner, expires_at=expires_at)
+            return True
+        except IntegrityError:
+            return False  # аренда у другого экземпляра
+
+    @classmethod
+    def release_lease(cls, owner: str) -> None:
+        SchedulerLease.objects.filter(name=cls.LEASE_NAME, owner=owner).delete()
+
+    @classmethod
+    def tick(cls, owner: Optional[str] = None, now: Optional[datetime] = None) -> List[JobRun]:
+        """Один проход: если мы лидер — последовательно выполнить наступившие задачи"""
+        owner = owner or cls.default_owner()
+        if not cls.acquire_lease(owner):
+            return []
+        now = now or timezone.now()
+        runs = []
+        due = PeriodicJob.objects.filter(is_active=True, next_run_at__lte=now).order_by('next_run_at', 'id')
+        for job in due:
+            # Иначе после LEASE_TTL резервный экземпляр возьмёт аренду и запустит
+            # остальные задачи параллельно с этой
+            if not cls.acquire_lease(owner, ttl=max(cls.LEASE_TTL, job.max_runtime_minutes * 60)):
+                break  # аренду потеряли (задача дольше max_runtime_minutes)
+            runs.append(cls.run_job(job, owner=owner))
+        if runs:
+            cls.acquire_lease(owner)  # обратно к обычному сроку
+        return runs
+
+    @classmethod
+    def run_job(cls, job: PeriodicJob, owner: str = '') -> JobRun:
+        """Выполнить задачу с защитой от наложения и записью в историю"""
+        now = timezone.now()
+        stale = now - timedelta(minutes=job.max_runtime_minutes)
+        claimed = PeriodicJob.objects.filter(pk=job.pk).filter(
+            Q(running_since__isnull=True) | Q(running_since__lt=stale)
+        ).update(running_since=now)
+        if not claimed:
+            return JobRun.objects.create(
+                job=job, status='skipped', worker=owner, started_at=now, finished_at=now,
+                error=f'Предыдущий запуск выполняется с {job.running_since}',
+            )
+
+        run = JobRun.objects.create(job=job, status='running', worker=owner, started_at=now)
+        started = time.perf_counter()
+        try:
+            task = JOB_TASKS.get(job.task)
+            if task is None:
+                raise ValueError(f'Неизвестная задача: {job.task}')
+            run.rows_affected = task(job.params or {})
+            run.status = 'success'
+        except Exception as e:
+            logger.exception('Periodic job %s failed', job.name)
+            run.status = 'failed'
+            run.error = str(e)
+        finally:
+            run.finished_at = timezone.now()
+            run.duration_seconds = round(time.perf_counter() - started, 3)
+            run.save(update_fields=['status', 'rows_affected', 'error', 'finished_at', 'duration_seconds'])
+            PeriodicJob.objects.filter(pk=job.pk).update(
+                running_since=None, last_run_at=now,
+                next_run_at=CronSchedule(job.schedule).next_after(run.finished_at),
+            )
+        return run
@@ -0,0 +1,30 @@
+"""
+Кэш, общий для всех процессов: settings.SHARED_CACHE (Redis при REDIS_URL).
+
+Записи и версии, которые сбрасываются по событиям (NBA, Client 360), должны
+лежать в нём: в LocMem сброс в одном воркере не виден остальным. Без общего
+кэша такие записи живут короткий TTL (см. ttl()).
+
+Использование:
+    from collection_app.services.shared_cache import shared_cache, ttl
+    shared_cache().set(key, value, ttl(900, 60))
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def shared_cache():
+    return caches[getattr(settings, 'SHARED_CACHE', 'default')]
+
+
+def is_process_local() -> bool:
+    """Кэш живёт в памяти процесса (сброс виден только в нём)"""
+    return isinstance(shared_cache(), (LocMemCache, DummyCache))
+
+
+def ttl(shared_ttl: int, local_ttl: int) -> int:
+    """TTL записи со сбросом по событиям: короткий, если кэш не общий"""
+    return local_ttl if is_process_local() else shared_ttl
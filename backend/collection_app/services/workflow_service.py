@@ -6,19 +6,51 @@ Workflow Service - Управление автоматическими бизн
 - Создания задач
 - Отправки уведомлений
 - Эскалации
+
+Правила компилируются один раз (предикаты + ORM Q-фильтры) и кэшируются до
+изменения WorkflowRule (см. signals.py). Массовый прогон — run_rules().
 """
 
+import logging
+import queue
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import date, datetime, timedelta
-from typing import Dict, List, Optional, Any
-from django.db import transaction
-from django.db.models import Q
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Any
+from django.db import connection, connections, transaction
+from django.db.models import (
+    Case, Count, DecimalField, Exists, ExpressionWrapper, F, FloatField, IntegerField,
+    Max, OuterRef, Q, Subquery, Value, When,
+)
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 from ..models import (
     CollectionCase, WorkflowRule, ScheduledAction, CommunicationTask,
-    Promise, PreCollectionAlert, Credit, Client
+    PreCollectionAlert, Credit, Client, CollectionStageHistory, CreditState
 )
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CompiledRule:
+    """Правило workflow, скомпилированное в предикат и (если возможно) Q-фильтр"""
+    rule: WorkflowRule
+    predicate: Callable[[Dict[str, Any]], bool]
+    q: Optional[Q]  # None — условие не переводится в SQL, проверяется предикатом
+
+    @property
+    def actions(self) -> Dict:
+        return self.rule.actions
+
+    @property
+    def to_stage(self) -> str:
+        return self.rule.to_stage
+
 
 class WorkflowEngine:
     """
@@ -44,6 +76,27 @@ class WorkflowEngine:
         'is_null': lambda a, b: a is None if b else a is not None,
     }
     
+    # Поля данных кейса, совпадающие с колонками CollectionCase
+    CASE_FIELDS = {
+        'stage', 'status', 'priority', 'priority_score', 'total_debt', 'overdue_amount',
+        'overdue_days', 'total_contacts', 'successful_contacts', 'promises_count',
+        'broken_promises', 'return_probability', 'risk_segment', 'psychotype',
+    }
+    Q_LOOKUPS = {'eq': 'exact', 'gt': 'gt', 'gte': 'gte', 'lt': 'lt', 'lte': 'lte', 'in': 'in'}
+    
+    RULES_CHECK_INTERVAL = 30  # секунд между проверками версии правил в БД
+    BATCH_SIZE = 500
+    ACTION_BATCH_SIZE = 200
+    EARLY_WARNING_THRESHOLD = 0.6
+    ALERT_COOLDOWN_DAYS = 3   # не чаще одного алерта по кредиту
+    ALERT_OPEN_DAYS = 30      # необработанный алерт считается открытым
+    CLAIM_TIMEOUT = 600  # секунд; после — захват считается брошенным
+    
+    # Скомпилированные правила процесса: {from_stage: [CompiledRule]}, сверяются с версией в БД
+    _compiled_rules: Optional[Dict[str, List[CompiledRule]]] = None
+    _compiled_version: Optional[tuple] = None
+    _version_checked_at = 0.0
+    
     @classmethod
     def evaluate_rules(cls, case: CollectionCase) -> List[Dict]:
         """
@@ -55,24 +108,127 @@ class WorkflowEngine:
         Returns:
             List[Dict]: Список сработавших правил и их действий
         """
-        triggered_rules = []
-        
-        rules = WorkflowRule.objects.filter(
-            is_active=True,
-            from_stage=case.stage
-        ).order_by('priority')
+        compiled = cls.get_compiled_rules().get(case.stage, [])
+        if not compiled:
+            return []
         
         case_data = cls._extract_case_data(case)
         
-        for rule in rules:
-            if cls._evaluate_conditions(rule.conditions, case_data):
-                triggered_rules.append({
-                    'rule': rule,
-                    'actions': rule.actions,
-                    'to_stage': rule.to_stage
-                })
+        return [
+            {'rule': item.rule, 'actions': item.actions, 'to_stage': item.to_stage}
+            for item in compiled
+            if item.predicate(case_data)
+        ]
+    
+    @classmethod
+    def get_compiled_rules(cls) -> Dict[str, List[CompiledRule]]:
+        """
+        Активные правила, сгруппированные по from_stage в порядке приоритета.
+        Версия — (последнее изменение, число правил) из БД, проверяется не чаще
+        RULES_CHECK_INTERVAL: правку в другом процессе видно не позже чем через него.
+        """
+        now = time.monotonic()
+        if cls._compiled_rules is not None and now - cls._version_checked_at < cls.RULES_CHECK_INTERVAL:
+            return cls._compiled_rules
+        version = cls._rules_version()
+        cls._version_checked_at = now
+        if cls._compiled_rules is None or cls._compiled_version != version:
+            compiled: Dict[str, List[CompiledRule]] = {}
+            for rule in WorkflowRule.objects.filter(is_active=True).order_by('priority', 'id'):
+                compiled.setdefault(rule.from_stage, []).append(cls.compile_rule(rule))
+            cls._compiled_rules = compiled
+            cls._compiled_version = version
+        return cls._compiled_rules
+    
+    @staticmethod
+    def _rules_version() -> tuple:
+        # Число правил учитывает удаление; правка через save() обновляет updated_at
+        stats = WorkflowRule.objects.aggregate(changed=Max('updated_at'), count=Count('id'))
+        return stats['changed'], stats['count']
+    
+    @classmethod
+    def invalidate_rules(cls) -> None:
+        """
+        Сбросить скомпилированные правила этого процесса; остальные процессы
+        увидят изменение по версии в БД (не позже RULES_CHECK_INTERVAL)
+        """
+        cls._compiled_rules = None
+    
+    @classmethod
+    def compile_rule(cls, rule: WorkflowRule) -> CompiledRule:
+        """Компиляция условий правила в предикат и Q-фильтр"""
+        checks = []
+        never = False
+        for field, field_conditions in rule.conditions.items():
+            if field not in cls.CASE_FIELDS and field not in ('days_in_stage', 'has_operator'):
+                never = True
+                continue
+            for operator, expected in field_conditions.items():
+                op_func = cls.OPERATORS.get(operator)
+                if op_func:
+                    checks.append((field, op_func, expected))
+        
+        if never:
+            return CompiledRule(rule=rule, predicate=lambda data: False, q=Q(pk__in=[]))
+        
+        def predicate(data: Dict[str, Any]) -> bool:
+            for field, op_func, expected in checks:
+                if not op_func(data[field], expected):
+                    return False
+            return True
+        
+        return CompiledRule(rule=rule, predicate=predicate, q=cls._conditions_to_q(rule.conditions))
+    
+    @classmethod
+    def match_case_ids(cls, compiled: CompiledRule, queryset=None) -> List[int]:
+        """ID кейсов стадии правила, удовлетворяющих его условиям"""
+        qs = (queryset if queryset is not None else CollectionCase.objects.all()).filter(
+            stage=compiled.rule.from_stage
+        )
+        if compiled.q is not None:
+            return list(qs.filter(compiled.q).values_list('id', flat=True))
+        # Непереводимое условие — проверка предикатом без создания моделей
+        return [
+            row['id'] for row in qs.values('id', 'assigned_operator_id', 'stage_changed_at', *cls.CASE_FIELDS)
+            if compiled.predicate(cls._extract_case_data_from_row(row))
+        ]
+    
+    @classmethod
+    def run_rules(cls, queryset=None, dry_run: bool = False, user=None,
+                  batch_size: Optional[int] = None) -> Dict[str, int]:
+        """
+        Массовый прогон правил по активным кейсам.
+        
+        Для каждого кейса срабатывает первое подходящее правило его стадии (по приоритету);
+        действия выполняются пачками по batch_size (BATCH_SIZE).
         
-        return triggered_rules
+        Returns:
+            Dict: {rule_id: число кейсов}, а также 'cases' — всего обработано
+        """
+        base_qs = queryset if queryset is not None else CollectionCase.objects.filter(status='active')
+        batch_size = batch_size or cls.BATCH_SIZE
+        stats: Dict[str, int] = {'cases': 0}
+        
+        # Сначала подбираем кейсы по всем правилам, затем выполняем —
+        # кейс, сменивший стадию в этом прогоне, не проходит по правилам новой стадии
+        plan = []
+        for compiled_rules in cls.get_compiled_rules().values():
+            taken = set()
+            for compiled in compiled_rules:
+                case_ids = [pk for pk in cls.match_case_ids(compiled, base_qs) if pk not in taken]
+                if not case_ids:
+                    continue
+                taken.update(case_ids)
+                plan.append((compiled.rule, case_ids))
+                stats[str(compiled.rule.id)] = len(case_ids)
+                stats['cases'] += len(case_ids)
+        
+        if not dry_run:
+            for rule, case_ids in plan:
+                for start in range(0, len(case_ids), batch_size):
+                    cls._execute_rule_batch(rule, case_ids[start:start + batch_size], user)
+        
+        return stats
     
     @classmethod
     def execute_rule(cls, case: CollectionCase, rule: WorkflowRule, 
@@ -109,35 +265,142 @@ class WorkflowEngine:
             return True
     
     @classmethod
-    def process_scheduled_actions(cls) -> Dict[str, int]:
+    def process_scheduled_actions(cls, batch_size: Optional[int] = None, workers: int = 1,
+                                  max_batches: Optional[int] = None) -> Dict[str, Any]:
         """
         Обработка запланированных действий
         
+        Действия захватываются пачками (claim_scheduled_actions), поэтому несколько
+        воркеров/cron-экземпляров могут работать параллельно без двойного выполнения.
+        
+        Args:
+            batch_size: Размер захватываемой пачки
+            workers: Число потоков выполнения
+            max_batches: Ограничение числа пачек за вызов (None — до исчерпания)
+            
         Returns:
-            Dict: Статистика обработки
+            Dict: Статистика обработки и латентность по типам действий
         """
-        stats = {'executed': 0, 'failed': 0}
-        
-        actions = ScheduledAction.objects.filter(
-            status='pending',
-            scheduled_at__lte=timezone.now()
-        ).select_related('case')
-        
-        for action in actions:
-            try:
-                cls._execute_scheduled_action(action)
-                action.status = 'executed'
-                action.executed_at = timezone.now()
-                stats['executed'] += 1
-            except Exception as e:
-                action.status = 'failed'
-                action.result = str(e)
-                stats['failed'] += 1
-            
-            action.save()
-        
+        stats: Dict[str, Any] = {'executed': 0, 'failed': 0, 'latency': {}}
+        timings: Dict[str, List[float]] = {}
+        
+        cls.release_stale_claims()
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            actions = cls.claim_scheduled_actions(batch_size)
+            if not actions:
+                break
+            batches += 1
+            for action, elapsed in cls._run_claimed_actions(actions, workers):
+                stats[action.status] += 1
+                timings.setdefault(action.action_type, []).append(elapsed)
+        
+        for action_type, values in timings.items():
+            stats['latency'][action_type] = {
+                'count': len(values),
+                'avg_ms': round(sum(values) / len(values) * 1000, 2),
+                'max_ms': round(max(values) * 1000, 2),
+            }
         return stats
     
+    @classmethod
+    def claim_scheduled_actions(cls, batch_size: Optional[int] = None) -> List[ScheduledAction]:
+        """
+        Захват пачки наступивших действий: pending → processing с уникальным claim_token.
+        
+        PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED — параллельные воркеры берут разные строки.
+        SQLite и др.: условный UPDATE ... WHERE status='pending' — строку получает тот,
+        чей UPDATE прошёл первым; свои строки воркер находит по токену.
+        """
+        batch_size = batch_size or cls.ACTION_BATCH_SIZE
+        token = uuid.uuid4().hex
+        now = timezone.now()
+        due = ScheduledAction.objects.filter(status='pending', scheduled_at__lte=now).order_by('scheduled_at', 'id')
+        
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            ids = list(due.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return []
+            ScheduledAction.objects.filter(id__in=ids, status='pending').update(
+                status='processing', claim_token=token, claimed_at=now,
+            )
+        
+        return list(
+            ScheduledAction.objects.filter(claim_token=token, status='processing')
+            .select_related('case__client', 'case__assigned_operator')
+        )
+    
+    @classmethod
+    def release_stale_claims(cls) -> int:
+        """Вернуть в очередь действия, захваченные упавшим воркером"""
+        return ScheduledAction.objects.filter(
+            status='processing',
+            claimed_at__lt=timezone.now() - timedelta(seconds=cls.CLAIM_TIMEOUT),
+        ).update(status='pending', claim_token='', claimed_at=None)
+    
+    @classmethod
+    def _run_claimed_actions(cls, actions: List[ScheduledAction], workers: int) -> List[tuple]:
+        """
+        Выполнение захваченной пачки (в пуле потоков при workers > 1), итог — одним bulk_update.
+        Пишутся только действия, которые всё ещё за нашим claim_token: действие дольше
+        CLAIM_TIMEOUT могло уйти другому воркеру (release_stale_claims), его итог — за ним.
+        """
+        token = actions[0].claim_token
+        if workers > 1:
+            pending = queue.SimpleQueue()
+            for action in actions:
+                pending.put(action)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                chunks = pool.map(lambda _: cls._drain_actions(pending), range(workers))
+                results = [item for chunk in chunks for item in chunk]
+        else:
+            results = [cls._run_action(action) for action in actions]
+        
+        with transaction.atomic():
+            owned = set(
+                ScheduledAction.objects.select_for_update()
+                .filter(pk__in=[action.pk for action, _ in results], claim_token=token, status='processing')
+                .values_list('id', flat=True)
+            )
+            results = [(action, elapsed) for action, elapsed in results if action.pk in owned]
+            ScheduledAction.objects.bulk_update(
+                [action for action, _ in results], ['status', 'executed_at', 'result', 'claim_token'],
+            )
+        lost = len(actions) - len(results)
+        if lost:
+            logger.warning('Scheduled actions: %s claims expired and were taken by another worker', lost)
+        return results
+    
+    @classmethod
+    def _drain_actions(cls, pending: 'queue.SimpleQueue') -> List[tuple]:
+        """Поток пула: выбирает действия из общей очереди; своё соединение с БД закрывает в конце"""
+        results = []
+        try:
+            while True:
+                try:
+                    action = pending.get_nowait()
+                except queue.Empty:
+                    return results
+                results.append(cls._run_action(action))
+        finally:
+            connections.close_all()
+    
+    @classmethod
+    def _run_action(cls, action: ScheduledAction) -> tuple:
+        started = time.perf_counter()
+        try:
+            cls._execute_scheduled_action(action)
+            action.status = 'executed'
+            action.executed_at = timezone.now()
+        except Exception as e:
+            logger.exception('Scheduled action #%s failed', action.pk)
+            action.status = 'failed'
+            action.result = str(e)
+        action.claim_token = ''
+        return action, time.perf_counter() - started
+    
     @classmethod
     def schedule_action(cls, case: CollectionCase, action_type: str,
                        scheduled_at: datetime, parameters: Dict = None) -> ScheduledAction:
@@ -162,70 +425,233 @@ class WorkflowEngine:
         )
     
     @classmethod
-    def create_pre_collection_alerts(cls) -> int:
+    def create_pre_collection_alerts(cls, batch_size: int = 1000) -> int:
         """
         Создание алертов Pre-Collection для кредитов близких к просрочке
         
+        Скор считается одним запросом по всему портфелю (early_warning_queryset),
+        алерты создаются через bulk_create.
+        
         Returns:
             int: Количество созданных алертов
         """
-        today = date.today()
-        alert_window = today + timedelta(days=7)  # За 7 дней до платежа
-        
-        # Находим кредиты с приближающимся платежом
-        from ..models import Payment
+        now = timezone.now()
         
-        # Это упрощённая логика - в реальности нужно анализировать график платежей
-        credits_at_risk = Credit.objects.filter(
-            status='active'
-        ).exclude(
-            precollection_alerts__created_at__gte=today - timedelta(days=3)
+        # Не дублируем: любой алерт за последние дни или ещё не обработанный открытый
+        open_alerts = PreCollectionAlert.objects.filter(credit=OuterRef('pk')).filter(
+            Q(created_at__gte=now - timedelta(days=cls.ALERT_COOLDOWN_DAYS)) |
+            Q(processed_at__isnull=True, payment_made=False,
+              created_at__gte=now - timedelta(days=cls.ALERT_OPEN_DAYS))
         )
+        # Это упрощённая логика - в реальности нужно анализировать график платежей
+        credits_at_risk = cls.early_warning_queryset(
+            Credit.objects.filter(status='active').exclude(Exists(open_alerts))
+        ).filter(early_warning_score__gt=cls.EARLY_WARNING_THRESHOLD)
+        
+        alerts = [
+            PreCollectionAlert(
+                client_id=client_id,
+                credit_id=credit_id,
+                alert_type='high_risk_detected',
+                days_before_due=7,
+                risk_score=min(risk_score, 1.0)
+            )
+            for credit_id, client_id, risk_score in credits_at_risk.values_list(
+                'id', 'client_id', 'early_warning_score'
+            ).iterator(chunk_size=batch_size)
+        ]
+        PreCollectionAlert.objects.bulk_create(alerts, batch_size=batch_size)
         
-        created_count = 0
-        
-        for credit in credits_at_risk[:100]:  # Лимит на итерацию
-            # Проверяем риск-скор
-            risk_score = cls._calculate_early_warning_score(credit)
-            
-            if risk_score > 0.6:  # Порог риска
-                PreCollectionAlert.objects.create(
-                    client=credit.client,
-                    credit=credit,
-                    alert_type='high_risk_detected',
-                    days_before_due=7,
-                    risk_score=risk_score
-                )
-                created_count += 1
-        
-        return created_count
+        return len(alerts)
+    
+    @classmethod
+    def early_warning_queryset(cls, queryset):
+        """
+        Аннотирует кредиты ранним предупреждающим скором (early_warning_score):
+        0.5 базово; +0.3 текущая просрочка; +0.2 больше 2 месяцев с просрочкой в истории;
+        +0.15 DTI (платёж + расходы) / доход > 0.6. Без состояний — 0.5.
+        """
+        past_overdue = CreditState.objects.filter(
+            credit=OuterRef('pk'), overdue_days__gt=0
+        ).order_by().values('credit').annotate(n=Count('id')).values('n')
+        
+        def bonus(condition: Q, value: float):
+            return Case(When(condition, then=Value(value)), default=Value(0.0), output_field=FloatField())
+        
+        return queryset.annotate(
+            past_overdue_count=Coalesce(Subquery(past_overdue, output_field=IntegerField()), 0),
+            payment_load=ExpressionWrapper(
+                F('monthly_payment') + F('client__monthly_expenses'), output_field=DecimalField()
+            ),
+        ).annotate(
+            early_warning_score=Case(
+                When(current_state__isnull=True, then=Value(0.5)),
+                default=Value(0.5)
+                + bonus(Q(current_overdue_days__gt=0), 0.3)
+                + bonus(Q(past_overdue_count__gt=2), 0.2)
+                + bonus(
+                    Q(client__income__gt=0, payment_load__gt=F('client__income') * Decimal('0.6')), 0.15
+                ),
+                output_field=FloatField(),
+            )
+        )
     
     @classmethod
     def check_promises(cls) -> Dict[str, int]:
         """
         Проверка выполнения обещаний
         
+        Все ожидающие обещания с истёкшим сроком сопоставляются с платежами
+        порциями (PromiseMatcher), без запросов на каждое обещание.
+        
         Returns:
             Dict: Статистика проверки
         """
-        from .collection_service import CollectionService
-        
-        stats = {'kept': 0, 'broken': 0, 'partial': 0}
-        
-        # Обещания с истёкшим сроком
-        overdue_promises = Promise.objects.filter(
-            status='pending',
-            promised_date__lt=date.today()
-        )
+        from .promise_matcher import PromiseMatcher
         
-        for promise in overdue_promises:
-            CollectionService.check_promise_fulfillment(promise)
-            stats[promise.status] = stats.get(promise.status, 0) + 1
-        
-        return stats
+        return PromiseMatcher.check_due_promises()
     
     # ==================== Приватные методы ====================
     
+    @classmethod
+    def _conditions_to_q(cls, conditions: Dict) -> Optional[Q]:
+        """Перевод условий в Q; None — если хотя бы одно условие не переводится"""
+        q = Q()
+        for field, field_conditions in conditions.items():
+            for operator, expected in field_conditions.items():
+                if operator not in cls.OPERATORS:
+                    continue
+                if field == 'days_in_stage':
+                    part = cls._days_in_stage_q(operator, expected)
+                elif field == 'has_operator':
+                    part = cls._has_operator_q(operator, expected)
+                elif operator in ('in', 'not_in') and not isinstance(expected, (list, tuple, set)):
+                    part = None  # `in` по строке — поиск подстроки
+                elif operator == 'is_null':
+                    part = Q(**{f'{field}__isnull': bool(expected)})
+                elif operator == 'ne':
+                    part = ~Q(**{field: expected})
+                elif operator == 'not_in':
+                    part = ~Q(**{f'{field}__in': expected})
+                elif operator in cls.Q_LOOKUPS:
+                    part = Q(**{f'{field}__{cls.Q_LOOKUPS[operator]}': expected})
+                else:
+                    part = None  # contains: str(a) в Python и LIKE в БД ведут себя по-разному
+                if part is None:
+                    return None
+                q &= part
+        return q
+    
+    @classmethod
+    def _days_in_stage_q(cls, operator: str, expected) -> Optional[Q]:
+        """days_in_stage = (now - stage_changed_at).days; NULL считается как 0"""
+        if operator not in ('eq', 'ne', 'gt', 'gte', 'lt', 'lte') or \
+                not isinstance(expected, int) or isinstance(expected, bool):
+            return None
+        now = timezone.now()
+        
+        def at_least(days: int) -> Q:
+            return Q(stage_changed_at__lte=now - timedelta(days=days))
+        
+        exact = at_least(expected) & ~at_least(expected + 1)
+        bound = {
+            'gte': at_least(expected),
+            'gt': at_least(expected + 1),
+            'lt': ~at_least(expected),
+            'lte': ~at_least(expected + 1),
+            'eq': exact,
+            'ne': ~exact,
+        }[operator]
+        q = Q(stage_changed_at__isnull=False) & bound
+        if cls.OPERATORS[operator](0, expected):
+            q |= Q(stage_changed_at__isnull=True)
+        return q
+    
+    @classmethod
+    def _has_operator_q(cls, operator: str, expected) -> Optional[Q]:
+        if operator not in ('eq', 'ne') or not isinstance(expected, bool):
+            return None
+        has = expected if operator == 'eq' else not expected
+        return Q(assigned_operator__isnull=not has)
+    
+    @classmethod
+    def _extract_case_data_from_row(cls, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Данные кейса из values()-строки (тот же формат, что _extract_case_data)"""
+        data = {field: row[field] for field in cls.CASE_FIELDS}
+        data['total_debt'] = float(row['total_debt'])
+        data['overdue_amount'] = float(row['overdue_amount'])
+        changed = row['stage_changed_at']
+        data['days_in_stage'] = (timezone.now() - changed).days if changed else 0
+        data['has_operator'] = row['assigned_operator_id'] is not None
+        return data
+    
+    @classmethod
+    def _execute_rule_batch(cls, rule: WorkflowRule, case_ids: List[int], user=None) -> None:
+        """Выполнение правила для пачки кейсов: переход стадии и действия — массовыми запросами"""
+        from .collection_service import CollectionService
+        
+        actions = rule.actions
+        now = timezone.now()
+        with transaction.atomic():
+            cases = list(
+                CollectionCase.objects.select_for_update().filter(pk__in=case_ids, stage=rule.from_stage)
+            )
+            if not cases:
+                return
+            
+            if rule.to_stage and rule.to_stage != rule.from_stage:
+                if not CollectionService._validate_stage_transition(rule.from_stage, rule.to_stage):
+                    return
+                CollectionCase.objects.filter(pk__in=[c.pk for c in cases]).update(
+                    stage=rule.to_stage, stage_changed_at=now, updated_at=now,
+                )
+                CollectionStageHistory.objects.bulk_create([
+                    CollectionStageHistory(
+                        case=case, from_stage=rule.from_stage, to_stage=rule.to_stage,
+                        changed_by=user, reason=f'Правило: {rule.name}', auto_transition=True,
+                    )
+                    for case in cases
+                ])
+                for case in cases:
+                    case.stage = rule.to_stage
+                    case.stage_changed_at = now
+                    CollectionService._execute_stage_transition_actions(case, rule.from_stage, rule.to_stage)
+            
+            if 'change_priority' in actions:
+                CollectionCase.objects.filter(pk__in=[c.pk for c in cases]).update(
+                    priority=actions['change_priority'], updated_at=now,
+                )
+                for case in cases:
+                    case.priority = actions['change_priority']
+            
+            if 'create_task' in actions:
+                CommunicationTask.objects.bulk_create([
+                    CommunicationTask(
+                        case=case,
+                        operator_id=case.assigned_operator_id,
+                        task_type=actions['create_task'],
+                        priority=actions.get('task_priority', case.priority),
+                        scheduled_date=date.today() + timedelta(days=actions.get('task_delay_days', 0)),
+                        status='pending'
+                    )
+                    for case in cases
+                ])
+            
+            if actions.get('notify_manager'):
+                for case in cases:
+                    cls._send_manager_notification(case)
+            
+            if 'schedule_action' in actions:
+                action_config = actions['schedule_action']
+                scheduled_at = now + timedelta(hours=action_config.get('delay_hours', 24))
+                ScheduledAction.objects.bulk_create([
+                    ScheduledAction(
+                        case=case, action_type=action_config['type'], scheduled_at=scheduled_at,
+                        parameters=action_config.get('parameters', {}), status='pending'
+                    )
+                    for case in cases
+                ])
+    
     @classmethod
     def _extract_case_data(cls, case: CollectionCase) -> Dict[str, Any]:
         """Извлечение данных кейса для оценки условий"""
@@ -245,7 +671,7 @@ class WorkflowEngine:
             'risk_segment': case.risk_segment,
             'psychotype': case.psychotype,
             'days_in_stage': (timezone.now() - case.stage_changed_at).days if case.stage_changed_at else 0,
-            'has_operator': case.assigned_operator is not None,
+            'has_operator': case.assigned_operator_id is not None,
         }
     
     @classmethod
@@ -343,10 +769,8 @@ class WorkflowEngine:
             )
         
         elif action.action_type == 'check_promise':
-            from .collection_service import CollectionService
-            pending_promises = case.promises.filter(status='pending')
-            for promise in pending_promises:
-                CollectionService.check_promise_fulfillment(promise)
+            from .promise_matcher import PromiseMatcher
+            PromiseMatcher.match_promises(list(case.promises.filter(status='pending')))
         
         elif action.action_type == 'check_payment':
             # Проверка поступления платежа
@@ -354,31 +778,11 @@ class WorkflowEngine:
     
     @classmethod
     def _calculate_early_warning_score(cls, credit: Credit) -> float:
-        """Расчёт раннего предупреждающего скора"""
-        score = 0.5
-        
-        # Получаем последнее состояние
-        latest_state = credit.states.order_by('-state_date').first()
-        if not latest_state:
-            return score
-        
-        # Факторы риска
-        if latest_state.overdue_days > 0:
-            score += 0.3
-        
-        # История просрочек
-        past_overdue = credit.states.filter(overdue_days__gt=0).count()
-        if past_overdue > 2:
-            score += 0.2
-        
-        # DTI
-        client = credit.client
-        if client.income > 0:
-            dti = (float(credit.monthly_payment) + float(client.monthly_expenses)) / float(client.income)
-            if dti > 0.6:
-                score += 0.15
-        
-        return min(score, 1.0)
+        """Расчёт раннего предупреждающего скора (та же формула, что early_warning_queryset)"""
+        score = cls.early_warning_queryset(Credit.objects.filter(pk=credit.pk)).values_list(
+            'early_warning_score', flat=True
+        ).first()
+        return min(score if score is not None else 0.5, 1.0)
     
     @classmethod
     def _send_sms(cls, client: Client, template: str) -> None:
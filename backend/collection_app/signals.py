@@ -0,0 +1,70 @@
+"""
+Сигналы collection_app.
+
+Инвалидация кэша Client 360 при записи в таблицы, из которых собирается профиль.
+Сброс скомпилированных правил workflow при изменении WorkflowRule.
+Сброс кэша NBA клиента при новых контактах, платежах, скоринге и изменении профиля.
+Отметка клиента к пересчёту поведенческого профиля при записи Payment / Intervention / Promise.
+"""
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    Client, Credit, CreditState, Intervention, NextBestAction, ReturnForecast,
+    ClientBehaviorProfile, WorkflowRule, Payment, Promise, CollectionCase, ScoringResult,
+)
+from .services.behavior_refresh import BehaviorProfileRefresher
+from .services.client_profile import Client360Loader
+from .services.nba_cache import NBACache
+from .services.workflow_service import WorkflowEngine
+
+
+def _client_id_of(instance):
+    """client_id объекта — напрямую, через кредит или через кейс"""
+    if isinstance(instance, Client):
+        return instance.pk
+    client_id = getattr(instance, 'client_id', None)
+    if client_id:
+        return client_id
+    credit_id = getattr(instance, 'credit_id', None)
+    if credit_id:
+        return Credit.objects.filter(pk=credit_id).values_list('client_id', flat=True).first()
+    case_id = getattr(instance, 'case_id', None)
+    if case_id:
+        return CollectionCase.objects.filter(pk=case_id).values_list('client_id', flat=True).first()
+    return None
+
+
+@receiver([post_save, post_delete], sender=Client)
+@receiver([post_save, post_delete], sender=Credit)
+@receiver([post_save, post_delete], sender=CreditState)
+@receiver([post_save, post_delete], sender=Intervention)
+@receiver([post_save, post_delete], sender=NextBestAction)
+@receiver([post_save, post_delete], sender=ReturnForecast)
+@receiver([post_save, post_delete], sender=ClientBehaviorProfile)
+def invalidate_client_360(sender, instance, **kwargs):
+    Client360Loader.invalidate(_client_id_of(instance))
+
+
+@receiver([post_save, post_delete], sender=Intervention)
+@receiver([post_save, post_delete], sender=Payment)
+@receiver([post_save, post_delete], sender=ScoringResult)
+@receiver([post_save, post_delete], sender=ClientBehaviorProfile)
+def invalidate_nba_cache(sender, instance, **kwargs):
+    NBACache.invalidate(_client_id_of(instance))
+
+
+@receiver([post_save, post_delete], sender=WorkflowRule)
+def invalidate_workflow_rules(sender, instance, **kwargs):
+    WorkflowEngine.invalidate_rules()
+
+
+@receiver([post_save, post_delete], sender=Payment)
+@receiver([post_save, post_delete], sender=Intervention)
+@receiver([post_save, post_delete], sender=Promise)
+def mark_behavior_profile_dirty(sender, instance, origin=None, **kwargs):
+    # Каскадное удаление клиента / кредита / кейса — отмечать некого
+    if origin is not None and getattr(origin, 'model', type(origin)) is not sender:
+        return
+    BehaviorProfileRefresher.mark_dirty([_client_id_of(instance)], reason=sender._meta.model_name)
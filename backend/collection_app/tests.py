@@ -8,13 +8,45 @@
   4. Банкротство
   5. API endpoints
   6. Delinquency buckets
+  7. Очередь оператора (N+1)
+  8. Client 360 (загрузчик и кэш)
+  9. Пагинация и ?fields=
+  10. Потоковая выгрузка
+  11. Загрузка файлов платежей
+  12. Графики погашения (AmortizationEngine)
+  13. Компилируемые правила workflow
+  14. Воркер запланированных действий
+  15. Планировщик периодических задач
+  16. Pre-collection алерты (скор по всему портфелю)
+  17. Пакетная проверка обещаний
+  18. Пакетное психотипирование
+  19. Инкрементальный пересчёт профилей (очередь DirtyClient)
+  20. Пакетная генерация NBA
+  21. Кэш NBA (инвалидация по событиям, метрики)
+  22. Пакетный прогноз возврата по портфелю
+  23. Монте-Карло симуляция транша
+  24. Скрипты Copilot (скомпилированные шаблоны, инкрементальный поиск)
+  25. Поток Copilot по звонку (SSE)
+  26. Async-отчёты дашборда и Client 360 (одновременные запросы)
+  27. Rate limiter (скользящее окно, атомарные счётчики)
+  28. Очередь аудита (пакетная запись, выборка GET, обратное давление)
+  29. Проверка запросов на запрещённые паттерны (один проход, лимит байт)
+  30. Профилирование запросов (SQL, N+1, бюджеты, отчёт по маршрутам)
 """
 
+import importlib.util
+import json
+import time
 from datetime import date, timedelta
 from decimal import Decimal
+from unittest import skipUnless
 from unittest.mock import patch
 
-from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from rest_framework.test import APIClient
 
@@ -139,6 +171,37 @@ class CreditModelTest(TestCase):
         )
         self.assertEqual(cr.days_past_due, 42)
 
+    def test_current_state_tracks_latest(self):
+        c = _make_client()
+        cr = _make_credit(c, status='overdue')
+        today = date.today()
+        latest = CreditState.objects.create(
+            credit=cr, state_date=today, principal_debt=Decimal('480000'), overdue_days=65,
+        )
+        # Более старое состояние не должно сдвигать указатель
+        CreditState.objects.create(
+            credit=cr, state_date=today - timedelta(days=30), principal_debt=Decimal('490000'), overdue_days=35,
+        )
+        cr = Credit.objects.get(pk=cr.pk)
+        self.assertEqual(cr.current_state_id, latest.pk)
+        self.assertEqual(cr.current_bucket, '60-90')
+        with self.assertNumQueries(0):
+            self.assertEqual(cr.days_past_due, 65)
+
+        latest.delete()
+        cr = Credit.objects.get(pk=cr.pk)
+        self.assertEqual(cr.current_overdue_days, 35)
+        self.assertEqual(cr.current_bucket, '30-60')
+
+    def test_refresh_current_states_bulk(self):
+        c = _make_client()
+        cr = _make_credit(c, status='overdue')
+        CreditState.objects.bulk_create([
+            CreditState(credit=cr, state_date=date.today(), overdue_days=100),
+        ])
+        self.assertEqual(Credit.refresh_current_states([cr.pk]), 1)
+        self.assertEqual(Credit.objects.get(pk=cr.pk).current_bucket, '90+')
+
 
 class ViolationLogModelTest(TestCase):
     def test_violation_creation(self):
@@ -436,3 +499,1977 @@ class DelinquencyBucketAPITest(TestCase):
         data = resp.json()
         self.assertEqual(data['delinquency_bucket'], '30-60')
         self.assertEqual(data['days_past_due'], 55)
+
+
+# =====================================================================
+# 7. Тесты очереди оператора (без N+1)
+# =====================================================================
+
+class AssignmentQueueQueryTest(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.operator = _make_operator()
+
+    def _add_assignments(self, count):
+        now = timezone.now()
+        for i in range(count):
+            c = _make_client(full_name=f'Должник {i}')
+            cr = _make_credit(c, status='overdue')
+            Assignment.objects.create(
+                operator=self.operator, client=c, credit=cr, debtor_name=c.full_name,
+                overdue_amount=Decimal('10000'), overdue_days=30, assignment_date=date.today(),
+            )
+            Intervention.objects.create(
+                client=c, credit=cr, operator=self.operator, datetime=now - timedelta(days=2),
+                intervention_type='phone', status='no_answer',
+            )
+            Intervention.objects.create(
+                client=c, credit=cr, operator=self.operator, datetime=now - timedelta(days=1),
+                intervention_type='phone', status='promise',
+                promise_amount=Decimal('5000'), promise_date=date.today() + timedelta(days=3),
+            )
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.api.get(f'/api/assignments/?operator_id={self.operator.id}')
+        self.assertEqual(resp.status_code, 200)
+        return len(ctx.captured_queries), resp.json()
+
+    def test_constant_query_count(self):
+        self._add_assignments(2)
+        small, _ = self._count_queries()
+        self._add_assignments(8)
+        large, data = self._count_queries()
+        self.assertEqual(small, large)
+
+        results = data if isinstance(data, list) else data.get('results', [])
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0]['total_attempts'], 2)
+        self.assertEqual(results[0]['last_promise_amount'], 5000.0)
+        self.assertEqual(results[0]['last_promise_date'], str(date.today() + timedelta(days=3)))
+
+    def test_my_queue_semantics(self):
+        from django.contrib.auth.models import User
+        user = User.objects.create_user('queue-op')
+        self.operator.user = user
+        self.operator.save()
+
+        def assign(operator=None, priority=1, days_ago=0, overdue_days=30, **client_fields):
+            client = _make_client(**client_fields)
+            return Assignment.objects.create(
+                operator=operator or self.operator, client=client, credit=_make_credit(client, status='overdue'),
+                debtor_name=client.full_name, overdue_amount=Decimal('10000'), overdue_days=overdue_days,
+                priority=priority, assignment_date=date.today() - timedelta(days=days_ago),
+            )
+
+        low_priority = assign(priority=2)
+        older = assign(priority=1, days_ago=1)
+        newer = assign(priority=1)
+        assign(overdue_days=0)                   # просрочки нет
+        assign(contact_refused=True)             # 230-ФЗ: отказ от взаимодействия
+        assign(is_bankrupt=True)                 # 230-ФЗ: банкрот
+        assign(operator=_make_operator())        # чужая очередь
+        self.api.force_authenticate(user)
+        resp = self.api.get('/api/assignments/my_queue/')
+        self.assertEqual(resp.status_code, 200)
+        # Приоритет 1 первым, при равном приоритете — новые назначения раньше
+        self.assertEqual([row['id'] for row in resp.json()], [newer.id, older.id, low_priority.id])
+
+
+# =====================================================================
+# 8. Тесты Client 360 (загрузчик и кэш)
+# =====================================================================
+
+class Client360LoaderTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.client_obj = _make_client()
+        self.operator = _make_operator()
+
+    def _add_credit(self, dpd=40):
+        cr = _make_credit(self.client_obj, status='overdue')
+        CreditState.objects.create(
+            credit=cr, state_date=date.today(),
+            principal_debt=Decimal('100000'), overdue_principal=Decimal('20000'),
+            overdue_days=dpd,
+        )
+        Intervention.objects.create(
+            client=self.client_obj, credit=cr, operator=self.operator,
+            datetime=timezone.now(), intervention_type='phone', status='no_answer',
+        )
+        return cr
+
+    def _profile_queries(self):
+        from .services.client_profile import Client360Loader
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            data = Client360Loader.get_profile(self.client_obj.id)
+        return len(ctx.captured_queries), data
+
+    def test_fixed_query_count(self):
+        self._add_credit()
+        small, _ = self._profile_queries()
+        for _ in range(4):
+            self._add_credit()
+        large, data = self._profile_queries()
+        self.assertEqual(small, large)
+        self.assertEqual(len(data['credits']), 5)
+        self.assertEqual(data['total_debt'], 500000.0)
+        self.assertEqual(data['total_overdue'], 100000.0)
+
+    def test_cache_invalidated_on_write(self):
+        self._add_credit()
+        resp = self.api.get(f'/api/clients/{self.client_obj.id}/profile_360/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()['interventions']), 1)
+
+        with self.assertNumQueries(1):  # только get_object() — права и 404 до кэша
+            self.api.get(f'/api/clients/{self.client_obj.id}/profile_360/')
+
+        self._add_credit()
+        resp = self.api.get(f'/api/clients/{self.client_obj.id}/profile_360/')
+        self.assertEqual(len(resp.json()['credits']), 2)
+        self.assertEqual(len(resp.json()['interventions']), 2)
+
+    def test_profile_in_shared_cache(self):
+        from django.core.cache import caches
+        from .services.client_profile import Client360Loader
+        shared = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared-test'}
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                                   'shared': shared}, SHARED_CACHE='shared'):
+            self.addCleanup(caches['shared'].clear)
+            key = Client360Loader.cache_key(self.client_obj.id)
+            Client360Loader.get_profile(self.client_obj.id)
+            self.assertIsNotNone(caches['shared'].get(key))
+            self.assertIsNone(caches['default'].get(key))
+            Client360Loader.invalidate(self.client_obj.id)
+            self.assertIsNone(caches['shared'].get(key))
+
+    def test_missing_client_404(self):
+        resp = self.api.get('/api/clients/999999/profile_360/')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_bulk_state_refresh_invalidates(self):
+        from .services.client_profile import Client360Loader
+        cr = self._add_credit(dpd=40)
+        self.assertEqual(Client360Loader.get_profile(self.client_obj.id)['credits'][0]['current_overdue_days'], 40)
+        # Как ночной пересчёт и amortization: состояния через bulk_create, без сигналов
+        CreditState.objects.bulk_create([
+            CreditState(credit=cr, client=self.client_obj, state_date=date.today() + timedelta(days=1),
+                        overdue_days=95),
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            Credit.refresh_current_states()
+        profile = Client360Loader.get_profile(self.client_obj.id)
+        self.assertEqual(profile['credits'][0]['current_overdue_days'], 95)
+        self.assertEqual(profile['credits'][0]['current_bucket'], '90+')
+
+
+# =====================================================================
+# 9. Тесты курсорной пагинации и ?fields=
+# =====================================================================
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        c = _make_client()
+        self.credit = _make_credit(c, status='overdue')
+        for i in range(5):
+            CreditState.objects.create(
+                credit=self.credit, client=c, state_date=date.today() - timedelta(days=30 * i),
+                principal_debt=Decimal('100000'), overdue_days=i * 10,
+            )
+
+    def test_cursor_walks_all_pages(self):
+        seen = []
+        url = '/api/credit-states/?page_size=2'
+        while url:
+            resp = self.api.get(url)
+            self.assertEqual(resp.status_code, 200)
+            data = resp.json()
+            self.assertLessEqual(len(data['results']), 2)
+            seen.extend(r['state_date'] for r in data['results'])
+            url = data['next']
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_sparse_fields_narrow_response_and_sql(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.api.get('/api/credits/?fields=id,status,client_name&page_size=10')
+        self.assertEqual(resp.status_code, 200)
+        row = resp.json()['results'][0]
+        self.assertEqual(set(row), {'id', 'status', 'client_name'})
+        select = [q['sql'] for q in ctx.captured_queries if 'collection_app_credit' in q['sql']][-1]
+        self.assertNotIn('principal_amount', select)
+        self.assertIn('full_name', select)
+
+    def test_sparse_fields_with_computed_field(self):
+        resp = self.api.get('/api/credits/?fields=id,delinquency_bucket,days_past_due')
+        row = resp.json()['results'][0]
+        self.assertEqual(row['delinquency_bucket'], 'current')
+        self.assertEqual(row['days_past_due'], 0)
+
+    def test_paginated_by_default_with_legacy_bypass(self):
+        from .pagination import KeysetPagination
+        with patch.object(KeysetPagination, 'page_size', 2), patch.object(KeysetPagination, 'max_page_size', 3):
+            data = self.api.get('/api/credit-states/').json()
+            self.assertEqual(len(data['results']), 2)
+            self.assertIsNotNone(data['next'])
+            # page_size из запроса ограничен max_page_size
+            self.assertEqual(len(self.api.get('/api/credit-states/?page_size=100').json()['results']), 3)
+            # Прежний ответ массивом — только по явному ?paginate=false
+            resp = self.api.get('/api/credit-states/?paginate=false')
+        self.assertIsInstance(resp.json(), list)
+        self.assertEqual(len(resp.json()), 5)
+
+    def test_intervention_ordering_whitelist(self):
+        resp = self.api.get('/api/interventions/?ordering=client__passport_number')
+        self.assertEqual(resp.status_code, 200)
+
+
+# =====================================================================
+# 10. Тесты потоковой выгрузки
+# =====================================================================
+
+class ExportAPITest(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_superuser('admin', 'a@a.ru', 'pass'))
+        c = _make_client()
+        self.credit = _make_credit(c, status='overdue')
+        self.states = [
+            CreditState.objects.create(
+                credit=self.credit, client=c, state_date=date.today() - timedelta(days=30 * i),
+                principal_debt=Decimal('100000.50'), overdue_days=i,
+            )
+            for i in range(3)
+        ]
+
+    def _body(self, resp):
+        return b''.join(resp.streaming_content)
+
+    def test_csv_export(self):
+        resp = self.api.get('/api/export/credit-states/?output=csv')
+        self.assertEqual(resp.status_code, 200)
+        lines = self._body(resp).decode().strip().splitlines()
+        self.assertTrue(lines[0].startswith('id,credit_id'))
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(resp['X-Export-Watermark'], str(self.states[-1].id))
+
+    def test_jsonl_incremental(self):
+        resp = self.api.get(f'/api/export/credit-states/?output=jsonl&after_id={self.states[0].id}')
+        rows = [json.loads(line) for line in self._body(resp).decode().splitlines()]
+        self.assertEqual([r['id'] for r in rows], [s.id for s in self.states[1:]])
+        self.assertEqual(rows[0]['principal_debt'], '100000.50')
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow не установлен')
+    def test_parquet_export(self):
+        import io
+        import pyarrow.parquet as pq
+        resp = self.api.get('/api/export/credit-states/?output=parquet')
+        table = pq.read_table(io.BytesIO(self._body(resp)))
+        self.assertEqual(table.num_rows, 3)
+
+    def test_requires_admin(self):
+        resp = APIClient().get('/api/export/credits/')
+        self.assertEqual(resp.status_code, 403)
+
+    def test_unknown_table(self):
+        resp = self.api.get('/api/export/users/')
+        self.assertEqual(resp.status_code, 404)
+
+
+# =====================================================================
+# 11. Тесты загрузки файлов платежей
+# =====================================================================
+
+class PaymentImportTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from .models import CollectionCase, Promise
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_superuser('admin', 'a@a.ru', 'pass'))
+        self.client_obj = _make_client()
+        self.credit = _make_credit(self.client_obj, status='overdue')
+        CreditState.objects.create(
+            credit=self.credit, client=self.client_obj, state_date=date.today() - timedelta(days=10),
+            principal_debt=Decimal('100000'), overdue_principal=Decimal('8000'),
+            overdue_interest=Decimal('2000'), overdue_start_date=date.today() - timedelta(days=40),
+            overdue_days=30,
+        )
+        self.case = CollectionCase.objects.create(client=self.client_obj, overdue_days=30)
+        self.case.credits.add(self.credit)
+        self.promise = Promise.objects.create(
+            case=self.case, promised_amount=Decimal('10000'), promised_date=date.today() + timedelta(days=5),
+        )
+
+    def _upload(self, content, name='bank.csv'):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return self.api.post(
+            '/api/payments/import/', {'file': SimpleUploadedFile(name, content.encode('utf-8'))},
+            format='multipart',
+        )
+
+    def test_csv_import_updates_state_and_promise(self):
+        content = (
+            'contract_id;payment_date;amount\n'
+            f'{self.credit.id};{date.today():%d.%m.%Y};10 000,00\n'
+            '999999;2025-01-01;100\n'
+            f'{self.credit.id};не дата;100\n'
+        )
+        resp = self._upload(content)
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual((data['rows_total'], data['rows_imported']), (3, 1))
+        self.assertEqual((data['rows_unmatched'], data['rows_invalid']), (1, 1))
+
+        self.credit.refresh_from_db()
+        self.assertEqual(self.credit.current_overdue_days, 0)
+        self.assertEqual(self.credit.status, 'active')
+        self.assertEqual(self.credit.current_state.principal_debt, Decimal('92000'))
+        self.promise.refresh_from_db()
+        self.assertEqual(self.promise.status, 'kept')
+        self.case.refresh_from_db()
+        self.assertEqual(self.case.overdue_amount, Decimal('0'))
+
+        again = self._upload(content)
+        self.assertTrue(again.json()['duplicate'])
+        self.assertEqual(self.credit.payments.count(), 1)
+
+    def test_abandoned_processing_import_retried(self):
+        import io
+        from .models import PaymentImport
+        from .services.payment_import import PaymentImportService
+        content = f'contract_id;payment_date;amount\n{self.credit.id};{date.today():%Y-%m-%d};500\n'.encode()
+        file_hash = PaymentImportService.file_hash(io.BytesIO(content))
+        stuck = PaymentImport.objects.create(file_hash=file_hash, file_name='bank.csv', file_format='csv',
+                                             rows_total=7)
+
+        # Идёт загрузка в другом процессе — повтор считается дублем
+        job = PaymentImportService.import_file(io.BytesIO(content), file_name='bank.csv')
+        self.assertTrue(job.duplicate)
+        self.assertEqual(self.credit.payments.count(), 0)
+
+        # Процесс убит: processing дольше PROCESSING_TIMEOUT — загрузка перезапускается
+        PaymentImport.objects.filter(pk=stuck.pk).update(
+            started_at=timezone.now() - timedelta(seconds=PaymentImportService.PROCESSING_TIMEOUT + 60),
+        )
+        job = PaymentImportService.import_file(io.BytesIO(content), file_name='bank.csv')
+        self.assertFalse(job.duplicate)
+        self.assertEqual((job.pk, job.status, job.rows_total, job.rows_imported), (stuck.pk, 'completed', 1, 1))
+        self.assertEqual(self.credit.payments.count(), 1)
+
+    def test_running_import_row_locked_against_reclaim(self):
+        import io
+        from django.db.models.query import QuerySet
+        from .services.payment_import import PaymentImportService
+        locks = []
+        select_for_update = QuerySet.select_for_update
+
+        def spy(qs, **kwargs):
+            locks.append((qs.model.__name__, kwargs))
+            return select_for_update(qs, **kwargs)
+
+        content = f'contract_id;payment_date;amount\n{self.credit.id};{date.today():%Y-%m-%d};500\n'.encode()
+        with patch.object(QuerySet, 'select_for_update', spy), \
+                patch.object(connection.features, 'has_select_for_update_skip_locked', True):
+            job = PaymentImportService.import_file(io.BytesIO(content), file_name='bank.csv')
+            # Идущая загрузка держит FOR UPDATE на своей строке весь импорт
+            self.assertEqual(locks, [('PaymentImport', {})])
+            job.status = 'failed'
+            job.save()
+            PaymentImportService.import_file(io.BytesIO(content), file_name='bank.csv')
+        # Перезапуск пропускает заблокированную строку (SKIP LOCKED)
+        self.assertIn(('PaymentImport', {'skip_locked': True}), locks)
+
+    def test_xml_statement(self):
+        import io
+        from .services.payment_import import PaymentImportService
+        xml = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Statement xmlns="urn:bank:statement">'
+            f'<Payment><ContractId>{self.credit.id}</ContractId>'
+            f'<Date>{date.today():%Y-%m-%d}</Date><Amount>3000.00</Amount></Payment>'
+            '</Statement>'
+        )
+        job = PaymentImportService.import_file(io.BytesIO(xml.encode()), file_name='st.xml')
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.rows_imported, 1)
+        self.promise.refresh_from_db()
+        self.assertEqual(self.promise.status, 'pending')
+        self.assertEqual(self.promise.actual_amount, Decimal('3000'))
+
+
+# =====================================================================
+# 12. Тесты графиков погашения
+# =====================================================================
+
+class AmortizationEngineTest(TestCase):
+    def setUp(self):
+        self.client_obj = _make_client()
+        self.credit = _make_credit(
+            self.client_obj, open_date=date(2025, 1, 31), planned_close_date=date(2027, 1, 31),
+            principal_amount=Decimal('120000'), monthly_payment=Decimal('6000'), interest_rate=Decimal('12'),
+        )
+
+    def test_annuity_schedule(self):
+        from .services.amortization import AmortizationEngine
+        schedule = AmortizationEngine.credit_schedule(self.credit, end_date=date(2025, 4, 27))
+        self.assertEqual(
+            [str(d) for d in schedule.state_date], ['2025-01-31', '2025-02-28', '2025-03-31'],
+        )
+        # B1 = 120000 * 1.01 - 6000
+        self.assertAlmostEqual(schedule.principal_debt[1], 115200.0)
+        self.assertAlmostEqual(schedule.interest[0], 1200.0)
+
+    def test_fill_gaps_is_idempotent(self):
+        from .services.amortization import AmortizationEngine
+        CreditState.objects.create(
+            credit=self.credit, client=self.client_obj, state_date=date(2025, 3, 31),
+            principal_debt=Decimal('110000'),
+        )
+        stats = AmortizationEngine.fill_gaps(today=date(2025, 6, 15), seed=1)
+        # 31.01, 28.02, (31.03 уже есть), 28.04 — короткий месяц, 31.05
+        self.assertEqual(stats.states_created, 4)
+        self.assertEqual(self.credit.states.count(), 5)
+        self.assertEqual(
+            self.credit.states.get(state_date=date(2025, 3, 31)).principal_debt, Decimal('110000'),
+        )
+        self.credit.refresh_from_db()
+        self.assertEqual(self.credit.current_state.state_date, date(2025, 5, 31))
+
+        again = AmortizationEngine.fill_gaps(today=date(2025, 6, 15), seed=1)
+        self.assertEqual((again.credits_fixed, again.states_created), (0, 0))
+
+    def test_recalculate_after_restructuring(self):
+        from .services.amortization import AmortizationEngine
+        AmortizationEngine.fill_gaps(today=date(2025, 6, 15), simulate=False)
+        self.credit.monthly_payment = Decimal('3000')
+        self.credit.interest_rate = Decimal('0')
+        self.credit.save()
+
+        written = AmortizationEngine.recalculate_credit(
+            self.credit, from_date=date(2025, 4, 1), end_date=date(2025, 8, 1),
+        )
+        self.assertEqual(written, 4)
+        base = self.credit.states.get(state_date=date(2025, 3, 31)).principal_debt
+        debts = list(
+            self.credit.states.filter(state_date__gte=date(2025, 4, 1))
+            .order_by('state_date').values_list('principal_debt', flat=True)
+        )
+        self.assertEqual(debts, [base, base - 3000, base - 6000, base - 9000])
+
+
+# =====================================================================
+# 13. Тесты компилируемых правил workflow
+# =====================================================================
+
+class WorkflowRuleEngineTest(TestCase):
+    def setUp(self):
+        from .models import CollectionCase, WorkflowRule
+        from .services.workflow_service import WorkflowEngine
+        cache.clear()
+        WorkflowEngine.invalidate_rules()
+        self.rule = WorkflowRule.objects.create(
+            name='DPD 30+', from_stage='soft_early', to_stage='soft_late',
+            conditions={'overdue_days': {'gte': 30}, 'days_in_stage': {'gte': 5}, 'has_operator': {'eq': False}},
+            actions={'create_task': 'call_followup', 'change_priority': 4},
+        )
+        client = _make_client()
+        old = timezone.now() - timedelta(days=10)
+        self.hit = CollectionCase.objects.create(client=client, stage='soft_early', overdue_days=45, stage_changed_at=old)
+        self.fresh = CollectionCase.objects.create(client=client, stage='soft_early', overdue_days=45,
+                                                   stage_changed_at=timezone.now())
+        self.low_dpd = CollectionCase.objects.create(client=client, stage='soft_early', overdue_days=10, stage_changed_at=old)
+        self.other_stage = CollectionCase.objects.create(client=client, stage='hard', overdue_days=90, stage_changed_at=old)
+
+    def test_q_matches_predicate(self):
+        from .models import CollectionCase
+        from .services.workflow_service import WorkflowEngine
+        compiled = WorkflowEngine.get_compiled_rules()['soft_early'][0]
+        self.assertIsNotNone(compiled.q)
+        sql_ids = WorkflowEngine.match_case_ids(compiled)
+        py_ids = [
+            case.id for case in CollectionCase.objects.filter(stage='soft_early')
+            if compiled.predicate(WorkflowEngine._extract_case_data(case))
+        ]
+        self.assertEqual(sorted(sql_ids), sorted(py_ids))
+        self.assertEqual(sql_ids, [self.hit.id])
+
+    def test_rules_cached_until_rule_changes(self):
+        from .services.workflow_service import WorkflowEngine
+        WorkflowEngine.evaluate_rules(self.hit)
+        with self.assertNumQueries(0):
+            triggered = WorkflowEngine.evaluate_rules(self.hit)
+        self.assertEqual([t['rule'].id for t in triggered], [self.rule.id])
+
+        self.rule.conditions = {'overdue_days': {'gte': 60}}
+        self.rule.save()
+        self.assertEqual(WorkflowEngine.evaluate_rules(self.hit), [])
+
+    def test_rule_change_in_other_process_picked_up(self):
+        from .models import WorkflowRule
+        from .services.workflow_service import WorkflowEngine
+        self.assertEqual(len(WorkflowEngine.evaluate_rules(self.hit)), 1)
+        # Правка в другом процессе: сигнал этого процесса не срабатывает
+        WorkflowRule.objects.filter(pk=self.rule.pk).update(
+            conditions={'overdue_days': {'gte': 60}}, updated_at=timezone.now() + timedelta(seconds=1),
+        )
+        self.assertEqual(len(WorkflowEngine.evaluate_rules(self.hit)), 1)  # до следующей проверки версии
+        with patch.object(WorkflowEngine, 'RULES_CHECK_INTERVAL', 0):
+            self.assertEqual(WorkflowEngine.evaluate_rules(self.hit), [])
+            with patch.object(WorkflowEngine, 'invalidate_rules'):  # удаление в другом процессе
+                WorkflowRule.objects.filter(pk=self.rule.pk).delete()
+            self.assertEqual(WorkflowEngine.get_compiled_rules(), {})
+
+    def test_run_rules_in_bulk(self):
+        from .models import CollectionStageHistory, CommunicationTask
+        from .services.workflow_service import WorkflowEngine
+        stats = WorkflowEngine.run_rules(dry_run=True)
+        self.assertEqual(stats['cases'], 1)
+        self.hit.refresh_from_db()
+        self.assertEqual(self.hit.stage, 'soft_early')
+
+        WorkflowEngine.run_rules()
+        self.hit.refresh_from_db()
+        self.assertEqual((self.hit.stage, self.hit.priority), ('soft_late', 4))
+        self.assertTrue(CollectionStageHistory.objects.filter(case=self.hit, auto_transition=True).exists())
+        self.assertTrue(CommunicationTask.objects.filter(case=self.hit, task_type='call_followup').exists())
+        self.fresh.refresh_from_db()
+        self.assertEqual(self.fresh.stage, 'soft_early')
+
+
+# =====================================================================
+# 14. Тесты воркера запланированных действий
+# =====================================================================
+
+class ScheduledActionWorkerTest(TestCase):
+    def setUp(self):
+        from .models import CollectionCase, ScheduledAction
+        case = CollectionCase.objects.create(client=_make_client(), stage='soft_early')
+        past = timezone.now() - timedelta(minutes=5)
+        ScheduledAction.objects.bulk_create(
+            [ScheduledAction(case=case, action_type='send_sms', scheduled_at=past) for _ in range(5)]
+            + [ScheduledAction(case=case, action_type='create_task', scheduled_at=past)]
+            + [ScheduledAction(case=case, action_type='send_sms', scheduled_at=timezone.now() + timedelta(days=1))]
+        )
+
+    def test_claims_do_not_overlap(self):
+        from .services.workflow_service import WorkflowEngine
+        first = WorkflowEngine.claim_scheduled_actions(batch_size=4)
+        second = WorkflowEngine.claim_scheduled_actions(batch_size=4)
+        self.assertEqual((len(first), len(second)), (4, 2))
+        self.assertFalse({a.id for a in first} & {a.id for a in second})
+        self.assertEqual(WorkflowEngine.claim_scheduled_actions(), [])
+
+    def test_process_in_batches_with_latency(self):
+        from .models import CommunicationTask, ScheduledAction
+        from .services.workflow_service import WorkflowEngine
+        with patch.object(WorkflowEngine, '_send_sms', side_effect=[None, None, None, None, RuntimeError('gateway')]):
+            stats = WorkflowEngine.process_scheduled_actions(batch_size=2)
+        self.assertEqual((stats['executed'], stats['failed']), (5, 1))
+        self.assertEqual(stats['latency']['send_sms']['count'], 5)
+        self.assertEqual(CommunicationTask.objects.count(), 1)
+        self.assertEqual(ScheduledAction.objects.filter(status='pending').count(), 1)
+        self.assertFalse(ScheduledAction.objects.filter(status='processing').exists())
+
+    def test_result_not_written_after_claim_lost(self):
+        from .models import ScheduledAction
+        from .services.workflow_service import WorkflowEngine
+        actions = WorkflowEngine.claim_scheduled_actions(batch_size=2)
+        slow, fast = actions
+
+        def execute(action):
+            if action.pk == slow.pk:
+                # Дольше CLAIM_TIMEOUT: действие отдано и захвачено другим воркером
+                ScheduledAction.objects.filter(pk=slow.pk).update(claim_token='other')
+
+        with patch.object(WorkflowEngine, '_execute_scheduled_action', side_effect=execute), \
+                self.assertLogs('collection_app.services.workflow_service', 'WARNING'):
+            results = WorkflowEngine._run_claimed_actions(actions, workers=1)
+        self.assertEqual([action.pk for action, _ in results], [fast.pk])
+        slow_row = ScheduledAction.objects.get(pk=slow.pk)
+        self.assertEqual((slow_row.status, slow_row.claim_token), ('processing', 'other'))
+        self.assertEqual(ScheduledAction.objects.get(pk=fast.pk).status, 'executed')
+
+    def test_stale_claims_released(self):
+        from .models import ScheduledAction
+        from .services.workflow_service import WorkflowEngine
+        WorkflowEngine.claim_scheduled_actions(batch_size=2)
+        ScheduledAction.objects.filter(status='processing').update(
+            claimed_at=timezone.now() - timedelta(seconds=WorkflowEngine.CLAIM_TIMEOUT + 1),
+        )
+        self.assertEqual(WorkflowEngine.release_stale_claims(), 2)
+        self.assertEqual(ScheduledAction.objects.filter(status='pending').count(), 7)
+
+
+# =====================================================================
+# 15. Тесты планировщика периодических задач
+# =====================================================================
+
+class PeriodicSchedulerTest(TestCase):
+    def test_cron_next_after(self):
+        from datetime import datetime, timezone as dt_timezone
+        from .services.scheduler import CronSchedule
+        moment = datetime(2025, 1, 31, 23, 59, tzinfo=dt_timezone.utc)
+        self.assertEqual(CronSchedule('0 2 * * *').next_after(moment), datetime(2025, 2, 1, 2, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(CronSchedule('*/15 * * * *').next_after(moment), datetime(2025, 2, 1, 0, 0, tzinfo=dt_timezone.utc))
+        # 1-е число или понедельник (2025-02-03)
+        self.assertEqual(CronSchedule('30 9 1 * 1').next_after(datetime(2025, 2, 1, 10, 0, tzinfo=dt_timezone.utc)),
+                         datetime(2025, 2, 3, 9, 30, tzinfo=dt_timezone.utc))
+        with self.assertRaises(ValueError):
+            CronSchedule('61 * * * *')
+
+    def test_tick_runs_due_jobs_with_history(self):
+        from .models import JobRun, PeriodicJob
+        from .services.scheduler import PeriodicScheduler
+        job = PeriodicJob.objects.create(
+            name='Алерты', task='pre_collection_alerts', schedule='0 4 * * *',
+            next_run_at=timezone.now() - timedelta(minutes=1),
+        )
+        PeriodicJob.objects.create(name='Будущая', task='check_promises', schedule='0 4 * * *',
+                                   next_run_at=timezone.now() + timedelta(hours=1))
+        runs = PeriodicScheduler.tick(owner='a')
+        self.assertEqual([(r.job_id, r.status) for r in runs], [(job.id, 'success')])
+        self.assertEqual(runs[0].rows_affected, 0)
+        job.refresh_from_db()
+        self.assertIsNone(job.running_since)
+        self.assertGreater(job.next_run_at, timezone.now())
+        self.assertEqual(JobRun.objects.count(), 1)
+
+    def test_single_leader_and_overlap(self):
+        from .models import PeriodicJob
+        from .services.scheduler import PeriodicScheduler
+        self.assertTrue(PeriodicScheduler.acquire_lease('a'))
+        self.assertFalse(PeriodicScheduler.acquire_lease('b'))
+        self.assertEqual(PeriodicScheduler.tick(owner='b'), [])
+        PeriodicScheduler.release_lease('a')
+        self.assertTrue(PeriodicScheduler.acquire_lease('b'))
+
+        job = PeriodicJob.objects.create(name='Обещания', task='check_promises', schedule='0 3 * * *',
+                                         running_since=timezone.now())
+        run = PeriodicScheduler.run_job(job, owner='b')
+        self.assertEqual(run.status, 'skipped')
+
+    def test_lease_held_while_job_outlives_ttl(self):
+        from .models import PeriodicJob
+        from .services import scheduler
+        from .services.scheduler import JOB_TASKS, PeriodicScheduler
+        standby_runs = []
+
+        def long_task(params):
+            # Прошло больше LEASE_TTL, задача ещё идёт — резервный экземпляр ждёт
+            later = timezone.now() + timedelta(seconds=PeriodicScheduler.LEASE_TTL + 60)
+            with patch.object(scheduler.timezone, 'now', return_value=later):
+                standby_runs.append(PeriodicScheduler.tick(owner='standby'))
+            return 1
+
+        due = timezone.now() - timedelta(minutes=1)
+        PeriodicJob.objects.create(name='Долгая', task='long', schedule='0 1 * * *',
+                                   next_run_at=due, max_runtime_minutes=30)
+        PeriodicJob.objects.create(name='Следующая', task='check_promises', schedule='0 3 * * *',
+                                   next_run_at=due + timedelta(seconds=1))
+        with patch.dict(JOB_TASKS, {'long': long_task}):
+            runs = PeriodicScheduler.tick(owner='leader')
+        self.assertEqual(standby_runs, [[]])
+        self.assertEqual([r.status for r in runs], ['success', 'success'])
+        self.assertFalse(PeriodicScheduler.acquire_lease('standby'))
+
+    def test_failed_job_recorded(self):
+        from .models import PeriodicJob
+        from .services.scheduler import PeriodicScheduler
+        job = PeriodicJob.objects.create(name='Нет такой', task='unknown', schedule='0 3 * * *')
+        run = PeriodicScheduler.run_job(job)
+        self.assertEqual(run.status, 'failed')
+        self.assertIn('unknown', run.error)
+        job.refresh_from_db()
+        self.assertIsNone(job.running_since)
+
+
+# =====================================================================
+# 16. Тесты pre-collection алертов
+# =====================================================================
+
+class PreCollectionAlertBulkTest(TestCase):
+    def _state(self, credit, days_ago, overdue_days=0):
+        CreditState.objects.create(
+            credit=credit, client=credit.client, state_date=date.today() - timedelta(days=days_ago),
+            principal_debt=Decimal('100000'), overdue_days=overdue_days,
+        )
+
+    def setUp(self):
+        client = _make_client(income=Decimal('50000'), monthly_expenses=Decimal('20000'))
+        self.risky = _make_credit(client)  # DTI (15000 + 20000) / 50000 = 0.7
+        for days_ago in (90, 60, 30):
+            self._state(self.risky, days_ago, overdue_days=10)
+        self._state(self.risky, 1, overdue_days=5)
+
+        calm_client = _make_client(income=Decimal('300000'))
+        self.calm = _make_credit(calm_client)
+        self._state(self.calm, 1)
+        self.no_states = _make_credit(calm_client)
+        self.overdue_only = _make_credit(calm_client)
+        self._state(self.overdue_only, 1, overdue_days=3)
+
+    def test_scores_match_single_credit_formula(self):
+        from .services.workflow_service import WorkflowEngine
+        scores = dict(WorkflowEngine.early_warning_queryset(Credit.objects.all()).values_list('id', 'early_warning_score'))
+        self.assertAlmostEqual(scores[self.risky.id], 1.15)
+        self.assertAlmostEqual(scores[self.calm.id], 0.5)
+        self.assertAlmostEqual(scores[self.no_states.id], 0.5)
+        self.assertAlmostEqual(scores[self.overdue_only.id], 0.8)
+        self.assertEqual(WorkflowEngine._calculate_early_warning_score(self.risky), 1.0)
+
+    def test_bulk_alerts_skip_existing(self):
+        from .models import PreCollectionAlert
+        from .services.workflow_service import WorkflowEngine
+        with self.assertNumQueries(2):
+            created = WorkflowEngine.create_pre_collection_alerts()
+        self.assertEqual(created, 2)
+        alerts = dict(PreCollectionAlert.objects.values_list('credit_id', 'risk_score'))
+        self.assertEqual(alerts, {self.risky.id: 1.0, self.overdue_only.id: 0.8})
+        self.assertEqual(WorkflowEngine.create_pre_collection_alerts(), 0)
+
+
+# =====================================================================
+# 17. Тесты пакетной проверки обещаний
+# =====================================================================
+
+class PromiseMatcherTest(TestCase):
+    def setUp(self):
+        from .models import ClientBehaviorProfile, CollectionCase, Payment, Promise
+        self.client_obj = _make_client()
+        self.profile = ClientBehaviorProfile.objects.create(client=self.client_obj)
+        first, second = _make_credit(self.client_obj), _make_credit(self.client_obj)
+        self.case = CollectionCase.objects.create(client=self.client_obj, stage='soft_early')
+        self.case.credits.add(first, second)
+
+        today = date.today()
+        self.kept = Promise.objects.create(case=self.case, promised_amount=Decimal('10000'),
+                                           promised_date=today - timedelta(days=10))
+        self.partial = Promise.objects.create(case=self.case, promised_amount=Decimal('50000'),
+                                              promised_date=today - timedelta(days=2))
+        self.broken = Promise.objects.create(case=self.case, promised_amount=Decimal('5000'),
+                                             promised_date=today - timedelta(days=40))
+        Promise.objects.filter(pk=self.broken.pk).update(created_at=timezone.now() - timedelta(days=50))
+        Promise.objects.filter(pk__in=[self.kept.pk, self.partial.pk]).update(
+            created_at=timezone.now() - timedelta(days=20),
+        )
+        self.future = Promise.objects.create(case=self.case, promised_amount=Decimal('1000'),
+                                             promised_date=today + timedelta(days=5))
+        # Два платежа по разным кредитам кейса закрывают первое обещание
+        Payment.objects.create(credit=first, payment_date=today - timedelta(days=9), amount=Decimal('6000'))
+        Payment.objects.create(credit=second, payment_date=today - timedelta(days=8), amount=Decimal('4000'))
+
+    def test_daily_check(self):
+        from .services.promise_matcher import PromiseMatcher
+        stats = PromiseMatcher.check_due_promises(chunk_size=2)
+        self.assertEqual(stats, {'kept': 1, 'partial': 1, 'broken': 1})
+        self.kept.refresh_from_db()
+        self.assertEqual((self.kept.status, self.kept.actual_amount), ('kept', Decimal('10000')))
+        self.assertEqual(self.kept.actual_date, date.today() - timedelta(days=8))
+        # Окна обещаний пересекаются — те же платежи засчитаны и второму
+        self.partial.refresh_from_db()
+        self.assertEqual((self.partial.status, self.partial.actual_amount), ('partial', Decimal('10000')))
+        self.broken.refresh_from_db()
+        self.assertEqual(self.broken.status, 'broken')
+        self.future.refresh_from_db()
+        self.assertEqual(self.future.status, 'pending')
+
+        self.case.refresh_from_db()
+        self.assertEqual(self.case.broken_promises, 1)
+        self.profile.refresh_from_db()
+        self.assertAlmostEqual(self.profile.promises_kept_ratio, 0.333)
+
+    def test_queries_do_not_grow_with_promises(self):
+        from .models import Promise
+        from .services.promise_matcher import PromiseMatcher
+        for _ in range(20):
+            Promise.objects.create(case=self.case, promised_amount=Decimal('100'),
+                                   promised_date=date.today() - timedelta(days=1))
+        promises = list(Promise.objects.filter(status='pending'))
+        # связи кейсов, платежи, обещания, кейсы (UPDATE ... + F), признаки клиента (3),
+        # отметка к пересчёту профиля + savepoint
+        with self.assertNumQueries(11):
+            PromiseMatcher.match_promises(promises, escalate=False)
+
+
+# =====================================================================
+# 18. Тесты пакетного психотипирования
+# =====================================================================
+
+class BatchPsychotypingTest(TestCase):
+    def _reference(self, client):
+        """Поклиентский расчёт через PsychotypingService (как прежний classify_client)"""
+        from .ml.psychotyping import PsychotypingService
+        overdue_days = 0
+        for credit in client.credits.filter(status='overdue'):
+            last_payment = credit.payments.order_by('-payment_date').first()
+            if last_payment and last_payment.planned_date:
+                overdue_days = max(overdue_days, (date.today() - last_payment.planned_date).days)
+        return PsychotypingService().determine_psychotype(
+            client_data={
+                'income': float(client.income),
+                'total_debt': sum(float(c.current_state.principal_debt) for c in client.credits.all() if c.current_state),
+                'overdue_days': overdue_days,
+            },
+            payments=[
+                {'amount': float(p.amount), 'min_payment': float(p.min_payment), 'overdue_days': p.overdue_days}
+                for c in client.credits.all() for p in c.payments.all()
+            ],
+            interventions=[{'status': i.status} for i in client.interventions.all()],
+            promises=[{'kept': False, 'partial': False} for _ in client.interventions.filter(status='promise')],
+        )
+
+    def setUp(self):
+        from .models import Payment
+        operator = _make_operator()
+        self.clients = [
+            _make_client(income=Decimal('25000')),
+            _make_client(income=Decimal('150000')),
+            _make_client(income=Decimal('0')),
+            _make_client(income=Decimal('60000')),
+        ]
+        for n, client in enumerate(self.clients[:3]):
+            credit = _make_credit(client, status='overdue' if n != 1 else 'active')
+            CreditState.objects.create(credit=credit, client=client, state_date=date.today(),
+                                       principal_debt=Decimal('200000') * (n + 1))
+            for k in range(3 + n):
+                Payment.objects.create(
+                    credit=credit, payment_date=date.today() - timedelta(days=30 * (k + 1)),
+                    planned_date=date.today() - timedelta(days=30 * (k + 1) + n * 5),
+                    amount=Decimal('15000') if k % 2 else Decimal('500'), min_payment=Decimal('1500'),
+                    overdue_days=0 if k % 3 else 10,
+                )
+            statuses = ['completed', 'no_answer', 'promise', 'refuse'][:n + 2]
+            for status in statuses:
+                Intervention.objects.create(
+                    client=client, credit=credit, operator=operator, datetime=timezone.now(),
+                    intervention_type='phone', status=status,
+                )
+
+    def test_batch_matches_single_client_scoring(self):
+        from .ml.psychotyping import classify_clients
+        results = classify_clients([c.id for c in self.clients])
+        for client in self.clients:
+            expected = self._reference(client)
+            self.assertEqual(results[client.id].psychotype, expected.psychotype, client.id)
+            self.assertEqual(results[client.id].confidence, expected.confidence, client.id)
+            self.assertEqual(results[client.id].factors, expected.factors, client.id)
+
+    def test_profiles_upserted(self):
+        from .models import ClientBehaviorProfile
+        from .ml.psychotyping import update_client_profiles
+        ClientBehaviorProfile.objects.create(client=self.clients[0], psychotype='toxic', promises_kept_ratio=0.4)
+        self.assertEqual(update_client_profiles(chunk_size=3), 4)
+        self.assertEqual(ClientBehaviorProfile.objects.count(), 4)
+        profile = ClientBehaviorProfile.objects.get(client=self.clients[0])
+        self.assertNotEqual(profile.psychotype, 'toxic')
+        self.assertEqual(profile.promises_kept_ratio, 0.4)
+
+
+# =====================================================================
+# 19. Тесты инкрементального пересчёта профилей
+# =====================================================================
+
+class BehaviorProfileRefreshTest(TestCase):
+    def setUp(self):
+        from .models import DirtyClient
+        self.operator = _make_operator()
+        self.client_a = _make_client()
+        self.client_b = _make_client(full_name='Пётр Сидоров')
+        self.credit_a = _make_credit(self.client_a)
+        self.credit_b = _make_credit(self.client_b)
+        DirtyClient.objects.all().delete()
+
+    def _contact(self, client, credit, hour, status='completed', kind='phone'):
+        moment = timezone.now().replace(hour=hour, minute=0, second=0, microsecond=0)
+        return Intervention.objects.create(
+            client=client, credit=credit, operator=self.operator, datetime=moment,
+            intervention_type=kind, status=status,
+        )
+
+    def test_writes_mark_client_dirty(self):
+        from .models import CollectionCase, DirtyClient, Payment, Promise
+        Payment.objects.create(credit=self.credit_a, payment_date=date.today(), amount=Decimal('1000'))
+        self.assertEqual(DirtyClient.objects.get().reason, 'payment')
+        case = CollectionCase.objects.create(client=self.client_b, stage='soft_early')
+        Promise.objects.create(case=case, promised_amount=Decimal('500'), promised_date=date.today())
+        self.assertEqual(
+            set(DirtyClient.objects.values_list('client_id', 'reason')),
+            {(self.client_a.id, 'payment'), (self.client_b.id, 'promise')},
+        )
+        # Повторная отметка не дублирует строку
+        self._contact(self.client_a, self.credit_a, 10)
+        self.assertEqual(DirtyClient.objects.count(), 2)
+        # Каскадное удаление клиента не оставляет отметок
+        self.client_b.delete()
+        self.assertEqual(list(DirtyClient.objects.values_list('client_id', flat=True)), [self.client_a.id])
+
+    def test_refresh_only_dirty_clients(self):
+        from .models import ClientBehaviorProfile, DirtyClient
+        from .services.behavior_refresh import BehaviorProfileRefresher
+        for hour in (18, 18, 9):
+            self._contact(self.client_a, self.credit_a, hour, kind='sms')
+        self._contact(self.client_a, self.credit_a, 9, status='no_answer')
+        self._contact(self.client_a, self.credit_a, 9, status='no_answer')
+        ClientBehaviorProfile.objects.create(client=self.client_b, best_contact_hour=7)
+        DirtyClient.objects.filter(client=self.client_b).delete()
+
+        stats = BehaviorProfileRefresher.refresh_dirty(batch_size=1)
+        self.assertEqual(stats, {'clients': 1, 'batches': 1})
+        self.assertFalse(DirtyClient.objects.exists())
+
+        profile = ClientBehaviorProfile.objects.get(client=self.client_a)
+        self.assertEqual((profile.best_contact_hour, profile.preferred_channel), (18, 'sms'))
+        self.assertEqual(profile.best_contact_day, timezone.now().weekday())
+        self.assertEqual((profile.total_contacts, profile.successful_contacts), (5, 3))
+        # Клиент без отметки не пересчитан
+        self.assertEqual(ClientBehaviorProfile.objects.get(client=self.client_b).best_contact_hour, 7)
+
+    def test_remark_during_refresh_stays_queued(self):
+        from .models import DirtyClient
+        from .services.behavior_refresh import BehaviorProfileRefresher
+        BehaviorProfileRefresher.mark_dirty([self.client_a.id, self.client_b.id], reason='manual')
+        original = BehaviorProfileRefresher.refresh_clients
+
+        def refresh_and_remark(client_ids, today=None):
+            result = original(client_ids, today=today)
+            DirtyClient.objects.filter(client=self.client_b).update(
+                marked_at=timezone.now() + timedelta(seconds=1),
+            )
+            return result
+
+        with patch.object(BehaviorProfileRefresher, 'refresh_clients', side_effect=refresh_and_remark):
+            stats = BehaviorProfileRefresher.refresh_dirty()
+        self.assertEqual(stats['clients'], 2)
+        self.assertEqual(list(DirtyClient.objects.values_list('client_id', flat=True)), [self.client_b.id])
+
+
+# =====================================================================
+# 20. Тесты пакетной генерации NBA
+# =====================================================================
+
+class BatchNBATest(TestCase):
+    def setUp(self):
+        from .models import ClientBehaviorProfile, Payment
+        operator = _make_operator()
+        self.pairs = []
+        profiles = [
+            dict(psychotype='unable', promises_kept_ratio=0.8, preferred_channel='sms'),
+            dict(psychotype='unwilling', promises_kept_ratio=0.1, best_contact_hour=19, best_contact_day=5),
+            dict(psychotype='toxic', promises_kept_ratio=0.5, preferred_channel='whatsapp'),
+            dict(psychotype='cooperative', promises_kept_ratio=0.6, best_contact_day=0),
+            None,
+        ]
+        segments = ['critical', 'low', 'high', 'medium', None]
+        for n, (profile, segment) in enumerate(zip(profiles, segments)):
+            client = _make_client(income=Decimal(str([20000, 90000, 0, 150000, 40000][n])))
+            if profile:
+                ClientBehaviorProfile.objects.create(client=client, **profile)
+            credit = _make_credit(client, status='overdue' if n % 2 == 0 else 'active')
+            state = CreditState.objects.create(
+                credit=credit, client=client, state_date=date.today(),
+                principal_debt=Decimal('300000') * (n + 1), overdue_principal=Decimal(str([150000, 5000, 50000, 0, 8000][n])),
+            )
+            Credit.objects.filter(pk=credit.pk).update(current_state=state)
+            Payment.objects.create(credit=credit, payment_date=date.today() - timedelta(days=40),
+                                   planned_date=date.today() - timedelta(days=20 + 30 * n), amount=Decimal('1000'))
+            if segment:
+                ScoringResult.objects.create(client=client, credit=credit, calculation_date=date.today(),
+                                             probability=0.5, risk_segment=segment)
+            for k, (kind, status) in enumerate([('phone', 'no_answer'), ('sms', 'refuse'), ('phone', 'completed')][:n]):
+                Intervention.objects.create(client=client, credit=credit, operator=operator,
+                                            datetime=timezone.now() - timedelta(hours=k + 1),
+                                            intervention_type=kind, status=status)
+            self.pairs.append((client.id, credit.id))
+
+    def test_batch_matches_single_pair_rules(self):
+        from .ml.next_best_action import NextBestActionService, collect_nba_inputs, score_nba_batch
+        service = NextBestActionService()
+        inputs = collect_nba_inputs(self.pairs)
+        for hour in (8, 12, 21):
+            now = timezone.localtime().replace(hour=hour, minute=30)
+            batch = score_nba_batch(self.pairs, inputs, now=now)
+            for (client_id, credit_id), (profile, credit_data, history), result in zip(self.pairs, inputs, batch):
+                expected = service.generate_nba(client_id, credit_id, profile, credit_data, history, now=now)
+                result = dict(result, recommended_datetime=result['recommended_datetime'].isoformat())
+                self.assertEqual(result, expected, (hour, client_id))
+
+    def test_inputs_in_fixed_number_of_queries(self):
+        from .ml.next_best_action import collect_nba_inputs
+        # клиенты с профилями, кредиты с подзапросами, контакты с оконной функцией
+        with self.assertNumQueries(3):
+            inputs = collect_nba_inputs(self.pairs)
+        self.assertEqual(len(inputs), 5)
+        profile, credit_data, history = inputs[3]
+        self.assertEqual(credit_data['risk_segment'], 'medium')
+        # История по возрастанию времени: последний контакт — в конце
+        self.assertEqual([c['result'] for c in history], ['completed', 'refuse', 'no_answer'])
+
+    def test_unknown_pair_and_bad_operator_id(self):
+        from .ml.next_best_action import collect_nba_inputs
+        with self.assertRaises(ValueError):
+            collect_nba_inputs(self.pairs + [(999999, self.pairs[0][1])])
+        api = APIClient()
+        for operator_id in ('abc', '1.5', '-1'):
+            resp = api.post('/api/assignments/prewarm_nba/', {'operator_id': operator_id})
+            self.assertEqual(resp.status_code, 400, operator_id)
+        resp = api.post('/api/assignments/prewarm_nba/', {'operator_id': '999999'})
+        self.assertEqual(resp.json(), {'operator_id': 999999, 'created': 0})
+
+    def test_save_expires_previous_pending(self):
+        from .models import NextBestAction
+        from .ml.next_best_action import save_nba_batch
+        first = save_nba_batch(self.pairs)
+        self.assertEqual(len(first), 5)
+        save_nba_batch(self.pairs[:2], chunk_size=1)
+        self.assertEqual(NextBestAction.objects.filter(status='pending').count(), 5)
+        self.assertEqual(NextBestAction.objects.filter(status='expired').count(), 2)
+
+    def test_client_generate_nba_endpoint(self):
+        client_id = self.pairs[0][0]
+        resp = APIClient().get(f'/api/clients/{client_id}/generate_nba/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()['recommendations']), 1)
+        self.assertEqual(resp.json()['recommendations'][0]['credit'], self.pairs[0][1])
+
+
+# =====================================================================
+# 21. Тесты кэша NBA
+# =====================================================================
+
+class NBACacheTest(TestCase):
+    def setUp(self):
+        from .models import ClientBehaviorProfile
+        cache.clear()
+        self.operator = _make_operator()
+        self.client_obj = _make_client()
+        self.profile = ClientBehaviorProfile.objects.create(client=self.client_obj, psychotype='forgetful')
+        self.credits = [_make_credit(self.client_obj), _make_credit(self.client_obj, status='overdue')]
+        self.pairs = [(self.client_obj.id, credit.id) for credit in self.credits]
+
+    def test_hit_after_first_computation(self):
+        from .services.nba_cache import NBACache
+        first = NBACache.get_many(self.pairs)
+        self.assertFalse(any(entry['cached'] for entry in first.values()))
+        with self.assertNumQueries(0):
+            second = NBACache.get_many(self.pairs)
+        self.assertTrue(all(entry['cached'] for entry in second.values()))
+        self.assertEqual(second[self.pairs[0]]['nba'], first[self.pairs[0]]['nba'])
+        stats = NBACache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['recompute_batches']), (2, 2, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_versions_in_shared_cache(self):
+        from django.core.cache import caches
+        from .services.nba_cache import NBACache
+        from .services.shared_cache import ttl
+        self.assertEqual(ttl(NBACache.CACHE_TTL, NBACache.LOCAL_CACHE_TTL), NBACache.LOCAL_CACHE_TTL)
+        shared = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared-test'}
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                                   'shared': shared}, SHARED_CACHE='shared'):
+            self.addCleanup(caches['shared'].clear)
+            NBACache.get_many(self.pairs)
+            version = caches['shared'].get(NBACache.version_key(self.client_obj.id))
+            self.assertIsNotNone(version)
+            self.assertIsNone(caches['default'].get(NBACache.version_key(self.client_obj.id)))
+            NBACache.invalidate(self.client_obj.id)
+            self.assertEqual(caches['shared'].get(NBACache.version_key(self.client_obj.id)), version + 1)
+            # Не кэш процесса (Redis) — полный TTL
+            with patch('collection_app.services.shared_cache.is_process_local', return_value=False):
+                self.assertEqual(ttl(NBACache.CACHE_TTL, NBACache.LOCAL_CACHE_TTL), NBACache.CACHE_TTL)
+
+    def test_new_contact_invalidates_all_client_credits(self):
+        from .services.nba_cache import NBACache
+        before = NBACache.get_many(self.pairs)
+        Intervention.objects.create(
+            client=self.client_obj, credit=self.credits[0], operator=self.operator,
+            datetime=timezone.now(), intervention_type='phone', status='no_answer',
+        )
+        after = NBACache.get_many(self.pairs)
+        self.assertFalse(any(entry['cached'] for entry in after.values()))
+        self.assertNotEqual(after[self.pairs[0]]['fingerprint'], before[self.pairs[0]]['fingerprint'])
+        # Входы второго кредита не изменились — пересчёт учтён как лишний
+        self.assertEqual(after[self.pairs[1]]['fingerprint'], before[self.pairs[1]]['fingerprint'])
+        self.assertEqual(NBACache.stats()['unchanged_recomputes'], 1)
+
+    def test_scoring_and_profile_writes_invalidate(self):
+        from .services.nba_cache import NBACache
+        NBACache.get_many(self.pairs)
+        ScoringResult.objects.create(client=self.client_obj, credit=self.credits[1],
+                                     calculation_date=date.today(), probability=0.9, risk_segment='critical')
+        self.assertFalse(NBACache.get(*self.pairs[1])['cached'])
+        self.assertEqual(NBACache.get(*self.pairs[1])['nba']['max_discount_percent'], 50.0)
+        self.profile.preferred_channel = 'email'
+        self.profile.save()
+        self.assertFalse(NBACache.get(*self.pairs[0])['cached'])
+
+    def test_endpoints(self):
+        api = APIClient()
+        client_id, credit_id = self.pairs[0]
+        resp = api.get(f'/api/nba/current/?client_id={client_id}&credit_id={credit_id}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['nba']['credit_id'], credit_id)
+        other = _make_client(full_name='Другой Клиент')
+        resp = api.get(f'/api/nba/current/?client_id={other.id}&credit_id={credit_id}')
+        self.assertEqual(resp.status_code, 404)
+        resp = api.get('/api/nba/cache_stats/')
+        self.assertEqual(resp.json()['misses'], 1)
+
+    def test_operator_queue_served_from_cache(self):
+        from django.contrib.auth.models import User
+        from .services.nba_cache import NBACache
+        user = User.objects.create_user('op', password='pass')
+        self.operator.user = user
+        self.operator.save()
+        for credit in self.credits:
+            Assignment.objects.create(
+                operator=self.operator, client=self.client_obj, credit=credit, debtor_name='x',
+                overdue_amount=Decimal('10000'), overdue_days=30, assignment_date=date.today(),
+            )
+        api = APIClient()
+        api.force_authenticate(user)
+        resp = api.get('/api/assignments/my_queue/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(all(row['nba']['fingerprint'] for row in resp.json()))
+        api.get('/api/assignments/my_queue/')
+        self.assertEqual(NBACache.stats()['hits'], 2)
+
+
+# =====================================================================
+# 22. Тесты пакетного прогноза возврата
+# =====================================================================
+
+class BatchReturnForecastTest(TestCase):
+    def setUp(self):
+        from .models import ClientBehaviorProfile, Payment
+        self.credit_ids = []
+        cases = [
+            # (доход, психотип, сегмент, дней просрочки, долг, частичный платёж)
+            (20000, 'unable', 'critical', 400, 900000, False),
+            (90000, 'cooperative', 'low', 10, 50000, True),
+            (0, 'unwilling', 'high', 200, 300000, False),
+            (150000, None, None, 95, 120000, True),
+            (40000, 'forgetful', 'medium', 0, 80000, False),
+        ]
+        for n, (income, psychotype, segment, overdue, debt, partial) in enumerate(cases):
+            client = _make_client(income=Decimal(str(income)))
+            if psychotype:
+                ClientBehaviorProfile.objects.create(
+                    client=client, psychotype=psychotype, total_contacts=10, successful_contacts=n * 2,
+                    promises_kept_ratio=[0.1, 0.9, 0.2, 0.5, 0.5][n], income_dropped=n == 2,
+                )
+            credit = _make_credit(client, status='overdue' if overdue else 'active')
+            state = CreditState.objects.create(credit=credit, client=client, state_date=date.today(),
+                                               principal_debt=Decimal(str(debt)))
+            Credit.objects.filter(pk=credit.pk).update(current_state=state)
+            Payment.objects.create(credit=credit, payment_date=date.today() - timedelta(days=overdue + 5),
+                                   planned_date=date.today() - timedelta(days=overdue),
+                                   amount=Decimal('500' if partial else '15000'), min_payment=Decimal('15000'))
+            if segment:
+                ScoringResult.objects.create(client=client, credit=credit, calculation_date=date.today(),
+                                             probability=0.5, risk_segment=segment)
+            self.credit_ids.append(credit.id)
+
+    def test_batch_matches_scalar_service(self):
+        from .ml.return_forecast import ReturnForecastService, collect_forecast_inputs, forecast_credits
+        inputs = collect_forecast_inputs(self.credit_ids)
+        self.assertEqual(inputs['overdue_days'].tolist(), [400, 10, 200, 95, 0])
+        self.assertEqual(inputs['partial_payments'].tolist(), [False, True, False, True, False])
+        service = ReturnForecastService()
+        for i, result in enumerate(forecast_credits(self.credit_ids)):
+            expected = service.forecast(
+                client_data={'income': inputs['income'][i], 'employment': inputs['employment'][i]},
+                behavior_profile={
+                    'psychotype': inputs['psychotype'][i], 'contact_rate': inputs['contact_rate'][i],
+                    'promises_kept_ratio': inputs['promises_kept_ratio'][i],
+                    'job_changed_recently': inputs['job_changed_recently'][i],
+                    'income_dropped': inputs['income_dropped'][i],
+                    'multiple_credits': inputs['multiple_credits'][i],
+                },
+                credit_data={'total_debt': inputs['total_debt'][i], 'overdue_days': int(inputs['overdue_days'][i]),
+                             'risk_segment': inputs['risk_segment'][i]},
+                contact_history=[{'type': 'payment', 'partial': bool(inputs['partial_payments'][i])}],
+            )
+            for field in ('return_probability', 'partial_return_probability', 'expected_return_days',
+                          'recommendation', 'recommendation_confidence', 'positive_factors', 'negative_factors'):
+                self.assertEqual(getattr(result, field), getattr(expected, field), (i, field))
+            for field in ('expected_return_amount', 'npv_continue', 'npv_sell', 'npv_write_off'):
+                self.assertLessEqual(abs(getattr(result, field) - getattr(expected, field)), Decimal('0.01'), (i, field))
+
+    def test_inputs_in_fixed_number_of_queries(self):
+        from .ml.return_forecast import collect_forecast_inputs
+        # кредиты с подзапросами, последние платежи с оконной функцией
+        with self.assertNumQueries(2):
+            collect_forecast_inputs(self.credit_ids)
+
+    def test_portfolio_bulk_creates_overdue_forecasts(self):
+        from .models import ReturnForecast
+        from .ml.return_forecast import forecast_portfolio
+        self.assertEqual(forecast_portfolio(chunk_size=3), 4)
+        forecasts = ReturnForecast.objects.order_by('credit_id')
+        self.assertEqual([f.credit_id for f in forecasts], self.credit_ids[:4])
+        self.assertEqual(forecasts[0].recommendation, 'write_off')
+        self.assertEqual(forecasts[0].expected_return_date,
+                         date.today() + timedelta(days=forecasts[0].expected_return_days))
+
+    def test_credit_forecast_endpoint(self):
+        resp = APIClient().get(f'/api/credits/{self.credit_ids[1]}/forecast/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('Делает частичные платежи', resp.json()['forecast']['positive_factors'])
+
+
+# =====================================================================
+# 23. Тесты Монте-Карло симуляции транша
+# =====================================================================
+
+class PortfolioSimulationTest(TestCase):
+    def setUp(self):
+        from .models import Payment
+        cache.clear()
+        self.credits = {'high': [], 'low': []}
+        for n in range(6):
+            segment = 'high' if n < 4 else 'low'
+            client = _make_client(income=Decimal(str(30000 + 10000 * n)))
+            credit = _make_credit(client, status='overdue')
+            state = CreditState.objects.create(credit=credit, client=client, state_date=date.today(),
+                                               principal_debt=Decimal(str(100000 * (n + 1))))
+            Credit.objects.filter(pk=credit.pk).update(current_state=state)
+            Payment.objects.create(credit=credit, payment_date=date.today() - timedelta(days=60),
+                                   planned_date=date.today() - timedelta(days=40 * n), amount=Decimal('1000'))
+            ScoringResult.objects.create(client=client, credit=credit, calculation_date=date.today(),
+                                         probability=0.5, risk_segment=segment)
+            self.credits[segment].append(credit.id)
+        _make_credit(_make_client(), status='active')
+
+    def test_tranche_by_segment(self):
+        from .ml.portfolio_simulation import tranche_credit_ids
+        self.assertEqual(tranche_credit_ids('high'), self.credits['high'])
+        self.assertEqual(tranche_credit_ids(), self.credits['high'] + self.credits['low'])
+
+    def test_mean_matches_point_forecast(self):
+        from .ml.portfolio_simulation import simulate_portfolio
+        from .ml.return_forecast import forecast_credits
+        result = simulate_portfolio(segment='high', n_scenarios=20000, correlation=0.0, workers=1)
+        forecasts = forecast_credits(self.credits['high'])
+        self.assertAlmostEqual(result['expected_npv_continue'],
+                               float(sum(f.npv_continue for f in forecasts)), delta=0.05)
+        continue_stats = result['strategies']['continue']
+        self.assertLess(abs(continue_stats['mean'] - result['expected_npv_continue']),
+                        4 * continue_stats['std'] / 20000 ** 0.5)
+        self.assertLessEqual(continue_stats['p5'], continue_stats['p50'])
+        self.assertLessEqual(continue_stats['p50'], continue_stats['p95'])
+        self.assertEqual(result['strategies']['sell']['p5'], float(sum(f.npv_sell for f in forecasts)))
+        self.assertEqual(result['strategies']['write_off']['std'], 0.0)
+
+    def test_correlation_widens_distribution(self):
+        from .ml.portfolio_simulation import simulate_portfolio
+        independent = simulate_portfolio(n_scenarios=5000, correlation=0.0, workers=1)
+        correlated = simulate_portfolio(n_scenarios=5000, correlation=0.6, workers=1)
+        self.assertGreater(correlated['strategies']['continue']['std'], independent['strategies']['continue']['std'])
+
+    def test_result_independent_of_worker_count(self):
+        import numpy as np
+        from .ml.portfolio_simulation import simulate_npv, simulation_inputs
+        from .ml.return_forecast import collect_forecast_inputs
+        sim_inputs = simulation_inputs(collect_forecast_inputs(self.credits['high']), 0.15)
+        single = simulate_npv(sim_inputs, 5000, workers=1, seed=7)
+        pooled = simulate_npv(sim_inputs, 5000, workers=2, seed=7)
+        self.assertEqual(len(single), 5000)
+        np.testing.assert_array_equal(single, pooled)
+
+    def test_cached_per_tranche_and_discount_rate(self):
+        from .ml.portfolio_simulation import simulate_portfolio
+        first = simulate_portfolio(segment='high', n_scenarios=2000, workers=1)
+        self.assertFalse(first['cached'])
+        with self.assertNumQueries(3):  # состав транша и входы прогноза, без симуляции
+            second = simulate_portfolio(segment='high', n_scenarios=2000, workers=1)
+        self.assertTrue(second['cached'])
+        self.assertEqual(second['strategies'], first['strategies'])
+        self.assertFalse(simulate_portfolio(segment='high', n_scenarios=2000, discount_rate=0.2, workers=1)['cached'])
+        self.assertFalse(simulate_portfolio(segment='low', n_scenarios=2000, workers=1)['cached'])
+
+    def test_cache_follows_tranche_data(self):
+        from .ml.portfolio_simulation import simulate_portfolio
+        simulate_portfolio(segment='high', n_scenarios=2000, workers=1)
+        # Изменение долга транша (bulk, без сигналов) — новый ключ, пересчёт
+        CreditState.objects.filter(credit_id=self.credits['high'][0]).update(principal_debt=Decimal('1'))
+        changed = simulate_portfolio(segment='high', n_scenarios=2000, workers=1)
+        self.assertFalse(changed['cached'])
+        self.assertTrue(simulate_portfolio(segment='high', n_scenarios=2000, workers=1)['cached'])
+        with patch('collection_app.services.shared_cache.shared_cache') as shared:
+            shared.return_value.get.return_value = None
+            simulate_portfolio(segment='low', n_scenarios=1000, workers=1)
+        shared.return_value.set.assert_called_once()
+
+    def test_endpoint(self):
+        from django.contrib.auth.models import User
+        from .ml.portfolio_simulation import simulate_portfolio
+        api = APIClient()
+        self.assertEqual(api.get('/api/credits/portfolio_simulation/?segment=low').status_code, 403)
+        api.force_authenticate(User.objects.create_superuser('admin', 'a@a.ru', 'pass'))
+        with patch('collection_app.ml.portfolio_simulation.ProcessPoolExecutor') as pool:
+            resp = api.get('/api/credits/portfolio_simulation/?segment=low&scenarios=1000')
+        pool.assert_not_called()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['credits'], 2)
+        self.assertEqual(set(resp.json()['strategies']), {'continue', 'sell', 'write_off'})
+        self.assertEqual(api.get('/api/credits/portfolio_simulation/?segment=junk').status_code, 400)
+        self.assertEqual(api.get('/api/credits/portfolio_simulation/?scenarios=x').status_code, 400)
+        for rate in ('-1', '-2', 'nan'):
+            resp = api.get(f'/api/credits/portfolio_simulation/?discount_rate={rate}')
+            self.assertEqual(resp.status_code, 400, rate)
+        with self.assertRaises(ValueError):
+            simulate_portfolio(segment='low', discount_rate=-1, workers=1)
+
+
+# =====================================================================
+# 24. Тесты скриптов Copilot
+# =====================================================================
+
+class SmartScriptTest(TestCase):
+    data = {'client_name': 'Иван', 'amount': '15 000', 'date': 'пятницы'}
+
+    def test_compiled_template_render(self):
+        from .ml.smart_scripts import CompiledTemplate
+        template = CompiledTemplate('{client_name}, долг {amount} до {date}; {client_name}, {unknown}')
+        self.assertEqual(template.render(self.data), 'Иван, долг 15 000 до пятницы; Иван, {unknown}')
+        self.assertEqual(CompiledTemplate('Хорошего дня!').render(self.data), 'Хорошего дня!')
+
+    def test_objection_detection(self):
+        from .ml.smart_scripts import RECENT_CHARS, SmartScriptService
+        service = SmartScriptService()
+        # При нескольких возражениях — первое по порядку OBJECTION_HANDLERS
+        self.assertEqual(service._detect_objection('перезвоните позже, нет денег'), 'нет денег')
+        # Возражение ищется только в последней реплике
+        self.assertIsNone(service._detect_objection('нет денег' + ' ' * RECENT_CHARS))
+        self.assertEqual(service.get_objection_response('Уже оплатил вчера', self.data)[0],
+                         'Когда и каким способом производили оплату?')
+        self.assertEqual(len(service.get_objection_response('какой-то текст', self.data)), 2)
+
+    def test_session_matches_stateless_suggestions(self):
+        from dataclasses import asdict
+        from .ml.smart_scripts import CopilotSession, SmartScriptService
+        service = SmartScriptService()
+        call = ('Добрый день, Иван! Звоню по поводу задолженности. Нет денег сейчас. '
+                'Понимаю, что сейчас сложно. Когда сможете внести? Перезвоните позже. ' * 3)
+        session = CopilotSession(self.data, 'unable', 'empathy')
+        for end in list(range(5, len(call), 7)) + [len(call), 20]:  # 20 — новый разговор
+            expected = service.get_realtime_suggestions(call[:end], self.data, 'unable', 'empathy')
+            self.assertEqual([asdict(s) for s in session.update(call[:end])], [asdict(s) for s in expected], end)
+
+    def test_said_key_phrase_not_suggested(self):
+        from .ml.smart_scripts import CopilotSession
+        session = CopilotSession(self.data, 'unable', 'empathy')
+        phrases = [s.phrase for s in session.update('Алло')]
+        self.assertIn('Понимаю, что сейчас сложно', phrases)
+        phrases = [s.phrase for s in session.update('Алло. Понимаю, что сейчас сложно')]
+        self.assertNotIn('Понимаю, что сейчас сложно', phrases)
+
+    def test_copilot_phrases_endpoint(self):
+        client = _make_client()
+        _make_credit(client, status='overdue')
+        api = APIClient()
+        resp = api.get(f'/api/clients/{client.id}/copilot_phrases/?context=objection&objection=нет денег')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()['phrases']), 3)
+        resp = api.get(f'/api/clients/{client.id}/copilot_phrases/?context=confirmation')
+        self.assertIn('Фиксирую: 500 000 рублей до пятницы.', resp.json()['phrases'])
+        self.assertEqual(api.get(f'/api/clients/{client.id}/copilot_phrases/?context=junk').status_code, 400)
+
+
+# =====================================================================
+# 25. Тесты потока Copilot по звонку
+# =====================================================================
+
+class CopilotStreamTest(TestCase):
+    def setUp(self):
+        from .models import ClientBehaviorProfile
+        cache.clear()
+        self.client_obj = _make_client()
+        ClientBehaviorProfile.objects.create(client=self.client_obj, psychotype='unable')
+        self.credit = _make_credit(self.client_obj, status='overdue')
+
+    def _open(self):
+        from .services.copilot_stream import CopilotStreamHub
+        call = CopilotStreamHub.open_call(self.client_obj.id, self.credit.id)
+        self.addCleanup(CopilotStreamHub.close_call, call.call_id)
+        return call
+
+    def test_open_loads_context_once(self):
+        call = self._open()
+        self.assertEqual(call.events[0]['event'], 'opened')
+        self.assertEqual(call.events[0]['data']['psychotype'], 'unable')
+        self.assertEqual(call.events[-1], {'id': len(call.events), 'event': 'stage', 'data': {'stage': 'in_progress'}})
+
+    def test_chunks_push_incremental_events(self):
+        from .services.copilot_stream import CopilotStreamHub
+        call = self._open()
+        with self.assertNumQueries(0):
+            events = CopilotStreamHub.push_chunk(call.call_id, 'Добрый день! Звоню по поводу задолженности. ')
+        self.assertIn(('stage', {'stage': 'need_ptp'}), [(e['event'], e['data']) for e in events])
+        events = CopilotStreamHub.push_chunk(call.call_id, 'Клиент: нет денег')
+        self.assertEqual([e['data'] for e in events if e['event'] == 'objection'], [{'objection': 'нет денег'}])
+        # Тот же этап и возражение — повторных событий нет
+        events = CopilotStreamHub.push_chunk(call.call_id, ' совсем')
+        self.assertFalse([e for e in events if e['event'] in ('stage', 'objection')])
+
+    def test_compliance_across_chunk_boundary_reported_once(self):
+        from .services.copilot_stream import CopilotStreamHub
+        call = self._open()
+        CopilotStreamHub.push_chunk(call.call_id, 'Если не заплатите, мы приедем ')
+        events = CopilotStreamHub.push_chunk(call.call_id, 'к вам домой.')
+        compliance = [e['data'] for e in events if e['event'] == 'compliance']
+        self.assertEqual(len(compliance), 1)
+        violation = compliance[0]['violations'][0]
+        self.assertEqual((violation['type'], violation['match']), ('threats', 'приедем к вам'))
+        self.assertEqual(violation['position'], call.transcript.index('приедем'))
+        events = CopilotStreamHub.push_chunk(call.call_id, ' Всего хорошего.')
+        self.assertFalse([e for e in events if e['event'] == 'compliance'])
+
+    def test_http_endpoints(self):
+        api = APIClient()
+        resp = api.post('/api/copilot/calls/', {'client_id': self.client_obj.id, 'credit_id': self.credit.id},
+                        format='json')
+        self.assertEqual(resp.status_code, 201)
+        call_id = resp.json()['call_id']
+        resp = api.post(f'/api/copilot/calls/{call_id}/chunks/', {'text': 'Уже оплатил'}, format='json')
+        self.assertIn('objection', [e['event'] for e in resp.json()['events']])
+        self.assertEqual(api.delete(f'/api/copilot/calls/{call_id}/').status_code, 200)
+        resp = api.post(f'/api/copilot/calls/{call_id}/chunks/', {'text': 'ещё'}, format='json')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(api.post('/api/copilot/calls/', {'client_id': 999999}, format='json').status_code, 404)
+        for payload in ({'client_id': 'abc'}, {'client_id': self.client_obj.id, 'credit_id': 'x'}):
+            self.assertEqual(api.post('/api/copilot/calls/', payload, format='json').status_code, 400, payload)
+
+    def test_idle_calls_purged_on_chunk_and_keepalive(self):
+        import asyncio
+        from .services.copilot_stream import CopilotStreamHub
+        idle, active = self._open(), self._open()
+        idle.last_activity -= CopilotStreamHub.CALL_TTL + 1
+        with patch.object(CopilotStreamHub, 'PURGE_INTERVAL', 0):
+            CopilotStreamHub.push_chunk(active.call_id, 'Добрый день')
+            self.assertTrue(idle.closed)
+            self.assertIsNone(CopilotStreamHub.get(idle.call_id))
+            self.assertIsNotNone(CopilotStreamHub.get(active.call_id))
+
+            # Брошенный звонок, к которому подключён только SSE: закрывается на пинге
+            active.last_activity -= CopilotStreamHub.CALL_TTL + 1
+
+            async def consume():
+                return [chunk async for chunk in CopilotStreamHub.stream(active, len(active.events))]
+
+            with patch.object(CopilotStreamHub, 'KEEPALIVE', 0.01):
+                chunks = asyncio.run(asyncio.wait_for(consume(), timeout=5))
+        self.assertTrue(active.closed)
+        self.assertTrue(chunks[0].startswith(': ping'))
+
+    async def test_sse_stream_until_closed(self):
+        import asyncio
+        from asgiref.sync import sync_to_async
+        from .services.copilot_stream import CopilotStreamHub
+        call = await sync_to_async(CopilotStreamHub.open_call)(self.client_obj.id, self.credit.id)
+        response = await self.async_client.get(f'/api/copilot/calls/{call.call_id}/events/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = []
+
+        async def consume():
+            async for chunk in response.streaming_content:
+                chunks.append(chunk.decode())
+
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.01)
+        CopilotStreamHub.push_chunk(call.call_id, 'Перезвоните позже')
+        CopilotStreamHub.close_call(call.call_id)
+        await asyncio.wait_for(task, timeout=5)
+        ids = [int(line[4:]) for chunk in chunks for line in chunk.splitlines() if line.startswith('id: ')]
+        self.assertEqual(ids, list(range(1, len(call.events) + 1)))
+        self.assertIn('event: objection', ''.join(chunks))
+        self.assertTrue(chunks[-1].startswith(f'id: {len(call.events)}\nevent: closed'))
+
+
+# =====================================================================
+# 26. Async-отчёты дашборда и Client 360
+# =====================================================================
+
+def _dashboard_data():
+    """Два оператора, звонки сегодня и неделю назад"""
+    client = _make_client()
+    credit = _make_credit(client, status='overdue')
+    ops = [_make_operator(full_name='Анна'), _make_operator(full_name='Борис')]
+    now = timezone.now()
+    rows = [
+        (ops[0], now, 'phone', 'promise', 120, Decimal('5000')),
+        (ops[0], now, 'phone', 'no_answer', 0, 0),
+        (ops[0], now - timedelta(days=6), 'phone', 'completed', 300, 0),
+        (ops[0], now, 'sms', 'completed', 0, 0),
+        (ops[1], now, 'phone', 'refuse', 60, 0),
+        (ops[1], now - timedelta(days=20), 'phone', 'promise', 90, Decimal('1000')),
+    ]
+    for op, dt, kind, status, duration, amount in rows:
+        Intervention.objects.create(client=client, credit=credit, operator=op, datetime=dt,
+                                    intervention_type=kind, status=status, duration=duration,
+                                    promise_amount=amount)
+    return client, credit, ops
+
+
+@override_settings(ASYNC_QUERY_WORKERS=0)
+class AsyncDashboardTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_obj, self.credit, self.ops = _dashboard_data()
+
+    def test_manager_dashboard_grouped_queries(self):
+        from .services.dashboards import ManagerDashboard
+        _make_operator(full_name='Без звонков')
+        with self.assertNumQueries(5):
+            data = ManagerDashboard('week').build()
+        anna, boris, idle = data['operatorStats']
+        self.assertEqual((anna['calls'], anna['contacts'], anna['ptpCount'], anna['ptpAmount']), (3, 2, 1, 5000.0))
+        self.assertEqual(anna['avgDuration'], 140)
+        self.assertEqual((boris['calls'], boris['contacts'], boris['ptpCount']), (1, 1, 0))
+        self.assertEqual((idle['calls'], idle['contactRate']), (0, 0))
+        self.assertEqual(data['totals']['calls'], 4)
+        self.assertEqual(sum(r['value'] for r in data['callResults']), 100)
+
+    def test_operator_dashboard_periods(self):
+        from .services.dashboards import OperatorDashboard
+        with self.assertNumQueries(9):
+            data = OperatorDashboard(self.ops[1]).build()
+        self.assertEqual((data['today']['calls'], data['today']['refusals']), (1, 1))
+        self.assertEqual(data['week']['promises'], 0)
+        self.assertEqual((data['month']['promises'], data['month']['promiseAmount']), (1, 1000.0))
+        self.assertEqual(data['month']['promiseRate'], 50.0)
+        self.assertEqual(data['allTime']['totalInterventions'], 2)
+        self.assertEqual(data['topPromises'][0]['client__full_name'], self.client_obj.full_name)
+
+    def test_stats_uses_existing_fields(self):
+        resp = APIClient().get('/api/dashboard/stats/')
+        self.assertEqual(resp.status_code, 200)
+        channels = {row['channel']: row['count'] for row in resp.json()['channel_stats']}
+        month = Intervention.objects.filter(datetime__date__gte=timezone.now().date().replace(day=1))
+        self.assertEqual(channels['sms'], 1)
+        self.assertEqual(sum(channels.values()), month.count())
+        self.assertIn('result', resp.json()['result_stats'][0])
+
+    async def test_async_endpoints_match_sync(self):
+        from asgiref.sync import sync_to_async
+        api = APIClient()
+        pairs = [
+            ('/api/dashboard/?period=month', '/api/async/dashboard/?period=month'),
+            ('/api/dashboard/stats/', '/api/async/dashboard/stats/'),
+            (f'/api/dashboard/operator/{self.ops[0].id}/', f'/api/async/dashboard/operator/{self.ops[0].id}/'),
+            (f'/api/clients/{self.client_obj.id}/profile_360/',
+             f'/api/async/clients/{self.client_obj.id}/profile_360/'),
+        ]
+        for sync_url, async_url in pairs:
+            expected = (await sync_to_async(api.get)(sync_url)).json()
+            await sync_to_async(cache.clear)()
+            response = await self.async_client.get(async_url)
+            self.assertEqual(response.status_code, 200, async_url)
+            self.assertEqual(json.loads(response.content), expected, async_url)
+        self.assertEqual((await self.async_client.get('/api/async/dashboard/operator/999999/')).status_code, 404)
+        self.assertEqual((await self.async_client.get('/api/async/clients/999999/profile_360/')).status_code, 404)
+
+    def test_profile_assemble_matches_prefetch(self):
+        from .models import NextBestAction, ReturnForecast
+        from .serializers import Client360Serializer
+        from .services.client_profile import Client360Loader
+        ReturnForecast.objects.create(
+            credit=self.credit, return_probability=0.4, partial_return_probability=0.6,
+            expected_return_amount=Decimal('1000'), expected_return_days=60,
+            npv_continue=Decimal('100'), npv_sell=Decimal('50'), npv_write_off=Decimal('-10'),
+            recommendation='continue', recommendation_confidence=0.7,
+        )
+        NextBestAction.objects.create(client=self.client_obj, credit=self.credit, recommended_channel='phone',
+                                      recommended_scenario='soft_reminder',
+                                      recommended_datetime=timezone.now())
+        parts = {name: section() for name, section in Client360Loader.sections(self.client_obj.id).items()}
+        with self.assertNumQueries(0):
+            data = dict(Client360Serializer(Client360Loader.assemble(parts)).data)
+        self.assertEqual(data, dict(Client360Serializer(Client360Loader.load(self.client_obj.id)).data))
+        self.assertIsNotNone(data['latest_forecast'])
+        self.assertEqual(len(data['nba_recommendations']), 1)
+
+
+@override_settings(ASYNC_QUERY_WORKERS=4)
+class AsyncDashboardThreadPoolTest(TransactionTestCase):
+    """Секции в потоках пула видят закоммиченные данные и дают тот же отчёт"""
+
+    def test_gather_in_thread_pool(self):
+        import asyncio
+        from .services.dashboards import ManagerDashboard, OperatorDashboard, shutdown_executor
+        self.addCleanup(shutdown_executor)
+        _, _, ops = _dashboard_data()
+        for dashboard in (ManagerDashboard('month'), OperatorDashboard(ops[0])):
+            self.assertEqual(asyncio.run(dashboard.abuild()), dashboard.build())
+
+    def test_stale_connection_closed_before_section(self):
+        import asyncio
+        from .services.dashboards import gather_sections, shutdown_executor
+        self.addCleanup(shutdown_executor)
+        calls = []
+        with patch('collection_app.services.dashboards.close_old_connections',
+                   side_effect=lambda: calls.append('close')):
+            asyncio.run(gather_sections({'a': lambda: calls.append('a')}))
+            with self.assertRaises(ValueError):
+                asyncio.run(gather_sections({'b': lambda: int('x')}))
+        # До каждой секции (CONN_MAX_AGE, разрыв соединения) и после ошибки
+        self.assertEqual(calls, ['close', 'a', 'close', 'close'])
+
+
+# =====================================================================
+# 27. Rate limiter
+# =====================================================================
+
+class SlidingWindowLimiterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1_000_000 * 60 + 30.0  # середина минутного окна
+
+    def _limiter(self, limit=10, window=60, lease=4):
+        from .middleware.rate_limiter import SlidingWindowLimiter
+        return SlidingWindowLimiter(limit, window, prefix='test', lease=lease, clock=lambda: self.now)
+
+    def test_limit_and_retry_after(self):
+        limiter = self._limiter()
+        decisions = [limiter.hit('ip:1') for _ in range(12)]
+        self.assertEqual([d.allowed for d in decisions], [True] * 10 + [False] * 2)
+        self.assertEqual(decisions[-1].retry_after, 30)
+        # Другой ключ считается отдельно
+        self.assertTrue(limiter.hit('user:1').allowed)
+
+    def test_previous_window_weighted(self):
+        limiter = self._limiter()
+        for _ in range(10):
+            limiter.hit('ip:1')
+        # Через 45 с: три четверти прошлого окна ещё в скользящем окне -> 10 - 7 = 3 запроса
+        self.now += 45
+        limiter.reset()
+        self.assertEqual(sum(limiter.hit('ip:1').allowed for _ in range(10)), 3)
+
+    def test_parallel_workers_never_over_admit(self):
+        import threading
+        # Несколько «процессов» (свои локальные аренды) над общим кэшем
+        limiters = [self._limiter(limit=50, lease=8) for _ in range(4)]
+        admitted = []
+        lock = threading.Lock()
+
+        def worker(limiter):
+            allowed = sum(limiter.hit('ip:1').allowed for _ in range(40))
+            with lock:
+                admitted.append(allowed)
+
+        threads = [threading.Thread(target=worker, args=(limiters[i % 4],)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(sum(admitted), 50)
+        # Недобор — не больше аренды на процесс
+        self.assertGreaterEqual(sum(admitted), 50 - 8 * len(limiters))
+        self.assertEqual(sum(admitted), cache.get(f'test:ip:1:{int(self.now // 60)}'))
+
+    def test_middleware_keys_by_user_then_ip(self):
+        from django.contrib.auth.models import AnonymousUser, User
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from .middleware.security import RateLimitMiddleware
+        with patch.dict(RateLimitMiddleware.DEFAULT_RATE_LIMITS, {'default': (2, 60)}):
+            middleware = RateLimitMiddleware(lambda request: HttpResponse('ok'))
+        factory = RequestFactory()
+        user = User.objects.create_user('op1')
+
+        def call(user_obj, ip='10.0.0.1'):
+            request = factory.get('/api/clients/', REMOTE_ADDR=ip)
+            request.user = user_obj
+            return middleware(request)
+
+        with self.assertLogs('collection_app.middleware.security', 'WARNING'):
+            self.assertEqual([call(AnonymousUser()).status_code for _ in range(3)], [200, 200, 429])
+            response = call(user)
+            self.assertEqual((response.status_code, response['X-RateLimit-Remaining']), (200, '1'))
+            blocked = call(AnonymousUser())
+        self.assertEqual(blocked.status_code, 429)
+        self.assertTrue(int(blocked['Retry-After']) >= 1)
+        self.assertEqual(call(AnonymousUser(), ip='10.0.0.2').status_code, 200)
+
+    def test_token_users_keyed_separately_behind_one_ip(self):
+        from django.contrib.auth.models import User
+        from django.test import RequestFactory
+        from rest_framework.authtoken.models import Token
+        from .middleware.security import RateLimitMiddleware
+        with patch.dict(RateLimitMiddleware.DEFAULT_RATE_LIMITS, {'default': (2, 60)}):
+            middleware = RateLimitMiddleware(lambda request: HttpResponse('ok'))
+        tokens = [Token.objects.create(user=User.objects.create_user(f'op{i}')).key for i in range(3)]
+        factory = RequestFactory()
+        # Один NAT колл-центра: общий IP, у каждого оператора свой токен
+        with self.assertNumQueries(0):  # ключ — хэш токена, проверка токена во view
+            statuses = [
+                middleware(factory.get('/api/clients/', HTTP_AUTHORIZATION=f'Token {token}',
+                                       REMOTE_ADDR='10.0.0.1')).status_code
+                for token in tokens for _ in range(2)
+            ]
+        self.assertEqual(statuses, [200] * 6)
+        with self.assertLogs('collection_app.middleware.security', 'WARNING'):
+            blocked = middleware(factory.get('/api/clients/', HTTP_AUTHORIZATION=f'Token {tokens[0]}',
+                                             REMOTE_ADDR='10.0.0.1'))
+        self.assertEqual(blocked.status_code, 429)
+        # Неверный токен — свой ключ без ошибки; 401 ответит view
+        bad = factory.get('/api/clients/', HTTP_AUTHORIZATION='Token nope', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(middleware(bad).status_code, 200)
+        # Без токена — лимит по IP
+        anonymous = factory.get('/api/clients/', HTTP_AUTHORIZATION='Basic abc', REMOTE_ADDR='10.0.0.9')
+        self.assertEqual(middleware(anonymous).status_code, 200)
+
+
+# =====================================================================
+# 28. Очередь аудита
+# =====================================================================
+
+@override_settings(AUDIT_BACKGROUND=False, AUDIT_GET_SAMPLE_RATE=0)
+class AuditQueueTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from django.test import RequestFactory
+        from .middleware.audit_queue import AuditQueue
+        from .middleware.security import AuditMiddleware
+        self.queue = AuditQueue(maxsize=100)
+        self.middleware = AuditMiddleware(lambda request: HttpResponse(status=201), queue=self.queue)
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user('auditor')
+        self.operator = _make_operator(user=self.user)
+        self.client_obj = _make_client()
+
+    def _call(self, request, user=None):
+        from django.contrib.auth.models import AnonymousUser
+        request.user = user or AnonymousUser()
+        return self.middleware(request)
+
+    def test_request_path_does_not_write(self):
+        with self.assertNumQueries(0):
+            self._call(self.factory.get(f'/api/clients/{self.client_obj.id}/'), self.user)
+            self._call(self.factory.post('/api/interventions/', {'client': 1}, content_type='application/json'))
+        self.assertEqual(self.queue.metrics()['depth'], 2)
+        self.assertEqual(AuditLog.objects.count(), 0)
+
+    def test_flush_bulk_writes_and_resolves_links(self):
+        self._call(self.factory.get(f'/api/clients/{self.client_obj.id}/'), self.user)
+        self._call(self.factory.post('/api/interventions/', {'client': 1, 'phone': '+7999', 'notes': 'x'},
+                                     content_type='application/json'))
+        self._call(self.factory.get('/api/credits/'))  # выборка 0 — не журналируется
+        # Операторы, клиенты, bulk_create
+        with self.assertNumQueries(3):
+            self.assertEqual(self.queue.flush(), 2)
+        read = AuditLog.objects.get(action='api_read')
+        self.assertEqual((read.operator_id, read.client_id), (self.operator.id, self.client_obj.id))
+        self.assertTrue(read.details['personal_data_accessed'])
+        write = AuditLog.objects.get(action='api_create')
+        self.assertEqual(write.details['sensitive_fields'], ['phone'])
+        self.assertNotIn('+7999', json.dumps(write.details))
+        self.assertEqual(write.details['status_code'], 201)
+
+    @override_settings(AUDIT_GET_SAMPLE_RATE=1)
+    def test_sampled_gets_marked(self):
+        self._call(self.factory.get('/api/credits/'))
+        self._call(self.factory.get('/api/dashboard/'))  # вне AUDIT_PATHS
+        self.queue.flush()
+        entry = AuditLog.objects.get()
+        self.assertEqual((entry.details['path'], entry.details['sample_rate']), ('/api/credits/', 1))
+        self.assertFalse(entry.details['personal_data_accessed'])
+
+    def test_back_pressure_drops_only_sampled(self):
+        from .middleware.audit_queue import AuditQueue, AuditRecord
+        small = AuditQueue(maxsize=2)
+        for _ in range(2):
+            self.assertTrue(small.enqueue(AuditRecord('api_read', '/api/clients/', 'GET')))
+        self.assertFalse(small.enqueue(AuditRecord('api_read', '/api/credits/', 'GET', required=False)))
+        # Обязательная запись при полной очереди — сразу в потоке запроса
+        self.assertTrue(small.enqueue(AuditRecord('api_delete', '/api/payments/5/', 'DELETE')))
+        self.assertEqual(AuditLog.objects.count(), 1)
+        metrics = small.metrics()
+        self.assertEqual((metrics['dropped'], metrics['sync_writes'], metrics['depth']), (1, 1, 2))
+        small.flush()
+        self.assertEqual(AuditLog.objects.count(), 3)
+
+    def test_metrics_endpoint_admin_only(self):
+        from django.contrib.auth.models import User
+        api = APIClient()
+        self.assertEqual(api.get('/api/audit/queue/').status_code, 403)
+        api.force_authenticate(User.objects.create_superuser('root', password='x'))
+        self.assertIn('dropped', api.get('/api/audit/queue/').json())
+
+
+@override_settings(AUDIT_BACKGROUND=True, AUDIT_FLUSH_INTERVAL=0.05)
+class AuditQueueBackgroundTest(TransactionTestCase):
+    def test_background_writer_drains_queue(self):
+        from .middleware.audit_queue import AuditQueue, AuditRecord
+        audit = AuditQueue(maxsize=1000)
+        for i in range(250):
+            audit.enqueue(AuditRecord('api_read', f'/api/clients/{i}/', 'GET'))
+        deadline = time.monotonic() + 10
+        while AuditLog.objects.count() < 250 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(AuditLog.objects.count(), 250)
+        metrics = audit.metrics()
+        self.assertEqual((metrics['written'], metrics['depth']), (250, 0))
+        self.assertLess(metrics['batches'], 250)
+
+
+# =====================================================================
+# 29. Проверка запросов на запрещённые паттерны
+# =====================================================================
+
+class RequestValidationTest(TestCase):
+    def setUp(self):
+        from django.test import RequestFactory
+        from .middleware.security import RequestValidationMiddleware
+        self.factory = RequestFactory()
+        self.seen_bodies = []
+
+        def view(request):
+            self.seen_bodies.append(request.body)
+            return HttpResponse('ok')
+
+        self.middleware = RequestValidationMiddleware(view)
+
+    def _status(self, request):
+        with patch('collection_app.middleware.security.logger'):
+            return self.middleware(request).status_code
+
+    def test_combined_pattern_matches_each_pattern(self):
+        for pattern in self.middleware.FORBIDDEN_PATTERNS:
+            text = f'abc {pattern.lower()} xyz'
+            self.assertTrue(self.middleware._pattern.search(text), pattern)
+        self.assertIsNone(self.middleware._pattern.search('SELECT name FROM clients - обычный текст'))
+
+    def test_query_string_decoded(self):
+        self.assertEqual(self._status(self.factory.get('/api/clients/', {'q': '<SCRIPT>'})), 400)
+        self.assertEqual(self._status(self.factory.get('/api/clients/?q=%3Cscript%3E')), 400)
+        self.assertEqual(self._status(self.factory.get('/api/clients/', {'q': 'Иванов'})), 200)
+
+    def test_json_strings_only(self):
+        post = lambda data: self.factory.post('/api/interventions/', data, content_type='application/json')
+        self.assertEqual(self._status(post({'notes': ['ok', {'deep': 'x; delete from'}]})), 400)
+        self.assertEqual(self._status(post({'drop table': 1})), 400)
+        # \u-экранирование не обходит проверку
+        self.assertEqual(self._status(post('{"notes": "\\u003cScript>"}')), 400)
+        self.assertEqual(self._status(post({'notes': 'Обещал оплатить', 'amount': -5})), 200)
+        self.assertEqual(self.seen_bodies[-1], json.dumps({'notes': 'Обещал оплатить', 'amount': -5}).encode())
+
+    def test_multipart_skips_files_and_boundaries(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        upload = SimpleUploadedFile('payments.csv', b'-- comment\ncredit_id;amount\n1;100\n')
+        self.assertEqual(self._status(self.factory.post('/api/payments/import/', {'file': upload})), 200)
+        upload.seek(0)
+        request = self.factory.post('/api/payments/import/', {'file': upload, 'comment': 'DROP TABLE x'})
+        self.assertEqual(self._status(request), 400)
+
+    def test_small_clean_body_single_pass(self):
+        post = lambda data, content_type: self.factory.post('/api/x/', data, content_type=content_type)
+        with patch.object(self.middleware, '_scan_json') as scan_json:
+            self.assertEqual(self._status(post({'notes': 'promised to pay'}, 'application/json')), 200)
+        scan_json.assert_not_called()
+        # Экранированное в сыром виде не видно — разбор по типу остаётся
+        form = 'application/x-www-form-urlencoded'
+        self.assertEqual(self._status(post('notes=%3Cscript%3E', form)), 400)
+        self.assertEqual(self._status(post('notes=drop+table+x', form)), 400)
+        self.assertEqual(self._status(post('notes=ok&amount=100', form)), 200)
+
+    def test_large_body_streamed_up_to_cap(self):
+        from .middleware.security import RequestValidationMiddleware
+        with patch.object(RequestValidationMiddleware, 'MAX_SCAN_BYTES', 1000), \
+                patch.object(RequestValidationMiddleware, 'SCAN_CHUNK', 100):
+            # Паттерн на стыке кусков (позиции 95..107)
+            body = b'a' * 95 + b'UNION SELECT' + b'b' * 2000
+            self.assertEqual(self._status(self.factory.post('/api/x/', body, content_type='text/plain')), 400)
+            # За пределами лимита не проверяется; view получает тело целиком
+            body = b'a' * 1500 + b'<script>' + b'b' * 500
+            self.assertEqual(self._status(self.factory.post('/api/x/', body, content_type='text/plain')), 200)
+            self.assertEqual(self.seen_bodies[-1], body)
+            # Большой multipart: после проверки начала Django разбирает файл целиком
+            from django.core.files.uploadedfile import SimpleUploadedFile
+            from .middleware.security import RequestValidationMiddleware as Middleware
+            content = b'--\n' * 2000
+            files = []
+            middleware = Middleware(lambda request: files.append(request.FILES['file'].read()) or HttpResponse())
+            request = self.factory.post('/api/payments/import/',
+                                        {'file': SimpleUploadedFile('p.csv', content), 'note': 'ok'})
+            self.assertEqual(middleware(request).status_code, 200)
+            self.assertEqual(files, [content])
+
+
+# =====================================================================
+# 30. Профилирование запросов
+# =====================================================================
+
+class RequestProfilingTest(TestCase):
+    def setUp(self):
+        from django.test import RequestFactory
+        from .middleware.profiling import ProfilingMiddleware, RequestProfiler
+        self.factory = RequestFactory()
+        self.profiler = RequestProfiler()
+
+        def view(request):
+            # N+1: один шаблон запроса с разными параметрами
+            for pk in (1, 2, 3):
+                Client.objects.filter(id=pk).exists()
+            list(Client.objects.filter(id__in=[1, 2, 3, 4]))
+            return HttpResponse('x' * 100)
+
+        self.middleware = ProfilingMiddleware(view, profiler=self.profiler)
+
+    def _request(self, path='/api/clients/5/'):
+        from django.urls import resolve
+        request = self.factory.get(path)
+        request.resolver_match = resolve(path)
+        return self.middleware(request)
+
+    def test_fingerprint(self):
+        from .middleware.profiling import fingerprint
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (%s, %s,  %s) LIMIT 21'),
+                         'SELECT * FROM t WHERE id IN (...) LIMIT N')
+        self.assertEqual(fingerprint('WHERE id IN (%s)'), fingerprint('WHERE id IN (%s, %s)'))
+
+    def test_records_queries_duplicates_and_route(self):
+        response = self._request()
+        self.assertEqual(response['X-Profile-Queries'], '4')
+        self._request('/api/clients/7/')
+        [row] = self.profiler.report()
+        self.assertEqual(row['route'], 'GET api/clients/<pk>/')
+        self.assertEqual(row['requests'], 2)
+        self.assertEqual(row['avg_queries'], 4)
+        self.assertEqual(row['avg_response_bytes'], 100)
+        self.assertEqual(len(row['duplicate_queries']), 1)
+        self.assertEqual(row['duplicate_queries'][0]['requests'], 2)
+        self.assertIn('LIMIT N', row['duplicate_queries'][0]['sql'])
+
+    def test_over_budget_logged(self):
+        with self.settings(PROFILING_BUDGETS={'queries': 3, 'total_ms': None}):
+            with self.assertLogs('collection_app.middleware.profiling', 'WARNING') as logs:
+                self._request()
+        self.assertIn('queries', logs.output[0])
+        self.assertIn('duplicates=2', logs.output[0])
+        self.assertEqual(self.profiler.report()[0]['over_budget'], 1)
+
+    def test_report_endpoint_admin_only(self):
+        from django.contrib.auth.models import User
+        from .middleware.profiling import RequestProfile, request_profiler
+        request_profiler.reset()
+        self.addCleanup(request_profiler.reset)
+        request_profiler.record(RequestProfile('api/a/', 'GET', 200, 500.0, 10.0, 2, 10))
+        request_profiler.record(RequestProfile('api/b/', 'GET', 200, 5.0, 4.0, 30, 10))
+
+        api = APIClient()
+        self.assertEqual(api.get('/api/profiling/routes/').status_code, 403)
+        api.force_authenticate(User.objects.create_superuser('admin', 'a@a.ru', 'pass'))
+        routes = api.get('/api/profiling/routes/').json()['routes']
+        self.assertEqual([row['route'] for row in routes], ['GET api/a/', 'GET api/b/'])
+        routes = api.get('/api/profiling/routes/?order=queries&limit=1').json()['routes']
+        self.assertEqual([row['route'] for row in routes], ['GET api/b/'])
+        self.assertEqual(api.get('/api/profiling/routes/?order=bad').status_code, 400)
+        self.assertEqual(api.delete('/api/profiling/routes/').status_code, 204)
+        self.assertEqual(request_profiler.report(), [])
@@ -54,10 +54,29 @@ urlpatterns = [
     
     # Audit Log
     path('audit/', views.AuditLogView.as_view(), name='audit-log'),
+    path('audit/queue/', views.AuditQueueMetricsView.as_view(), name='audit-queue'),
+
+    # Профилирование запросов (PROFILING_ENABLED=1)
+    path('profiling/routes/', views.RequestProfileView.as_view(), name='profiling-routes'),
     
     # Violation Log (230-ФЗ)
     path('violations/', views.ViolationLogView.as_view(), name='violation-log'),
     
     # Daily credit states (interpolated)
     path('credit-daily-states/', views.CreditDailyStatesView.as_view(), name='credit-daily-states'),
+    
+    # Bulk export (CSV / JSONL / Parquet)
+    path('export/<str:table>/', views.ExportView.as_view(), name='export'),
+
+    # Copilot: поток подсказок по звонку (SSE — в ASGI-режиме)
+    path('copilot/calls/', views.CopilotCallView.as_view(), name='copilot-calls'),
+    path('copilot/calls/<str:call_id>/', views.CopilotCallView.as_view(), name='copilot-call'),
+    path('copilot/calls/<str:call_id>/chunks/', views.CopilotChunkView.as_view(), name='copilot-chunks'),
+    path('copilot/calls/<str:call_id>/events/', views.copilot_events, name='copilot-events'),
+
+    # Async-версии тяжёлых отчётов (запросы выполняются одновременно; ASGI-режим)
+    path('async/dashboard/', views.async_dashboard_full, name='async-dashboard-full'),
+    path('async/dashboard/stats/', views.async_dashboard_stats, name='async-dashboard-stats'),
+    path('async/dashboard/operator/<int:operator_id>/', views.async_operator_stats, name='async-operator-stats'),
+    path('async/clients/<int:pk>/profile_360/', views.async_profile_360, name='async-profile-360'),
 ]
@@ -1,10 +1,17 @@
-from rest_framework import viewsets, permissions, status
+from rest_framework import viewsets, permissions, status, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.exceptions import ValidationError as DRFValidationError
-from django.db.models import Sum, Count, Q, Avg, F
+from rest_framework.parsers import MultiPartParser
+from django.conf import settings
+from django.db.models import Sum, Count, Q, Avg, F, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce
+from django.core.exceptions import FieldDoesNotExist
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
 from django.utils import timezone
+from dataclasses import asdict
 from datetime import timedelta, date as date_type
 from decimal import Decimal
 
@@ -17,19 +24,29 @@ from .models import (
 from .serializers import (
     ClientSerializer, CreditSerializer, PaymentSerializer, InterventionSerializer,
     OperatorSerializer, ScoringResultSerializer, AssignmentSerializer, CreditApplicationSerializer,
-    Client360Serializer, ClientBehaviorProfileSerializer, NextBestActionSerializer,
+    ClientBehaviorProfileSerializer, NextBestActionSerializer,
     SmartScriptSerializer, ComplianceAlertSerializer, ReturnForecastSerializer,
     OperatorQueueSerializer, CreditStateSerializer,
     BankruptcyCheckSerializer, MLModelVersionSerializer, AuditLogSerializer,
-    ViolationLogSerializer,
+    ViolationLogSerializer, PaymentImportSerializer, parse_requested_fields,
 )
-from .ml.next_best_action import NextBestActionService
+from .pagination import KeysetPagination
+from .middleware.audit_queue import audit_queue
+from .middleware.profiling import request_profiler
+from .ml.next_best_action import save_nba_batch
 from .ml.psychotyping import PsychotypingService
-from .ml.return_forecast import ReturnForecastService
+from .ml.portfolio_simulation import DEFAULT_CORRELATION, simulate_portfolio
+from .ml.return_forecast import RISK_SEGMENTS, forecast_credit_return
 from .ml.compliance import ComplianceService
-from .ml.smart_scripts import SmartScriptService
+from .ml.smart_scripts import STAGE_PHRASES, SmartScriptService, script_client_data
 from .ml.loan_predictor import predict_loan_approval, get_predictor
 from .ml.overdue_predictor import predict_risk, predict_risk_batch
+from .services.client_profile import Client360Loader
+from .services.nba_cache import NBACache
+from .services.copilot_stream import CopilotStreamHub
+from .services.dashboards import ManagerDashboard, OperatorDashboard, SummaryDashboard
+from .services.export import ExportService, EXPORT_TABLES
+from .services.payment_import import PaymentImportService
 from .services.compliance_230fz import can_contact, log_compliance_violation, check_bankruptcy, validate_intervention, get_compliance_summary
 
 
@@ -38,27 +55,97 @@ class IsDBAdmin(permissions.BasePermission):
         return request.user.is_superuser
 
 
-class ClientViewSet(viewsets.ModelViewSet):
+class SparseFieldsViewMixin:
+    """
+    Курсорная пагинация (по умолчанию; ?paginate=false — весь список) + ?fields= для списков.
+    ?fields= сужает и ответ (SparseFieldsMixin), и SQL-проекцию через only().
+    Если поле нельзя сопоставить с колонками модели — проекция не сужается.
+    """
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-id',)
+
+    def get_cursor_ordering(self):
+        return self.cursor_ordering
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.request.method in permissions.SAFE_METHODS:
+            requested = parse_requested_fields(self.request)
+            if requested:
+                qs = self._narrow_projection(qs, requested)
+        return qs
+
+    @staticmethod
+    def _model_path(model, attrs):
+        """source_attrs сериализатора -> путь для only() (client.full_name -> client__full_name)"""
+        current = model
+        for i, attr in enumerate(attrs):
+            try:
+                field = current._meta.get_field(attr)
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or field.many_to_many:
+                return None
+            if i < len(attrs) - 1:
+                if not field.is_relation:
+                    return None
+                current = field.related_model
+        return '__'.join(attrs)
+
+    def _narrow_projection(self, qs, requested):
+        serializer_class = self.get_serializer_class()
+        fields = serializer_class().fields
+        dependencies = getattr(serializer_class.Meta, 'sparse_dependencies', {})
+
+        paths = {qs.model._meta.pk.name}
+        paths.update(name.lstrip('-') for name in self.get_cursor_ordering())
+        for name in requested:
+            if name not in fields:
+                continue
+            if name in dependencies:
+                paths.update(dependencies[name])
+                continue
+            field = fields[name]
+            if field.source == '*' or isinstance(field, serializers.SerializerMethodField):
+                return qs
+            path = self._model_path(qs.model, field.source_attrs)
+            if path is None:
+                return qs
+            paths.add(path)
+
+        # select_related оставляем только для реально используемых связей
+        selected = qs.query.select_related if isinstance(qs.query.select_related, dict) else {}
+        related = {p.rsplit('__', 1)[0] for p in paths if '__' in p}
+        related |= {p for p in paths if p in selected}
+        qs = qs.select_related(None)
+        if related:
+            qs = qs.select_related(*related)
+        return qs.only(*paths)
+
+
+class ClientViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Client.objects.all()
     serializer_class = ClientSerializer
     permission_classes = [permissions.AllowAny]  # Для просмотра без авторизации
     
     @action(detail=True, methods=['get'])
     def profile_360(self, request, pk=None):
-        """Полный 360° портрет клиента"""
-        client = self.get_object()
-        serializer = Client360Serializer(client)
-        return Response(serializer.data)
+        """Полный 360° портрет клиента (кэшируется, см. Client360Loader)"""
+        client = self.get_object()  # права и проверки объекта — до ответа из кэша
+        data = Client360Loader.get_profile(client.pk)
+        if data is None:
+            raise Http404
+        return Response(data)
     
     @action(detail=True, methods=['get'])
     def generate_nba(self, request, pk=None):
         """Генерация NBA рекомендаций для клиента"""
         client = self.get_object()
-        nba_service = NextBestActionService()
-        recommendations = nba_service.generate_recommendations(client)
+        credit_ids = client.credits.exclude(status='closed').values_list('id', flat=True)
+        recommendations = save_nba_batch([(client.id, credit_id) for credit_id in credit_ids])
         return Response({
             'client_id': client.id,
-            'recommendations': recommendations
+            'recommendations': NextBestActionSerializer(recommendations, many=True).data
         })
     
     @action(detail=True, methods=['get'])
@@ -68,8 +155,15 @@ class ClientViewSet(viewsets.ModelViewSet):
         context = request.query_params.get('context', 'objection')
         objection = request.query_params.get('objection', '')
         
+        if context != 'objection' and context not in STAGE_PHRASES:
+            return Response({'error': f'context: objection или один из {", ".join(STAGE_PHRASES)}'}, status=400)
+        credit = client.credits.exclude(status='closed').order_by('-id').first()
+        client_data = script_client_data(client, credit)
         scripts_service = SmartScriptService()
-        phrases = scripts_service.suggest_phrases(client, context, objection)
+        if context == 'objection':
+            phrases = scripts_service.get_objection_response(objection, client_data)
+        else:
+            phrases = scripts_service.get_stage_phrases(context, client_data)
         return Response({
             'client_id': client.id,
             'context': context,
@@ -77,8 +171,8 @@ class ClientViewSet(viewsets.ModelViewSet):
         })
 
 
-class CreditViewSet(viewsets.ModelViewSet):
-    queryset = Credit.objects.select_related('client').all()
+class CreditViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
+    queryset = Credit.objects.select_related('client', 'current_state').all()
     serializer_class = CreditSerializer
     permission_classes = [permissions.AllowAny]
     
@@ -92,24 +186,51 @@ class CreditViewSet(viewsets.ModelViewSet):
         client_id = self.request.query_params.get('client', None)
         if client_id:
             qs = qs.filter(client_id=client_id)
+        bucket = self.request.query_params.get('bucket', None)
+        if bucket:
+            qs = qs.filter(current_bucket__in=[b.strip() for b in bucket.split(',')])
         return qs
     
     @action(detail=True, methods=['get'])
     def forecast(self, request, pk=None):
         """Прогноз возврата по кредиту"""
         credit = self.get_object()
-        forecast_service = ReturnForecastService()
-        forecast = forecast_service.calculate_forecast(credit)
+        forecast = forecast_credit_return(credit)
         return Response({
             'credit_id': credit.id,
-            'forecast': forecast
+            'forecast': asdict(forecast)
         })
 
-
-class PaymentViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'], permission_classes=[IsDBAdmin])
+    def portfolio_simulation(self, request):
+        """
+        Монте-Карло NPV транша просроченных кредитов: ?segment=high&scenarios=20000&discount_rate=0.15
+        Считается в одном процессе; параллельно — py manage.py simulate_portfolio --workers N.
+        """
+        params = request.query_params
+        segment = params.get('segment') or None
+        if segment and segment not in RISK_SEGMENTS:
+            return Response({'error': f'segment: одно из {", ".join(RISK_SEGMENTS)}'}, status=400)
+        try:
+            n_scenarios = int(params.get('scenarios', 20000))
+            discount_rate = float(params.get('discount_rate', 0.15))
+            correlation = float(params.get('correlation', DEFAULT_CORRELATION))
+        except ValueError:
+            return Response({'error': 'scenarios, discount_rate, correlation должны быть числами'}, status=400)
+        if not (0 < n_scenarios <= 200000 and 0 <= correlation < 1 and 0 <= discount_rate <= 1):
+            return Response({'error': 'scenarios: 1..200000, correlation: [0, 1), discount_rate: [0, 1]'},
+                            status=400)
+        return Response(simulate_portfolio(
+            segment=segment, n_scenarios=n_scenarios, discount_rate=discount_rate, correlation=correlation,
+            refresh=params.get('refresh') == '1', workers=1,
+        ))
+
+
+class PaymentViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [permissions.AllowAny]
+    cursor_ordering = ('-payment_date', '-id')
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -119,21 +240,54 @@ class PaymentViewSet(viewsets.ModelViewSet):
         client_id = self.request.query_params.get('client', None)
         if client_id:
             qs = qs.filter(credit__client_id=client_id)
-        return qs.order_by('-payment_date')
+        return qs.order_by(*self.cursor_ordering)
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsDBAdmin],
+            parser_classes=[MultiPartParser])
+    def import_file(self, request):
+        """
+        Загрузка банковского файла платежей (CSV или XML-выписка).
+
+        POST /api/payments/import/  (multipart: file=<payments.csv>, format=csv|xml)
+        Повторная загрузка того же файла возвращает прежний результат (duplicate=true).
+        """
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response({'error': 'Не передан файл (поле file)'}, status=400)
+        file_format = request.data.get('format') or None
+        if file_format not in (None, 'csv', 'xml'):
+            return Response({'error': 'format: ожидается csv или xml'}, status=400)
 
+        job = PaymentImportService.import_file(upload, file_name=upload.name, file_format=file_format)
+        data = PaymentImportSerializer(job).data
+        data['duplicate'] = job.duplicate
+        code = status.HTTP_200_OK if job.duplicate or job.status == 'completed' else status.HTTP_422_UNPROCESSABLE_ENTITY
+        return Response(data, status=code)
 
-class InterventionViewSet(viewsets.ModelViewSet):
+
+class InterventionViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Intervention.objects.select_related('client', 'operator', 'credit').all()
     serializer_class = InterventionSerializer
     permission_classes = [permissions.AllowAny]
     
+    # Допустимые ?ordering= (только по индексированным колонкам)
+    ORDERINGS = {
+        '-datetime': ('-datetime', '-id'),
+        'datetime': ('datetime', 'id'),
+        '-id': ('-id',),
+        'id': ('id',),
+    }
+    
+    def get_cursor_ordering(self):
+        ordering = self.request.query_params.get('ordering', '-datetime')
+        return self.ORDERINGS.get(ordering, self.ORDERINGS['-datetime'])
+    
     def get_queryset(self):
         qs = super().get_queryset()
         client_id = self.request.query_params.get('client_id') or self.request.query_params.get('client')
         if client_id:
             qs = qs.filter(client_id=client_id)
-        ordering = self.request.query_params.get('ordering', '-datetime')
-        return qs.order_by(ordering)
+        return qs.order_by(*self.get_cursor_ordering())
     
     def perform_create(self, serializer):
         # === 230-ФЗ: Предварительная проверка перед созданием интервенции ===
@@ -201,10 +355,11 @@ class OperatorViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.AllowAny]
 
 
-class CreditStateViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = CreditState.objects.select_related('credit', 'client').all()
+class CreditStateViewSet(SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = CreditState.objects.all()
     serializer_class = CreditStateSerializer
     permission_classes = [permissions.AllowAny]
+    cursor_ordering = ('-state_date', '-id')
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -214,7 +369,7 @@ class CreditStateViewSet(viewsets.ReadOnlyModelViewSet):
         client_id = self.request.query_params.get('client', None)
         if client_id:
             qs = qs.filter(client_id=client_id)
-        return qs.order_by('-state_date')
+        return qs.order_by(*self.cursor_ordering)
 
 
 class CreditDailyStatesView(APIView):
@@ -281,7 +436,7 @@ class CreditDailyStatesView(APIView):
         return Response(daily)
 
 
-class ScoringResultViewSet(viewsets.ReadOnlyModelViewSet):
+class ScoringResultViewSet(SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
     queryset = ScoringResult.objects.all()
     serializer_class = ScoringResultSerializer
     permission_classes = [permissions.AllowAny]
@@ -292,6 +447,31 @@ class AssignmentViewSet(viewsets.ModelViewSet):
     serializer_class = AssignmentSerializer
     permission_classes = [permissions.AllowAny]
     
+    @staticmethod
+    def annotate_queue(qs):
+        """Последнее обещание и число попыток по кредиту — подзапросами, без N+1"""
+        promises = Intervention.objects.filter(
+            credit=OuterRef('credit'), status='promise'
+        ).order_by('-datetime')
+        attempts = Intervention.objects.filter(
+            credit=OuterRef('credit')
+        ).order_by().values('credit').annotate(cnt=Count('id')).values('cnt')
+        return qs.annotate(
+            queue_last_promise_amount=Subquery(promises.values('promise_amount')[:1]),
+            queue_last_promise_date=Subquery(promises.values('promise_date')[:1]),
+            queue_total_attempts=Coalesce(Subquery(attempts, output_field=IntegerField()), 0),
+        )
+    
+    @staticmethod
+    def active_queue(qs):
+        """
+        Рабочие назначения: просрочка > 0, без банкротов и отказавшихся от контактов
+        (230-ФЗ) — те же, что прогревает prewarm_nba (operator_queue_pairs)
+        """
+        return qs.filter(overdue_days__gt=0).exclude(
+            credit__client__is_bankrupt=True,
+        ).exclude(credit__client__contact_refused=True)
+    
     def get_queryset(self):
         qs = super().get_queryset()
         operator_id = self.request.query_params.get('operator_id') or self.request.query_params.get('operator')
@@ -299,31 +479,44 @@ class AssignmentViewSet(viewsets.ModelViewSet):
         if operator_id:
             qs = qs.filter(operator_id=operator_id)
         
-        # Only show assignments with overdue > 0
-        qs = qs.filter(overdue_days__gt=0)
-        
-        # 230-ФЗ: исключаем банкротов и отказавшихся от контактов
-        qs = qs.exclude(credit__client__is_bankrupt=True)
-        qs = qs.exclude(credit__client__contact_refused=True)
-        
-        return qs.order_by('-priority', '-overdue_amount')
+        return self.annotate_queue(self.active_queue(qs)).order_by('-priority', '-overdue_amount')
     
     @action(detail=False, methods=['get'])
     def my_queue(self, request):
-        """Получить очередь текущего оператора с NBA"""
+        """
+        Очередь текущего оператора с NBA: рабочие назначения (active_queue),
+        по приоритету (1 — первым), затем новые назначения раньше
+        """
         try:
             operator = Operator.objects.get(user=request.user)
         except Operator.DoesNotExist:
             return Response({'error': 'Оператор не найден'}, status=404)
         
-        assignments = Assignment.objects.filter(
-            operator=operator, 
-            is_active=True
-        ).select_related('credit__client').order_by('priority', '-assigned_at')
+        assignments = self.active_queue(Assignment.objects.filter(operator=operator)).select_related(
+            'operator', 'credit__client__behavior_profile'
+        ).order_by('priority', '-assignment_date', 'id')
+        assignments = list(self.annotate_queue(assignments))
         
-        serializer = OperatorQueueSerializer(assignments, many=True)
+        # Рекомендации всей очереди — одним чтением кэша, промахи пересчитываются пачкой
+        nba_cache = NBACache.get_many((a.credit.client_id, a.credit_id) for a in assignments)
+        serializer = OperatorQueueSerializer(assignments, many=True, context={'nba_cache': nba_cache})
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    def prewarm_nba(self, request):
+        """Пакетная генерация NBA по всей очереди оператора (утренний прогрев)"""
+        operator_id = request.data.get('operator_id') or request.query_params.get('operator_id')
+        if operator_id is None:
+            operator = Operator.objects.filter(user=request.user).first() if request.user.is_authenticated else None
+            if operator is None:
+                return Response({'error': 'Оператор не найден'}, status=404)
+            operator_id = operator.id
+        elif not str(operator_id).isdigit():
+            return Response({'error': 'operator_id должен быть числом'}, status=400)
+        pairs = self.get_queryset().filter(operator_id=operator_id).values_list('credit__client_id', 'credit_id')
+        created = save_nba_batch(pairs)
+        return Response({'operator_id': int(operator_id), 'created': len(created)})
+
 
 class CreditApplicationViewSet(viewsets.ModelViewSet):
     queryset = CreditApplication.objects.select_related('client').all()
@@ -747,6 +940,22 @@ class NextBestActionViewSet(viewsets.ModelViewSet):
         
         return qs.order_by('-created_at')
     
+    @action(detail=False, methods=['get'])
+    def current(self, request):
+        """Актуальная рекомендация по паре клиент/кредит (из NBACache)"""
+        client_id = request.query_params.get('client_id', '')
+        credit_id = request.query_params.get('credit_id', '')
+        if not (client_id.isdigit() and credit_id.isdigit()):
+            return Response({'error': 'Нужны client_id и credit_id'}, status=400)
+        if not Credit.objects.filter(pk=credit_id, client_id=client_id).exists():
+            raise Http404
+        return Response(NBACache.get(int(client_id), int(credit_id)))
+    
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """Доля попаданий и время пересчёта кэша NBA"""
+        return Response(NBACache.stats())
+    
     @action(detail=True, methods=['post'])
     def execute(self, request, pk=None):
         """Отметить рекомендацию как выполненную"""
@@ -828,235 +1037,28 @@ class ReturnForecastViewSet(viewsets.ReadOnlyModelViewSet):
 # ===== DASHBOARD API =====
 
 class DashboardFullView(APIView):
-    """Полная статистика для дашборда руководителя"""
+    """Полная статистика для дашборда руководителя (async-версия: /api/async/dashboard/)"""
     permission_classes = [permissions.AllowAny]
     
     def get(self, request):
-        from django.db.models.functions import TruncDate, TruncHour, ExtractHour
-        from collections import defaultdict
-        
-        today = timezone.now().date()
-        period = request.query_params.get('period', 'day')
-        
-        # Определяем период
-        if period == 'day':
-            start_date = today
-        elif period == 'week':
-            start_date = today - timedelta(days=7)
-        else:  # month
-            start_date = today - timedelta(days=30)
-        
-        # Получаем интервенции за период
-        interventions = Intervention.objects.filter(
-            datetime__date__gte=start_date
-        ).select_related('operator', 'client', 'credit')
-        
-        # === Статистика по операторам ===
-        operators = Operator.objects.all()
-        operator_stats = []
-        
-        for op in operators:
-            op_interventions = interventions.filter(operator=op)
-            total_calls = op_interventions.filter(intervention_type='phone').count()
-            contacts = op_interventions.filter(
-                intervention_type='phone',
-                status__in=['completed', 'promise', 'refuse', 'callback']
-            ).count()
-            ptp_count = op_interventions.filter(status='promise').count()
-            ptp_amount = op_interventions.filter(status='promise').aggregate(
-                total=Sum('promise_amount')
-            )['total'] or 0
-            
-            # Расчёт времени на звонках
-            total_duration = op_interventions.filter(intervention_type='phone').aggregate(
-                total=Sum('duration')
-            )['total'] or 0
-            
-            avg_duration = 0
-            if total_calls > 0:
-                avg_duration = total_duration // total_calls
-            
-            contact_rate = round((contacts / total_calls * 100), 1) if total_calls > 0 else 0
-            
-            # Время работы (эмуляция)
-            total_time_min = total_duration // 60
-            break_time_min = int(total_time_min * 0.12)  # ~12% на перерывы
-            
-            operator_stats.append({
-                'id': op.id,
-                'name': op.full_name,
-                'calls': total_calls,
-                'contacts': contacts,
-                'contactRate': contact_rate,
-                'avgDuration': avg_duration,
-                'totalTime': total_time_min,
-                'breakTime': break_time_min,
-                'ptpCount': ptp_count,
-                'ptpAmount': float(ptp_amount),
-            })
-        
-        # === Динамика звонков по дням ===
-        daily_calls = interventions.filter(intervention_type='phone').annotate(
-            date=TruncDate('datetime')
-        ).values('date').annotate(
-            calls=Count('id'),
-            contacts=Count('id', filter=Q(status__in=['completed', 'promise', 'refuse', 'callback'])),
-            ptp=Count('id', filter=Q(status='promise'))
-        ).order_by('date')
-        
-        daily_data = []
-        for day in daily_calls:
-            daily_data.append({
-                'date': day['date'].strftime('%d.%m') if day['date'] else '',
-                'calls': day['calls'],
-                'contacts': day['contacts'],
-                'ptp': day['ptp']
-            })
-        
-        # === Распределение по часам ===
-        hourly_calls = interventions.filter(intervention_type='phone').annotate(
-            hour=ExtractHour('datetime')
-        ).values('hour').annotate(
-            calls=Count('id'),
-            total_duration=Sum('duration'),
-            contacts=Count('id', filter=Q(status__in=['completed', 'promise', 'refuse', 'callback']))
-        ).order_by('hour')
-        
-        hourly_data = []
-        for h in hourly_calls:
-            avg_dur = h['total_duration'] // h['calls'] if h['calls'] > 0 else 0
-            contact_rate = round(h['contacts'] / h['calls'] * 100, 1) if h['calls'] > 0 else 0
-            hourly_data.append({
-                'hour': f"{h['hour']:02d}:00",
-                'calls': h['calls'],
-                'avgDuration': avg_dur,
-                'contactRate': contact_rate
-            })
-        
-        # === Распределение результатов ===
-        result_distribution = interventions.filter(intervention_type='phone').values('status').annotate(
-            count=Count('id')
-        )
-        
-        status_mapping = {
-            'no_answer': ('Не дозвон', '#94a3b8'),
-            'promise': ('Обещание', '#22c55e'),
-            'refuse': ('Отказ', '#ef4444'),
-            'callback': ('Перезвонить', '#f59e0b'),
-            'completed': ('Контакт', '#3b82f6'),
-        }
-        
-        call_results = []
-        total_results = sum(r['count'] for r in result_distribution)
-        for r in result_distribution:
-            status = r['status']
-            if status in status_mapping:
-                name, color = status_mapping[status]
-                value = round(r['count'] / total_results * 100) if total_results > 0 else 0
-                call_results.append({
-                    'name': name,
-                    'value': value,
-                    'color': color
-                })
-        
-        # === Распределение времени ===
-        time_distribution = [
-            {'name': 'На звонке', 'value': 65, 'color': '#22c55e'},
-            {'name': 'Постобработка', 'value': 15, 'color': '#3b82f6'},
-            {'name': 'Ожидание', 'value': 12, 'color': '#f59e0b'},
-            {'name': 'Перерыв', 'value': 8, 'color': '#94a3b8'},
-        ]
-        
-        # === Агрегированная статистика ===
-        totals = {
-            'calls': sum(op['calls'] for op in operator_stats),
-            'contacts': sum(op['contacts'] for op in operator_stats),
-            'totalTime': sum(op['totalTime'] for op in operator_stats),
-            'breakTime': sum(op['breakTime'] for op in operator_stats),
-            'ptpCount': sum(op['ptpCount'] for op in operator_stats),
-            'ptpAmount': sum(op['ptpAmount'] for op in operator_stats),
-        }
-        totals['contactRate'] = round(totals['contacts'] / totals['calls'] * 100, 1) if totals['calls'] > 0 else 0
-        totals['avgDuration'] = sum(op['avgDuration'] for op in operator_stats) // len(operator_stats) if operator_stats else 0
-        
-        return Response({
-            'period': period,
-            'startDate': start_date.isoformat(),
-            'endDate': today.isoformat(),
-            'totals': totals,
-            'operatorStats': operator_stats,
-            'dailyCalls': daily_data,
-            'hourlyCalls': hourly_data,
-            'callResults': call_results,
-            'timeDistribution': time_distribution,
-        })
+        return Response(ManagerDashboard(request.query_params.get('period', 'day')).build())
+
 
 class DashboardStatsView(APIView):
-    """Статистика для дашборда"""
+    """Статистика для дашборда (async-версия: /api/async/dashboard/stats/)"""
     
     def get(self, request):
-        today = timezone.now().date()
-        month_start = today.replace(day=1)
-        
-        # Общая статистика
-        total_clients = Client.objects.count()
-        total_credits = Credit.objects.count()
-        overdue_credits = Credit.objects.filter(status='overdue').count()
-        
-        # Статистика за месяц
-        payments_this_month = Payment.objects.filter(
-            payment_date__gte=month_start
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        interventions_today = Intervention.objects.filter(
-            datetime__date=today
-        ).count()
-        
-        # Статистика по каналам
-        channel_stats = Intervention.objects.filter(
-            datetime__date__gte=month_start
-        ).values('channel').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        # Статистика результатов
-        result_stats = Intervention.objects.filter(
-            datetime__date__gte=month_start
-        ).values('result').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        # Compliance алерты
-        active_alerts = ComplianceAlert.objects.filter(is_resolved=False).count()
-        
-        # Эффективность NBA
-        nba_stats = NextBestAction.objects.filter(
-            created_at__date__gte=month_start
-        ).values('status').annotate(count=Count('id'))
-        
-        return Response({
-            'summary': {
-                'total_clients': total_clients,
-                'total_credits': total_credits,
-                'overdue_credits': overdue_credits,
-                'payments_this_month': float(payments_this_month),
-                'interventions_today': interventions_today,
-                'active_compliance_alerts': active_alerts,
-            },
-            'channel_stats': list(channel_stats),
-            'result_stats': list(result_stats),
-            'nba_stats': list(nba_stats),
-        })
+        return Response(SummaryDashboard().build())
 
 
 class OperatorStatsView(APIView):
-    """Подробная статистика оператора для страницы личной статистики"""
+    """
+    Подробная статистика оператора для страницы личной статистики
+    (async-версия: /api/async/dashboard/operator/<id>/)
+    """
     permission_classes = [permissions.AllowAny]
     
     def get(self, request, operator_id=None):
-        from django.db.models.functions import TruncDate
-        from collections import defaultdict
-        
         if operator_id is None:
             operator_id = request.query_params.get('operator_id')
             if not operator_id:
@@ -1064,128 +1066,10 @@ class OperatorStatsView(APIView):
         
         try:
             operator = Operator.objects.get(id=operator_id)
-        except Operator.DoesNotExist:
+        except (Operator.DoesNotExist, ValueError):
             return Response({'error': 'Оператор не найден'}, status=404)
         
-        today = timezone.now().date()
-        week_ago = today - timedelta(days=7)
-        month_ago = today - timedelta(days=30)
-        
-        # Все интервенции оператора
-        all_interventions = Intervention.objects.filter(operator=operator)
-        today_ints = all_interventions.filter(datetime__date=today)
-        week_ints = all_interventions.filter(datetime__date__gte=week_ago)
-        month_ints = all_interventions.filter(datetime__date__gte=month_ago)
-        
-        def calc_stats(qs):
-            total = qs.count()
-            calls = qs.filter(intervention_type='phone').count()
-            contacts = qs.filter(
-                intervention_type='phone',
-                status__in=['completed', 'promise', 'refuse', 'callback']
-            ).count()
-            no_answer = qs.filter(status='no_answer').count()
-            promises = qs.filter(status='promise').count()
-            promise_amount = float(qs.filter(status='promise').aggregate(s=Sum('promise_amount'))['s'] or 0)
-            refusals = qs.filter(status='refuse').count()
-            completed = qs.filter(status='completed').count()
-            callbacks = qs.filter(status='callback').count()
-            total_duration = qs.filter(intervention_type='phone').aggregate(s=Sum('duration'))['s'] or 0
-            avg_duration = total_duration // calls if calls > 0 else 0
-            contact_rate = round(contacts / calls * 100, 1) if calls > 0 else 0
-            promise_rate = round(promises / contacts * 100, 1) if contacts > 0 else 0
-            return {
-                'total': total,
-                'calls': calls,
-                'contacts': contacts,
-                'noAnswer': no_answer,
-                'promises': promises,
-                'promiseAmount': promise_amount,
-                'refusals': refusals,
-                'completed': completed,
-                'callbacks': callbacks,
-                'totalDuration': total_duration,
-                'avgDuration': avg_duration,
-                'contactRate': contact_rate,
-                'promiseRate': promise_rate,
-            }
-        
-        # === Ежедневная динамика за 30 дней ===
-        daily_data = []
-        daily_qs = month_ints.filter(intervention_type='phone').annotate(
-            date=TruncDate('datetime')
-        ).values('date').annotate(
-            calls=Count('id'),
-            contacts=Count('id', filter=Q(status__in=['completed', 'promise', 'refuse', 'callback'])),
-            promises=Count('id', filter=Q(status='promise')),
-            promise_amount=Sum('promise_amount', filter=Q(status='promise')),
-            total_duration=Sum('duration'),
-        ).order_by('date')
-        
-        for day in daily_qs:
-            daily_data.append({
-                'date': day['date'].strftime('%d.%m') if day['date'] else '',
-                'dateFull': day['date'].isoformat() if day['date'] else '',
-                'calls': day['calls'],
-                'contacts': day['contacts'],
-                'promises': day['promises'],
-                'promiseAmount': float(day['promise_amount'] or 0),
-                'avgDuration': (day['total_duration'] or 0) // day['calls'] if day['calls'] > 0 else 0,
-            })
-        
-        # === Распределение по статусам (за месяц) ===
-        status_dist = list(month_ints.values('status').annotate(count=Count('id')).order_by('-count'))
-        
-        # === Распределение по часам (за месяц) ===
-        from django.db.models.functions import ExtractHour
-        hourly = month_ints.filter(intervention_type='phone').annotate(
-            hour=ExtractHour('datetime')
-        ).values('hour').annotate(
-            calls=Count('id')
-        ).order_by('hour')
-        hourly_data = [{'hour': f"{h['hour']:02d}:00", 'calls': h['calls']} for h in hourly]
-        
-        # === Активные назначения ===
-        active_assignments = Assignment.objects.filter(
-            operator=operator,
-            overdue_days__gt=0
-        ).count()
-        
-        # === Топ обещаний (за 30 дней) ===
-        top_promises = list(
-            month_ints.filter(status='promise', promise_amount__gt=0)
-            .select_related('client')
-            .order_by('-promise_amount')[:10]
-            .values('id', 'client__full_name', 'promise_amount', 'promise_date', 'datetime')
-        )
-        for p in top_promises:
-            p['promise_amount'] = float(p['promise_amount'])
-            p['datetime'] = p['datetime'].isoformat() if p['datetime'] else None
-            p['promise_date'] = p['promise_date'].isoformat() if p['promise_date'] else None
-        
-        return Response({
-            'operator': {
-                'id': operator.id,
-                'name': operator.full_name,
-                'role': operator.role,
-                'specialization': operator.specialization,
-                'hireDate': operator.hire_date.isoformat() if operator.hire_date else None,
-                'status': operator.status,
-            },
-            'today': calc_stats(today_ints),
-            'week': calc_stats(week_ints),
-            'month': calc_stats(month_ints),
-            'allTime': {
-                'totalInterventions': all_interventions.count(),
-                'totalCollected': float(operator.total_collected),
-                'successRate': operator.success_rate,
-            },
-            'daily': daily_data,
-            'statusDistribution': status_dist,
-            'hourly': hourly_data,
-            'activeAssignments': active_assignments,
-            'topPromises': top_promises,
-        })
+        return Response(OperatorDashboard(operator).build())
 
 
 # ===== 230-ФЗ COMPLIANCE API =====
@@ -1427,7 +1311,7 @@ class SmartDistributionView(APIView):
         svc = DistributionService()
 
         # Кредиты без оператора, исключая банкротов
-        unassigned = Credit.objects.filter(
+        unassigned = Credit.objects.select_related('client', 'current_state').filter(
             status__in=['overdue', 'default'],
         ).exclude(
             client__is_bankrupt=True,
@@ -1456,8 +1340,8 @@ class SmartDistributionView(APIView):
                     operator=rec['operator'],
                     assigned_at=timezone.now(),
                     priority=rec.get('priority', 'medium'),
-                    overdue_amount=credit.states.order_by('-state_date').first().overdue_principal if credit.states.exists() else 0,
-                    overdue_days=credit.states.order_by('-state_date').first().overdue_days if credit.states.exists() else 0,
+                    overdue_amount=credit.current_state.overdue_principal if credit.current_state else 0,
+                    overdue_days=credit.current_overdue_days,
                     ab_group=ab_group,
                     assignment_method=strategy,
                     match_score=rec.get('score', 0),
@@ -1515,6 +1399,44 @@ class AuditLogView(APIView):
         return Response(AuditLogSerializer(qs, many=True).data)
 
 
+class AuditQueueMetricsView(APIView):
+    """
+    Метрики очереди аудита процесса: глубина, записано, отброшено, синхронные записи.
+
+    GET /api/audit/queue/
+    """
+    permission_classes = [IsDBAdmin]
+
+    def get(self, request):
+        return Response(audit_queue.metrics())
+
+
+class RequestProfileView(APIView):
+    """
+    Профили запросов процесса по маршрутам (ProfilingMiddleware, PROFILING_ENABLED=1):
+    p50/p95, число SQL-запросов, время SQL и Python, повторяющиеся запросы.
+
+    GET /api/profiling/routes/?order=p95&limit=20   (order: p95, queries, sql, requests)
+    DELETE /api/profiling/routes/                   — сбросить статистику
+    """
+    permission_classes = [IsDBAdmin]
+
+    def get(self, request):
+        order = request.query_params.get('order', 'p95')
+        if order not in request_profiler.ORDERS:
+            return Response({'error': f'order: {", ".join(request_profiler.ORDERS)}'}, status=400)
+        limit = int(request.query_params.get('limit', 20))
+        return Response({
+            'enabled': getattr(settings, 'PROFILING_ENABLED', False),
+            'budgets': request_profiler.budgets(),
+            'routes': request_profiler.report(order=order, limit=limit),
+        })
+
+    def delete(self, request):
+        request_profiler.reset()
+        return Response(status=204)
+
+
 # ===== SCORING RESULTS (enhanced) =====
 
 class ScoringDashboardView(APIView):
@@ -1568,3 +1490,160 @@ class ScoringDashboardView(APIView):
             'total_expected_recovery': total_expected_recovery,
             'active_model': model_info,
         })
+
+
+# ===== BULK EXPORT =====
+
+class ExportView(APIView):
+    """
+    Потоковая выгрузка таблиц (только для администраторов БД).
+
+    GET /api/export/payments/?output=csv
+    GET /api/export/interventions/?output=jsonl&since=2025-01-01
+    GET /api/export/credit-states/?output=parquet&after_id=150000
+
+    Таблицы: credits, payments, interventions, credit-states, scorings.
+    Заголовок X-Export-Watermark — максимальный id в выгрузке;
+    для инкрементальной выгрузки передайте его как after_id.
+    """
+    permission_classes = [IsDBAdmin]
+
+    def get(self, request, table):
+        if table not in EXPORT_TABLES:
+            return Response({'error': f'Неизвестная таблица: {table}'}, status=404)
+
+        fmt = request.query_params.get('output', 'csv')
+        if fmt not in ExportService.available_formats():
+            return Response({
+                'error': f'Формат недоступен: {fmt}',
+                'available': ExportService.available_formats(),
+            }, status=400)
+
+        since = None
+        if request.query_params.get('since'):
+            since = parse_date(request.query_params['since'])
+            if since is None:
+                return Response({'error': 'since: ожидается дата YYYY-MM-DD'}, status=400)
+        try:
+            after_id = int(request.query_params.get('after_id', 0))
+        except ValueError:
+            return Response({'error': 'after_id: ожидается целое число'}, status=400)
+
+        chunks, watermark = ExportService.stream(table, fmt, since=since, after_id=after_id)
+
+        AuditLog.objects.create(
+            action='data_export',
+            severity='info',
+            details={'table': table, 'format': fmt, 'since': str(since) if since else None,
+                     'after_id': after_id, 'watermark': watermark},
+            ip_address=request.META.get('REMOTE_ADDR'),
+        )
+
+        response = StreamingHttpResponse(chunks, content_type=ExportService.CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = f'attachment; filename="{table}.{fmt}"'
+        response['X-Export-Watermark'] = str(watermark or after_id)
+        return response
+
+
+# ============== Copilot: поток подсказок по звонку ==============
+
+class CopilotCallView(APIView):
+    """
+    Открытие и закрытие звонка для потока подсказок.
+
+    POST   /api/copilot/calls/            {client_id, credit_id?, operator_id?}
+    DELETE /api/copilot/calls/<call_id>/
+    События: GET /api/copilot/calls/<call_id>/events/ (SSE, ASGI-режим)
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request, call_id=None):
+        client_id = request.data.get('client_id')
+        credit_id = request.data.get('credit_id')
+        if not client_id:
+            return Response({'error': 'client_id обязателен'}, status=400)
+        if not str(client_id).isdigit() or (credit_id and not str(credit_id).isdigit()):
+            return Response({'error': 'client_id и credit_id должны быть числами'}, status=400)
+        try:
+            call = CopilotStreamHub.open_call(
+                int(client_id), credit_id=int(credit_id) if credit_id else None,
+                operator_id=request.data.get('operator_id'),
+            )
+        except Client.DoesNotExist:
+            return Response({'error': 'Клиент не найден'}, status=404)
+        return Response({'call_id': call.call_id, 'events': call.events}, status=201)
+
+    def delete(self, request, call_id=None):
+        call = CopilotStreamHub.close_call(call_id)
+        if call is None:
+            return Response({'error': 'Звонок не найден'}, status=404)
+        return Response({'call_id': call_id, 'events': len(call.events)})
+
+
+class CopilotChunkView(APIView):
+    """
+    Кусок транскрипции звонка; в ответе — новые события
+    (те же события получают подписчики SSE).
+
+    POST /api/copilot/calls/<call_id>/chunks/  {text}
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request, call_id):
+        text = request.data.get('text')
+        if not isinstance(text, str):
+            return Response({'error': 'text обязателен'}, status=400)
+        try:
+            events = CopilotStreamHub.push_chunk(call_id, text)
+        except KeyError:
+            return Response({'error': 'Звонок не найден или закрыт'}, status=404)
+        return Response({'events': events})
+
+
+async def copilot_events(request, call_id):
+    """
+    SSE-поток событий звонка (нужен ASGI-сервер). Поддерживает Last-Event-ID
+    для переподключения без потери событий.
+    """
+    call = CopilotStreamHub.get(call_id)
+    if call is None:
+        raise Http404
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id') or 0)
+    except ValueError:
+        last_event_id = 0
+    response = StreamingHttpResponse(CopilotStreamHub.stream(call, last_event_id),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ===== ASYNC READ API (ASGI) =====
+# Те же отчёты, что DashboardFullView / DashboardStatsView / OperatorStatsView / profile_360,
+# но независимые запросы выполняются одновременно (services/dashboards.gather_sections).
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+async def async_dashboard_full(request):
+    return _json(await ManagerDashboard(request.GET.get('period', 'day')).abuild())
+
+
+async def async_dashboard_stats(request):
+    return _json(await SummaryDashboard().abuild())
+
+
+async def async_operator_stats(request, operator_id):
+    operator = await Operator.objects.filter(id=operator_id).afirst()
+    if operator is None:
+        return _json({'error': 'Оператор не найден'}, status=404)
+    return _json(await OperatorDashboard(operator).abuild())
+
+
+async def async_profile_360(request, pk):
+    data = await Client360Loader.aget_profile(pk)
+    if data is None:
+        raise Http404
+    return _json(data)
@@ -79,7 +79,7 @@ export default function CollectionDeskApp({ user, onClient360, onCreditClick })
 
       if (isManager) {
         // Руководитель видит всех должников
-        const resp = await fetch(`${API_URL}/credits/?status=overdue,default`);
+        const resp = await fetch(`${API_URL}/credits/?status=overdue,default&paginate=false`);
         if (!resp.ok) throw new Error('Ошибка загрузки');
         const credits = await resp.json();
         
@@ -143,7 +143,7 @@ export default function CollectionDeskApp({ user, onClient360, onCreditClick })
       const todayStr = new Date().toISOString().slice(0, 10); // 'YYYY-MM-DD'
       for (const d of debtors) {
         try {
-          const hResp = await fetch(`${API_URL}/interventions/?client_id=${d.clientId}&ordering=-datetime`);
+          const hResp = await fetch(`${API_URL}/interventions/?client_id=${d.clientId}&ordering=-datetime&paginate=false`);
           if (hResp.ok) {
             const interventions = await hResp.json();
             d.attempts = interventions.length;
@@ -195,7 +195,7 @@ export default function CollectionDeskApp({ user, onClient360, onCreditClick })
   const loadHistory = useCallback(async (clientId) => {
     if (!clientId) return;
     try {
-      const resp = await fetch(`${API_URL}/interventions/?client_id=${clientId}&ordering=-datetime`);
+      const resp = await fetch(`${API_URL}/interventions/?client_id=${clientId}&ordering=-datetime&paginate=false`);
       if (resp.ok) {
         const data = await resp.json();
         setHistory(data.map(i => ({
@@ -93,14 +93,14 @@ export default function CreditDetailPage({ creditId, onBack, onClient360 }) {
       }
 
       // Загружаем платежи по этому кредиту
-      const paymentsRes = await fetch(`${API_URL}/payments/?credit=${creditId}`);
+      const paymentsRes = await fetch(`${API_URL}/payments/?credit=${creditId}&paginate=false`);
       if (paymentsRes.ok) {
         const paymentsData = await paymentsRes.json();
         setPayments(Array.isArray(paymentsData) ? paymentsData : paymentsData.results || []);
       }
 
       // Загружаем состояния кредита
-      const statesRes = await fetch(`${API_URL}/credit-states/?credit=${creditId}`);
+      const statesRes = await fetch(`${API_URL}/credit-states/?credit=${creditId}&paginate=false`);
       if (statesRes.ok) {
         const statesData = await statesRes.json();
         setCreditStates(Array.isArray(statesData) ? statesData : statesData.results || []);
@@ -108,7 +108,7 @@ export default function CreditDetailPage({ creditId, onBack, onClient360 }) {
 
       // Загружаем взаимодействия с клиентом
       if (creditData.client) {
-        const interactionsRes = await fetch(`${API_URL}/interventions/?client=${creditData.client}`);
+        const interactionsRes = await fetch(`${API_URL}/interventions/?client=${creditData.client}&paginate=false`);
         if (interactionsRes.ok) {
           const interactionsData = await interactionsRes.json();
           setInteractions(Array.isArray(interactionsData) ? interactionsData : interactionsData.results || []);
@@ -36,7 +36,7 @@ export default function CreditsPage({ onCreditClick }) {
   const fetchCredits = async () => {
     try {
       setLoading(true);
-      const response = await fetch(`${API_URL}/credits/`);
+      const response = await fetch(`${API_URL}/credits/?paginate=false`);
       if (!response.ok) throw new Error('Ошибка загрузки данных');
       const data = await response.json();
       setCredits(Array.isArray(data) ? data : data.results || []);
@@ -212,7 +212,7 @@ export default function ModelTrainingPage() {
 
   // Fetch basic DB stats on mount
   useEffect(() => {
-    fetch(`${API}/credits/`)
+    fetch(`${API}/credits/?paginate=false`)
       .then(r => r.json())
       .then(data => {
         const credits = Array.isArray(data) ? data : data.results || [];